@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+离线批量分析工具 - 进程内直接调用 ModelService，跳过HTTP和multipart开销
+
+用法：
+python bin/batch_analyze.py --input ./images --output results.jsonl --model MiniCPM-V-4_5-int4
+python bin/batch_analyze.py --input manifest.jsonl --output results.jsonl --batch-size 8
+
+manifest.jsonl 每行一个JSON对象: {"id": "可选", "image": "本地路径或URL", "prompt": "可选"}
+输出文件同时作为断点记录，中断后用相同参数重新运行即可跳过已完成的条目。
+"""
+import argparse
+import io
+import json
+import logging
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import requests
+from PIL import Image
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'src'))
+from model_service import ModelService, QUALITY_TIERS, DEFAULT_QUALITY
+
+logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger("batch_analyze")
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.webp', '.bmp', '.gif', '.tif', '.tiff'}
+DEFAULT_PROMPT = "请详细描述这张图片的内容"
+
+
+def iter_items(input_path: Path, default_prompt: str):
+    """从目录或JSONL清单生成待处理条目"""
+    if input_path.is_dir():
+        for p in sorted(input_path.rglob("*")):
+            if p.is_file() and p.suffix.lower() in IMAGE_EXTENSIONS:
+                rel = str(p.relative_to(input_path))
+                yield {"id": rel, "image": str(p), "prompt": default_prompt}
+        return
+
+    with open(input_path, encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            entry = json.loads(line)
+            if "image" not in entry:
+                raise ValueError(f"{input_path}:{line_no} 缺少 image 字段")
+            prompt = entry.get("prompt", default_prompt)
+            yield {
+                "id": entry.get("id") or f"{entry['image']}\t{prompt}",
+                "image": entry["image"],
+                "prompt": prompt,
+            }
+
+
+def load_checkpoint(output_path: Path, retry_errors: bool) -> set:
+    """读取已有输出文件，返回已完成条目的ID；截断被中断写入的半行"""
+    done = set()
+    if not output_path.exists():
+        return done
+
+    with open(output_path, "rb+") as f:
+        data = f.read()
+        if data and not data.endswith(b"\n"):
+            f.truncate(data.rfind(b"\n") + 1)
+            data = data[:data.rfind(b"\n") + 1]
+
+    for line in data.decode("utf-8").splitlines():
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError:
+            continue
+        if retry_errors and record.get("status") != "success":
+            continue
+        done.add(record["id"])
+    return done
+
+
+def fetch_and_decode(item: dict, service: ModelService, max_size: int) -> dict:
+    """下载/读取并解码、缩放图片，在预取线程池中执行"""
+    start = time.time()
+    try:
+        source = item["image"]
+        if source.startswith(("http://", "https://")):
+            response = requests.get(source, timeout=30)
+            response.raise_for_status()
+            image = Image.open(io.BytesIO(response.content))
+        else:
+            image = Image.open(source)
+        item["pil_image"] = service.preprocess_image(image.convert('RGB'), max_size)
+    except Exception as e:
+        item["error"] = f"decode failed: {e}"
+    item["decode_seconds"] = time.time() - start
+    return item
+
+
+def write_records(out, records: list):
+    for record in records:
+        out.write(json.dumps(record, ensure_ascii=False) + "\n")
+    out.flush()
+    os.fsync(out.fileno())
+
+
+def run(args) -> int:
+    input_path = Path(args.input)
+    output_path = Path(args.output)
+    if not input_path.exists():
+        print(f"错误: 输入不存在: {input_path}")
+        return 1
+
+    done = load_checkpoint(output_path, args.retry_errors)
+    if done:
+        print(f"断点恢复: 跳过 {len(done)} 个已完成条目")
+
+    service = ModelService(Path(args.models_dir))
+    print(f"正在加载模型 {args.model} ...")
+    if not service.load_model(args.model):
+        print("❌ 模型加载失败")
+        return 1
+
+    pending_items = (item for item in iter_items(input_path, args.prompt) if item["id"] not in done)
+
+    processed = 0
+    failed = 0
+    start_time = time.time()
+    max_in_flight = max(args.batch_size * 2, args.prefetch)
+    max_size = QUALITY_TIERS[args.quality]["max_size"]
+
+    with ThreadPoolExecutor(max_workers=args.workers) as pool, \
+            open(output_path, "a", encoding="utf-8") as out:
+        in_flight = deque()
+
+        def refill():
+            # 保持预取队列有足够的已提交解码任务，让模型始终有图片可处理
+            while len(in_flight) < max_in_flight:
+                item = next(pending_items, None)
+                if item is None:
+                    break
+                in_flight.append(pool.submit(fetch_and_decode, item, service, max_size))
+
+        refill()
+        while in_flight:
+            batch = []
+            records = []
+            while in_flight and len(batch) < args.batch_size:
+                item = in_flight.popleft().result()
+                refill()
+                if "error" in item:
+                    records.append({"id": item["id"], "image": item["image"], "prompt": item["prompt"],
+                                    "status": "error", "error": item["error"]})
+                    continue
+                batch.append(item)
+
+            if batch:
+                results, elapsed = service.analyze_images(
+                    [item["pil_image"] for item in batch],
+                    [item["prompt"] for item in batch],
+                    args.quality
+                )
+                for item, result in zip(batch, results):
+                    record = {"id": item["id"], "image": item["image"], "prompt": item["prompt"],
+                              "model": args.model, "quality": args.quality, "batch_size": len(batch),
+                              "inference_seconds": round(elapsed / len(batch), 3),
+                              "decode_seconds": round(item["decode_seconds"], 3)}
+                    if result is None:
+                        record.update(status="error", error="inference failed")
+                    else:
+                        record.update(status="success", result=result)
+                    records.append(record)
+
+            write_records(out, records)
+            processed += len(records)
+            failed += sum(1 for r in records if r["status"] != "success")
+
+            elapsed_total = time.time() - start_time
+            print(f"已处理 {processed} 条 (失败 {failed})，{processed / elapsed_total:.2f} 张/秒")
+
+    print("=" * 50)
+    print(f"完成: 处理 {processed} 条，失败 {failed} 条，耗时 {time.time() - start_time:.1f}s")
+    print(f"结果文件: {output_path}")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='离线批量图片分析')
+    parser.add_argument('--input', required=True, help='图片目录或JSONL清单文件')
+    parser.add_argument('--output', required=True, help='结果JSONL文件（兼作断点记录）')
+    parser.add_argument('--model', default='MiniCPM-V-4_5-int4', help='模型名称 (默认: MiniCPM-V-4_5-int4)')
+    parser.add_argument('--models-dir', default=os.getenv("MODEL_PATH", "./models"), help='模型目录')
+    parser.add_argument('--prompt', default=DEFAULT_PROMPT, help='默认分析提示词')
+    parser.add_argument('--quality', default=DEFAULT_QUALITY, choices=list(QUALITY_TIERS),
+                        help=f'速度/质量档位 (默认: {DEFAULT_QUALITY})')
+    parser.add_argument('--batch-size', type=int, default=4, help='每次推理的图片数量 (默认: 4)')
+    parser.add_argument('--workers', type=int, default=4, help='下载/解码线程数 (默认: 4)')
+    parser.add_argument('--prefetch', type=int, default=16, help='预取队列深度 (默认: 16)')
+    parser.add_argument('--retry-errors', action='store_true', help='重新处理之前失败的条目')
+
+    args = parser.parse_args()
+    return run(args)
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+图片解码基准 - 比较各解码后端与原来的完整解码+缩放在大图上的耗时和输出差异
+
+用法：
+python bin/benchmark_decode.py                         # 合成 12/24/48 百万像素 JPEG
+python bin/benchmark_decode.py --images ./samples --sizes 448,1024 --rounds 10
+python bin/benchmark_decode.py --output decode_benchmark.json
+
+基准 pil-full 为完整解码后 LANCZOS 缩放（即 JPEG_DRAFT=false）；diff 为与基准输出的平均绝对像素差（0-255）。
+"""
+import argparse
+import io
+import json
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'src'))
+
+import image_decoding
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.webp'}
+
+
+def synthetic_jpeg(megapixels: float, quality: int = 90, seed: int = 0) -> bytes:
+    """4:3 的合成照片：平滑的低频内容加噪声，压缩率接近真实照片"""
+    rng = np.random.default_rng(seed)
+    width = int((megapixels * 1e6 * 4 / 3) ** 0.5)
+    height = int(width * 3 / 4)
+    base = Image.fromarray(rng.integers(0, 256, (48, 64, 3), dtype=np.uint8)).resize((width, height),
+                                                                                    Image.Resampling.BICUBIC)
+    pixels = np.asarray(base, dtype=np.int16) + rng.normal(0, 6, (height, width, 1)).astype(np.int16)
+    buffer = io.BytesIO()
+    Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8)).save(buffer, 'JPEG', quality=quality)
+    return buffer.getvalue()
+
+
+def load_inputs(args):
+    if args.images:
+        paths = sorted(p for p in Path(args.images).iterdir() if p.suffix.lower() in IMAGE_EXTENSIONS)
+        return [(p.name, p.read_bytes()) for p in paths[:args.max_images]]
+    return [(f"synthetic-{mp}MP.jpg", synthetic_jpeg(float(mp))) for mp in args.megapixels.split(",")]
+
+
+def measure(decoder, data: bytes, max_size: int, rounds: int):
+    times = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        image, _ = decoder.decode(io.BytesIO(data), max_size)
+        times.append(time.perf_counter() - start)
+    return image, statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="图片解码后端基准")
+    parser.add_argument("--images", help="图片目录，不指定时使用合成 JPEG")
+    parser.add_argument("--megapixels", default="12,24,48", help="合成图片的百万像素数，逗号分隔")
+    parser.add_argument("--sizes", default="448,1024,1344", help="目标最大边长（fast/balanced/accurate），逗号分隔")
+    parser.add_argument("--rounds", type=int, default=5, help="每组重复次数，取中位数")
+    parser.add_argument("--max-images", type=int, default=20)
+    parser.add_argument("--output", help="把结果写入JSON文件")
+    args = parser.parse_args()
+
+    baseline = image_decoding.PilDecoder(draft=False)
+    candidates = [("pil-draft", image_decoding.PilDecoder(draft=True))]
+    for name in ("turbojpeg", "pyvips"):
+        decoder = image_decoding._create(name)
+        if decoder is not None:
+            candidates.append((name, decoder))
+        else:
+            print(f"⚠️  {name} 不可用，跳过")
+
+    results = []
+    for label, data in load_inputs(args):
+        with Image.open(io.BytesIO(data)) as probe:
+            print(f"\n{label}: {probe.size[0]}x{probe.size[1]} {probe.format}, {len(data) / 1e6:.1f} MB")
+        for max_size in (int(s) for s in args.sizes.split(",")):
+            reference, base_seconds = measure(baseline, data, max_size, args.rounds)
+            reference_pixels = np.asarray(reference, dtype=np.int16)
+            row = {"image": label, "max_size": max_size, "pil-full_ms": round(base_seconds * 1000, 1)}
+            line = f"  {max_size:>5}px  pil-full {base_seconds * 1000:7.1f}ms"
+            for name, decoder in candidates:
+                if not decoder.supports(image_decoding.sniff_format(data[:16])):
+                    continue
+                image, seconds = measure(decoder, data, max_size, args.rounds)
+                assert image.size == reference.size, (name, image.size, reference.size)
+                diff = float(np.abs(np.asarray(image, dtype=np.int16) - reference_pixels).mean())
+                row.update({f"{name}_ms": round(seconds * 1000, 1), f"{name}_speedup": round(base_seconds / seconds, 2),
+                            f"{name}_diff": round(diff, 2)})
+                line += f" | {name} {seconds * 1000:7.1f}ms x{base_seconds / seconds:4.1f} diff {diff:.2f}"
+            print(line)
+            results.append(row)
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2, ensure_ascii=False))
+        print(f"\n结果已写入 {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+CPU执行参数自动调优 - 在代表性图片集上扫描torch线程数、inter-op线程数和核心分配，
+把最快的配置写入 cpu_tuning.json（服务启动时通过 CPU_TUNING_FILE 读取）
+
+用法：
+python bin/cpu_autotune.py --images tests/ --model MiniCPM-V-4_5-int4
+python bin/cpu_autotune.py --images ./samples --threads 8,16,32 --interop 1,2 --reserve 0,2,4
+
+每组配置在独立子进程中运行（inter-op线程数每个进程只能设置一次），因此每组都会重新加载模型。
+"""
+import argparse
+import itertools
+import json
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'src'))
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.webp', '.bmp'}
+RESULT_MARKER = "AUTOTUNE_RESULT "
+
+
+def run_trial(args) -> int:
+    """子进程：按环境变量中的配置加载模型并测量每张图片的处理时间"""
+    import statistics
+    from model_service import ModelService, QUALITY_TIERS, DEFAULT_QUALITY
+    import cpu_tuning
+    import image_decoding
+
+    service = ModelService(Path(args.models_dir))
+    if not service.load_model(args.model):
+        print(RESULT_MARKER + json.dumps({"error": "model load failed"}))
+        return 1
+
+    pool = cpu_tuning.create_preprocess_pool(service.cpu_config)
+    images = _list_images(Path(args.images), args.max_images)
+
+    def decode(path):
+        with open(path, 'rb') as fp:
+            return image_decoding.decoders.decode(fp, QUALITY_TIERS[DEFAULT_QUALITY]["max_size"])
+
+    latencies = []
+    for _ in range(args.rounds):
+        for path in images:
+            start = time.time()
+            image = pool.submit(decode, path).result()
+            result, _, _ = service.analyze_image(image, args.prompt)
+            if result is None:
+                print(RESULT_MARKER + json.dumps({"error": f"inference failed on {path}"}))
+                return 1
+            latencies.append(time.time() - start)
+
+    pool.shutdown()
+    print(RESULT_MARKER + json.dumps({
+        "mean_seconds": statistics.mean(latencies),
+        "median_seconds": statistics.median(latencies),
+        "samples": len(latencies),
+    }))
+    return 0
+
+
+def _list_images(images_dir: Path, limit: int) -> list:
+    images = sorted(p for p in images_dir.rglob("*") if p.suffix.lower() in IMAGE_EXTENSIONS)
+    return images[:limit]
+
+
+def _parse_int_list(value: str) -> list:
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+def build_candidates(args) -> list:
+    """生成候选配置：保留的预处理核心数 x torch线程数 x inter-op线程数"""
+    available = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(os.cpu_count()))
+    candidates = []
+    for reserve, threads, interop in itertools.product(args.reserve, args.threads, args.interop):
+        if reserve >= len(available):
+            continue
+        inference_cpus = available[:len(available) - reserve]
+        preprocess_cpus = available[len(available) - reserve:] or available
+        if threads > len(inference_cpus):
+            continue
+        candidates.append({
+            "torch_threads": threads,
+            "interop_threads": interop,
+            "inference_cpus": inference_cpus,
+            "preprocess_cpus": preprocess_cpus,
+            "preprocess_workers": max(1, reserve) if reserve else 2,
+        })
+    return candidates
+
+
+def main():
+    from cpu_tuning import format_cpu_list
+
+    cpu_count = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+    default_threads = ",".join(str(t) for t in sorted({max(1, cpu_count // 4), max(1, cpu_count // 2), cpu_count}))
+
+    parser = argparse.ArgumentParser(description='CPU执行参数自动调优')
+    parser.add_argument('--images', required=True, help='代表性图片目录')
+    parser.add_argument('--model', default='MiniCPM-V-4_5-int4', help='模型名称 (默认: MiniCPM-V-4_5-int4)')
+    parser.add_argument('--models-dir', default=os.getenv("MODEL_PATH", "./models"), help='模型目录')
+    parser.add_argument('--prompt', default='请详细描述这张图片的内容', help='分析提示词')
+    parser.add_argument('--max-images', type=int, default=4, help='最多使用的图片数 (默认: 4)')
+    parser.add_argument('--rounds', type=int, default=1, help='每组配置重复轮数 (默认: 1)')
+    parser.add_argument('--threads', type=_parse_int_list, default=_parse_int_list(default_threads),
+                        help=f'torch intra-op线程数候选 (默认: {default_threads})')
+    parser.add_argument('--interop', type=_parse_int_list, default=[1, 2], help='inter-op线程数候选 (默认: 1,2)')
+    parser.add_argument('--reserve', type=_parse_int_list, default=[0, 2],
+                        help='留给图片预处理的核心数候选 (默认: 0,2)')
+    parser.add_argument('--output', default=os.getenv("CPU_TUNING_FILE", "./cpu_tuning.json"), help='输出配置文件')
+    parser.add_argument('--trial', action='store_true', help=argparse.SUPPRESS)
+
+    args = parser.parse_args()
+    if args.trial:
+        return run_trial(args)
+
+    if not _list_images(Path(args.images), args.max_images):
+        print(f"错误: 目录中没有图片: {args.images}")
+        return 1
+
+    candidates = build_candidates(args)
+    print(f"共 {len(candidates)} 组候选配置")
+    results = []
+    for i, config in enumerate(candidates, 1):
+        env = os.environ.copy()
+        env.update({
+            "CPU_TUNING_FILE": os.devnull,
+            "CUDA_VISIBLE_DEVICES": "",
+            "TORCH_NUM_THREADS": str(config["torch_threads"]),
+            "TORCH_NUM_INTEROP_THREADS": str(config["interop_threads"]),
+            "INFERENCE_CPUS": format_cpu_list(config["inference_cpus"]),
+            "PREPROCESS_CPUS": format_cpu_list(config["preprocess_cpus"]),
+            "PREPROCESS_WORKERS": str(config["preprocess_workers"]),
+        })
+        print(f"[{i}/{len(candidates)}] threads={config['torch_threads']} interop={config['interop_threads']} "
+              f"inference_cpus={env['INFERENCE_CPUS']} preprocess_cpus={env['PREPROCESS_CPUS']}")
+
+        proc = subprocess.run(
+            [sys.executable, __file__, '--trial', '--images', args.images, '--model', args.model,
+             '--models-dir', args.models_dir, '--prompt', args.prompt,
+             '--max-images', str(args.max_images), '--rounds', str(args.rounds)],
+            env=env, capture_output=True, text=True
+        )
+        trial = None
+        for line in proc.stdout.splitlines():
+            if line.startswith(RESULT_MARKER):
+                trial = json.loads(line[len(RESULT_MARKER):])
+        if trial is None or "error" in trial:
+            print(f"  ❌ 失败: {trial.get('error') if trial else proc.stderr[-500:]}")
+            continue
+
+        print(f"  平均: {trial['mean_seconds']:.3f}s  中位数: {trial['median_seconds']:.3f}s")
+        results.append({"config": config, **trial})
+
+    if not results:
+        print("没有成功的配置")
+        return 1
+
+    results.sort(key=lambda r: r["mean_seconds"])
+    best = results[0]
+    output = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "model": args.model,
+        "config": {
+            **best["config"],
+            "inference_cpus": format_cpu_list(best["config"]["inference_cpus"]),
+            "preprocess_cpus": format_cpu_list(best["config"]["preprocess_cpus"]),
+        },
+        "mean_seconds": best["mean_seconds"],
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(output, f, ensure_ascii=False, indent=2)
+
+    print("=" * 50)
+    print(f"最快配置: {output['config']}")
+    print(f"平均处理时间: {best['mean_seconds']:.3f}s")
+    print(f"已写入: {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -1,138 +1,256 @@
 #!/usr/bin/env python3
 """
-部署脚本 - 更新运行中的服务
+部署脚本 - 滚动更新运行中的服务（不中断请求）
+
+1. 在新端口启动新实例（PRELOAD_MODEL 启动时自动加载并预热模型）
+2. 轮询新实例的 /ready 直到模型加载并预热完成，而不是固定等待；新实例启动失败时旧实例不受影响
+3. 切换流量：有路由进程时把新实例加入路由并移除旧实例；否则由负载均衡按 /ready 健康检查切换
+4. 调用旧实例的 /drain（/ready 返回503，不再领取异步任务），等待进行中的请求和任务完成
+5. 向旧实例发送 SIGTERM，uvicorn 在 --timeout-graceful-shutdown 内处理完剩余连接后退出
+
+用法：
+# 旧实例在 8207，新实例在 8208 启动，通过路由进程切换流量
+python bin/deploy.py --port 8208 --old http://127.0.0.1:8207 --router http://127.0.0.1:8300
+
+# 没有路由进程（nginx等按 /ready 做健康检查），排空后再等待一个健康检查周期
+python bin/deploy.py --port 8208 --old http://127.0.0.1:8207 --drain-delay 10
+
+# 首次部署：只启动并等待就绪
+python bin/deploy.py --port 8207
 """
-import requests
-import time
-import subprocess
+import argparse
 import os
 import signal
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Optional
+
+import requests
 
-def check_service_status(host="10.10.6.197", port=8207):
-    """检查服务状态"""
+SRC_DIR = Path(__file__).resolve().parent.parent / 'src'
+DEFAULT_MODEL = "MiniCPM-V-4_5-int4"
+
+
+def start_instance(port: int, model: str, host: str = "0.0.0.0", log_path: Optional[Path] = None,
+                   graceful_timeout: int = 120) -> subprocess.Popen:
+    """启动新实例（独立进程组，部署脚本退出后继续运行）"""
+    env = os.environ.copy()
+    env["PRELOAD_MODEL"] = model
+    env["SERVER_PORT"] = str(port)
+    output = open(log_path, "ab") if log_path else subprocess.DEVNULL
+    return subprocess.Popen([
+        sys.executable, '-m', 'uvicorn', 'main:app',
+        '--host', host,
+        '--port', str(port),
+        '--workers', '1',
+        '--timeout-graceful-shutdown', str(graceful_timeout)
+    ],
+    cwd=SRC_DIR,
+    env=env,
+    stdout=output,
+    stderr=subprocess.STDOUT,
+    start_new_session=True)
+
+
+def wait_ready(url: str, process: Optional[subprocess.Popen] = None, timeout: float = 600,
+               interval: float = 0.5) -> float:
+    """轮询 /ready 直到返回200，返回从调用到就绪的秒数；进程退出、预加载失败或超时时抛出异常"""
+    start = time.time()
+    while time.time() - start < timeout:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"实例进程已退出 (exit code {process.returncode})")
+        try:
+            response = requests.get(f"{url}/ready", timeout=2)
+            if response.status_code == 200:
+                return time.time() - start
+            error = response.json().get("preload_error")
+            if error:
+                raise RuntimeError(f"模型加载失败: {error}")
+        except requests.RequestException:
+            pass
+        time.sleep(interval)
+    raise RuntimeError(f"等待 {url} 就绪超时 ({timeout:.0f}s)")
+
+
+def get_status(url: str) -> Optional[dict]:
     try:
-        response = requests.get(f"http://{host}:{port}/health", timeout=5)
+        response = requests.get(f"{url}/status", timeout=5)
+        response.raise_for_status()
         return response.json()
-    except:
+    except requests.RequestException:
         return None
 
-def deploy_service():
-    """部署服务"""
-    print("🚀 开始部署MiniCPM-V服务...")
-    
-    # 检查当前服务状态
-    current_status = check_service_status()
-    if current_status:
-        print(f"当前服务状态: {current_status}")
-        
-        # 检查是否是新版本
-        if current_status.get('service') == 'MiniCPM-V Server':
-            print("✅ 新版本服务已在运行")
+
+def shift_traffic(router: str, new_url: str, old_url: Optional[str], timeout: float = 30):
+    """把新实例加入路由进程，确认路由已看到其就绪后移除旧实例"""
+    requests.post(f"{router}/router/replicas", json={"url": new_url}, timeout=10).raise_for_status()
+    deadline = time.time() + timeout
+    while True:
+        replicas = requests.get(f"{router}/router/status", timeout=5).json()["replicas"]
+        if any(r["url"] == new_url and r["ready"] for r in replicas):
+            break
+        if time.time() > deadline:
+            raise RuntimeError(f"路由进程未确认新实例 {new_url} 就绪")
+        time.sleep(0.5)
+    if old_url:
+        response = requests.delete(f"{router}/router/replicas", params={"url": old_url}, timeout=10)
+        if response.status_code not in (200, 404):
+            response.raise_for_status()
+
+
+def drain_instance(url: str, timeout: float = 300, delay: float = 0) -> float:
+    """开始排空并等待进行中的请求和异步任务完成，返回排空耗时"""
+    start = time.time()
+    response = requests.post(f"{url}/drain", timeout=10)
+    if response.status_code == 404:
+        print("⚠️  旧实例不支持 /drain，直接依赖 uvicorn 优雅退出")
+        return 0.0
+    response.raise_for_status()
+    # 负载均衡按健康检查周期发现实例未就绪，期间仍可能有新请求到达
+    time.sleep(delay)
+    while time.time() - start < timeout:
+        status = get_status(url)
+        if status is None or (status.get("in_flight", 0) == 0 and not status.get("job_running")):
+            return time.time() - start
+        time.sleep(0.5)
+    print(f"⚠️  排空超时 ({timeout:.0f}s)，仍有请求未完成")
+    return time.time() - start
+
+
+def process_exited(pid: int) -> bool:
+    """进程是否已退出（是本进程的子进程时同时回收，避免僵尸进程被当作仍在运行）"""
+    try:
+        if os.waitpid(pid, os.WNOHANG)[0] == pid:
             return True
-        else:
-            print("⚠️  发现旧版本服务，需要更新")
-    
-    # 启动新服务进程
-    print("正在启动新服务...")
-    
-    env = os.environ.copy()
-    env['PYTHONPATH'] = 'src'
-    
+    except ChildProcessError:
+        pass
     try:
-        # 尝试启动服务
-        process = subprocess.Popen([
-            'python', '-m', 'uvicorn', 'main:app',
-            '--host', '0.0.0.0',
-            '--port', '8207',
-            '--workers', '1'
-        ], 
-        cwd='/home/litata/xuke/MDMiniCPMServer',
-        env=env,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE)
-        
-        # 等待服务启动
-        print("等待服务启动...")
-        time.sleep(10)
-        
-        # 检查服务是否启动成功
-        status = check_service_status()
-        if status and status.get('service') == 'MiniCPM-V Server':
-            print("✅ 新服务启动成功！")
-            
-            # 加载默认模型
-            print("正在加载默认模型...")
-            try:
-                response = requests.post(
-                    "http://10.10.6.197:8207/load-model",
-                    json={"model_name": "MiniCPM-V-4_5-int4"},
-                    timeout=60
-                )
-                if response.status_code == 200:
-                    print("✅ 默认模型加载成功！")
-                else:
-                    print(f"⚠️  模型加载失败: {response.text}")
-            except Exception as e:
-                print(f"⚠️  模型加载异常: {e}")
-            
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return True
+    return False
+
+
+def stop_process(pid: int, timeout: float = 150) -> bool:
+    """发送 SIGTERM 并等待进程退出，超时后发送 SIGKILL"""
+    try:
+        os.kill(pid, signal.SIGTERM)
+    except ProcessLookupError:
+        return True
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process_exited(pid):
             return True
+        time.sleep(0.5)
+    print(f"⚠️  进程 {pid} 未在 {timeout:.0f}s 内退出，强制结束")
+    os.kill(pid, signal.SIGKILL)
+    return False
+
+
+def deploy_service(args) -> bool:
+    """启动新实例、等待就绪、切换流量、排空并停止旧实例"""
+    host = args.public_host
+    new_url = f"http://{host}:{args.port}"
+    old_url = args.old.rstrip("/") if args.old else None
+    print("🚀 开始部署MiniCPM-V服务...")
+
+    old_status = get_status(old_url) if old_url else None
+    if old_url:
+        if old_status is None:
+            print(f"⚠️  旧实例 {old_url} 无法访问，只启动新实例")
         else:
-            print("❌ 服务启动失败")
-            process.terminate()
-            return False
-            
-    except Exception as e:
-        print(f"❌ 启动过程出错: {e}")
+            print(f"当前服务状态: 模型 {old_status.get('model_name')}, 进行中请求 {old_status.get('in_flight')}")
+
+    if get_status(new_url) is not None:
+        print(f"❌ 端口 {args.port} 上已有服务在运行")
+        return False
+
+    started = time.time()
+    process = start_instance(args.port, args.model, args.host, Path(args.log) if args.log else None,
+                             args.graceful_timeout)
+    print(f"新实例已启动 (pid {process.pid})，等待模型加载和预热...")
+    try:
+        ready_seconds = wait_ready(new_url, process, timeout=args.ready_timeout)
+    except RuntimeError as e:
+        print(f"❌ 新实例未就绪: {e}")
+        if process.poll() is None:
+            stop_process(process.pid, timeout=10)
+        print("旧实例保持不变")
         return False
+    print(f"✅ 新实例就绪: {new_url} (启动到就绪 {ready_seconds:.1f}s)")
 
-def test_service():
+    if args.router:
+        shift_traffic(args.router.rstrip("/"), new_url, old_url if old_status else None)
+        print("✅ 路由已切换到新实例")
+
+    if old_status is not None:
+        drain_seconds = drain_instance(old_url, timeout=args.drain_timeout, delay=args.drain_delay)
+        print(f"✅ 旧实例已排空 ({drain_seconds:.1f}s)")
+        pid = old_status.get("pid")
+        if pid:
+            try:
+                stop_process(pid, timeout=args.graceful_timeout + 30)
+                print(f"✅ 旧实例已停止 (pid {pid})")
+            except PermissionError:
+                print(f"⚠️  无权停止旧实例进程 {pid}，请手动停止")
+        else:
+            print("⚠️  旧实例未报告进程号，请手动停止")
+
+    print(f"部署耗时 {time.time() - started:.1f}s，其中启动到就绪 {ready_seconds:.1f}s")
+    return True
+
+
+def test_service(url: str) -> bool:
     """测试服务功能"""
     print("\n🧪 测试服务功能...")
-    
-    # 测试健康检查
-    status = check_service_status()
-    if not status:
-        print("❌ 健康检查失败")
-        return False
-    
-    print(f"✅ 健康检查通过: {status}")
-    
-    # 测试模型列表
     try:
-        response = requests.get("http://10.10.6.197:8207/models", timeout=10)
+        response = requests.get(f"{url}/models", timeout=10)
         if response.status_code == 200:
             models = response.json()
-            print(f"✅ 模型列表获取成功: {models['count']} 个模型")
-            
-            # 显示当前模型状态
-            current_model = models.get('current_model')
-            if current_model:
-                print(f"当前加载模型: {current_model}")
-            else:
-                print("当前没有加载任何模型")
-                
+            print(f"✅ 模型列表获取成功: {models['count']} 个模型, 当前模型: {models.get('current_model')}")
             return True
-        else:
-            print(f"❌ 模型列表获取失败: {response.status_code}")
-            return False
-            
+        print(f"❌ 模型列表获取失败: {response.status_code}")
+        return False
     except Exception as e:
         print(f"❌ 测试异常: {e}")
         return False
 
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='MiniCPM-V Server 滚动部署')
+    parser.add_argument('--port', type=int, default=int(os.getenv("SERVER_PORT", 8207)), help='新实例端口')
+    parser.add_argument('--host', default='0.0.0.0', help='新实例监听地址 (默认: 0.0.0.0)')
+    parser.add_argument('--public-host', default='127.0.0.1', help='访问新实例使用的地址 (默认: 127.0.0.1)')
+    parser.add_argument('--old', help='旧实例地址，如 http://127.0.0.1:8207（需与本脚本在同一主机）')
+    parser.add_argument('--router', help='路由进程地址，如 http://127.0.0.1:8300')
+    parser.add_argument('--model', default=DEFAULT_MODEL, help=f'启动时加载的模型 (默认: {DEFAULT_MODEL})')
+    parser.add_argument('--log', help='新实例日志文件')
+    parser.add_argument('--ready-timeout', type=float, default=600, help='等待就绪的最长秒数 (默认: 600)')
+    parser.add_argument('--drain-timeout', type=float, default=300, help='等待旧实例排空的最长秒数 (默认: 300)')
+    parser.add_argument('--drain-delay', type=float, default=0,
+                        help='排空后至少等待的秒数，负载均衡按 /ready 健康检查时设为检查间隔 (默认: 0)')
+    parser.add_argument('--graceful-timeout', type=int, default=120,
+                        help='uvicorn 优雅退出等待连接关闭的最长秒数 (默认: 120)')
+    return parser.parse_args(argv)
+
+
 if __name__ == "__main__":
+    args = parse_args()
     print("=" * 50)
     print("MiniCPM-V Server 部署工具")
     print("=" * 50)
-    
-    success = deploy_service()
+
+    success = deploy_service(args)
     if success:
-        test_success = test_service()
-        if test_success:
+        url = f"http://{args.public_host}:{args.port}"
+        if test_service(url):
             print("\n🎉 部署和测试完成！")
-            print(f"服务地址: http://10.10.6.197:8207")
-            print("API文档: http://10.10.6.197:8207/docs")
+            print(f"服务地址: {url}")
+            print(f"API文档: {url}/docs")
         else:
             print("\n⚠️  部署完成但测试失败")
     else:
-        print("\n💥 部署失败")
\ No newline at end of file
+        print("\n💥 部署失败")
+        sys.exit(1)
@@ -1,173 +1,113 @@
 #!/usr/bin/env python3
 """
 启动MiniCPM-V服务器
+
+启动时自动加载并预热模型（PRELOAD_MODEL），轮询 /ready 直到就绪并报告启动耗时。
+
+用法：
+python bin/start_server.py                    # 后台启动，就绪后退出
+python bin/start_server.py --supervise        # 前台监管：进程异常退出时重启，Ctrl-C/SIGTERM 时排空后优雅停止
 """
-import subprocess
-import time
-import requests
+import argparse
 import os
+import signal
 import sys
+import time
+from pathlib import Path
+
+import requests
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from deploy import DEFAULT_MODEL, start_instance, wait_ready, get_status, drain_instance, stop_process, test_service
+
+
+def start_server(args):
+    """启动实例并等待就绪，返回进程；端口上已有本服务时返回 None"""
+    url = f"http://{args.public_host}:{args.port}"
+    status = get_status(url)
+    if status is not None:
+        print(f"✅ MiniCPM-V服务已在 {url} 运行 (pid {status.get('pid')}, 模型 {status.get('model_name')})")
+        return None
+
+    print(f"🚀 在 {args.host}:{args.port} 启动MiniCPM-V服务器，预加载模型 {args.model}...")
+    process = start_instance(args.port, args.model, args.host, Path(args.log) if args.log else None,
+                             args.graceful_timeout)
+    ready_seconds = wait_ready(url, process, timeout=args.ready_timeout)
+    print(f"✅ 服务就绪! 地址: {url} (启动到就绪 {ready_seconds:.1f}s)")
+    return process
+
+
+def supervise(args, process):
+    """监管实例：异常退出时按退避间隔重启；收到停止信号时排空后优雅停止"""
+    url = f"http://{args.public_host}:{args.port}"
+    stopping = []
 
-def check_port_available(port):
-    """检查端口是否可用"""
-    import socket
-    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    result = sock.connect_ex(('127.0.0.1', port))
-    sock.close()
-    return result != 0
-
-def start_server(host="10.10.6.197", port=8207):
-    """启动服务器"""
-    # 检查端口是否被占用
-    if not check_port_available(port):
-        print(f"❌ 端口 {port} 已被占用")
-        
-        # 尝试连接现有服务并检查类型
+    def request_stop(signum, frame):
+        stopping.append(signum)
+
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGTERM, request_stop)
+
+    backoff = 1.0
+    while True:
+        while process.poll() is None and not stopping:
+            time.sleep(0.5)
+
+        if stopping:
+            print("正在排空并停止服务...")
+            if process.poll() is None:
+                try:
+                    drain_instance(url, timeout=args.drain_timeout)
+                except requests.RequestException:
+                    pass
+                stop_process(process.pid, timeout=args.graceful_timeout + 30)
+            print("服务已停止")
+            return
+
+        print(f"⚠️  服务进程异常退出 (exit code {process.returncode})，{backoff:.0f}s 后重启")
+        time.sleep(backoff)
+        backoff = min(backoff * 2, 60)
+        process = start_instance(args.port, args.model, args.host, Path(args.log) if args.log else None,
+                                 args.graceful_timeout)
         try:
-            response = requests.get(f"http://{host}:{port}/health", timeout=5)
-            service_info = response.json()
-            
-            if service_info.get('service') == 'MiniCPM-V Server':
-                print("✅ MiniCPM-V服务已在运行")
-                return True
-            else:
-                print(f"⚠️  端口被其他服务占用: {service_info}")
-                # 尝试使用不同端口
-                for try_port in [8208, 8209, 8210, 8211, 8212, 8213]:
-                    if check_port_available(try_port):
-                        print(f"尝试使用端口 {try_port}")
-                        return start_server_on_port(host, try_port)
-                        
-                print("❌ 无法找到可用端口")
-                return False
-                
-        except Exception as e:
-            print(f"⚠️  无法连接到现有服务: {e}")
-            return False
-    
-    return start_server_on_port(host, port)
-
-def start_server_on_port(host, port):
-    """在指定端口启动服务器"""
-    print(f"🚀 在 {host}:{port} 启动MiniCPM-V服务器...")
-    
-    env = os.environ.copy()
-    env['PYTHONPATH'] = 'src'
-    
-    try:
-        # 启动服务器
-        process = subprocess.Popen([
-            sys.executable, '-m', 'uvicorn', 'main:app',
-            '--host', '0.0.0.0',
-            '--port', str(port)
-        ], 
-        cwd='/home/litata/xuke/MDMiniCPMServer',
-        env=env,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE)
-        
-        # 等待服务启动
-        print("等待服务启动...")
-        for i in range(10):
-            time.sleep(2)
-            try:
-                response = requests.get(f"http://{host}:{port}/health", timeout=2)
-                if response.status_code == 200:
-                    service_info = response.json()
-                    if service_info.get('service') == 'MiniCPM-V Server':
-                        print(f"✅ 服务启动成功! 地址: http://{host}:{port}")
-                        return True
-            except:
-                continue
-        
-        print("❌ 服务启动超时")
-        process.terminate()
-        return False
-        
-    except Exception as e:
-        print(f"❌ 启动失败: {e}")
-        return False
-
-def load_default_model(host, port):
-    """加载默认模型"""
-    print("正在加载默认模型...")
-    try:
-        response = requests.post(
-            f"http://{host}:{port}/load-model",
-            json={"model_name": "MiniCPM-V-4_5-int4"},
-            timeout=120
-        )
-        if response.status_code == 200:
-            print("✅ 默认模型加载成功!")
-            return True
-        else:
-            print(f"⚠️  模型加载失败: {response.text}")
-            return False
-    except Exception as e:
-        print(f"⚠️  模型加载异常: {e}")
-        return False
-
-def test_service(host, port):
-    """测试服务"""
-    print("🧪 测试服务功能...")
-    
-    try:
-        # 测试模型列表
-        response = requests.get(f"http://{host}:{port}/models", timeout=10)
-        if response.status_code == 200:
-            models = response.json()
-            print(f"✅ 发现 {models['count']} 个模型")
-            
-            current_model = models.get('current_model')
-            if current_model:
-                print(f"当前模型: {current_model}")
-            
-            return True
-        else:
-            print(f"❌ 测试失败: {response.status_code}")
-            return False
-            
-    except Exception as e:
-        print(f"❌ 测试异常: {e}")
-        return False
+            ready_seconds = wait_ready(url, process, timeout=args.ready_timeout)
+            print(f"✅ 服务已重启 (启动到就绪 {ready_seconds:.1f}s)")
+            backoff = 1.0
+        except RuntimeError as e:
+            print(f"❌ 重启后未就绪: {e}")
+            if process.poll() is None:
+                stop_process(process.pid, timeout=10)
+
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='MiniCPM-V 服务器启动工具')
+    parser.add_argument('--port', type=int, default=int(os.getenv("SERVER_PORT", 8207)), help='服务端口')
+    parser.add_argument('--host', default='0.0.0.0', help='监听地址 (默认: 0.0.0.0)')
+    parser.add_argument('--public-host', default='127.0.0.1', help='访问服务使用的地址 (默认: 127.0.0.1)')
+    parser.add_argument('--model', default=DEFAULT_MODEL, help=f'启动时加载的模型 (默认: {DEFAULT_MODEL})')
+    parser.add_argument('--log', help='服务日志文件')
+    parser.add_argument('--ready-timeout', type=float, default=600, help='等待就绪的最长秒数 (默认: 600)')
+    parser.add_argument('--drain-timeout', type=float, default=300, help='停止前等待排空的最长秒数 (默认: 300)')
+    parser.add_argument('--graceful-timeout', type=int, default=120,
+                        help='uvicorn 优雅退出等待连接关闭的最长秒数 (默认: 120)')
+    parser.add_argument('--supervise', action='store_true', help='前台监管进程，异常退出时自动重启')
+    args = parser.parse_args()
+
     print("=" * 50)
     print("MiniCPM-V 服务器启动工具")
     print("=" * 50)
-    
-    host = "10.10.6.197"
-    port = 8207
-    
-    # 启动服务器
-    if start_server(host, port):
-        # 如果端口不是8207，询问最终使用的端口
-        try:
-            response = requests.get(f"http://{host}:8207/health", timeout=2)
-            if response.status_code == 200 and response.json().get('service') == 'MiniCPM-V Server':
-                final_port = 8207
-            else:
-                # 查找实际端口
-                for try_port in [8208, 8209, 8210, 8211, 8212, 8213]:
-                    try:
-                        response = requests.get(f"http://{host}:{try_port}/health", timeout=2)
-                        if response.status_code == 200 and response.json().get('service') == 'MiniCPM-V Server':
-                            final_port = try_port
-                            break
-                    except:
-                        continue
-                else:
-                    final_port = port
-        except:
-            final_port = port
-        
-        # 加载模型和测试
-        load_default_model(host, final_port)
-        test_service(host, final_port)
-        
-        print(f"\n🎉 服务就绪!")
-        print(f"服务地址: http://{host}:{final_port}")
-        print(f"API文档: http://{host}:{final_port}/docs")
-        print(f"健康检查: curl http://{host}:{final_port}/health")
-    else:
-        print("\n💥 启动失败")
\ No newline at end of file
+
+    try:
+        process = start_server(args)
+    except RuntimeError as e:
+        print(f"\n💥 启动失败: {e}")
+        sys.exit(1)
+
+    url = f"http://{args.public_host}:{args.port}"
+    test_service(url)
+    print(f"API文档: {url}/docs")
+    print(f"健康检查: curl {url}/ready")
+
+    if args.supervise and process is not None:
+        supervise(args, process)
@@ -0,0 +1,138 @@
+import logging
+import math
+import os
+import threading
+from contextlib import contextmanager
+from typing import Dict, Any, Optional
+
+from fastapi import HTTPException
+
+logger = logging.getLogger(__name__)
+
+# 同时执行推理的请求数（单模型实例上并发推理会争抢同一组CPU核心/GPU，默认视为串行）
+ADMISSION_CONCURRENCY = int(os.getenv("ADMISSION_CONCURRENCY", 1))
+# 已接纳但未完成的请求上限，超出时直接返回503
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", 32))
+# 客户端未通过 X-Request-Timeout 请求头给出期限时使用的默认期限（秒），与客户端常用的120s超时一致
+ADMISSION_DEFAULT_TIMEOUT = float(os.getenv("ADMISSION_DEFAULT_TIMEOUT", 120))
+# 服务时间滑动平均的权重
+ADMISSION_EWMA_ALPHA = float(os.getenv("ADMISSION_EWMA_ALPHA", 0.2))
+
+TIMEOUT_HEADER = "x-request-timeout"
+
+
+class AdmissionController:
+    """
+    基于延迟估计的准入控制
+
+    按 (模型, 档位) 维护服务时间的指数滑动平均，并累计已接纳请求的预计服务时间作为排队深度。
+    新请求的预计完成时间 = 排队等待时间 + 自身服务时间，超过请求期限时返回429，
+    排队数达到上限时返回503，两者都带有根据当前队列计算的 Retry-After。
+    """
+
+    def __init__(self, concurrency: int = ADMISSION_CONCURRENCY, max_queue: int = ADMISSION_MAX_QUEUE,
+                 default_timeout: float = ADMISSION_DEFAULT_TIMEOUT, alpha: float = ADMISSION_EWMA_ALPHA):
+        self.concurrency = max(1, concurrency)
+        self.max_queue = max_queue
+        self.default_timeout = default_timeout
+        self.alpha = alpha
+        self._lock = threading.Lock()
+        self._estimates: Dict[str, Dict[str, float]] = {}
+        self.in_flight = 0
+        self.pending_seconds = 0.0
+        self.admitted = 0
+        self.shed = {"deadline": 0, "queue_full": 0}
+
+    def _estimate_locked(self, model: Optional[str], quality: str) -> float:
+        """预计服务时间；该档位还没有样本时用同模型其他档位的平均值，都没有时为0（乐观接纳）"""
+        estimates = self._estimates.get(model, {})
+        if quality in estimates:
+            return estimates[quality]
+        if estimates:
+            return sum(estimates.values()) / len(estimates)
+        return 0.0
+
+    def observe(self, model: Optional[str], quality: str, seconds: float):
+        """记录一次实际服务时间"""
+        with self._lock:
+            estimates = self._estimates.setdefault(model, {})
+            if quality in estimates:
+                estimates[quality] += self.alpha * (seconds - estimates[quality])
+            else:
+                estimates[quality] = seconds
+
+    def parse_timeout(self, headers) -> float:
+        value = headers.get(TIMEOUT_HEADER)
+        try:
+            timeout = float(value) if value else self.default_timeout
+        except ValueError:
+            timeout = self.default_timeout
+        return timeout if timeout > 0 else self.default_timeout
+
+    def _check_locked(self, estimate: float, timeout: float):
+        wait = self.pending_seconds / self.concurrency
+
+        if self.in_flight >= self.max_queue:
+            self.shed["queue_full"] += 1
+            retry_after = max(1, math.ceil(wait))
+            logger.warning(f"Shedding request: queue full ({self.in_flight}), retry after {retry_after}s")
+            raise HTTPException(
+                status_code=503,
+                detail=f"服务繁忙：排队请求数已达上限 {self.max_queue}",
+                headers={"Retry-After": str(retry_after)}
+            )
+
+        if wait + estimate > timeout:
+            self.shed["deadline"] += 1
+            # 等排队时间缩短到期限内所需的时间
+            retry_after = max(1, math.ceil(wait + estimate - timeout))
+            logger.warning(f"Shedding request: estimated {wait + estimate:.1f}s exceeds timeout {timeout:.1f}s")
+            raise HTTPException(
+                status_code=429,
+                detail=f"预计完成时间 {wait + estimate:.1f}s 超过请求期限 {timeout:.1f}s",
+                headers={"Retry-After": str(retry_after)}
+            )
+
+    def precheck(self, timeout: Optional[float] = None):
+        """不占用排队名额的预检查（只看排队等待时间），用于在接收请求体之前快速拒绝"""
+        timeout = self.default_timeout if timeout is None else timeout
+        with self._lock:
+            self._check_locked(0.0, timeout)
+
+    @contextmanager
+    def admit(self, model: Optional[str], quality: str, timeout: Optional[float] = None):
+        """
+        接纳一个请求，不能在期限内完成时抛出429/503
+
+        在 with 块内执行推理，退出时释放其占用的排队时间。
+        """
+        timeout = self.default_timeout if timeout is None else timeout
+        with self._lock:
+            estimate = self._estimate_locked(model, quality)
+            self._check_locked(estimate, timeout)
+            self.in_flight += 1
+            self.pending_seconds += estimate
+            self.admitted += 1
+
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+                self.pending_seconds = max(0.0, self.pending_seconds - estimate)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "in_flight": self.in_flight,
+                "estimated_wait_seconds": round(self.pending_seconds / self.concurrency, 3),
+                "concurrency": self.concurrency,
+                "max_queue": self.max_queue,
+                "default_timeout_seconds": self.default_timeout,
+                "service_time_seconds": {
+                    str(model): {q: round(v, 3) for q, v in estimates.items()}
+                    for model, estimates in self._estimates.items()
+                },
+                "admitted": self.admitted,
+                "shed": dict(self.shed),
+            }
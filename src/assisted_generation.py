@@ -0,0 +1,288 @@
+"""
+辅助生成（投机解码）- 小型草稿模型一次提出若干token，由已加载模型的语言模型一次前向验证
+
+只用于单条贪心解码：草稿模型看到的是去掉图片占位符后的文本提示词和已生成的token，
+目标模型接受与自身贪心预测一致的最长前缀，再追加一个自己预测的token，因此输出与普通贪心解码相同，
+每次目标模型前向可以生成多个token。
+
+草稿模型必须与服务模型的语言模型使用相同的分词器（如 MiniCPM-V 4.5 / Qwen3-0.6B），按服务模型分别配置：
+    ASSISTED_DRAFT_MODELS=MiniCPM-V-4_5-int4=Qwen3-0.6B,MiniCPM-V-4-int4=MiniCPM4-0.5B
+草稿模型名为 MODEL_PATH 下的目录名或绝对路径。接受率持续低于 ASSISTED_MIN_ACCEPTANCE 时自动回退为普通解码，
+每隔 ASSISTED_PROBE_INTERVAL 次请求重新尝试；辅助生成期间同样每隔该次数用普通解码测一次基准速度，用于计算实际加速比。
+"""
+import logging
+import os
+import threading
+import time
+from typing import Optional, Dict, Any, List, Tuple
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+
+def parse_draft_models(spec: str) -> Dict[str, str]:
+    """解析 "服务模型=草稿模型,..." 形式的配置"""
+    mapping = {}
+    for item in spec.split(","):
+        if "=" in item:
+            served, draft = item.split("=", 1)
+            if served.strip() and draft.strip():
+                mapping[served.strip()] = draft.strip()
+    return mapping
+
+
+ASSISTED_DRAFT_MODELS = parse_draft_models(os.getenv("ASSISTED_DRAFT_MODELS", ""))
+# 草稿模型每轮提出的token数
+ASSISTED_NUM_TOKENS = int(os.getenv("ASSISTED_NUM_TOKENS", 4))
+# 接受率低于该值时回退为普通解码
+ASSISTED_MIN_ACCEPTANCE = float(os.getenv("ASSISTED_MIN_ACCEPTANCE", 0.3))
+# 回退后每隔多少次请求重新尝试辅助生成；辅助生成期间每隔多少次请求测一次普通解码基准
+ASSISTED_PROBE_INTERVAL = int(os.getenv("ASSISTED_PROBE_INTERVAL", 50))
+
+EWMA_ALPHA = 0.2
+# 单次生成中至少验证这么多轮后才判断接受率
+MIN_ROUNDS_BEFORE_FALLBACK = 2
+
+
+# 检查分词器是否一致时使用的文本
+TOKENIZER_PROBE = "请详细描述这张图片的内容。Describe the image in detail: 1234, <tag> café!"
+
+
+def tokenizers_compatible(target_tokenizer: Any, draft_tokenizer: Any) -> bool:
+    """草稿模型的token编号必须与服务模型一致：探测文本的编码相同，且草稿词表不大于服务模型词表"""
+    try:
+        return (target_tokenizer.encode(TOKENIZER_PROBE, add_special_tokens=False)
+                == draft_tokenizer.encode(TOKENIZER_PROBE, add_special_tokens=False)
+                and len(draft_tokenizer) <= len(target_tokenizer))
+    except Exception as e:
+        logger.warning(f"Tokenizer compatibility check failed: {str(e)}")
+        return False
+
+
+def strip_image_tokens(input_ids: List[int], image_bound: Any) -> List[int]:
+    """去掉图片占位符位置（image_bound 为 [起始, 结束) 区间列表），得到草稿模型使用的文本提示词"""
+    ranges = [(int(start), int(end)) for start, end in (image_bound.tolist() if hasattr(image_bound, "tolist")
+                                                         else image_bound or [])]
+    return [token for i, token in enumerate(input_ids) if not any(start <= i < end for start, end in ranges)]
+
+
+def _crop_cache(cache: Any, length: int) -> Any:
+    """把KV缓存截断到前 length 个位置"""
+    if hasattr(cache, "crop"):
+        # 负数表示去掉末尾的token数，新旧版本的 transformers 都支持
+        extra = cache.get_seq_length() - length
+        if extra > 0:
+            cache.crop(-extra)
+        return cache
+    return tuple(tuple(t[..., :length, :] for t in layer) for layer in cache)
+
+
+def _pick(logits: torch.Tensor, context: List[int], repetition_penalty: float) -> int:
+    """贪心选择下一个token，按 transformers 的规则对已生成的token施加重复惩罚"""
+    if repetition_penalty != 1.0 and context:
+        logits = logits.clone()
+        ids = torch.tensor(sorted(set(context)), device=logits.device)
+        scores = logits[ids]
+        logits[ids] = torch.where(scores < 0, scores * repetition_penalty, scores / repetition_penalty)
+    return int(torch.argmax(logits))
+
+
+def _as_ids(tokens: List[int], device: Any) -> torch.Tensor:
+    return torch.tensor([tokens], dtype=torch.long, device=device)
+
+
+@torch.no_grad()
+def speculative_generate(target: Any, draft: Optional[Any], inputs_embeds: torch.Tensor,
+                         draft_input_ids: Optional[List[int]], max_new_tokens: int, eos_token_ids: List[int],
+                         num_draft_tokens: int = ASSISTED_NUM_TOKENS, repetition_penalty: float = 1.0,
+                         min_acceptance: float = ASSISTED_MIN_ACCEPTANCE,
+                         attention_mask: Optional[torch.Tensor] = None) -> Tuple[List[int], Dict[str, Any]]:
+    """
+    贪心投机解码（batch=1）
+
+    Args:
+        target: 目标语言模型（接受 inputs_embeds / input_ids 和 past_key_values）
+        draft: 草稿模型，为None时退化为普通贪心解码
+        inputs_embeds: 目标模型的提示词嵌入（已包含视觉特征）
+        draft_input_ids: 草稿模型的文本提示词
+
+    Returns:
+        Tuple[List[int], Dict[str, Any]]: (生成的token，包含结束符), 统计（草稿/接受token数、目标模型前向次数）
+    """
+    eos = set(eos_token_ids)
+    target_device = inputs_embeds.device
+    out = target(inputs_embeds=inputs_embeds, attention_mask=attention_mask, use_cache=True)
+    target_cache = out.past_key_values
+    # 目标缓存覆盖提示词和除最后一个token之外的已生成token
+    target_cached = inputs_embeds.shape[1]
+    tokens = [_pick(out.logits[0, -1], [], repetition_penalty)]
+    target_steps = 1
+
+    # 两个模型的词表填充长度可能不同，草稿模型只在服务模型的词表范围内选择
+    target_vocab = target.get_input_embeddings().num_embeddings
+    draft_prompt = list(draft_input_ids or [])
+    draft_cache = None
+    draft_cached = 0
+    draft_device = next(draft.parameters()).device if draft is not None else None
+    if draft is not None and draft_prompt:
+        draft_cache = draft(input_ids=_as_ids(draft_prompt, draft_device), use_cache=True).past_key_values
+        draft_cached = len(draft_prompt)
+
+    drafted = accepted = rounds = 0
+    assisting = draft is not None and num_draft_tokens > 0
+    fell_back = False
+
+    while len(tokens) < max_new_tokens and tokens[-1] not in eos:
+        k = min(num_draft_tokens, max_new_tokens - len(tokens)) if assisting else 0
+
+        # 草稿模型逐个提出 k 个token（草稿缓存覆盖提示词和部分已生成token，先补齐）
+        proposals = []
+        if k:
+            feed = tokens[draft_cached - len(draft_prompt):]
+            for _ in range(k):
+                d_out = draft(input_ids=_as_ids(feed, draft_device), past_key_values=draft_cache, use_cache=True)
+                draft_cache = d_out.past_key_values
+                draft_cached += len(feed)
+                feed = [_pick(d_out.logits[0, -1, :target_vocab], tokens + proposals, repetition_penalty)]
+                proposals.append(feed[0])
+
+        # 目标模型一次前向验证：最后一个已生成token + 全部提议
+        t_out = target(input_ids=_as_ids([tokens[-1]] + proposals, target_device),
+                       past_key_values=target_cache, use_cache=True)
+        target_cache = t_out.past_key_values
+        target_steps += 1
+
+        n = 0
+        new_tokens = []
+        for i in range(k + 1):
+            prediction = _pick(t_out.logits[0, i], tokens + new_tokens, repetition_penalty)
+            if i < k and proposals[i] == prediction:
+                n += 1
+                new_tokens.append(prediction)
+                if prediction in eos:
+                    break
+                continue
+            new_tokens.append(prediction)
+            break
+        new_tokens = new_tokens[:max_new_tokens - len(tokens)]
+
+        # 丢弃被拒绝的提议在两个缓存中的位置
+        target_cached += 1 + n
+        target_cache = _crop_cache(target_cache, target_cached)
+        if k:
+            draft_cached = min(draft_cached, len(draft_prompt) + len(tokens) + n)
+            draft_cache = _crop_cache(draft_cache, draft_cached)
+            drafted += k
+            accepted += n
+            rounds += 1
+            if rounds >= MIN_ROUNDS_BEFORE_FALLBACK and accepted < min_acceptance * drafted:
+                assisting = False
+                fell_back = True
+        tokens.extend(new_tokens)
+
+    return tokens, {
+        "new_tokens": len(tokens),
+        "draft_tokens": drafted,
+        "accepted_tokens": accepted,
+        "acceptance_rate": round(accepted / drafted, 3) if drafted else None,
+        "target_steps": target_steps,
+        "tokens_per_target_step": round(len(tokens) / target_steps, 3),
+        "fell_back": fell_back,
+    }
+
+
+class AssistedGenerator:
+    """
+    一个服务模型的草稿模型和运行统计
+
+    按请求决定是否使用草稿模型：接受率的移动平均低于阈值后回退为普通解码，每隔 probe_interval 次请求
+    重新尝试；辅助生成期间每隔 probe_interval 次请求用普通解码测一次每token耗时作为加速比的基准。
+    """
+
+    def __init__(self, draft: Any, draft_name: str, num_tokens: int = ASSISTED_NUM_TOKENS,
+                 min_acceptance: float = ASSISTED_MIN_ACCEPTANCE, probe_interval: int = ASSISTED_PROBE_INTERVAL):
+        self.draft = draft
+        self.draft_name = draft_name
+        self.num_tokens = num_tokens
+        self.min_acceptance = min_acceptance
+        self.probe_interval = max(1, probe_interval)
+        self._lock = threading.Lock()
+        self.enabled = True
+        self.calls = 0
+        self.assisted_calls = 0
+        self.fallbacks = 0
+        self._calls_since_switch = 0
+        self.acceptance = None
+        self.assisted_seconds_per_token = None
+        self.baseline_seconds_per_token = None
+
+    @staticmethod
+    def _ewma(current: Optional[float], sample: float) -> float:
+        return sample if current is None else (1 - EWMA_ALPHA) * current + EWMA_ALPHA * sample
+
+    def _choose(self) -> bool:
+        """本次请求是否使用草稿模型"""
+        with self._lock:
+            self.calls += 1
+            self._calls_since_switch += 1
+            probe = self._calls_since_switch % self.probe_interval == 0
+            # 启用时偶尔测普通解码基准，回退时偶尔重新尝试
+            return self.enabled != probe
+
+    def generate(self, target: Any, inputs_embeds: torch.Tensor, draft_input_ids: Optional[List[int]],
+                 max_new_tokens: int, eos_token_ids: List[int], repetition_penalty: float = 1.0,
+                 attention_mask: Optional[torch.Tensor] = None) -> Tuple[List[int], Dict[str, Any]]:
+        use_draft = self._choose()
+        start = time.time()
+        tokens, stats = speculative_generate(
+            target, self.draft if use_draft else None, inputs_embeds, draft_input_ids, max_new_tokens,
+            eos_token_ids, self.num_tokens, repetition_penalty, self.min_acceptance, attention_mask
+        )
+        seconds_per_token = (time.time() - start) / max(1, len(tokens))
+
+        with self._lock:
+            if not use_draft:
+                self.baseline_seconds_per_token = self._ewma(self.baseline_seconds_per_token, seconds_per_token)
+            elif stats["draft_tokens"]:
+                self.assisted_calls += 1
+                self.acceptance = self._ewma(self.acceptance, stats["acceptance_rate"])
+                self.assisted_seconds_per_token = self._ewma(self.assisted_seconds_per_token, seconds_per_token)
+                if not self.enabled and self.acceptance >= self.min_acceptance:
+                    self.enabled = True
+                    self._calls_since_switch = 0
+                    logger.info(f"Assisted generation re-enabled (acceptance {self.acceptance:.2f})")
+                elif self.enabled and self.acceptance < self.min_acceptance:
+                    self.enabled = False
+                    self.fallbacks += 1
+                    self._calls_since_switch = 0
+                    logger.info(f"Assisted generation acceptance {self.acceptance:.2f} below "
+                                f"{self.min_acceptance} - falling back to plain decoding")
+            speedup = self.speedup()
+
+        stats.update(assisted=use_draft, seconds_per_token=round(seconds_per_token, 4), speedup=speedup)
+        return tokens, stats
+
+    def speedup(self) -> Optional[float]:
+        if not self.baseline_seconds_per_token or not self.assisted_seconds_per_token:
+            return None
+        return round(self.baseline_seconds_per_token / self.assisted_seconds_per_token, 3)
+
+    def to(self, device: Any) -> "AssistedGenerator":
+        self.draft = self.draft.to(device)
+        return self
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "draft_model": self.draft_name,
+                "enabled": self.enabled,
+                "num_tokens": self.num_tokens,
+                "calls": self.calls,
+                "assisted_calls": self.assisted_calls,
+                "fallbacks": self.fallbacks,
+                "acceptance_rate": round(self.acceptance, 3) if self.acceptance is not None else None,
+                "assisted_seconds_per_token": self.assisted_seconds_per_token,
+                "baseline_seconds_per_token": self.baseline_seconds_per_token,
+                "speedup": self.speedup(),
+            }
@@ -0,0 +1,81 @@
+import logging
+import os
+from typing import List, Tuple, Any
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+# CPU加速模式: none / int8 / compile / int8+compile
+CPU_ACCELERATION = os.getenv("CPU_ACCELERATION", "none")
+
+SUPPORTED_MODES = ("int8", "compile")
+
+
+def parse_modes(spec: str) -> List[str]:
+    """解析加速模式字符串，忽略不支持的模式"""
+    modes = []
+    for mode in (spec or "none").replace(",", "+").split("+"):
+        mode = mode.strip().lower()
+        if mode in ("", "none"):
+            continue
+        if mode not in SUPPORTED_MODES:
+            logger.warning(f"Unknown CPU acceleration mode ignored: {mode}")
+            continue
+        modes.append(mode)
+    return modes
+
+
+def load_dtype(modes: List[str]) -> torch.dtype:
+    """动态int8量化需要float32权重，其余情况沿用CPU上的bfloat16"""
+    return torch.float32 if "int8" in modes else torch.bfloat16
+
+
+def apply(model: Any, modes: List[str]) -> Tuple[List[str], Any]:
+    """
+    对语言模型部分应用CPU加速
+
+    - int8: 对 model.llm 中的 nn.Linear 做动态int8量化（bitsandbytes的4bit层类型不同，保持不变）
+    - compile: 用 torch.compile 包装 model.llm.forward，不支持的算子自动回退到eager执行
+
+    Returns:
+        Tuple[List[str], Any]: (实际生效的模式, 原始llm模块 - 验证失败时用于回退)
+    """
+    llm = getattr(model, "llm", None)
+    if llm is None:
+        logger.warning("Model has no 'llm' submodule - CPU acceleration skipped")
+        return [], None
+
+    original_llm = llm
+    applied = []
+
+    if "int8" in modes:
+        try:
+            llm = torch.ao.quantization.quantize_dynamic(
+                llm, {torch.nn.Linear}, dtype=torch.qint8, inplace=False
+            )
+            applied.append("int8")
+            logger.info("Applied dynamic int8 quantization to language model linear layers")
+        except Exception as e:
+            logger.warning(f"Dynamic int8 quantization failed: {str(e)} - keeping original weights")
+
+    if "compile" in modes:
+        try:
+            import torch._dynamo
+            torch._dynamo.config.suppress_errors = True  # 编译失败的子图回退到eager
+            llm.forward = torch.compile(llm.forward, dynamic=True)
+            applied.append("compile")
+            logger.info("Wrapped language model forward with torch.compile")
+        except Exception as e:
+            logger.warning(f"torch.compile unavailable: {str(e)} - running eager")
+
+    model.llm = llm
+    return applied, original_llm
+
+
+def revert(model: Any, original_llm: Any):
+    """恢复未加速的语言模型"""
+    if original_llm is None:
+        return
+    original_llm.__dict__.pop("forward", None)  # 去掉实例上的compile包装
+    model.llm = original_llm
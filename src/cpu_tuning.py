@@ -0,0 +1,162 @@
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional, Dict, Any, List
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+CPU_TUNING_FILE = Path(os.getenv("CPU_TUNING_FILE", "./cpu_tuning.json"))
+
+# 环境变量 -> 配置项
+_ENV_KEYS = {
+    "TORCH_NUM_THREADS": "torch_threads",
+    "TORCH_NUM_INTEROP_THREADS": "interop_threads",
+    "INFERENCE_CPUS": "inference_cpus",
+    "PREPROCESS_CPUS": "preprocess_cpus",
+    "PREPROCESS_WORKERS": "preprocess_workers",
+}
+
+
+def parse_cpu_list(spec: Optional[str]) -> Optional[List[int]]:
+    """解析 "0-3,8,10-11" 形式的CPU列表（去重并排序），格式错误时抛出 ValueError"""
+    if spec is None or str(spec).strip() == "":
+        return None
+    if isinstance(spec, list):
+        cpus = [int(c) for c in spec]
+    else:
+        cpus = []
+        for part in str(spec).split(","):
+            part = part.strip()
+            if "-" in part:
+                lo, hi = part.split("-", 1)
+                if int(lo) > int(hi):
+                    raise ValueError(f"无效的CPU范围: {part}")
+                cpus.extend(range(int(lo), int(hi) + 1))
+            elif part:
+                cpus.append(int(part))
+    if any(c < 0 for c in cpus):
+        raise ValueError(f"无效的CPU列表: {spec}")
+    return sorted(set(cpus)) or None
+
+
+def format_cpu_list(cpus: Optional[List[int]]) -> Optional[str]:
+    """把CPU列表格式化为 "0-3,8" 形式"""
+    if not cpus:
+        return None
+    cpus = sorted(set(cpus))
+    ranges = []
+    start = prev = cpus[0]
+    for c in cpus[1:] + [None]:
+        if c is not None and c == prev + 1:
+            prev = c
+            continue
+        ranges.append(f"{start}-{prev}" if start != prev else str(start))
+        if c is not None:
+            start = prev = c
+    return ",".join(ranges)
+
+
+def _normalize(config: Dict[str, Any]) -> Dict[str, Any]:
+    """转换配置项类型，格式错误时抛出 ValueError"""
+    config = dict(config)
+    for key in ("torch_threads", "interop_threads", "preprocess_workers"):
+        if config[key] is not None:
+            config[key] = int(config[key])
+            if config[key] <= 0:
+                raise ValueError(f"{key} 必须为正整数: {config[key]}")
+    for key in ("inference_cpus", "preprocess_cpus"):
+        config[key] = parse_cpu_list(config[key])
+    return config
+
+
+def load_cpu_config(path: Optional[Path] = None) -> Dict[str, Any]:
+    """
+    读取CPU调优配置：先读 autotune 生成的JSON文件（默认 CPU_TUNING_FILE），再用环境变量覆盖
+
+    文件无法解析或其中的值格式错误时忽略整个文件；环境变量格式错误时抛出 ValueError。
+    """
+    path = path or CPU_TUNING_FILE
+    config: Dict[str, Any] = {
+        "torch_threads": None,
+        "interop_threads": None,
+        "inference_cpus": None,
+        "preprocess_cpus": None,
+        "preprocess_workers": 2,
+    }
+
+    if path.is_file():
+        try:
+            with open(path, encoding="utf-8") as f:
+                file_config = json.load(f).get("config", {})
+            file_config = {key: file_config[key] for key in config if key in file_config}
+            _normalize({**config, **file_config})
+            config.update(file_config)
+            logger.info(f"Loaded CPU tuning config from {path}")
+        except Exception as e:
+            logger.warning(f"Failed to read CPU tuning file {path}: {str(e)}")
+
+    for env_key, key in _ENV_KEYS.items():
+        value = os.getenv(env_key)
+        if value:
+            config[key] = value
+    return _normalize(config)
+
+
+def _set_affinity(cpus: Optional[List[int]]):
+    if not cpus or not hasattr(os, "sched_setaffinity"):
+        return
+    try:
+        # Linux上 pid=0 只作用于当前线程，之后创建的线程会继承
+        os.sched_setaffinity(0, cpus)
+    except OSError as e:
+        logger.warning(f"Failed to set CPU affinity {cpus}: {str(e)}")
+
+
+def apply_cpu_config(config: Dict[str, Any]):
+    """
+    应用CPU执行配置
+
+    必须在第一次推理前调用：torch的inter-op线程数只能在并行任务开始前设置一次，
+    OpenMP线程在首次使用时创建并继承当前线程的CPU亲和性。
+    """
+    _set_affinity(config.get("inference_cpus"))
+
+    if config.get("torch_threads"):
+        torch.set_num_threads(config["torch_threads"])
+    if config.get("interop_threads"):
+        try:
+            torch.set_num_interop_threads(config["interop_threads"])
+        except RuntimeError as e:
+            logger.warning(f"Cannot change inter-op threads after parallel work started: {str(e)}")
+
+    logger.info(
+        f"CPU config applied: torch_threads={torch.get_num_threads()}, "
+        f"interop_threads={torch.get_num_interop_threads()}, "
+        f"inference_cpus={format_cpu_list(config.get('inference_cpus'))}, "
+        f"preprocess_cpus={format_cpu_list(config.get('preprocess_cpus'))}"
+    )
+
+
+def create_preprocess_pool(config: Dict[str, Any]) -> ThreadPoolExecutor:
+    """创建图片解码/缩放线程池，线程绑定到 preprocess_cpus，避免与推理线程争抢核心"""
+    return ThreadPoolExecutor(
+        max_workers=config.get("preprocess_workers") or 2,
+        thread_name_prefix="preprocess",
+        initializer=_set_affinity,
+        initargs=(config.get("preprocess_cpus"),)
+    )
+
+
+def describe_cpu_config(config: Dict[str, Any]) -> Dict[str, Any]:
+    """返回当前生效的CPU配置，用于状态接口"""
+    return {
+        "torch_threads": torch.get_num_threads(),
+        "interop_threads": torch.get_num_interop_threads(),
+        "inference_cpus": format_cpu_list(config.get("inference_cpus")),
+        "preprocess_cpus": format_cpu_list(config.get("preprocess_cpus")),
+        "preprocess_workers": config.get("preprocess_workers"),
+    }
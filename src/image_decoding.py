@@ -0,0 +1,225 @@
+"""
+图片解码 - 按格式选择解码后端，解码时直接缩小到接近目标尺寸
+
+- turbojpeg: JPEG，libjpeg-turbo 的DCT缩放解码（安装 PyTurboJPEG 和 libturbojpeg 时可用）
+- pyvips: JPEG/WebP 解码时缩小（shrink-on-load），PNG 完整解码后缩放（安装 pyvips 和 libvips 时可用）
+- pil: 所有格式；JPEG 使用 draft 模式按 1/2、1/4、1/8 的比例缩放解码
+
+缩放解码得到的图片边长不小于目标尺寸，最后统一用 LANCZOS 缩放，输出尺寸与原来的完整解码+缩放完全一致。
+IMAGE_DECODERS 指定后端优先级，不可用或不支持该格式的后端跳过；后端解码失败时依次尝试下一个，最后总是回退到 pil。
+"""
+import abc
+import io
+import logging
+import os
+import threading
+import time
+from typing import BinaryIO, Dict, Any, List, Optional, Tuple, Union
+
+import numpy as np
+from PIL import Image
+
+try:
+    from turbojpeg import TurboJPEG, TJPF_RGB
+except ImportError:
+    TurboJPEG = None
+
+try:
+    import pyvips
+except (ImportError, OSError):
+    # pyvips 已安装但找不到 libvips 时抛出 OSError
+    pyvips = None
+
+logger = logging.getLogger(__name__)
+
+# 解码后端优先级，逗号分隔
+IMAGE_DECODERS = [name.strip() for name in os.getenv("IMAGE_DECODERS", "turbojpeg,pyvips,pil").split(",") if name.strip()]
+# PIL 解码 JPEG 时使用 draft 模式缩放解码；false 时完整解码后再缩放
+JPEG_DRAFT = os.getenv("JPEG_DRAFT", "true").lower() == "true"
+
+
+def target_size(width: int, height: int, max_size: int) -> Tuple[int, int]:
+    """最大边长不超过 max_size 的输出尺寸，与 ModelService.preprocess_image 的计算相同"""
+    if max(width, height) <= max_size:
+        return width, height
+    ratio = max_size / max(width, height)
+    return int(width * ratio), int(height * ratio)
+
+
+def sniff_format(head: bytes) -> Optional[str]:
+    """按文件头识别格式（与 PIL 的格式名一致）"""
+    if head.startswith(b"\xff\xd8\xff"):
+        return "JPEG"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "PNG"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "WEBP"
+    return None
+
+
+def _finish(image: Image.Image, size: Tuple[int, int]) -> Image.Image:
+    """转为RGB并缩放到输出尺寸"""
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    if image.size != size:
+        image = image.resize(size, Image.Resampling.LANCZOS)
+    return image
+
+
+class Decoder(abc.ABC):
+    """解码后端接口：decode 返回最大边长不超过 max_size 的RGB图片，以及是否在解码时缩小了图片"""
+
+    name = "base"
+    formats: Tuple[str, ...] = ()
+
+    def supports(self, image_format: Optional[str]) -> bool:
+        return image_format in self.formats
+
+    @abc.abstractmethod
+    def decode(self, fp: BinaryIO, max_size: int) -> Tuple[Image.Image, bool]:
+        """解码并缩小图片，返回 (图片, 是否在解码时缩小)"""
+
+
+class PilDecoder(Decoder):
+    """PIL 解码，支持所有格式；JPEG 用 draft 模式按 1/2^n 缩放解码"""
+
+    name = "pil"
+
+    def __init__(self, draft: bool = JPEG_DRAFT):
+        self.draft = draft
+
+    def supports(self, image_format: Optional[str]) -> bool:
+        return True
+
+    def decode(self, fp: BinaryIO, max_size: int) -> Tuple[Image.Image, bool]:
+        image = Image.open(fp)
+        original = image.size
+        size = target_size(*original, max_size)
+        if self.draft and image.format == "JPEG" and size != original:
+            # 选择解码后边长仍不小于目标尺寸的最大缩放比例
+            image.draft('RGB', size)
+        image.load()
+        return _finish(image, size), image.size != original
+
+
+class TurboJpegDecoder(Decoder):
+    """libjpeg-turbo 解码 JPEG，按支持的缩放比例（num/8）直接解码到接近目标尺寸"""
+
+    name = "turbojpeg"
+    formats = ("JPEG",)
+
+    def __init__(self):
+        # 找不到 libturbojpeg 时抛出异常，后端视为不可用
+        self.jpeg = TurboJPEG()
+        self.factors = sorted(self.jpeg.scaling_factors, key=lambda f: f[0] / f[1])
+
+    def decode(self, fp: BinaryIO, max_size: int) -> Tuple[Image.Image, bool]:
+        data = fp.read()
+        width, height, _, _ = self.jpeg.decode_header(data)
+        size = target_size(width, height, max_size)
+        factor = (1, 1)
+        for num, denom in self.factors:
+            # 缩放后的尺寸向上取整（与 libjpeg-turbo 的 TJSCALED 一致）
+            if -(-width * num // denom) >= size[0] and -(-height * num // denom) >= size[1]:
+                factor = (num, denom)
+                break
+        pixels = self.jpeg.decode(data, pixel_format=TJPF_RGB, scaling_factor=factor)
+        return _finish(Image.fromarray(pixels), size), factor != (1, 1)
+
+
+class VipsDecoder(Decoder):
+    """libvips 解码，JPEG/WebP 在解码时缩小"""
+
+    name = "pyvips"
+    formats = ("JPEG", "WEBP", "PNG")
+
+    def decode(self, fp: BinaryIO, max_size: int) -> Tuple[Image.Image, bool]:
+        data = fp.read()
+        header = pyvips.Image.new_from_buffer(data, "")
+        size = target_size(header.width, header.height, max_size)
+        shrink = min(header.width // size[0], header.height // size[1])
+        options = ""
+        if header.get("vips-loader").startswith("jpeg"):
+            shrink = max(s for s in (1, 2, 4, 8) if s <= shrink)
+            options = f"shrink={shrink}"
+        elif header.get("vips-loader").startswith("webp") and shrink > 1:
+            options = f"scale={1 / shrink}"
+        image = pyvips.Image.new_from_buffer(data, options, access="sequential")
+        # 灰度/16位/CMYK统一转为8位sRGB；与 PIL 的 convert('RGB') 一致，丢弃alpha通道
+        if image.interpretation != "srgb":
+            image = image.colourspace("srgb")
+        if image.format != "uchar":
+            image = image.cast("uchar")
+        pixels = np.ndarray(buffer=image.extract_band(0, n=3).write_to_memory(), dtype=np.uint8,
+                            shape=(image.height, image.width, 3))
+        return _finish(Image.fromarray(pixels), size), image.width < header.width
+
+
+def _create(name: str) -> Optional[Decoder]:
+    """按名称创建后端，依赖不可用时返回None"""
+    try:
+        if name == "pil":
+            return PilDecoder()
+        if name == "turbojpeg" and TurboJPEG is not None:
+            return TurboJpegDecoder()
+        if name == "pyvips" and pyvips is not None:
+            return VipsDecoder()
+    except Exception as e:
+        logger.warning(f"Image decoder {name} unavailable: {str(e)}")
+        return None
+    if name not in ("turbojpeg", "pyvips"):
+        logger.warning(f"Unknown image decoder: {name}")
+    return None
+
+
+class ImageDecoders:
+    """按格式选择后端解码，并统计各后端的解码次数、耗时和缩放解码次数"""
+
+    def __init__(self, names: List[str] = IMAGE_DECODERS):
+        self.decoders = [d for d in (_create(name) for name in names) if d is not None]
+        if not any(isinstance(d, PilDecoder) for d in self.decoders):
+            self.decoders.append(PilDecoder())
+        self._lock = threading.Lock()
+        self.stats = {d.name: {"count": 0, "reduced": 0, "seconds": 0.0} for d in self.decoders}
+        self.fallbacks = 0
+        logger.info(f"Image decoders: {[d.name for d in self.decoders]}")
+
+    def decode(self, source: Union[bytes, BinaryIO], max_size: int) -> Image.Image:
+        """解码图片并缩放到最大边长 max_size，返回RGB图片"""
+        fp = io.BytesIO(source) if isinstance(source, bytes) else source
+        image_format = sniff_format(fp.read(16))
+        fp.seek(0)
+
+        candidates = [d for d in self.decoders if d.supports(image_format)]
+        for i, decoder in enumerate(candidates):
+            start = time.time()
+            try:
+                image, reduced = decoder.decode(fp, max_size)
+            except Exception as e:
+                if i == len(candidates) - 1:
+                    raise
+                logger.warning(f"Image decoder {decoder.name} failed on {image_format}: {str(e)} - falling back")
+                with self._lock:
+                    self.fallbacks += 1
+                fp.seek(0)
+                continue
+            with self._lock:
+                stats = self.stats[decoder.name]
+                stats["count"] += 1
+                stats["reduced"] += int(reduced)
+                stats["seconds"] += time.time() - start
+            return image
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "decoders": [d.name for d in self.decoders],
+                "jpeg_draft": JPEG_DRAFT,
+                "backends": {name: {"count": s["count"], "reduced": s["reduced"],
+                                    "mean_ms": round(1000 * s["seconds"] / s["count"], 2) if s["count"] else None}
+                             for name, s in self.stats.items()},
+                "fallbacks": self.fallbacks,
+            }
+
+
+decoders = ImageDecoders()
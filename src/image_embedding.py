@@ -0,0 +1,132 @@
+"""
+图片向量 - 只运行已加载模型的视觉编码器，不生成文本，用于相似度检索和去重
+
+每张图片只取不切片的整图（与 fast 档位相同），经视觉编码器和重采样器得到查询token特征，
+平均池化后做L2归一化。一批图片只需一次视觉前向，比逐张调用 model.chat 生成描述便宜得多。
+
+输出精度：
+- float32 / float16: 归一化后的向量
+- int8: 每个向量按最大绝对值缩放到 [-127, 127]，同时返回缩放系数（原值 ≈ 量化值 × scale）
+
+响应编码：JSON（嵌套列表）或 msgpack（整个矩阵为一个小端字节串，按 dtype 和 [count, dim] 还原）。
+"""
+import logging
+import os
+from typing import Any, Dict, List
+
+import msgpack
+import numpy as np
+import torch
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# 单次 /embed 请求最多的图片数
+EMBED_MAX_IMAGES = int(os.getenv("EMBED_MAX_IMAGES", 64))
+# 每次视觉前向的图片数（限制显存占用）
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", 16))
+
+EMBED_DTYPES = ("float32", "float16", "int8")
+MSGPACK_MEDIA_TYPE = "application/x-msgpack"
+
+
+def _vision_features(model: Any, images: List[Image.Image]) -> torch.Tensor:
+    """
+    MiniCPM-V 的视觉编码：与 model.get_vllm_embedding 中的视觉部分相同（vpm + resampler），
+    返回 [N, 查询token数, 隐藏维度]
+    """
+    processor = getattr(model, "processor", None)
+    if processor is None:
+        raise RuntimeError("Model processor is not initialized")
+
+    # 每张图片作为一个独立样本，不切片
+    inputs = processor.image_processor([[image] for image in images], do_pad=True, max_slice_nums=1,
+                                       return_tensors="pt")
+    pixel_values = [sample[0] for sample in inputs["pixel_values"]]
+    tgt_sizes = torch.vstack([sizes[:1] for sizes in inputs["tgt_sizes"]]).type(torch.int32)
+
+    patch_embedding = model.vpm.embeddings.patch_embedding.weight
+    device, dtype = patch_embedding.device, patch_embedding.dtype
+    tgt_sizes = tgt_sizes.to(device)
+
+    max_patches = int(torch.max(tgt_sizes[:, 0] * tgt_sizes[:, 1]))
+    flat = [p.flatten(end_dim=1).permute(1, 0) for p in pixel_values]
+    flat = torch.nn.utils.rnn.pad_sequence(flat, batch_first=True, padding_value=0.0)
+    batch, length, _ = flat.shape
+    flat = flat.permute(0, 2, 1).reshape(batch, 3, -1, length)
+
+    patch_attn_mask = torch.zeros((batch, 1, max_patches), dtype=torch.bool, device=device)
+    for i in range(batch):
+        patch_attn_mask[i, 0, :tgt_sizes[i][0] * tgt_sizes[i][1]] = True
+
+    hidden = model.vpm(flat.to(device=device, dtype=dtype), patch_attention_mask=patch_attn_mask,
+                       tgt_sizes=tgt_sizes).last_hidden_state
+    return model.resampler(hidden, tgt_sizes)
+
+
+@torch.no_grad()
+def encode_images(model: Any, images: List[Image.Image], batch_size: int = EMBED_BATCH_SIZE) -> np.ndarray:
+    """
+    计算图片向量（平均池化 + L2归一化）
+
+    Returns:
+        np.ndarray: [N, dim] float32
+    """
+    vectors = []
+    for start in range(0, len(images), max(1, batch_size)):
+        chunk = images[start:start + batch_size]
+        pooled = _vision_features(model, chunk).mean(dim=1)
+        pooled = torch.nn.functional.normalize(pooled.float(), dim=-1)
+        vectors.append(pooled.cpu().numpy())
+    return np.concatenate(vectors, axis=0)
+
+
+def quantize(embeddings: np.ndarray, dtype: str) -> Dict[str, Any]:
+    """按输出精度转换向量；int8 时返回每个向量的缩放系数"""
+    if dtype == "float32":
+        return {"data": embeddings.astype(np.float32), "scales": None}
+    if dtype == "float16":
+        return {"data": embeddings.astype(np.float16), "scales": None}
+    if dtype == "int8":
+        scales = np.abs(embeddings).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        data = np.clip(np.rint(embeddings / scales[:, None]), -127, 127).astype(np.int8)
+        return {"data": data, "scales": scales.astype(np.float32)}
+    raise ValueError(f"Unsupported embedding dtype: {dtype}")
+
+
+def dequantize(data: np.ndarray, scales: Any = None) -> np.ndarray:
+    """把响应中的向量还原为 float32"""
+    data = data.astype(np.float32)
+    if scales is not None:
+        data *= np.asarray(scales, dtype=np.float32)[:, None]
+    return data
+
+
+def to_json(quantized: Dict[str, Any]) -> Dict[str, Any]:
+    scales = quantized["scales"]
+    return {
+        "embeddings": quantized["data"].tolist(),
+        "scales": scales.tolist() if scales is not None else None,
+    }
+
+
+def to_msgpack(payload: Dict[str, Any], quantized: Dict[str, Any]) -> bytes:
+    """msgpack 响应：embeddings 为 [count, dim] 矩阵的小端字节，scales 为 float32 字节"""
+    data = quantized["data"]
+    scales = quantized["scales"]
+    payload = dict(payload)
+    payload["embeddings"] = data.astype(data.dtype.newbyteorder("<")).tobytes()
+    payload["scales"] = scales.astype("<f4").tobytes() if scales is not None else None
+    return msgpack.packb(payload, use_bin_type=True)
+
+
+def from_msgpack(content: bytes) -> Dict[str, Any]:
+    """客户端解码 msgpack 响应，embeddings 还原为 numpy 数组（int8 时 scales 也还原为数组）"""
+    payload = msgpack.unpackb(content, raw=False)
+    shape = (payload["count"], payload["dim"])
+    payload["embeddings"] = np.frombuffer(payload["embeddings"],
+                                          dtype=np.dtype(payload["dtype"]).newbyteorder("<")).reshape(shape)
+    if payload.get("scales") is not None:
+        payload["scales"] = np.frombuffer(payload["scales"], dtype="<f4")
+    return payload
@@ -0,0 +1,453 @@
+"""
+推理后端 - 模型的加载/卸载和推理调用（单条、流式、批量、图片向量、候选标签打分）
+
+ModelService 负责生命周期、停放、缓存、预热和辅助生成等与运行时无关的部分，通过 InferenceBackend 调用具体的运行时：
+- transformers: AutoModel + model.chat（MiniCPM-V 原始权重或预处理快照），权重可在设备间移动（停放、空闲释放显存）
+- llama_cpp: llama.cpp（llama-cpp-python）运行 MiniCPM-V 的 GGUF 量化模型，适合纯CPU副本；不支持停放和候选标签打分
+- stub: 测试用桩模型（STUB_MODEL=true）
+
+每个模型使用的后端由 MODEL_BACKENDS 指定（"模型名=后端,..."），未指定时模型目录中有 .gguf 文件则使用 llama_cpp，
+否则使用 transformers。chat/stream/batch 的参数与 MiniCPM-V 的 model.chat 相同，
+其他后端只使用 max_new_tokens、sampling、repetition_penalty，忽略不适用的参数（如 max_slice_nums、num_beams）。
+"""
+import abc
+import base64
+import ctypes
+import io
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+import numpy as np
+import torch
+from fastapi import HTTPException
+from PIL import Image
+from transformers import AutoModel, AutoTokenizer
+
+import cpu_acceleration
+import image_embedding
+import label_scoring
+import model_snapshot
+import stub_model
+
+try:
+    import llama_cpp
+    from llama_cpp.llama_chat_format import MiniCPMv26ChatHandler
+except ImportError:
+    llama_cpp = None
+
+logger = logging.getLogger(__name__)
+
+
+def parse_model_backends(spec: str) -> Dict[str, str]:
+    """解析 "模型名=后端,..." 格式的配置"""
+    backends = {}
+    for item in spec.split(","):
+        if "=" not in item:
+            continue
+        name, backend = (part.strip() for part in item.split("=", 1))
+        if name and backend:
+            backends[name] = backend
+    return backends
+
+
+# 模型名=后端（transformers / llama_cpp），逗号分隔；未列出的模型按目录内容自动选择
+MODEL_BACKENDS = parse_model_backends(os.getenv("MODEL_BACKENDS", ""))
+# GGUF 模型目录中有多个量化版本时选择文件名包含该字符串的文件
+GGUF_QUANT = os.getenv("GGUF_QUANT", "Q4_K_M")
+# llama.cpp 上下文长度（token），需容纳切片后的视觉token、提示词和生成的token
+GGUF_N_CTX = int(os.getenv("GGUF_N_CTX", 4096))
+# 在GPU上运行时卸载到GPU的层数（-1 为全部）；在CPU上运行时为0
+GGUF_GPU_LAYERS = int(os.getenv("GGUF_GPU_LAYERS", -1))
+# llama.cpp 推理线程数，0 表示使用 TORCH_THREADS（未设置时为CPU核心数）
+GGUF_THREADS = int(os.getenv("GGUF_THREADS", 0))
+# llama.cpp 的重复惩罚（与官方 MiniCPM-V GGUF 示例一致）
+GGUF_REPEAT_PENALTY = float(os.getenv("GGUF_REPEAT_PENALTY", 1.05))
+
+
+class BackendUnsupported(HTTPException):
+    """当前模型的推理后端不支持该操作"""
+
+    def __init__(self, backend: str, operation: str):
+        super().__init__(status_code=501, detail=f"当前模型的推理后端 {backend} 不支持 {operation}")
+
+
+class InferenceBackend(abc.ABC):
+    """
+    推理后端接口
+
+    load 之后 model/tokenizer 为运行时对象；movable 为 True 时 ModelService 可以把 model 移到其他设备
+    （停放到主机内存、空闲时释放显存）。
+    """
+
+    name = "base"
+    movable = False
+
+    def __init__(self, **options):
+        self.model: Any = None
+        self.tokenizer: Any = None
+
+    @abc.abstractmethod
+    def load(self, model_name: str, model_path: Path, device: str) -> Dict[str, Any]:
+        """
+        加载模型
+
+        Returns:
+            Dict[str, Any]: {"source": 加载来源, "path": 实际加载路径, "phases": 各阶段耗时秒数}
+        """
+
+    def finish_load(self) -> Dict[str, float]:
+        """预热完成后调用，返回额外的阶段耗时"""
+        return {}
+
+    def unload(self):
+        self.model = None
+        self.tokenizer = None
+
+    def chat(self, msgs: List[Dict[str, Any]], **kwargs) -> str:
+        raise BackendUnsupported(self.name, "chat")
+
+    def stream(self, msgs: List[Dict[str, Any]], **kwargs) -> Iterator[str]:
+        raise BackendUnsupported(self.name, "流式生成")
+
+    def batch(self, batch_msgs: List[List[Dict[str, Any]]], **kwargs) -> List[str]:
+        """默认逐条生成"""
+        return [self.chat(msgs, **kwargs) for msgs in batch_msgs]
+
+    def embed(self, images: List[Image.Image]) -> np.ndarray:
+        """图片向量（L2归一化），[N, dim] float32"""
+        raise BackendUnsupported(self.name, "图片向量")
+
+    def classify(self, image: Image.Image, prompt: str, labels: List[str],
+                 max_slice_nums: Optional[int] = None) -> Dict[str, Any]:
+        """候选标签打分，返回格式见 label_scoring.rank"""
+        raise BackendUnsupported(self.name, "候选标签打分")
+
+    def describe(self) -> Dict[str, Any]:
+        return {"name": self.name, "movable": self.movable}
+
+
+class TransformersBackend(InferenceBackend):
+    """transformers 运行 MiniCPM-V：优先从预处理快照加载，首次加载后保存快照"""
+
+    name = "transformers"
+    movable = True
+
+    def __init__(self, cpu_acceleration_modes: Optional[List[str]] = None, **options):
+        super().__init__()
+        self.cpu_acceleration_modes = cpu_acceleration_modes or []
+        self._snapshot = None
+
+    def load(self, model_name: str, model_path: Path, device: str) -> Dict[str, Any]:
+        phases = {}
+        # 优化数据类型选择
+        torch_dtype = torch.bfloat16 if torch.cuda.is_bf16_supported() else torch.float16
+        if device == "cpu":
+            # CPU上默认使用bfloat16更高效；int8动态量化需要float32权重
+            torch_dtype = cpu_acceleration.load_dtype(self.cpu_acceleration_modes)
+
+        # 优先从预处理好的快照加载（权重已是目标dtype，safetensors内存映射）
+        snapshot_dir = model_snapshot.snapshot_path(model_name, device, torch_dtype)
+        from_snapshot = model_snapshot.is_valid(snapshot_dir, model_path)
+        load_path = snapshot_dir if from_snapshot else model_path
+        logger.info(f"Loading model from {load_path}")
+
+        # 加载tokenizer（缓存到磁盘以加快后续加载）
+        phase_start = time.time()
+        self.tokenizer = AutoTokenizer.from_pretrained(
+            str(load_path),
+            trust_remote_code=True,
+            cache_dir=os.getenv("HF_HOME", "/tmp/hf_cache")
+        )
+        phases["tokenizer"] = time.time() - phase_start
+
+        # 加载模型并启用优化选项
+        phase_start = time.time()
+        self.model = AutoModel.from_pretrained(
+            str(load_path),
+            torch_dtype=torch_dtype,
+            device_map="auto" if device == "cuda" else None,
+            trust_remote_code=True,
+            cache_dir=os.getenv("HF_HOME", "/tmp/hf_cache"),
+            low_cpu_mem_usage=True,  # 降低CPU内存使用
+            use_flash_attention_2=True if device == "cuda" else False  # CUDA启用FlashAttention
+        )
+
+        # 修复模型配置中的_name_or_path为原始HuggingFace repo名称，避免processor加载错误
+        if hasattr(self.model, 'config'):
+            self.model.config._name_or_path = f"openbmb/{model_name}"
+
+        if device == "cpu":
+            self.model = self.model.to(device)
+
+        self.model.eval()
+        phases["model"] = time.time() - phase_start
+
+        if from_snapshot:
+            phase_start = time.time()
+            model_snapshot.load_processor(self.model, snapshot_dir)
+            phases["processor"] = time.time() - phase_start
+
+        # 首次加载成功后保存快照权重（需在CPU加速修改模型之前），processor 在预热后写入（见 finish_load）
+        if snapshot_dir is not None and not from_snapshot:
+            phase_start = time.time()
+            try:
+                staging = model_snapshot.save_weights(self.model, self.tokenizer, snapshot_dir, model_path)
+                self._snapshot = (staging, snapshot_dir, model_path,
+                                  {"model_name": model_name, "device": device, "dtype": str(torch_dtype)})
+            except Exception as e:
+                logger.warning(f"Failed to save model snapshot: {str(e)}")
+                model_snapshot.discard(snapshot_dir)
+            phases["snapshot_save"] = time.time() - phase_start
+
+        return {"source": "snapshot" if from_snapshot else "pretrained", "path": str(load_path), "phases": phases}
+
+    def finish_load(self) -> Dict[str, float]:
+        """预热后processor已创建，一并写入快照"""
+        if self._snapshot is None:
+            return {}
+        staging, snapshot_dir, model_path, meta = self._snapshot
+        self._snapshot = None
+        phase_start = time.time()
+        try:
+            model_snapshot.finish_save(staging, snapshot_dir, self.model, model_path, meta)
+        except Exception as e:
+            logger.warning(f"Failed to finalize model snapshot: {str(e)}")
+            model_snapshot.discard(snapshot_dir)
+        return {"snapshot_save": time.time() - phase_start}
+
+    def unload(self):
+        if self.model is not None:
+            # 将模型移到CPU以释放GPU内存
+            try:
+                self.model = self.model.cpu()
+            except Exception:
+                pass
+        super().unload()
+
+    @torch.no_grad()
+    def chat(self, msgs: List[Dict[str, Any]], **kwargs) -> str:
+        res = self.model.chat(msgs=msgs, tokenizer=self.tokenizer, **kwargs)
+        if isinstance(res, list):
+            res = res[0] if res else ""
+        return res
+
+    def stream(self, msgs: List[Dict[str, Any]], **kwargs) -> Iterator[str]:
+        with torch.no_grad():
+            yield from self.model.chat(msgs=msgs, tokenizer=self.tokenizer, stream=True, **kwargs)
+
+    @torch.no_grad()
+    def batch(self, batch_msgs: List[List[Dict[str, Any]]], **kwargs) -> List[str]:
+        res = self.model.chat(msgs=batch_msgs, tokenizer=self.tokenizer, **kwargs)
+        if not isinstance(res, list) or len(res) != len(batch_msgs):
+            raise ValueError(f"Unexpected batch result: {type(res)}")
+        return res
+
+    def embed(self, images: List[Image.Image]) -> np.ndarray:
+        return image_embedding.encode_images(self.model, images)
+
+    def classify(self, image: Image.Image, prompt: str, labels: List[str],
+                 max_slice_nums: Optional[int] = None) -> Dict[str, Any]:
+        return label_scoring.classify(self.model, self.tokenizer, image, prompt, labels, max_slice_nums)
+
+
+class StubBackend(TransformersBackend):
+    """测试用桩模型，实现与 MiniCPM-V 相同的 model.chat 接口"""
+
+    name = "stub"
+
+    def load(self, model_name: str, model_path: Path, device: str) -> Dict[str, Any]:
+        if model_name not in stub_model.STUB_MODEL_NAMES:
+            raise ValueError(f"Unknown stub model: {model_name}")
+        self.model = stub_model.StubModel(model_name).to(device)
+        self.tokenizer = stub_model.StubTokenizer()
+        return {"source": "stub", "path": None, "phases": {}}
+
+    def embed(self, images: List[Image.Image]) -> np.ndarray:
+        """代替视觉编码器：缩小到8x8灰度后的像素（去均值后L2归一化），相似图片得到相近的向量"""
+        vectors = np.stack([np.asarray(image.convert('L').resize((8, 8)), dtype=np.float32).ravel()
+                            for image in images])
+        vectors = vectors - vectors.mean(axis=1, keepdims=True) + 1e-3
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    def classify(self, image: Image.Image, prompt: str, labels: List[str],
+                 max_slice_nums: Optional[int] = None) -> Dict[str, Any]:
+        """代替候选标签打分：颜色名与图片平均颜色越接近对数似然越高，其他标签为固定的低分"""
+        mean = image.convert('RGB').resize((1, 1), Image.Resampling.BOX).getpixel((0, 0))
+        scores = []
+        for label in labels:
+            color = stub_model.STUB_COLORS.get(label.lower())
+            distance = sum((a - b) ** 2 for a, b in zip(mean, color)) ** 0.5 if color else 500.0
+            scores.append(-1.0 - distance / 50.0)
+        return label_scoring.rank(labels, scores)
+
+
+def _image_data_uri(image: Image.Image) -> str:
+    buffer = io.BytesIO()
+    image.convert('RGB').save(buffer, 'JPEG', quality=95)
+    return "data:image/jpeg;base64," + base64.b64encode(buffer.getvalue()).decode("ascii")
+
+
+def find_gguf_files(model_path: Path, quant: str = GGUF_QUANT):
+    """
+    在模型目录中查找语言模型和视觉投影（mmproj）的 GGUF 文件
+
+    Returns:
+        Tuple[Path, Optional[Path]]: (语言模型文件, 视觉投影文件)
+    """
+    files = sorted(model_path.glob("*.gguf"))
+    projectors = [f for f in files if "mmproj" in f.name.lower()]
+    weights = [f for f in files if f not in projectors]
+    if not weights:
+        raise FileNotFoundError(f"No GGUF model file in {model_path}")
+    preferred = [f for f in weights if quant and quant.lower() in f.name.lower()]
+    return (preferred or weights)[0], (projectors[0] if projectors else None)
+
+
+class LlamaCppBackend(InferenceBackend):
+    """
+    llama.cpp 运行 MiniCPM-V 的 GGUF 量化模型（需安装 llama-cpp-python）
+
+    模型目录中放置语言模型的 GGUF 文件和视觉投影的 mmproj GGUF 文件（如 openbmb/MiniCPM-V-4_5-gguf）。
+    llama.cpp 的上下文不是线程安全的，同一模型的推理依次执行；不使用beam search，非流式同样为贪心解码。
+    """
+
+    name = "llama_cpp"
+
+    def __init__(self, cpu_config: Optional[Dict[str, Any]] = None, **options):
+        super().__init__()
+        self.threads = GGUF_THREADS or (cpu_config or {}).get("torch_threads") or os.cpu_count() or 1
+        self.files: Dict[str, Optional[str]] = {}
+        self._lock = threading.Lock()
+
+    def load(self, model_name: str, model_path: Path, device: str) -> Dict[str, Any]:
+        if llama_cpp is None:
+            raise RuntimeError("GGUF 模型需要安装 llama-cpp-python (pip install llama-cpp-python)")
+        weights, projector = find_gguf_files(model_path)
+        if projector is None:
+            raise FileNotFoundError(f"No mmproj GGUF file in {model_path}")
+        phases = {}
+
+        phase_start = time.time()
+        handler = MiniCPMv26ChatHandler(clip_model_path=str(projector), verbose=False)
+        phases["projector"] = time.time() - phase_start
+
+        phase_start = time.time()
+        self.model = llama_cpp.Llama(
+            model_path=str(weights),
+            chat_handler=handler,
+            n_ctx=GGUF_N_CTX,
+            n_threads=self.threads,
+            n_gpu_layers=GGUF_GPU_LAYERS if device == "cuda" else 0,
+            verbose=False
+        )
+        phases["model"] = time.time() - phase_start
+        self.files = {"model": weights.name, "mmproj": projector.name}
+        logger.info(f"Loaded GGUF model {weights.name} with {projector.name} ({self.threads} threads)")
+        return {"source": "gguf", "path": str(weights), "phases": phases}
+
+    def unload(self):
+        if self.model is not None:
+            try:
+                self.model.close()
+            except Exception:
+                pass
+        super().unload()
+
+    @staticmethod
+    def _messages(msgs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """MiniCPM-V 格式的消息（content 为图片和文本的列表）转为 OpenAI 格式"""
+        messages = []
+        for msg in msgs:
+            content = msg["content"] if isinstance(msg["content"], list) else [msg["content"]]
+            if not any(isinstance(item, Image.Image) for item in content):
+                messages.append({"role": msg["role"], "content": "\n".join(str(item) for item in content)})
+                continue
+            messages.append({"role": msg["role"], "content": [
+                {"type": "image_url", "image_url": {"url": _image_data_uri(item)}} if isinstance(item, Image.Image)
+                else {"type": "text", "text": str(item)}
+                for item in content
+            ]})
+        return messages
+
+    @staticmethod
+    def _options(kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        sampling = kwargs.get("sampling", False) and kwargs.get("do_sample", True)
+        return {
+            "max_tokens": kwargs.get("max_new_tokens") or 512,
+            "temperature": kwargs.get("temperature", 0.7) if sampling else 0.0,
+            "repeat_penalty": kwargs.get("repetition_penalty") or GGUF_REPEAT_PENALTY,
+        }
+
+    def chat(self, msgs: List[Dict[str, Any]], **kwargs) -> str:
+        with self._lock:
+            response = self.model.create_chat_completion(messages=self._messages(msgs), **self._options(kwargs))
+        return response["choices"][0]["message"]["content"] or ""
+
+    def stream(self, msgs: List[Dict[str, Any]], **kwargs) -> Iterator[str]:
+        with self._lock:
+            for chunk in self.model.create_chat_completion(messages=self._messages(msgs), stream=True,
+                                                           **self._options(kwargs)):
+                text = chunk["choices"][0]["delta"].get("content")
+                if text:
+                    yield text
+
+    def embed(self, images: List[Image.Image]) -> np.ndarray:
+        """视觉投影输出的各位置平均池化后L2归一化（与 transformers 后端的向量不可混用）"""
+        handler = self.model.chat_handler
+        if not hasattr(handler, "_llava_cpp") or getattr(handler, "clip_ctx", None) is None:
+            raise BackendUnsupported(self.name, "图片向量")
+        vectors = []
+        with self._lock:
+            for image in images:
+                buffer = io.BytesIO()
+                image.convert('RGB').save(buffer, 'JPEG', quality=95)
+                data = buffer.getvalue()
+                embed = handler._llava_cpp.llava_image_embed_make_with_bytes(
+                    handler.clip_ctx, self.threads, (ctypes.c_uint8 * len(data)).from_buffer_copy(data), len(data)
+                )
+                try:
+                    positions = embed.contents.n_image_pos
+                    features = np.ctypeslib.as_array(embed.contents.embed, shape=(positions * self.model.n_embd(),))
+                    vectors.append(features.reshape(positions, -1).mean(axis=0))
+                finally:
+                    handler._llava_cpp.llava_image_embed_free(embed)
+        vectors = np.stack(vectors).astype(np.float32)
+        return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+    def describe(self) -> Dict[str, Any]:
+        return {**super().describe(), "files": self.files, "threads": self.threads, "n_ctx": GGUF_N_CTX}
+
+
+BACKENDS = {
+    TransformersBackend.name: TransformersBackend,
+    LlamaCppBackend.name: LlamaCppBackend,
+    StubBackend.name: StubBackend,
+}
+
+
+def register_backend(backend: type):
+    """注册其他推理后端（如测试用的轻量实现），之后可在 MODEL_BACKENDS 中按名称使用"""
+    BACKENDS[backend.name] = backend
+
+
+def is_gguf_model(model_path: Path) -> bool:
+    return model_path.is_dir() and any(model_path.glob("*.gguf"))
+
+
+def backend_for(model_name: str, model_path: Path) -> str:
+    """模型使用的后端：MODEL_BACKENDS 指定的，否则桩模型 / GGUF 目录为 llama_cpp / 其他为 transformers"""
+    if model_name in MODEL_BACKENDS:
+        return MODEL_BACKENDS[model_name]
+    if stub_model.STUB_MODEL:
+        return StubBackend.name
+    return LlamaCppBackend.name if is_gguf_model(model_path) else TransformersBackend.name
+
+
+def create_backend(name: str, **options) -> InferenceBackend:
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown inference backend: {name} (available: {', '.join(BACKENDS)})")
+    return BACKENDS[name](**options)
@@ -0,0 +1,230 @@
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Optional, Dict, Any
+
+logger = logging.getLogger(__name__)
+
+# 任务状态
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+
+FINISHED_STATUSES = (JOB_SUCCEEDED, JOB_FAILED)
+
+
+class JobStore:
+    """基于SQLite的异步分析任务存储，服务重启后排队中的任务不会丢失"""
+
+    def __init__(self, db_path: Path, ttl_seconds: int = 24 * 3600, lease_seconds: float = 120):
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds
+        # 运行中任务的租约时长：执行实例定期刷新 heartbeat_at，超时未刷新视为实例已退出
+        self.lease_seconds = lease_seconds
+        self._lock = threading.Lock()
+
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                prompt TEXT NOT NULL,
+                image_url TEXT,
+                image_data BLOB,
+                filename TEXT,
+                callback_url TEXT,
+                result TEXT,
+                error TEXT,
+                created_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, created_at)")
+        columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+        if "owner" not in columns:
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN owner TEXT")
+        if "heartbeat_at" not in columns:
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN heartbeat_at REAL")
+        self._conn.commit()
+
+        # 执行任务的实例标识：主机名、进程号和随机后缀（区分同一进程号被复用的情况）
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+        # 上次进程退出时正在执行的任务重新排队（滚动部署时新旧实例共用数据库，旧实例仍在执行的任务保持不变）
+        recovered = self.requeue_running()
+        if recovered:
+            logger.info(f"Requeued {recovered} interrupted jobs from {self.db_path}")
+
+    def create_job(self, prompt: str, image_url: Optional[str] = None,
+                   image_data: Optional[bytes] = None, filename: Optional[str] = None,
+                   callback_url: Optional[str] = None) -> str:
+        """创建新任务并返回任务ID"""
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, status, prompt, image_url, image_data, filename, callback_url, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, JOB_QUEUED, prompt, image_url, image_data, filename, callback_url, time.time())
+            )
+            self._conn.commit()
+        return job_id
+
+    def claim_next(self) -> Optional[Dict[str, Any]]:
+        """取出最早的排队任务并标记为运行中"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1",
+                (JOB_QUEUED,)
+            ).fetchone()
+            if row is None:
+                return None
+            now = time.time()
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, started_at = ?, heartbeat_at = ?, owner = ? WHERE id = ?",
+                (JOB_RUNNING, now, now, self.owner, row["id"])
+            )
+            self._conn.commit()
+            return dict(row)
+
+    def complete_job(self, job_id: str, result: Dict[str, Any]):
+        """记录任务成功结果，并释放已不再需要的图片数据"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, image_data = NULL, finished_at = ? WHERE id = ?",
+                (JOB_SUCCEEDED, json.dumps(result, ensure_ascii=False), time.time(), job_id)
+            )
+            self._conn.commit()
+
+    def fail_job(self, job_id: str, error: str):
+        """记录任务失败原因"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, image_data = NULL, finished_at = ? WHERE id = ?",
+                (JOB_FAILED, error, time.time(), job_id)
+            )
+            self._conn.commit()
+
+    def heartbeat(self, job_id: str) -> bool:
+        """刷新本实例运行中任务的租约，任务已不属于本实例时返回False"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET heartbeat_at = ? WHERE id = ? AND status = ? AND owner = ?",
+                (time.time(), job_id, JOB_RUNNING, self.owner)
+            )
+            self._conn.commit()
+            return cursor.rowcount > 0
+
+    def release_job(self, job_id: str):
+        """把本实例运行中的任务放回队列（模型暂时不可用时）"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, started_at = NULL, heartbeat_at = NULL, owner = NULL "
+                "WHERE id = ? AND status = ?",
+                (JOB_QUEUED, job_id, JOB_RUNNING)
+            )
+            self._conn.commit()
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """获取任务状态和结果（不包含图片数据）"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, status, prompt, image_url, filename, callback_url, result, error, "
+                "created_at, started_at, finished_at FROM jobs WHERE id = ?",
+                (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+
+        job = dict(row)
+        if job["result"] is not None:
+            job["result"] = json.loads(job["result"])
+        if job["status"] in FINISHED_STATUSES and job["finished_at"] is not None:
+            job["expires_at"] = job["finished_at"] + self.ttl_seconds
+            # 已过期但尚未被清理的任务视为不存在
+            if job["expires_at"] < time.time():
+                return None
+        return job
+
+    def _owner_alive(self, owner: Optional[str], heartbeat_at: Optional[float]) -> bool:
+        """
+        执行任务的实例是否仍在运行
+
+        租约超时未刷新的视为已退出（其他主机上的实例只能这样判断）；同一主机上的实例还检查进程是否存在，
+        进程已退出时不必等租约过期。
+        """
+        if not owner:
+            return False
+        if owner == self.owner:
+            return True
+        if heartbeat_at is None or time.time() - heartbeat_at > self.lease_seconds:
+            return False
+        parts = owner.rsplit(":", 2)
+        if len(parts) != 3:
+            return True
+        host, pid, _ = parts
+        if host != socket.gethostname() or not pid.isdigit():
+            return True
+        if int(pid) == os.getpid():
+            # 同一进程号但标识不同：本进程之前的实例（如重新创建的 JobStore）或进程号被复用
+            return False
+        try:
+            os.kill(int(pid), 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    def requeue_running(self) -> int:
+        """将所属实例已退出或租约已过期的运行中任务重置为排队状态"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, owner, COALESCE(heartbeat_at, started_at) AS heartbeat_at FROM jobs WHERE status = ?",
+                (JOB_RUNNING,)
+            ).fetchall()
+            stale = [row for row in rows if not self._owner_alive(row["owner"], row["heartbeat_at"])]
+            requeued = 0
+            for row in stale:
+                # 只有在读取之后仍由同一实例持有时才重置，避免与该实例刚刷新的租约冲突
+                cursor = self._conn.execute(
+                    "UPDATE jobs SET status = ?, started_at = NULL, heartbeat_at = NULL, owner = NULL "
+                    "WHERE id = ? AND status = ? AND owner IS ?",
+                    (JOB_QUEUED, row["id"], JOB_RUNNING, row["owner"])
+                )
+                requeued += cursor.rowcount
+            self._conn.commit()
+            return requeued
+
+    def purge_expired(self) -> int:
+        """删除超过TTL的已完成任务"""
+        cutoff = time.time() - self.ttl_seconds
+        with self._lock:
+            cursor = self._conn.execute(
+                f"DELETE FROM jobs WHERE status IN ({','.join('?' * len(FINISHED_STATUSES))}) AND finished_at < ?",
+                (*FINISHED_STATUSES, cutoff)
+            )
+            self._conn.commit()
+            return cursor.rowcount
+
+    def count_by_status(self) -> Dict[str, int]:
+        """按状态统计任务数量"""
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status").fetchall()
+        return {row["status"]: row["n"] for row in rows}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
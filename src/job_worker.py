@@ -0,0 +1,174 @@
+import logging
+import threading
+import time
+from typing import Optional, Dict, Any
+
+import requests
+from PIL import Image
+
+from job_store import JobStore
+from model_service import ModelService, QUALITY_TIERS, DEFAULT_QUALITY
+from model_lifecycle import LifecycleError
+import image_decoding
+import upload_limits
+
+logger = logging.getLogger(__name__)
+
+
+class JobWorker:
+    """后台任务执行线程 - 从JobStore依次取出任务交给ModelService处理"""
+
+    def __init__(self, model_service: ModelService, job_store: JobStore,
+                 poll_interval: float = 0.5, purge_interval: float = 60.0):
+        self.model_service = model_service
+        self.job_store = job_store
+        self.poll_interval = poll_interval
+        self.purge_interval = purge_interval
+        self._stop_event = threading.Event()
+        self._wakeup_event = threading.Event()
+        self._paused = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._last_purge = 0.0
+        # 正在执行的任务ID
+        self.current_job: Optional[str] = None
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="job-worker", daemon=True)
+        self._thread.start()
+        logger.info("Job worker started")
+
+    def stop(self, timeout: float = 5.0):
+        self._stop_event.set()
+        self._wakeup_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=timeout)
+            self._thread = None
+        logger.info("Job worker stopped")
+
+    def notify(self):
+        """有新任务入队时唤醒工作线程"""
+        self._wakeup_event.set()
+
+    def pause(self):
+        """停止领取新任务（排空时使用），正在执行的任务继续完成，排队任务留给其他实例"""
+        self._paused.set()
+
+    @property
+    def busy(self) -> bool:
+        return self.current_job is not None
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            self._maybe_purge()
+
+            # 模型未就绪或正在排空时任务保持排队，等待模型加载和预热完成
+            if not self.model_service.ready or self._paused.is_set():
+                self._wait()
+                continue
+
+            job = self.job_store.claim_next()
+            if job is None:
+                self._wait()
+                continue
+
+            self.current_job = job["id"]
+            done = threading.Event()
+            heartbeat = threading.Thread(target=self._heartbeat, args=(job["id"], done),
+                                         name="job-heartbeat", daemon=True)
+            heartbeat.start()
+            try:
+                self._process(job)
+            finally:
+                done.set()
+                heartbeat.join()
+                self.current_job = None
+
+    def _wait(self):
+        self._wakeup_event.wait(self.poll_interval)
+        self._wakeup_event.clear()
+
+    def _heartbeat(self, job_id: str, done: threading.Event):
+        """任务执行期间定期刷新租约，其他主机上的实例据此判断本实例仍在运行"""
+        interval = max(self.job_store.lease_seconds / 4, 0.1)
+        while not done.wait(interval):
+            try:
+                self.job_store.heartbeat(job_id)
+            except Exception as e:
+                logger.warning(f"Failed to refresh lease for job {job_id}: {str(e)}")
+
+    def _maybe_purge(self):
+        now = time.time()
+        if now - self._last_purge < self.purge_interval:
+            return
+        self._last_purge = now
+        try:
+            purged = self.job_store.purge_expired()
+            if purged:
+                logger.info(f"Purged {purged} expired jobs")
+            # 其他实例（如滚动部署中被强制停止的旧实例、其他主机上已停止的副本）留下的运行中任务
+            recovered = self.job_store.requeue_running()
+            if recovered:
+                logger.info(f"Requeued {recovered} jobs from exited instances")
+        except Exception as e:
+            logger.warning(f"Failed to purge expired jobs: {str(e)}")
+
+    def _process(self, job: Dict[str, Any]):
+        job_id = job["id"]
+        logger.info(f"Processing job {job_id}")
+        try:
+            image = self._load_image(job)
+            result, processing_time, details = self.model_service.analyze_image(image, job["prompt"])
+            if result is None:
+                raise RuntimeError("图片分析失败")
+
+            self.job_store.complete_job(job_id, {
+                "result": result,
+                "model_used": self.model_service.current_model_name,
+                "prompt": job["prompt"],
+                "vision_tokens": details.get("vision_tokens"),
+                "processing_time_seconds": round(processing_time, 3)
+            })
+            logger.info(f"Job {job_id} succeeded")
+        except LifecycleError as e:
+            # 模型切换/卸载期间不可用，任务重新排队等待模型就绪
+            logger.info(f"Job {job_id} requeued: {e.detail}")
+            self.job_store.release_job(job_id)
+            # 任务还没有结束，不发送回调
+            return
+        except Exception as e:
+            logger.error(f"Job {job_id} failed: {str(e)}")
+            self.job_store.fail_job(job_id, str(e))
+
+        if job.get("callback_url"):
+            self._send_callback(job_id, job["callback_url"])
+
+    def _load_image(self, job: Dict[str, Any]) -> Image.Image:
+        max_size = QUALITY_TIERS[DEFAULT_QUALITY]["max_size"]
+        if job.get("image_data") is not None:
+            return image_decoding.decoders.decode(job["image_data"], max_size)
+
+        # 与同步接口相同：以流方式下载到有字节上限的临时文件，先读头部检查像素数再解码
+        with requests.get(job["image_url"], timeout=30, stream=True) as response:
+            response.raise_for_status()
+            content_type = response.headers.get('content-type', '')
+            if not content_type.startswith('image/'):
+                raise ValueError("URL 必须指向图片文件")
+            with upload_limits.tracker.track() as usage:
+                spool = upload_limits.spool_response(response, usage)
+                try:
+                    upload_limits.probe_image(spool, usage)
+                    return image_decoding.decoders.decode(spool, max_size)
+                finally:
+                    spool.close()
+
+    def _send_callback(self, job_id: str, callback_url: str):
+        """任务完成后将最终状态POST到回调地址，失败只记录日志"""
+        job = self.job_store.get_job(job_id)
+        try:
+            response = requests.post(callback_url, json=job, timeout=10)
+            response.raise_for_status()
+        except Exception as e:
+            logger.warning(f"Callback for job {job_id} to {callback_url} failed: {str(e)}")
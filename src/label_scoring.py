@@ -0,0 +1,138 @@
+"""
+候选标签打分 - 按模型似然对候选标签排序，代替生成自由文本后再解析
+
+对每个候选标签计算 log P(标签token + 回答结束符 | 图片和提示词)：
+图片和提示词前缀只做一次前向，KV缓存复制给全部候选，所有候选的后续token在一次批量前向中打分，
+没有自回归生成，结果是确定的。概率为各候选对数似然在候选集合内的 softmax；
+coverage 为全部候选的原始概率之和，接近0表示模型认为图片不属于任何候选。
+"""
+import logging
+import math
+import os
+from copy import deepcopy
+from typing import Any, Dict, List, Optional
+
+import torch
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# 单次请求最多的候选标签数
+CLASSIFY_MAX_LABELS = int(os.getenv("CLASSIFY_MAX_LABELS", 50))
+
+DEFAULT_CLASSIFY_PROMPT = "这张图片属于以下哪一类？\n候选类别：{labels}\n只回答类别名称。"
+
+
+def build_prompt(labels: List[str], prompt: Optional[str] = None) -> str:
+    """未指定提示词时列出全部候选；提示词中可用 {labels} 引用候选列表"""
+    return (prompt or DEFAULT_CLASSIFY_PROMPT).replace("{labels}", "、".join(labels))
+
+
+def _repeat_cache(cache: Any, repeats: int) -> Any:
+    """把 batch=1 的KV缓存复制为 batch=repeats"""
+    if hasattr(cache, "batch_repeat_interleave"):
+        cache.batch_repeat_interleave(repeats)
+        return cache
+    return tuple(tuple(t.repeat_interleave(repeats, dim=0) for t in layer) for layer in cache)
+
+
+@torch.no_grad()
+def score_labels(llm: Any, prefix_embeds: torch.Tensor, label_ids: List[List[int]]) -> List[float]:
+    """
+    计算每个候选token序列在前缀之后的对数似然
+
+    Args:
+        llm: 语言模型（接受 inputs_embeds / input_ids 和 past_key_values）
+        prefix_embeds: [1, 前缀长度, 隐藏维度]，已包含视觉特征
+        label_ids: 每个候选的token序列（含回答结束符）
+
+    Returns:
+        List[float]: 每个候选的 log P(序列 | 前缀)
+    """
+    out = llm(inputs_embeds=prefix_embeds, use_cache=True)
+    first = torch.log_softmax(out.logits[0, -1].float(), dim=-1)
+    scores = [float(first[ids[0]]) for ids in label_ids]
+
+    longest = max(len(ids) for ids in label_ids)
+    if longest == 1:
+        return scores
+
+    # 右侧填充：因果注意力下填充位置不影响前面的token，不需要attention mask
+    device = prefix_embeds.device
+    inputs = torch.zeros((len(label_ids), longest - 1), dtype=torch.long, device=device)
+    for i, ids in enumerate(label_ids):
+        inputs[i, :len(ids) - 1] = torch.tensor(ids[:-1], device=device)
+    cache = _repeat_cache(out.past_key_values, len(label_ids))
+    logprobs = torch.log_softmax(llm(input_ids=inputs, past_key_values=cache, use_cache=True).logits.float(), dim=-1)
+
+    for i, ids in enumerate(label_ids):
+        for position, token in enumerate(ids[1:]):
+            scores[i] += float(logprobs[i, position, token])
+    return scores
+
+
+def rank(labels: List[str], logprobs: List[float]) -> Dict[str, Any]:
+    """按对数似然排序，给出候选集合内归一化的概率和候选覆盖的原始概率"""
+    top = max(logprobs)
+    weights = [math.exp(score - top) for score in logprobs]
+    total = sum(weights)
+    ranked = sorted(
+        ({"label": label, "probability": round(weight / total, 6), "logprob": round(score, 4)}
+         for label, weight, score in zip(labels, weights, logprobs)),
+        key=lambda item: item["logprob"], reverse=True
+    )
+    return {
+        "label": ranked[0]["label"],
+        "labels": ranked,
+        "coverage": round(sum(math.exp(score) for score in logprobs), 6),
+    }
+
+
+def _answer_end_id(tokenizer: Any) -> int:
+    """聊天模板中助手回答的结束符（<|im_end|>，没有时用 eos）"""
+    token_id = tokenizer.convert_tokens_to_ids("<|im_end|>")
+    if isinstance(token_id, int) and token_id != tokenizer.unk_token_id:
+        return token_id
+    return tokenizer.eos_token_id
+
+
+def _prefix_embeds(model: Any, tokenizer: Any, msgs: List[Dict[str, Any]], max_slice_nums: Optional[int]):
+    """按 MiniCPM-V model.chat 的方式构建输入（聊天模板 + processor + 视觉编码），返回前缀嵌入"""
+    processor = getattr(model, "processor", None)
+    if processor is None:
+        raise RuntimeError("Model processor is not initialized")
+
+    copy_msgs = deepcopy(msgs)
+    images = []
+    for msg in copy_msgs:
+        parts = []
+        for item in msg["content"]:
+            if isinstance(item, Image.Image):
+                images.append(item)
+                parts.append("(<image>./</image>)")
+            else:
+                parts.append(item)
+        msg["content"] = "\n".join(parts)
+    prompt = tokenizer.apply_chat_template(copy_msgs, tokenize=False, add_generation_prompt=True,
+                                           enable_thinking=False)
+
+    kwargs = {"max_slice_nums": max_slice_nums} if max_slice_nums is not None else {}
+    inputs = processor([prompt], [images], return_tensors="pt", **kwargs).to(model.device)
+    embeds, _ = model.get_vllm_embedding({
+        "input_ids": inputs["input_ids"],
+        "image_bound": inputs["image_bound"],
+        "pixel_values": inputs["pixel_values"],
+        "tgt_sizes": inputs["tgt_sizes"],
+    })
+    return embeds
+
+
+@torch.no_grad()
+def classify(model: Any, tokenizer: Any, image: Image.Image, prompt: str, labels: List[str],
+             max_slice_nums: Optional[int] = None) -> Dict[str, Any]:
+    """对图片在候选标签上打分：按 MiniCPM-V 的结构构建前缀，所有候选共享前缀的KV缓存"""
+    msgs = [{'role': 'user', 'content': [image, prompt]}]
+    end_id = _answer_end_id(tokenizer)
+    label_ids = [tokenizer.encode(label, add_special_tokens=False) + [end_id] for label in labels]
+    prefix = _prefix_embeds(model, tokenizer, msgs, max_slice_nums)
+    return rank(labels, score_labels(model.llm, prefix, label_ids))
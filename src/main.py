@@ -1,14 +1,34 @@
 import os
+import asyncio
 import logging
 from pathlib import Path
 from dotenv import load_dotenv
-from fastapi import FastAPI, File, UploadFile, Form, HTTPException
-from fastapi.responses import JSONResponse
+from typing import Optional, Union, BinaryIO, List
+from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Request, WebSocket
+from fastapi.responses import JSONResponse, Response
 from pydantic import BaseModel, Field
 from enum import Enum
 from PIL import Image
-import io
-from model_service import ModelService
+import hashlib
+import functools
+import threading
+import time
+from urllib.parse import unquote
+import numpy as np
+from model_service import ModelService, QUALITY_TIERS, DEFAULT_QUALITY
+from job_store import JobStore
+from job_worker import JobWorker
+from session_store import SessionStore
+from single_flight import SingleFlight, file_digest
+from admission import AdmissionController
+from request_pipeline import RequestPipeline
+import cpu_tuning
+import upload_limits
+import video_frames
+import image_embedding
+import label_scoring
+import image_decoding
+from rpc_server import RpcSession
 
 # load env first
 load_dotenv()
@@ -20,29 +40,246 @@ logger = logging.getLogger(__name__)
 APP_PORT = int(os.getenv("SERVER_PORT", 8207))
 APP_HOST = os.getenv("SERVER_HOST", "0.0.0.0")
 MODELS_DIR = Path(os.getenv("MODEL_PATH", "./models"))
+JOB_DB_PATH = Path(os.getenv("JOB_DB_PATH", "./data/jobs.sqlite3"))
+JOB_TTL_SECONDS = int(os.getenv("JOB_TTL_SECONDS", 24 * 3600))
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", 120))
+# 启动时在后台加载并预热的模型（为空则等待 /load-model），部署脚本通过 /ready 判断就绪
+PRELOAD_MODEL = os.getenv("PRELOAD_MODEL", "")
+
+# 进程启动时间，用于统计从启动到就绪的耗时
+STARTED_AT = time.time()
 
 app = FastAPI(title="MiniCPM-V Server", version="0.1.0")
 
 # 全局模型服务实例
 model_service = ModelService(MODELS_DIR)
 
+# 图片解码/缩放线程池（CPU主机上绑定到 PREPROCESS_CPUS）
+preprocess_pool = cpu_tuning.create_preprocess_pool(model_service.cpu_config)
+
+# 请求流水线：下载（事件循环）、解码（预处理线程池）、推理（推理线程）三个阶段各自限流，不同请求的阶段互相重叠
+pipeline = RequestPipeline(preprocess_pool, model_service.cpu_config.get("preprocess_workers") or 2)
+
+# 异步任务存储和后台执行线程
+job_store = JobStore(JOB_DB_PATH, ttl_seconds=JOB_TTL_SECONDS, lease_seconds=JOB_LEASE_SECONDS)
+job_worker = JobWorker(model_service, job_store)
+
+# 多轮对话会话（历史消息和视觉编码缓存保存在内存中）
+session_store = SessionStore()
+
+# 相同请求（模型、图片内容/URL、提示词、档位均相同）并发到达时只推理一次
+single_flight = SingleFlight()
+
+# 准入控制：按服务时间估计和排队深度提前拒绝无法在期限内完成的请求
+admission = AdmissionController()
+
+# 启动/排空状态：ready_at 为模型加载并预热完成的时间，draining_since 为收到 /drain 的时间
+lifecycle = {"ready_at": None, "draining_since": None, "preload_error": None}
+
 # 可用模型枚举
 class AvailableModels(str, Enum):
     MINICPM_V4_INT4 = "MiniCPM-V-4-int4"  # 注意：此模型可能有兼容性问题，推荐使用4.5版本
     MINICPM_V4_5_INT4 = "MiniCPM-V-4_5-int4"  # 推荐版本
+    MINICPM_V4_GGUF = "MiniCPM-V-4-gguf"  # GGUF量化模型，llama.cpp运行，适合纯CPU副本
+    MINICPM_V4_5_GGUF = "MiniCPM-V-4_5-gguf"
+
+# 速度/质量档位枚举
+class QualityTier(str, Enum):
+    FAST = "fast"  # 448px、不切片，适合简单打标签
+    BALANCED = "balanced"  # 1024px、模型默认切片（默认）
+    ACCURATE = "accurate"  # 1344px、最多9个切片，适合OCR和细节描述
 
 # Pydantic models
 class AnalyzeRequest(BaseModel):
     image_url: str = Field(..., description="图片URL地址")
     prompt: str = Field("请详细描述这张图片的内容", description="分析提示词")
+    quality: QualityTier = Field(QualityTier(DEFAULT_QUALITY), description="速度/质量档位: fast / balanced / accurate")
+
+# 模型运行设备
+class ModelDevice(str, Enum):
+    CUDA = "cuda"
+    CPU = "cpu"  # 在CPU上运行，不占用显存
+
+# 图片向量的输出精度和响应编码
+class EmbedDtype(str, Enum):
+    FLOAT32 = "float32"
+    FLOAT16 = "float16"
+    INT8 = "int8"  # 每个向量一个缩放系数
+
+class EmbedFormat(str, Enum):
+    JSON = "json"
+    MSGPACK = "msgpack"  # 向量矩阵为一个字节串
 
 class LoadModelRequest(BaseModel):
-    model_name: AvailableModels = Field(..., description="要加载的模型名称，可选值: MiniCPM-V-4-int4, MiniCPM-V-4_5-int4")
+    model_name: AvailableModels = Field(..., description="要加载的模型名称，可选值: MiniCPM-V-4-int4, MiniCPM-V-4_5-int4, MiniCPM-V-4-gguf, MiniCPM-V-4_5-gguf")
+    device: Optional[ModelDevice] = Field(None, description="运行设备: cuda / cpu，默认使用服务检测到的设备")
+
+def decode_image(source: Union[bytes, BinaryIO], quality: str = DEFAULT_QUALITY) -> Image.Image:
+    """按档位的最大边长解码图片（JPEG直接缩放解码），在预处理线程池中执行；数据损坏或被截断时返回400"""
+    try:
+        return image_decoding.decoders.decode(source, QUALITY_TIERS[quality]["max_size"])
+    except (OSError, SyntaxError, ValueError) as e:
+        # 头部完整时 probe_image 可以通过，截断的数据在完整解码时才会出错
+        upload_limits.tracker.reject("format")
+        raise HTTPException(status_code=400, detail=f"图片数据损坏或不完整: {str(e)}")
+
+def image_flight_key(image_info: dict, digest: str, prompt: str, quality: str) -> tuple:
+    """合并执行的key：当前模型、图片格式/尺寸/内容哈希、提示词和档位"""
+    return (model_service.current_model_name, image_info["format"], image_info["width"], image_info["height"],
+            digest, prompt, quality)
+
+async def decode_and_analyze(spool: BinaryIO, prompt: str, quality: str):
+    """
+    解码阶段解码图片后交给推理阶段，作为合并执行的单元
+
+    协程接管 spool 并在解码后关闭：执行者的请求被取消时协程仍在继续执行，调用方不能提前关闭。
+    """
+    try:
+        image = await pipeline.decode.run(decode_image, spool, quality)
+    finally:
+        spool.close()
+    return await pipeline.inference.run(model_service.analyze_image, image, prompt, quality)
+
+@app.middleware("http")
+async def reject_oversized_requests(request: Request, call_next):
+    """在解析multipart之前根据 Content-Length 拒绝超过上限的请求"""
+    content_length = request.headers.get("content-length")
+    # 未压缩像素输入允许更大的请求体，具体上限在接口内按格式检查
+    limit = upload_limits.MAX_REQUEST_BYTES
+    if request.url.path == "/analyze-raw":
+        limit = max(limit, upload_limits.MAX_RAW_PIXEL_BYTES)
+    elif request.url.path == "/analyze-video":
+        limit = max(limit, video_frames.MAX_VIDEO_BYTES)
+    if content_length and content_length.isdigit() and int(content_length) > limit:
+        upload_limits.tracker.reject("bytes")
+        return JSONResponse(
+            status_code=413,
+            content={"detail": f"请求体超过上限 {limit} 字节"}
+        )
+    return await call_next(request)
+
+# 需要准入控制的推理接口
+ADMISSION_PATHS = ("/analyze", "/analyze-url", "/analyze-raw", "/sessions", "/embed", "/classify")
+
+@app.middleware("http")
+async def shed_load(request: Request, call_next):
+    """在接收请求体之前按排队情况拒绝请求（档位未知，只检查排队等待时间和排队上限）"""
+    if request.method == "POST" and request.url.path.startswith(ADMISSION_PATHS):
+        try:
+            admission.precheck(admission.parse_timeout(request.headers))
+        except HTTPException as e:
+            return JSONResponse(status_code=e.status_code, content={"detail": e.detail}, headers=e.headers)
+    return await call_next(request)
+
+def preload_model(model_name: str):
+    """后台加载并预热模型，期间 /health 可用、/ready 返回503"""
+    logger.info(f"Preloading model {model_name}")
+    try:
+        if model_service.load_model(model_name):
+            lifecycle["ready_at"] = time.time()
+            logger.info(f"Model {model_name} ready {lifecycle['ready_at'] - STARTED_AT:.1f}s after start")
+        else:
+            lifecycle["preload_error"] = f"Failed to load model {model_name}"
+    except Exception as e:
+        logger.error(f"Error preloading model: {str(e)}")
+        lifecycle["preload_error"] = str(e)
+
+@app.on_event("startup")
+def start_job_worker():
+    job_worker.start()
+    if PRELOAD_MODEL:
+        threading.Thread(target=preload_model, args=(PRELOAD_MODEL,), name="model-preload", daemon=True).start()
+
+@app.on_event("shutdown")
+def stop_job_worker():
+    job_worker.stop()
+    preprocess_pool.shutdown(wait=False)
+    model_service.result_cache.close()
+
+@app.on_event("shutdown")
+async def close_pipeline():
+    await pipeline.close()
 
 @app.get("/health")
 def health():
     return {"status": "healthy", "service": "MiniCPM-V Server", "version": app.version}
 
+@app.get("/ready")
+def ready():
+    """
+    就绪检查
+    
+    模型加载并完成预热后返回200，否则返回503；收到 /drain 后同样返回503，负载均衡不再转发新请求。
+    可用于负载均衡和部署脚本的就绪探测。
+    """
+    model_info = model_service.get_model_info()
+    is_ready = model_info["ready"] and lifecycle["draining_since"] is None
+    content = {
+        "ready": is_ready,
+        "model_name": model_info["model_name"],
+        "model_state": model_info["lifecycle"]["state"],
+        "warmup_profile": model_info["warmup_profile"],
+        "draining": lifecycle["draining_since"] is not None,
+        "seconds_to_ready": round(lifecycle["ready_at"] - STARTED_AT, 3) if lifecycle["ready_at"] else None,
+        "preload_error": lifecycle["preload_error"]
+    }
+    return JSONResponse(status_code=200 if is_ready else 503, content=content)
+
+@app.post("/drain")
+def drain():
+    """
+    开始排空（滚动部署时由部署脚本调用）
+    
+    /ready 和 /status 之后报告未就绪，路由和负载均衡不再转发新请求；已到达的请求照常处理，
+    异步任务线程不再领取新任务。部署脚本在 in_flight 归零后发送 SIGTERM 停止进程。
+    """
+    if lifecycle["draining_since"] is None:
+        lifecycle["draining_since"] = time.time()
+        job_worker.pause()
+        logger.info("Draining: no longer reporting ready")
+    return {
+        "status": "draining",
+        "in_flight": admission.snapshot()["in_flight"],
+        "job_running": job_worker.busy
+    }
+
+@app.get("/status")
+def status():
+    """
+    轻量状态（供路由进程轮询）
+    
+    返回当前模型、是否就绪、排队深度和预计等待时间。
+    """
+    admission_stats = admission.snapshot()
+    return {
+        "service": "MiniCPM-V Server",
+        "ready": model_service.ready and lifecycle["draining_since"] is None,
+        "draining": lifecycle["draining_since"] is not None,
+        "model_name": model_service.current_model_name,
+        "model_state": model_service.lifecycle.state,
+        "in_flight": admission_stats["in_flight"],
+        "job_running": job_worker.busy,
+        "estimated_wait_seconds": admission_stats["estimated_wait_seconds"],
+        "max_queue": admission_stats["max_queue"],
+        "pid": os.getpid()
+    }
+
+@app.get("/stats")
+def stats():
+    """服务运行统计：进行中的上传数量、内存占用、被拒绝的请求数和辅助生成的接受率/加速比"""
+    return {
+        "uploads": upload_limits.tracker.snapshot(),
+        "sessions": session_store.snapshot(),
+        "coalescing": single_flight.snapshot(),
+        "admission": admission.snapshot(),
+        "result_cache": model_service.result_cache.snapshot(),
+        "model_parking": model_service.parking.snapshot(),
+        "image_decoding": image_decoding.decoders.snapshot(),
+        "pipeline": pipeline.snapshot(),
+        "model_lifecycle": model_service.lifecycle.snapshot(),
+        "assisted_generation": model_service.assistant.snapshot() if model_service.assistant is not None else None
+    }
+
 @app.get("/")
 def root():
     return {
@@ -50,9 +287,19 @@ def root():
         "status": "running",
         "docs": "/docs",
         "health": "/health",
+        "ready": "/ready",
+        "server_status": "/status",
         "models": "/models",
+        "stats": "/stats",
         "analyze": "/analyze",
-        "analyze_url": "/analyze-url"
+        "analyze_url": "/analyze-url",
+        "analyze_raw": "/analyze-raw",
+        "analyze_video": "/analyze-video",
+        "embed": "/embed",
+        "classify": "/classify",
+        "rpc": "/rpc",
+        "sessions": "/sessions",
+        "jobs": "/jobs"
     }
 
 @app.get("/models")
@@ -81,7 +328,12 @@ def list_models():
             "count": len(models),
             "items": models,
             "current_model": model_info["model_name"],
-            "device": model_info["device"]
+            "ready": model_info["ready"],
+            "load_profile": model_info["load_profile"],
+            "warmup_profile": model_info["warmup_profile"],
+            "device": model_info["device"],
+            "cpu_config": model_info["cpu_config"],
+            "residency": model_info["residency"]
         }
     except Exception as e:
         return JSONResponse(status_code=500, content={"status": "error", "message": str(e)})
@@ -94,39 +346,59 @@ def load_model(request: LoadModelRequest):
     可用模型:
     - MiniCPM-V-4-int4: 基础版本，较快推理速度
     - MiniCPM-V-4_5-int4: 增强版本，更好的图片理解能力 (推荐)
+    - MiniCPM-V-4-gguf / MiniCPM-V-4_5-gguf: GGUF量化模型，由llama.cpp运行（推理后端见 MODEL_BACKENDS）
+    
+    停放在主机内存中的模型只需把权重拷回设备（load_profile.source 为 parked），当前模型同时停放到主机内存。
+    切换前等待进行中的推理完成（最长 MODEL_DRAIN_TIMEOUT 秒，超时返回409且当前模型不变），期间新请求等待切换完成。
     """
+    device = request.device.value if request.device else None
+    if device == "cuda" and model_service.device != "cuda":
+        raise HTTPException(status_code=400, detail="当前主机没有可用的CUDA设备")
     try:
-        success = model_service.load_model(request.model_name.value)
+        success = model_service.load_model(request.model_name.value, device)
         if success:
-            return {"status": "success", "message": f"Model {request.model_name.value} loaded successfully"}
+            return {
+                "status": "success",
+                "message": f"Model {request.model_name.value} loaded successfully",
+                "load_profile": model_service.load_profile
+            }
         else:
             raise HTTPException(status_code=400, detail=f"Failed to load model {request.model_name.value}")
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error loading model: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/unload-model")
-def unload_model():
+def unload_model(discard: bool = False):
     """
     卸载当前模型
     
-    释放GPU内存，为加载其他模型做准备。
+    释放GPU内存，为加载其他模型做准备。默认停放到主机内存（之后重新加载只需拷贝权重），
+    discard=true 时直接丢弃。
     """
     try:
         if model_service.current_model is None:
             return {"status": "success", "message": "No model currently loaded"}
         
         current_model_name = model_service.current_model_name
+        if not discard and model_service.park_model():
+            return {"status": "success", "message": f"Model {current_model_name} parked in host memory"}
         model_service.unload_model()
         return {"status": "success", "message": f"Model {current_model_name} unloaded successfully"}
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error unloading model: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/analyze")
 async def analyze_image_upload(
+    request: Request,
     file: UploadFile = File(..., description="要分析的图片文件"),
-    prompt: str = Form("请详细描述这张图片的内容", description="分析提示词")
+    prompt: str = Form("请详细描述这张图片的内容", description="分析提示词"),
+    quality: QualityTier = Form(QualityTier(DEFAULT_QUALITY), description="速度/质量档位: fast / balanced / accurate")
 ):
     """
     分析上传的图片文件
@@ -135,19 +407,36 @@ async def analyze_image_upload(
     """
     try:
         # 检查是否有已加载的模型
-        if model_service.current_model is None:
-            raise HTTPException(status_code=400, detail="没有已加载的模型，请先调用 /load-model 加载模型")
+        model_service.lifecycle.check_available()
         
         # 检查文件类型
         if not file.content_type.startswith('image/'):
             raise HTTPException(status_code=400, detail="文件必须是图片格式")
         
-        # 读取图片
-        image_data = await file.read()
-        image = Image.open(io.BytesIO(image_data)).convert('RGB')
+        # 在解码和推理之前判断能否在期限内完成
+        timeout = admission.parse_timeout(request.headers)
+        with admission.admit(model_service.current_model_name, quality.value, timeout):
+            # 分块读取图片（有字节上限），先读头部检查尺寸；相同图片和参数的并发请求合并为一次解码和推理
+            with upload_limits.tracker.track() as usage:
+                spool = await upload_limits.spool_upload(file, usage)
+                try:
+                    image_info = upload_limits.probe_image(spool, usage)
+                    key = image_flight_key(image_info, file_digest(spool), prompt, quality.value)
+                    (result, processing_time, details), coalesced = await single_flight.do_await(
+                        key, decode_and_analyze, spool, prompt, quality.value
+                    )
+                except asyncio.CancelledError:
+                    # 被取消的可能是执行者，合并执行的协程仍在读取 spool，由它在解码后关闭
+                    raise
+                except BaseException:
+                    spool.close()
+                    raise
+                # 合并执行的协程已经结束（或本请求合并到了其他请求），重复关闭没有影响
+                spool.close()
+        
+        if not coalesced and not details.get("cached"):
+            admission.observe(model_service.current_model_name, quality.value, processing_time)
         
-        # 分析图片
-        result, processing_time = model_service.analyze_image(image, prompt)
         if result is None:
             raise HTTPException(status_code=500, detail="图片分析失败")
         
@@ -157,6 +446,12 @@ async def analyze_image_upload(
             "model_used": model_service.current_model_name,
             "prompt": prompt,
             "filename": file.filename,
+            "image": image_info,
+            "quality": quality.value,
+            "vision_tokens": details.get("vision_tokens"),
+            "coalesced": coalesced,
+            "cached": details.get("cached", False),
+            "assisted": details.get("assisted"),
             "processing_time_seconds": round(processing_time, 3)
         }
         
@@ -166,34 +461,36 @@ async def analyze_image_upload(
         logger.error(f"Error analyzing image: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+async def fetch_and_analyze(image_url: str, prompt: str, quality: str):
+    """下载阶段以流方式下载图片（有字节上限），先读头部检查尺寸，再经过解码和推理阶段，返回 (图片信息, 推理结果)"""
+    with upload_limits.tracker.track() as usage:
+        spool = await pipeline.download(image_url, usage)
+        try:
+            image_info = upload_limits.probe_image(spool, usage)
+            return image_info, await decode_and_analyze(spool, prompt, quality)
+        finally:
+            spool.close()
+
 @app.post("/analyze-url")
-def analyze_image_url(request: AnalyzeRequest):
+async def analyze_image_url(request: AnalyzeRequest, http_request: Request):
     """
     分析图片URL
     
     使用当前已加载的模型分析网络图片。如需切换模型，请先调用 /load-model 接口。
     """
     try:
-        import requests
-        
         # 检查是否有已加载的模型
-        if model_service.current_model is None:
-            raise HTTPException(status_code=400, detail="没有已加载的模型，请先调用 /load-model 加载模型")
-        
-        # 下载图片
-        response = requests.get(request.image_url, timeout=30)
-        response.raise_for_status()
-        
-        # 检查内容类型
-        content_type = response.headers.get('content-type', '')
-        if not content_type.startswith('image/'):
-            raise HTTPException(status_code=400, detail="URL 必须指向图片文件")
+        model_service.lifecycle.check_available()
         
-        # 打开图片
-        image = Image.open(io.BytesIO(response.content)).convert('RGB')
-        
-        # 分析图片
-        result, processing_time = model_service.analyze_image(image, request.prompt)
+        # 相同URL和参数的并发请求在下载前合并，只下载和推理一次
+        key = (model_service.current_model_name, "url", request.image_url, request.prompt, request.quality.value)
+        timeout = admission.parse_timeout(http_request.headers)
+        with admission.admit(model_service.current_model_name, request.quality.value, timeout):
+            (image_info, (result, processing_time, details)), coalesced = await single_flight.do_await(
+                key, fetch_and_analyze, request.image_url, request.prompt, request.quality.value
+            )
+        if not coalesced and not details.get("cached"):
+            admission.observe(model_service.current_model_name, request.quality.value, processing_time)
         if result is None:
             raise HTTPException(status_code=500, detail="图片分析失败")
         
@@ -203,6 +500,12 @@ def analyze_image_url(request: AnalyzeRequest):
             "model_used": model_service.current_model_name,
             "prompt": request.prompt,
             "image_url": request.image_url,
+            "image": image_info,
+            "quality": request.quality.value,
+            "vision_tokens": details.get("vision_tokens"),
+            "coalesced": coalesced,
+            "cached": details.get("cached", False),
+            "assisted": details.get("assisted"),
             "processing_time_seconds": round(processing_time, 3)
         }
         
@@ -212,6 +515,474 @@ def analyze_image_url(request: AnalyzeRequest):
         logger.error(f"Error analyzing image URL: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+# 原始请求体支持的未压缩像素格式
+RAW_RGB_CONTENT_TYPES = ("application/x-rgb", "application/x-rgba")
+NPY_CONTENT_TYPE = "application/x-npy"
+
+def pixels_to_image(buffer: bytearray, width: int, height: int, mode: str) -> Image.Image:
+    """在像素缓冲区上直接构建PIL图片（不复制数据）"""
+    return Image.frombuffer(mode, (width, height), buffer, 'raw', mode, 0, 1)
+
+def npy_to_image(spool: BinaryIO) -> Image.Image:
+    """读取 .npy 格式的 HxWx3 / HxWx4 / HxW uint8 数组"""
+    array = np.load(spool, allow_pickle=False)
+    if array.dtype != np.uint8 or array.ndim not in (2, 3) or (array.ndim == 3 and array.shape[2] not in (3, 4)):
+        raise HTTPException(status_code=400, detail=f"不支持的数组形状或类型: {array.shape} {array.dtype}，需要 uint8 HxW[x3|x4]")
+    upload_limits.check_pixels(array.shape[1], array.shape[0])
+    return Image.fromarray(array)
+
+@app.post("/analyze-raw")
+async def analyze_image_raw(
+    request: Request,
+    prompt: Optional[str] = None,
+    quality: QualityTier = QualityTier(DEFAULT_QUALITY),
+    width: Optional[int] = None,
+    height: Optional[int] = None
+):
+    """
+    分析原始请求体中的图片（无multipart）
+    
+    按 Content-Type 区分输入格式：
+    - `image/*` 或 `application/octet-stream`: 编码后的图片文件（JPEG/PNG等）
+    - `application/x-rgb` / `application/x-rgba`: 未压缩的行优先像素，需通过 width/height 查询参数
+      或 X-Image-Width/X-Image-Height 请求头给出形状
+    - `application/x-npy`: NumPy .npy 格式的 uint8 数组 (HxW、HxWx3 或 HxWx4)
+    
+    提示词通过查询参数 prompt 或 URL编码后的 X-Prompt 请求头传递。
+    """
+    try:
+        model_service.lifecycle.check_available()
+        
+        if prompt is None:
+            prompt = unquote(request.headers.get("x-prompt", "")) or "请详细描述这张图片的内容"
+        content_type = request.headers.get("content-type", "application/octet-stream").split(";")[0].strip().lower()
+        
+        timeout = admission.parse_timeout(request.headers)
+        with admission.admit(model_service.current_model_name, quality.value, timeout):
+            with upload_limits.tracker.track() as usage:
+                if content_type in RAW_RGB_CONTENT_TYPES:
+                    width = width or int(request.headers.get("x-image-width", 0))
+                    height = height or int(request.headers.get("x-image-height", 0))
+                    upload_limits.check_pixels(width, height)
+                    mode = "RGBA" if content_type.endswith("rgba") else "RGB"
+                    buffer = await upload_limits.read_request_exact(request, width * height * len(mode), usage)
+                    image = pixels_to_image(buffer, width, height, mode)
+                    image_info = {"width": width, "height": height, "format": mode}
+                    digest = hashlib.sha256(buffer).hexdigest()
+                elif content_type == NPY_CONTENT_TYPE:
+                    spool = await upload_limits.spool_request(request, usage, upload_limits.MAX_RAW_PIXEL_BYTES)
+                    try:
+                        digest = file_digest(spool)
+                        image = npy_to_image(spool)
+                    finally:
+                        spool.close()
+                    image_info = {"width": image.width, "height": image.height, "format": "NPY"}
+                elif content_type.startswith("image/") or content_type == "application/octet-stream":
+                    spool = await upload_limits.spool_request(request, usage)
+                    try:
+                        image_info = upload_limits.probe_image(spool, usage)
+                        digest = file_digest(spool)
+                        image = await pipeline.decode.run(decode_image, spool, quality.value)
+                    finally:
+                        spool.close()
+                else:
+                    raise HTTPException(status_code=415, detail=f"不支持的 Content-Type: {content_type}")
+            
+                # 分析图片（在线程中执行推理，避免阻塞事件循环）；相同输入的并发请求共享一次推理
+                key = image_flight_key(image_info, digest, prompt, quality.value)
+                (result, processing_time, details), coalesced = await single_flight.do_await(
+                    key, pipeline.inference.run, model_service.analyze_image, image, prompt, quality.value
+                )
+        
+        if not coalesced and not details.get("cached"):
+            admission.observe(model_service.current_model_name, quality.value, processing_time)
+        
+        if result is None:
+            raise HTTPException(status_code=500, detail="图片分析失败")
+        
+        return {
+            "status": "success",
+            "result": result,
+            "model_used": model_service.current_model_name,
+            "prompt": prompt,
+            "image": image_info,
+            "quality": quality.value,
+            "vision_tokens": details.get("vision_tokens"),
+            "coalesced": coalesced,
+            "cached": details.get("cached", False),
+            "assisted": details.get("assisted"),
+            "processing_time_seconds": round(processing_time, 3)
+        }
+        
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error analyzing raw image: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/analyze-video")
+async def analyze_video_upload(
+    request: Request,
+    file: UploadFile = File(..., description="要分析的视频文件"),
+    prompt: str = Form("请描述这段视频的内容", description="分析提示词"),
+    quality: QualityTier = Form(QualityTier(DEFAULT_QUALITY), description="速度/质量档位，决定生成token上限"),
+    max_frames: int = Form(video_frames.VIDEO_MAX_FRAMES, description="送入模型的最大帧数")
+):
+    """
+    分析上传的视频
+    
+    服务端流式解码视频，按时长自适应采样并去除近似重复帧，最多 max_frames 帧在一次多图推理中分析，
+    代替客户端抽帧后逐帧调用 /analyze。
+    """
+    try:
+        model_service.lifecycle.check_available()
+        
+        if not (file.content_type.startswith('video/') or file.content_type == 'application/octet-stream'):
+            raise HTTPException(status_code=400, detail="文件必须是视频格式")
+        max_frames = max(1, min(max_frames, video_frames.VIDEO_MAX_FRAMES))
+        
+        # 视频的服务时间与单图差别很大，单独估计
+        admission_key = f"video:{quality.value}"
+        timeout = admission.parse_timeout(request.headers)
+        with admission.admit(model_service.current_model_name, admission_key, timeout):
+            with upload_limits.tracker.track() as usage:
+                # 上传内容落盘（内存中只保留 UPLOAD_SPOOL_MEMORY_BYTES），解码时逐帧读取
+                spool = await upload_limits.spool_upload(file, usage, video_frames.MAX_VIDEO_BYTES)
+                try:
+                    video = await pipeline.decode.run(functools.partial(
+                        video_frames.sample_video, spool, max_frames, check_pixels=upload_limits.check_pixels
+                    ))
+                finally:
+                    spool.close()
+                upload_limits.tracker.add_memory(usage, sum(f.width * f.height * 3 for f in video["frames"]))
+                
+                result, processing_time, details = await pipeline.inference.run(
+                    model_service.analyze_video, video.pop("frames"), prompt, quality.value
+                )
+        
+        if not details.get("cached"):
+            admission.observe(model_service.current_model_name, admission_key, processing_time)
+        
+        if result is None:
+            raise HTTPException(status_code=500, detail="视频分析失败")
+        
+        return {
+            "status": "success",
+            "result": result,
+            "model_used": model_service.current_model_name,
+            "prompt": prompt,
+            "filename": file.filename,
+            "video": video,
+            "quality": quality.value,
+            "cached": details.get("cached", False),
+            "assisted": details.get("assisted"),
+            "processing_time_seconds": round(processing_time, 3)
+        }
+        
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"无法解码视频: {str(e)}")
+    except RuntimeError as e:
+        logger.error(f"Error analyzing video: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error analyzing video: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/embed")
+async def embed_images(
+    request: Request,
+    files: List[UploadFile] = File(..., description="要计算向量的图片文件（可多张）"),
+    dtype: EmbedDtype = Form(EmbedDtype.FLOAT32, description="输出精度: float32 / float16 / int8"),
+    format: EmbedFormat = Form(EmbedFormat.JSON, description="响应编码: json / msgpack")
+):
+    """
+    计算图片向量（用于相似度检索和去重）
+    
+    只运行已加载模型的视觉编码器，一批图片一次前向，不生成文本。向量已L2归一化，点积即余弦相似度。
+    format=msgpack 或请求头 Accept: application/x-msgpack 时返回二进制响应。
+    """
+    try:
+        model_service.lifecycle.check_available()
+        if len(files) > image_embedding.EMBED_MAX_IMAGES:
+            raise HTTPException(status_code=400,
+                                detail=f"单次最多 {image_embedding.EMBED_MAX_IMAGES} 张图片，收到 {len(files)} 张")
+        for file in files:
+            if not file.content_type.startswith('image/'):
+                raise HTTPException(status_code=400, detail=f"文件必须是图片格式: {file.filename}")
+        
+        timeout = admission.parse_timeout(request.headers)
+        with admission.admit(model_service.current_model_name, "embed", timeout):
+            with upload_limits.tracker.track() as usage:
+                images, infos = [], []
+                for file in files:
+                    spool = await upload_limits.spool_upload(file, usage)
+                    try:
+                        infos.append(upload_limits.probe_image(spool, usage))
+                        images.append(await pipeline.decode.run(decode_image, spool, "fast"))
+                    finally:
+                        spool.close()
+                
+                embeddings, processing_time, details = await pipeline.inference.run(
+                    model_service.embed_images, images
+                )
+        
+        admission.observe(model_service.current_model_name, "embed", processing_time)
+        if embeddings is None:
+            raise HTTPException(status_code=500, detail="图片向量计算失败")
+        
+        quantized = image_embedding.quantize(embeddings, dtype.value)
+        payload = {
+            "status": "success",
+            "model_used": model_service.current_model_name,
+            "dtype": dtype.value,
+            "count": int(embeddings.shape[0]),
+            "dim": int(embeddings.shape[1]),
+            "images": [dict(info, filename=file.filename) for info, file in zip(infos, files)],
+            "processing_time_seconds": round(processing_time, 3)
+        }
+        if format == EmbedFormat.MSGPACK or image_embedding.MSGPACK_MEDIA_TYPE in request.headers.get("accept", ""):
+            return Response(content=image_embedding.to_msgpack(payload, quantized),
+                            media_type=image_embedding.MSGPACK_MEDIA_TYPE)
+        payload.update(image_embedding.to_json(quantized))
+        return payload
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error embedding images: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/classify")
+async def classify_image(
+    request: Request,
+    file: UploadFile = File(..., description="要分类的图片文件"),
+    labels: List[str] = Form(..., description="候选标签（重复该字段传入多个）"),
+    prompt: Optional[str] = Form(None, description="分类提示词，可用 {labels} 引用候选列表；默认列出全部候选"),
+    quality: QualityTier = Form(QualityTier(DEFAULT_QUALITY), description="速度/质量档位: fast / balanced / accurate")
+):
+    """
+    在候选标签上为图片打分
+    
+    按模型似然对每个候选打分并返回排序后的概率：图片和提示词前缀只计算一次，全部候选在一次批量前向中打分，
+    不做自回归生成，相同输入的结果完全相同。
+    """
+    try:
+        model_service.lifecycle.check_available()
+        if not file.content_type.startswith('image/'):
+            raise HTTPException(status_code=400, detail="文件必须是图片格式")
+        
+        labels = list(dict.fromkeys(label.strip() for label in labels if label.strip()))
+        if len(labels) < 2:
+            raise HTTPException(status_code=400, detail="至少需要两个不同的候选标签")
+        if len(labels) > label_scoring.CLASSIFY_MAX_LABELS:
+            raise HTTPException(status_code=400,
+                                detail=f"候选标签最多 {label_scoring.CLASSIFY_MAX_LABELS} 个，收到 {len(labels)} 个")
+        
+        admission_key = f"classify:{quality.value}"
+        timeout = admission.parse_timeout(request.headers)
+        with admission.admit(model_service.current_model_name, admission_key, timeout):
+            with upload_limits.tracker.track() as usage:
+                spool = await upload_limits.spool_upload(file, usage)
+                try:
+                    image_info = upload_limits.probe_image(spool, usage)
+                    image = await pipeline.decode.run(decode_image, spool, quality.value)
+                finally:
+                    spool.close()
+                result, processing_time, details = await pipeline.inference.run(
+                    model_service.classify_image, image, labels, prompt, quality.value
+                )
+        
+        if not details.get("cached"):
+            admission.observe(model_service.current_model_name, admission_key, processing_time)
+        if result is None:
+            raise HTTPException(status_code=500, detail="图片分类失败")
+        
+        return {
+            "status": "success",
+            "result": result["label"],
+            "labels": result["labels"],
+            "coverage": result["coverage"],
+            "model_used": model_service.current_model_name,
+            "filename": file.filename,
+            "image": image_info,
+            "quality": quality.value,
+            "cached": details.get("cached", False),
+            "processing_time_seconds": round(processing_time, 3)
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error classifying image: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.websocket("/rpc")
+async def rpc_endpoint(websocket: WebSocket):
+    """
+    二进制RPC接口 (msgpack over WebSocket)
+    
+    在一条长连接上支持单次分析、服务端流式返回token和客户端流式批量上传，
+    省去每个请求的multipart解析、Pydantic校验和JSON编码。客户端见 rpc_client.py。
+    """
+    await RpcSession(websocket, model_service, decode_image, pipeline, session_store, admission).run()
+
+async def read_upload_image(file: UploadFile, quality: str):
+    """按上传限制读取、检查并在解码阶段解码图片，返回 (图片, 图片信息)"""
+    if not file.content_type.startswith('image/'):
+        raise HTTPException(status_code=400, detail="文件必须是图片格式")
+    with upload_limits.tracker.track() as usage:
+        spool = await upload_limits.spool_upload(file, usage)
+        try:
+            image_info = upload_limits.probe_image(spool, usage)
+            image = await pipeline.decode.run(decode_image, spool, quality)
+        finally:
+            spool.close()
+    return image, image_info
+
+async def run_session_turn(session, prompt: str, file: Optional[UploadFile], timeout: float):
+    """执行会话中的一轮对话并构造响应"""
+    model_service.lifecycle.check_available()
+    
+    # 复用视觉编码缓存的轮次比单图分析快得多，单独估计服务时间
+    admission_key = f"session:{session.quality}"
+    with admission.admit(model_service.current_model_name, admission_key, timeout):
+        image, image_info = None, None
+        if file is not None:
+            image, image_info = await read_upload_image(file, session.quality)
+        
+        turn = await pipeline.inference.run(session_store.chat, session, model_service, prompt, image)
+    admission.observe(model_service.current_model_name, admission_key, turn["processing_time"])
+    if turn["result"] is None:
+        raise HTTPException(status_code=500, detail="图片分析失败")
+    
+    return {
+        "status": "success",
+        "session_id": session.id,
+        "turn": turn["turn"],
+        "result": turn["result"],
+        "model_used": model_service.current_model_name,
+        "prompt": prompt,
+        "image": image_info,
+        "quality": session.quality,
+        "vision_cached": turn["vision_cached"],
+        "processing_time_seconds": round(turn["processing_time"], 3)
+    }
+
+@app.post("/sessions")
+async def create_session(
+    request: Request,
+    file: Optional[UploadFile] = File(None, description="会话的图片（可选，也可在后续轮次中发送）"),
+    prompt: Optional[str] = Form(None, description="第一轮提示词（可选，不提供则只创建会话）"),
+    quality: QualityTier = Form(QualityTier(DEFAULT_QUALITY), description="速度/质量档位，整个会话保持不变")
+):
+    """
+    创建多轮对话会话
+    
+    服务端保存对话历史和视觉编码结果，后续通过 POST /sessions/{session_id}/messages 只发送新的问题，
+    无需重新上传图片和历史。会话空闲超过 SESSION_TTL_SECONDS 后过期，内存超出 SESSION_MEMORY_BYTES 时按LRU淘汰。
+    """
+    try:
+        session = session_store.create(quality.value)
+        if prompt is None and file is None:
+            return {"status": "success", "session_id": session.id, "quality": session.quality}
+        return await run_session_turn(session, prompt or "请详细描述这张图片的内容", file,
+                                      admission.parse_timeout(request.headers))
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error creating session: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/sessions/{session_id}/messages")
+async def send_session_message(
+    request: Request,
+    session_id: str,
+    prompt: str = Form(..., description="本轮提示词"),
+    file: Optional[UploadFile] = File(None, description="本轮附加的新图片（可选）")
+):
+    """在会话中追加一轮对话，返回本轮回复"""
+    session = session_store.get(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail=f"会话不存在或已过期: {session_id}")
+    try:
+        return await run_session_turn(session, prompt, file, admission.parse_timeout(request.headers))
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error in session {session_id}: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/sessions/{session_id}")
+def get_session(session_id: str):
+    """查询会话历史（图片以尺寸表示）"""
+    session = session_store.get(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail=f"会话不存在或已过期: {session_id}")
+    return session.describe()
+
+@app.delete("/sessions/{session_id}")
+def delete_session(session_id: str):
+    """结束会话并释放其缓存"""
+    if not session_store.delete(session_id):
+        raise HTTPException(status_code=404, detail=f"会话不存在或已过期: {session_id}")
+    return {"status": "success", "session_id": session_id}
+
+@app.post("/jobs", status_code=202)
+async def create_job(
+    file: Optional[UploadFile] = File(None, description="要分析的图片文件（与image_url二选一）"),
+    image_url: Optional[str] = Form(None, description="图片URL地址（与file二选一）"),
+    prompt: str = Form("请详细描述这张图片的内容", description="分析提示词"),
+    callback_url: Optional[str] = Form(None, description="任务完成后POST结果的回调地址")
+):
+    """
+    提交异步分析任务
+    
+    立即返回任务ID，通过 GET /jobs/{job_id} 查询状态和结果。任务持久化在本地SQLite中，服务重启后排队任务会继续执行。
+    """
+    if (file is None) == (image_url is None):
+        raise HTTPException(status_code=400, detail="必须且只能提供 file 或 image_url 之一")
+    
+    image_data = None
+    filename = None
+    if file is not None:
+        if not file.content_type.startswith('image/'):
+            raise HTTPException(status_code=400, detail="文件必须是图片格式")
+        with upload_limits.tracker.track() as usage:
+            spool = await upload_limits.spool_upload(file, usage)
+            try:
+                upload_limits.probe_image(spool, usage)
+                image_data = spool.read()
+            finally:
+                spool.close()
+        filename = file.filename
+    
+    job_id = job_store.create_job(
+        prompt=prompt,
+        image_url=image_url,
+        image_data=image_data,
+        filename=filename,
+        callback_url=callback_url
+    )
+    job_worker.notify()
+    
+    return {"status": "queued", "job_id": job_id, "status_url": f"/jobs/{job_id}"}
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    """
+    查询异步任务状态
+    
+    状态: queued / running / succeeded / failed。已完成任务在 JOB_TTL_SECONDS 后过期删除。
+    """
+    job = job_store.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"任务不存在或已过期: {job_id}")
+    return job
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run("main:app", host=APP_HOST, port=APP_PORT, reload=False)
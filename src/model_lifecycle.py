@@ -0,0 +1,167 @@
+"""
+模型生命周期 - 状态机、读写锁和进行中请求计数
+
+状态：
+- empty: 没有已加载的模型
+- loading: 正在加载/激活模型（包括预热）
+- ready: 可以推理；推理请求以共享方式持有模型，可以并发，计入 in_flight
+- draining: 加载/卸载已提出，不再放行新的推理请求，等待进行中的请求完成
+- unloading: 正在停放/卸载模型或移动权重
+
+加载、卸载、停放和移动权重以独占方式执行：先进入 draining 并等待 in_flight 归零（最长 MODEL_DRAIN_TIMEOUT 秒，
+超时则放弃本次操作并恢复原状态，返回409），同一时间只有一个独占操作，并发的加载请求依次执行。
+推理请求在 loading/draining/unloading 期间最多等待 MODEL_WAIT_SECONDS 秒，超时返回503；没有模型时立即返回503。
+只读操作（模型信息、状态、统计）不需要持有锁。
+
+同一线程内共享持有可以嵌套（如批量推理失败后逐张重试），独占持有同样可以嵌套（如加载时先停放当前模型）。
+"""
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Any, Optional
+
+from fastapi import HTTPException
+
+logger = logging.getLogger(__name__)
+
+# 加载/卸载等待进行中的请求完成的最长时间（秒）
+MODEL_DRAIN_TIMEOUT = float(os.getenv("MODEL_DRAIN_TIMEOUT", 120))
+# 推理请求等待模型加载/切换完成的最长时间（秒）
+MODEL_WAIT_SECONDS = float(os.getenv("MODEL_WAIT_SECONDS", 30))
+
+EMPTY = "empty"
+LOADING = "loading"
+READY = "ready"
+DRAINING = "draining"
+UNLOADING = "unloading"
+
+
+class LifecycleError(HTTPException):
+    """模型暂时不可用（503）或独占操作等待进行中的请求超时（409）"""
+
+
+class ModelLifecycle:
+    """模型的状态机和读写锁"""
+
+    def __init__(self, drain_timeout: float = MODEL_DRAIN_TIMEOUT, wait_seconds: float = MODEL_WAIT_SECONDS):
+        self.drain_timeout = drain_timeout
+        self.wait_seconds = wait_seconds
+        self.state = EMPTY
+        self.in_flight = 0
+        self._cond = threading.Condition()
+        self._local = threading.local()
+        self._writer: Optional[int] = None
+        self.changed_at = time.time()
+        self.transitions = 0
+        self.drain_timeouts = 0
+        self.rejected = 0
+
+    def _set_state(self, state: str):
+        if state != self.state:
+            logger.info(f"Model lifecycle: {self.state} -> {state}")
+            self.state = state
+            self.changed_at = time.time()
+        self._cond.notify_all()
+
+    def check_available(self):
+        """接收请求前检查：没有模型时返回400；加载/切换期间放行，由推理时的共享持有等待"""
+        if self.state == EMPTY:
+            raise HTTPException(status_code=400, detail="没有已加载的模型，请先调用 /load-model 加载模型")
+
+    @contextmanager
+    def reader(self, wait_seconds: Optional[float] = None):
+        """推理期间共享持有模型；模型不可用时等待，超时抛出 LifecycleError(503)"""
+        depth = getattr(self._local, "depth", 0)
+        if depth or self._writer == threading.get_ident():
+            # 嵌套持有或在独占操作内部（如预热）直接进入
+            self._local.depth = depth + 1
+            try:
+                yield
+            finally:
+                self._local.depth = depth
+            return
+
+        wait_seconds = self.wait_seconds if wait_seconds is None else wait_seconds
+        deadline = time.time() + wait_seconds
+        with self._cond:
+            while self.state != READY:
+                remaining = deadline - time.time()
+                if self.state == EMPTY or remaining <= 0:
+                    self.rejected += 1
+                    detail = ("没有已加载的模型，请先调用 /load-model 加载模型" if self.state == EMPTY
+                              else f"模型正在切换（{self.state}），请稍后重试")
+                    raise LifecycleError(status_code=503, detail=detail,
+                                         headers={"Retry-After": str(max(1, int(wait_seconds)))})
+                self._cond.wait(remaining)
+            self.in_flight += 1
+        self._local.depth = 1
+        try:
+            yield
+        finally:
+            self._local.depth = 0
+            with self._cond:
+                self.in_flight -= 1
+                self._cond.notify_all()
+
+    @contextmanager
+    def exclusive(self, state: str, settle: Callable[[], str], timeout: Optional[float] = None):
+        """
+        独占执行加载/卸载/移动权重
+
+        Args:
+            state: 执行期间的状态（loading / unloading）
+            settle: 结束时调用，返回最终状态（ready / empty）
+            timeout: 等待进行中请求完成的最长秒数，0 表示有进行中的请求时立即放弃
+        """
+        if self._writer == threading.get_ident():
+            yield
+            return
+
+        timeout = self.drain_timeout if timeout is None else timeout
+        deadline = time.time() + timeout
+        with self._cond:
+            # 等待其他独占操作结束
+            while self._writer is not None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    self.drain_timeouts += 1
+                    raise LifecycleError(status_code=409, detail="另一个模型加载/卸载操作仍在进行，等待超时")
+                self._cond.wait(remaining)
+            self._writer = threading.get_ident()
+            previous = self.state
+            if self.in_flight:
+                self._set_state(DRAINING)
+            while self.in_flight:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    self.drain_timeouts += 1
+                    in_flight = self.in_flight
+                    self._writer = None
+                    self._set_state(previous)
+                    raise LifecycleError(status_code=409,
+                                         detail=f"等待 {in_flight} 个进行中的请求完成超时（{timeout:.0f}s），操作已取消")
+                self._cond.wait(remaining)
+            self._set_state(state)
+            self.transitions += 1
+
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer = None
+                self._set_state(settle())
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "state": self.state,
+                "in_flight": self.in_flight,
+                "state_seconds": round(time.time() - self.changed_at, 1),
+                "transitions": self.transitions,
+                "drain_timeouts": self.drain_timeouts,
+                "rejected": self.rejected,
+                "drain_timeout_seconds": self.drain_timeout,
+                "wait_seconds": self.wait_seconds,
+            }
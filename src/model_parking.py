@@ -0,0 +1,168 @@
+"""
+模型分级驻留 - 空闲模型停放在主机内存，切换回来时只需拷贝权重，不必从磁盘重新加载
+
+三级驻留：
+- active: 正在服务请求的模型（加速器显存中，或指定在CPU上运行），同一时间只有一个；
+  空闲超过 ACTIVE_IDLE_SECONDS 时权重移到主机内存释放显存，下一个请求到来时自动拷回
+- host: 停放在主机内存中的模型（PARK_PIN_MEMORY 时使用锁页内存，拷回显存更快），
+  总大小不超过 PARK_MAX_BYTES（超出时淘汰最久未使用的模型），空闲超过 PARK_IDLE_SECONDS 时丢弃
+- disk: 快照（MODEL_SNAPSHOT_DIR，safetensors 内存映射加载）或原始权重，冷加载
+"""
+import itertools
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Dict, Any, List
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+# 切换/卸载模型时是否停放到主机内存（false 时恢复为直接丢弃）
+MODEL_PARKING = os.getenv("MODEL_PARKING", "true").lower() in ("1", "true", "yes")
+# 主机内存中停放模型的总大小上限（字节）
+PARK_MAX_BYTES = int(os.getenv("PARK_MAX_BYTES", 16 * 1024 * 1024 * 1024))
+# 停放的模型空闲多久后丢弃（秒），0表示不过期
+PARK_IDLE_SECONDS = int(os.getenv("PARK_IDLE_SECONDS", 1800))
+# 停放时使用锁页内存（只在有CUDA时生效，占用不可换出的内存）
+PARK_PIN_MEMORY = os.getenv("PARK_PIN_MEMORY", "false").lower() in ("1", "true", "yes")
+# 活动模型空闲多久后把权重移到主机内存释放显存（秒），0表示不启用
+ACTIVE_IDLE_SECONDS = int(os.getenv("ACTIVE_IDLE_SECONDS", 0))
+
+
+def model_nbytes(model: Any) -> int:
+    """模型参数和缓冲区占用的字节数（桩模型使用 nbytes 属性）"""
+    if hasattr(model, "parameters"):
+        return sum(t.numel() * t.element_size() for t in itertools.chain(model.parameters(), model.buffers()))
+    return int(getattr(model, "nbytes", 0))
+
+
+def move_model(model: Any, device: str, pin_memory: bool = False) -> Any:
+    """把模型权重移到指定设备；移到主机内存且 pin_memory 时改用锁页内存"""
+    model = model.to(device)
+    if pin_memory and device == "cpu" and torch.cuda.is_available() and hasattr(model, "parameters"):
+        for tensor in itertools.chain(model.parameters(), model.buffers()):
+            tensor.data = tensor.data.pin_memory()
+    return model
+
+
+class ParkedModel:
+    """停放在主机内存中的模型，以及重新激活时需要恢复的状态"""
+
+    def __init__(self, name: str, model: Any, tokenizer: Any, nbytes: int, pinned: bool, state: Dict[str, Any]):
+        self.name = name
+        self.model = model
+        self.tokenizer = tokenizer
+        self.nbytes = nbytes
+        self.pinned = pinned
+        # load_profile、warmup_profile、cpu_acceleration 等，激活时原样恢复
+        self.state = state
+        self.parked_at = time.time()
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "model_name": self.name,
+            "bytes": self.nbytes,
+            "pinned": self.pinned,
+            "parked_seconds": round(time.time() - self.parked_at, 1),
+        }
+
+
+class ModelParking:
+    """主机内存中的停放模型，按最近停放顺序淘汰"""
+
+    def __init__(self, max_bytes: int = PARK_MAX_BYTES, idle_seconds: int = PARK_IDLE_SECONDS,
+                 pin_memory: bool = PARK_PIN_MEMORY, enabled: bool = MODEL_PARKING):
+        self.max_bytes = max_bytes
+        self.idle_seconds = idle_seconds
+        self.pin_memory = pin_memory
+        self.enabled = enabled
+        self._models: "OrderedDict[str, ParkedModel]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.parked = 0
+        self.reactivated = 0
+        self.evicted = 0
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(p.nbytes for p in self._models.values())
+
+    def park(self, name: str, model: Any, tokenizer: Any, state: Dict[str, Any]) -> bool:
+        """
+        把模型移到主机内存并停放
+
+        未启用、模型超过上限或移动失败（如不支持移动的量化模型）时返回False，由调用方丢弃模型。
+        """
+        if not self.enabled:
+            return False
+        nbytes = model_nbytes(model)
+        if nbytes > self.max_bytes:
+            logger.info(f"Model {name} ({nbytes} bytes) exceeds PARK_MAX_BYTES - not parking")
+            return False
+
+        with self._lock:
+            # 先淘汰，避免移动权重时主机内存超出上限
+            while self._models and self.total_bytes + nbytes > self.max_bytes:
+                self._evict_locked(next(iter(self._models)))
+
+        try:
+            pinned = self.pin_memory and torch.cuda.is_available()
+            model = move_model(model, "cpu", pinned)
+        except Exception as e:
+            logger.warning(f"Failed to park model {name}: {str(e)} - discarding")
+            return False
+
+        with self._lock:
+            self._models.pop(name, None)
+            self._models[name] = ParkedModel(name, model, tokenizer, nbytes, pinned, state)
+            self.parked += 1
+        logger.info(f"Parked model {name} in host memory ({nbytes} bytes)")
+        return True
+
+    def take(self, name: str) -> Optional[ParkedModel]:
+        """取出停放的模型（由调用方激活）"""
+        with self._lock:
+            parked = self._models.pop(name, None)
+            if parked is not None:
+                self.reactivated += 1
+            return parked
+
+    def contains(self, name: str) -> bool:
+        with self._lock:
+            return name in self._models
+
+    def _evict_locked(self, name: str):
+        parked = self._models.pop(name)
+        self.evicted += 1
+        logger.info(f"Evicted parked model {name} ({parked.nbytes} bytes)")
+
+    def purge_idle(self) -> List[str]:
+        """丢弃停放超过 idle_seconds 的模型"""
+        if not self.idle_seconds:
+            return []
+        cutoff = time.time() - self.idle_seconds
+        with self._lock:
+            expired = [name for name, p in self._models.items() if p.parked_at < cutoff]
+            for name in expired:
+                self._evict_locked(name)
+        return expired
+
+    def clear(self):
+        with self._lock:
+            self._models.clear()
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "models": [p.describe() for p in self._models.values()],
+                "bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+                "idle_seconds": self.idle_seconds,
+                "pin_memory": self.pin_memory,
+                "parked": self.parked,
+                "reactivated": self.reactivated,
+                "evicted": self.evicted,
+            }
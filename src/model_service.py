@@ -2,98 +2,279 @@ import os
 import logging
 import time
 from pathlib import Path
-from typing import Optional, Dict, Any, Tuple
+from typing import Optional, Dict, Any, Tuple, List, Iterator
 from PIL import Image
 import torch
-from transformers import AutoModel, AutoTokenizer
+from transformers import AutoModelForCausalLM, AutoTokenizer
 import gc
+import threading
+import functools
+from contextlib import contextmanager
+import cpu_tuning
+import cpu_acceleration
+import model_parking
+import model_lifecycle
+import assisted_generation
+import stub_model
+import result_cache
+import label_scoring
+import inference_backends
+import hashlib
+import json
 
 logger = logging.getLogger(__name__)
 
 
+def parse_warmup_plan(sizes: str, batch_size: int, stream: bool) -> List[Dict[str, Any]]:
+    """
+    解析预热计划
+    
+    sizes 为逗号分隔的 "宽x高" 列表，每个尺寸一次单图推理；格式错误的尺寸记录警告后跳过，
+    没有有效尺寸时使用 448x448。batch_size > 1 时追加一次批量推理，stream 为真时追加一次流式推理（均使用第一个尺寸）。
+    """
+    plan = []
+    for spec in sizes.split(","):
+        spec = spec.strip()
+        if not spec:
+            continue
+        try:
+            width, height = (int(v) for v in spec.lower().split("x"))
+            if width <= 0 or height <= 0:
+                raise ValueError("size must be positive")
+        except ValueError as e:
+            logger.warning(f"Invalid warmup size {spec!r}: {str(e)} - skipped")
+            continue
+        plan.append({"name": f"single_{width}x{height}", "kind": "single", "size": (width, height)})
+    
+    if not plan:
+        plan.append({"name": "single_448x448", "kind": "single", "size": (448, 448)})
+    
+    first_size = plan[0]["size"]
+    if batch_size > 1:
+        plan.append({"name": f"batch_{batch_size}", "kind": "batch", "size": first_size, "batch_size": batch_size})
+    if stream:
+        plan.append({"name": "stream", "kind": "stream", "size": first_size})
+    return plan
+
+
+# 预热计划：默认覆盖小图、1024方图以及横/竖两种长宽比，走完整的切片路径
+WARMUP_PLAN = parse_warmup_plan(
+    os.getenv("WARMUP_SIZES", "448x448,1024x1024,1024x576,576x1024"),
+    int(os.getenv("WARMUP_BATCH_SIZE", 0)),
+    os.getenv("WARMUP_STREAM", "false").lower() in ("1", "true", "yes")
+)
+WARMUP_MAX_NEW_TOKENS = int(os.getenv("WARMUP_MAX_NEW_TOKENS", 16))
+
+# 速度/质量档位：最大边长、最大切片数（None为模型默认）和最大生成token数
+QUALITY_TIERS = {
+    "fast": {"max_size": 448, "max_slice_nums": 1, "max_new_tokens": 128},
+    "balanced": {"max_size": 1024, "max_slice_nums": None, "max_new_tokens": 512},
+    "accurate": {"max_size": 1344, "max_slice_nums": 9, "max_new_tokens": 1024},
+}
+DEFAULT_QUALITY = "balanced"
+
+# 生成参数版本：修改 analyze_image 的解码参数或后处理时递增，使旧的缓存结果失效
+GENERATION_PARAMS_VERSION = "1"
+
+
+def generation_version(quality: str) -> str:
+    """结果缓存使用的生成参数版本（全局版本号 + 档位参数哈希）"""
+    tier_hash = hashlib.sha256(json.dumps(QUALITY_TIERS[quality], sort_keys=True).encode()).hexdigest()[:12]
+    return f"{GENERATION_PARAMS_VERSION}:{quality}:{tier_hash}"
+
+
+def image_digest(image: Image.Image) -> str:
+    """预处理后图片像素的哈希，与原始编码格式无关"""
+    digest = hashlib.sha256(f"{image.mode}:{image.width}x{image.height}:".encode())
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+def _holds_model(method):
+    """推理方法在整个调用期间共享持有模型：期间模型不会被加载/卸载替换，模型不可用时抛出 LifecycleError"""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.lifecycle.reader():
+            return method(self, *args, **kwargs)
+    return wrapper
+
+# 当前线程是否需要记录视觉编码器的输出（多轮会话缓存用）
+_vision_capture = threading.local()
+# 当前线程的辅助生成请求：记录草稿模型使用的文本提示词和本次生成的统计
+_assisted_request = threading.local()
+
+# llm.generate 中辅助生成能处理的参数，出现其他参数时交给原始实现
+ASSISTED_GENERATE_KWARGS = {"inputs_embeds", "attention_mask", "pad_token_id", "eos_token_id", "max_new_tokens",
+                            "num_beams", "repetition_penalty", "do_sample"}
+
+
 class ModelService:
     """MiniCPM-V 模型服务管理类"""
     
     def __init__(self, models_dir: Path):
         self.models_dir = models_dir
-        self.current_model = None
-        self.current_tokenizer = None
+        # 当前模型的推理后端（transformers / llama_cpp / stub），未加载时为None
+        self.backend: Optional[inference_backends.InferenceBackend] = None
         self.current_model_name = None
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
         logger.info(f"Using device: {self.device}")
+        
+        # CPU主机上显式设置torch线程数和核心绑定，避免与uvicorn/PIL线程争抢
+        self.cpu_config = cpu_tuning.load_cpu_config()
+        if self.device == "cpu":
+            cpu_tuning.apply_cpu_config(self.cpu_config)
+        
+        # 可选的CPU加速模式（int8动态量化 / torch.compile），以及实际生效的模式
+        self.cpu_acceleration_modes = cpu_acceleration.parse_modes(cpu_acceleration.CPU_ACCELERATION)
+        self.cpu_acceleration = []
+        
+        # 最近一次模型加载的分阶段耗时和预热各步骤耗时
+        self.load_profile = None
+        self.warmup_profile = []
+        
+        # 模型生命周期（加载并完成预热后才为 ready）；推理共享持有，加载/卸载/移动权重独占执行
+        self.lifecycle = model_lifecycle.ModelLifecycle()
+        
+        # 分析结果缓存（RESULT_CACHE_BACKEND: none / disk / redis），推理前查询，写入在后台线程进行
+        self.result_cache = result_cache.create_cache()
+        
+        # 分级驻留：切换/卸载的模型停放在主机内存，活动模型空闲时释放显存
+        self.parking = model_parking.ModelParking()
+        # 当前模型应运行的设备（load_model 可指定在CPU上运行）和权重实际所在的设备
+        self.target_device = self.device
+        self.active_device = None
+        self.last_used = time.time()
+        # 推理前把空闲时移走的权重拷回目标设备（多个推理请求可能同时到达）
+        self._residency_lock = threading.Lock()
+        
+        # 辅助生成（ASSISTED_DRAFT_MODELS 为当前模型配置了草稿模型时）
+        self.assistant: Optional[assisted_generation.AssistedGenerator] = None
+        threading.Thread(target=self._residency_loop, name="model-residency", daemon=True).start()
     
     def get_available_models(self) -> list[str]:
         """获取可用模型列表"""
+        if stub_model.STUB_MODEL:
+            return list(stub_model.STUB_MODEL_NAMES)
+        
         models = []
         if self.models_dir.exists() and self.models_dir.is_dir():
             for p in sorted(self.models_dir.iterdir()):
-                if p.is_dir() and any(f.name == "config.json" for f in p.iterdir()):
+                if p.is_dir() and any(f.name == "config.json" or f.suffix == ".gguf" for f in p.iterdir()):
                     models.append(p.name)
         return models
     
-    def load_model(self, model_name: str) -> bool:
-        """加载指定模型"""
-        if self.current_model_name == model_name and self.current_model is not None:
+    @property
+    def current_model(self) -> Any:
+        """当前后端的模型对象（transformers 为 MiniCPM-V 模型，llama_cpp 为 Llama 实例）"""
+        return self.backend.model if self.backend is not None else None
+    
+    @current_model.setter
+    def current_model(self, model: Any):
+        # 移动权重后替换为新的模型对象（测试中也用于注入模型）
+        self.backend.model = model
+    
+    @property
+    def current_tokenizer(self) -> Any:
+        return self.backend.tokenizer if self.backend is not None else None
+    
+    def load_model(self, model_name: str, device: Optional[str] = None) -> bool:
+        """
+        加载指定模型
+        
+        停放在主机内存中的模型直接拷回目标设备（只拷贝权重），否则从快照/原始权重冷加载；
+        当前模型先停放到主机内存。device 为 "cpu" 时模型在CPU上运行，不占用显存。
+        """
+        device = device or self.device
+        if self.current_model_name == model_name and self.ready and device == self.target_device:
             logger.info(f"Model {model_name} already loaded")
             return True
         
-        model_path = self.models_dir / model_name
-        if not model_path.exists():
-            logger.error(f"Model path does not exist: {model_path}")
+        # 等待进行中的推理完成后独占执行；并发的加载请求依次执行
+        with self.lifecycle.exclusive(model_lifecycle.LOADING, self._settled_state):
+            return self._load_model(model_name, device)
+    
+    @property
+    def ready(self) -> bool:
+        """模型已加载并完成预热，可以推理"""
+        return self.lifecycle.state == model_lifecycle.READY
+    
+    def _settled_state(self) -> str:
+        """独占操作结束后的状态"""
+        return model_lifecycle.READY if self.current_model is not None else model_lifecycle.EMPTY
+    
+    def _load_model(self, model_name: str, device: str) -> bool:
+        """load_model 的实现（调用方独占持有模型）"""
+        if self.current_model_name == model_name and self.backend is not None:
+            if device != self.target_device and self.backend.movable:
+                self.target_device = device
+                self._move_active(device)
+            logger.info(f"Model {model_name} already loaded")
+            return True
+        
+        parked = self.parking.take(model_name)
+        if parked is not None:
+            self.park_model()
+            if self._activate_parked(parked, device):
+                return True
+        
+        if model_name not in self.get_available_models():
+            logger.error(f"Model not found: {model_name} (available: {self.get_available_models()})")
             return False
         
+        model_path = self.models_dir / model_name
+        backend_name = inference_backends.backend_for(model_name, model_path)
+        
         try:
-            # 清理之前的模型
-            if self.current_model is not None:
-                logger.info(f"Unloading current model: {self.current_model_name}")
-                self.unload_model()
-                # 等待一下确保内存清理完成
-                import time
-                time.sleep(1)  # 减少等待时间
-            
-            logger.info(f"Loading model from {model_path}")
-            
-            # 加载tokenizer（缓存到磁盘以加快后续加载）
-            self.current_tokenizer = AutoTokenizer.from_pretrained(
-                str(model_path),
-                trust_remote_code=True,
-                cache_dir=os.getenv("HF_HOME", "/tmp/hf_cache")
-            )
+            # 停放之前的模型（无法停放时卸载）
+            if self.backend is not None:
+                logger.info(f"Parking current model: {self.current_model_name}")
+                # 卸载时已同步CUDA并回收内存，不需要再等待
+                self.park_model()
             
-            # 获取原始的HuggingFace repo名称
-            original_repo_name = f"openbmb/{model_name}"
-            
-            # 优化数据类型选择
-            torch_dtype = torch.bfloat16 if torch.cuda.is_bf16_supported() else torch.float16
-            if self.device == "cpu":
-                torch_dtype = torch.bfloat16  # CPU上使用bfloat16更高效
-            
-            # 加载模型并启用优化选项
-            self.current_model = AutoModel.from_pretrained(
-                str(model_path),
-                torch_dtype=torch_dtype,
-                device_map="auto" if self.device == "cuda" else None,
-                trust_remote_code=True,
-                cache_dir=os.getenv("HF_HOME", "/tmp/hf_cache"),
-                low_cpu_mem_usage=True,  # 降低CPU内存使用
-                use_flash_attention_2=True if self.device == "cuda" else False  # CUDA启用FlashAttention
+            load_start = time.time()
+            backend = inference_backends.create_backend(
+                backend_name, cpu_acceleration_modes=self.cpu_acceleration_modes, cpu_config=self.cpu_config
             )
+            # 可移动的后端先在服务设备上加载再移到目标设备（快照按服务设备保存），其他后端直接在目标设备上加载
+            load_device = self.device if backend.movable else device
+            logger.info(f"Loading model {model_name} with {backend.name} backend on {load_device}")
+            profile = backend.load(model_name, model_path, load_device)
+            self.backend = backend
+            phases = profile["phases"]
             
-            # 修复模型配置中的_name_or_path为原始repo名称，避免processor加载错误
-            if hasattr(self.current_model, 'config'):
-                self.current_model.config._name_or_path = original_repo_name
+            if (backend.name == inference_backends.TransformersBackend.name and self.device == "cpu"
+                    and self.cpu_acceleration_modes):
+                phase_start = time.time()
+                self._apply_cpu_acceleration()
+                phases["cpu_acceleration"] = time.time() - phase_start
             
-            if self.device == "cpu":
-                self.current_model = self.current_model.to(self.device)
+            # 模型预热 - 按预热计划推理
+            phase_start = time.time()
+            self._warmup_model()
+            phases["warmup"] = time.time() - phase_start
             
-            self.current_model.eval()
+            for phase, seconds in backend.finish_load().items():
+                phases[phase] = phases.get(phase, 0.0) + seconds
             
-            # 模型预热 - 用小图片进行一次推理
-            self._warmup_model()
+            phase_start = time.time()
+            self.assistant = self._load_draft_model(model_name)
+            if self.assistant is not None:
+                phases["draft_model"] = time.time() - phase_start
             
             self.current_model_name = model_name
+            self.active_device = self.target_device = load_device
+            if device != load_device:
+                self._move_active(device)
+                self.target_device = device
+            self.last_used = time.time()
+            self.load_profile = {
+                "source": profile["source"],
+                "backend": backend.name,
+                "path": profile["path"],
+                "phases_seconds": {k: round(v, 3) for k, v in phases.items()},
+                "total_seconds": round(time.time() - load_start, 3)
+            }
             
-            logger.info(f"Successfully loaded model: {model_name}")
+            logger.info(f"Successfully loaded model: {model_name} ({self.load_profile})")
             return True
             
         except Exception as e:
@@ -102,23 +283,23 @@ class ModelService:
             return False
     
     def unload_model(self):
-        """卸载当前模型"""
+        """卸载当前模型（等待进行中的推理完成）"""
+        with self.lifecycle.exclusive(model_lifecycle.UNLOADING, self._settled_state):
+            self._unload_model()
+    
+    def _unload_model(self):
         logger.info("Starting model unload...")
-        
-        if self.current_model is not None:
-            # 将模型移到CPU以释放GPU内存
+        if self.backend is not None:
             try:
-                self.current_model = self.current_model.cpu()
-            except:
-                pass
-            del self.current_model
-            self.current_model = None
-        
-        if self.current_tokenizer is not None:
-            del self.current_tokenizer
-            self.current_tokenizer = None
+                self.backend.unload()
+            except Exception as e:
+                logger.warning(f"Backend unload failed: {str(e)}")
+            self.backend = None
         
         self.current_model_name = None
+        self.cpu_acceleration = []
+        self.active_device = None
+        self.assistant = None
         
         # 强制清理GPU内存
         if torch.cuda.is_available():
@@ -131,56 +312,397 @@ class ModelService:
         
         logger.info("Model unloaded and memory cleared")
     
-    def _warmup_model(self):
-        """模型预热 - 用小图片进行一次推理以优化后续性能"""
+    def park_model(self) -> bool:
+        """
+        停放当前模型：权重移到主机内存，之后加载同名模型时只需拷回；无法停放时卸载
+        
+        Returns:
+            bool: 是否已停放（False 表示没有模型或已直接卸载）
+        """
+        if self.backend is None:
+            return False
+        
+        with self.lifecycle.exclusive(model_lifecycle.UNLOADING, self._settled_state):
+            if self.backend is None:
+                return False
+            if not self.backend.movable:
+                # 权重不能移到主机内存的后端（如 llama_cpp）直接卸载
+                self._unload_model()
+                return False
+            name = self.current_model_name
+            state = {
+                "load_profile": self.load_profile,
+                "warmup_profile": self.warmup_profile,
+                "cpu_acceleration": self.cpu_acceleration,
+                "assistant": self.assistant,
+                "backend": self.backend
+            }
+            if self.assistant is not None:
+                # 草稿模型不计入停放容量，随服务模型一起移到主机内存
+                try:
+                    self.assistant.to("cpu")
+                except Exception as e:
+                    logger.warning(f"Failed to move draft model to host memory: {str(e)} - discarding")
+                    state["assistant"] = None
+            if not self.parking.park(name, self.current_model, self.current_tokenizer, state):
+                self._unload_model()
+                return False
+            
+            self.backend = None
+            self.current_model_name = None
+            self.cpu_acceleration = []
+            self.active_device = None
+            self.assistant = None
+        
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+        return True
+    
+    def _activate_parked(self, parked: model_parking.ParkedModel, device: str) -> bool:
+        """把停放的模型拷回目标设备并设为当前模型；失败时返回False，由调用方冷加载"""
+        start = time.time()
+        assistant = parked.state.get("assistant")
         try:
-            logger.info("Warming up model...")
-            # 创建一个16x16的小图片用于预热
-            warmup_image = Image.new('RGB', (16, 16), color='white')
-            warmup_prompt = "test"
-            
-            msgs = [{'role': 'user', 'content': [warmup_image, warmup_prompt]}]
-            
-            # 执行预热推理（不记录结果）
-            with torch.no_grad():
-                self.current_model.chat(
-                    msgs=msgs,
-                    tokenizer=self.current_tokenizer,
-                    sampling=False,
-                    max_new_tokens=10,  # 极短的输出
-                    enable_thinking=False
-                )
+            model = model_parking.move_model(parked.model, device)
+            if assistant is not None:
+                assistant.to(device)
+        except Exception as e:
+            logger.warning(f"Failed to reactivate parked model {parked.name}: {str(e)} - loading from disk")
+            return False
+        
+        self.backend = parked.state["backend"]
+        self.backend.model = model
+        self.current_model_name = parked.name
+        self.cpu_acceleration = parked.state["cpu_acceleration"]
+        self.warmup_profile = parked.state["warmup_profile"]
+        self.assistant = assistant
+        self.active_device = self.target_device = device
+        self.last_used = time.time()
+        
+        elapsed = time.time() - start
+        self.load_profile = {
+            "source": "parked",
+            "path": None,
+            "phases_seconds": {"weight_copy": round(elapsed, 3)},
+            "total_seconds": round(elapsed, 3),
+            "cold_load_profile": parked.state["load_profile"]
+        }
+        logger.info(f"Reactivated parked model {parked.name} on {device} in {elapsed:.3f}s")
+        return True
+    
+    def _move_active(self, device: str):
+        """把当前模型的权重移到指定设备（调用方独占持有模型，或持有 _residency_lock 拷回目标设备）"""
+        if self.backend is None or not self.backend.movable or self.active_device == device:
+            return
+        pin_memory = device == "cpu" and self.parking.pin_memory
+        self.current_model = model_parking.move_model(self.current_model, device, pin_memory)
+        if self.assistant is not None:
+            self.assistant.to(device)
+        self.active_device = device
+        if device == "cpu" and torch.cuda.is_available():
+            torch.cuda.empty_cache()
+    
+    @contextmanager
+    def _model_in_use(self):
+        """推理期间共享持有模型：权重因空闲被移到主机内存时先拷回目标设备，期间不会被再次移走"""
+        with self.lifecycle.reader():
+            with self._residency_lock:
+                if self.active_device != self.target_device:
+                    start = time.time()
+                    self._move_active(self.target_device)
+                    logger.info(f"Model {self.current_model_name} moved back to {self.target_device} "
+                                f"in {time.time() - start:.3f}s")
+            try:
+                yield
+            finally:
+                self.last_used = time.time()
+    
+    def _residency_loop(self):
+        """后台检查：活动模型空闲超时后权重移到主机内存，停放的模型空闲超时后丢弃"""
+        idle_seconds = model_parking.ACTIVE_IDLE_SECONDS
+        interval = max(0.5, min(10.0, idle_seconds / 4)) if idle_seconds else 10.0
+        while True:
+            time.sleep(interval)
+            try:
+                self.parking.purge_idle()
+                if idle_seconds:
+                    self._release_if_idle(idle_seconds)
+            except Exception as e:
+                logger.warning(f"Model residency check failed: {str(e)}")
+    
+    def _release_if_idle(self, idle_seconds: float) -> bool:
+        """活动模型空闲超过 idle_seconds 且没有进行中的推理时，把权重移到主机内存"""
+        if (self.backend is None or not self.backend.movable or self.lifecycle.in_flight
+                or self.active_device == "cpu" or time.time() - self.last_used <= idle_seconds):
+            return False
+        try:
+            # 有进行中的推理或其他加载/卸载操作时放弃本次释放
+            with self.lifecycle.exclusive(model_lifecycle.UNLOADING, self._settled_state, timeout=0):
+                if self.backend is None or self.active_device == "cpu":
+                    return False
+                self._move_active("cpu")
+        except model_lifecycle.LifecycleError:
+            return False
+        logger.info(f"Model {self.current_model_name} idle for {idle_seconds}s - weights moved to host memory")
+        return True
+    
+    def _load_draft_model(self, model_name: str) -> Optional[assisted_generation.AssistedGenerator]:
+        """
+        加载 ASSISTED_DRAFT_MODELS 为该模型配置的草稿模型
+        
+        草稿模型与服务模型的语言模型使用相同的dtype和设备；分词器不一致或加载失败时不启用辅助生成。
+        """
+        draft_name = assisted_generation.ASSISTED_DRAFT_MODELS.get(model_name)
+        llm = getattr(self.current_model, "llm", None)
+        if not draft_name or llm is None:
+            return None
+        
+        draft_path = Path(draft_name) if Path(draft_name).is_absolute() else self.models_dir / draft_name
+        try:
+            draft_tokenizer = AutoTokenizer.from_pretrained(str(draft_path), trust_remote_code=True)
+            if not assisted_generation.tokenizers_compatible(self.current_tokenizer, draft_tokenizer):
+                logger.warning(f"Draft model {draft_name} uses a different tokenizer - assisted generation disabled")
+                return None
+            draft = AutoModelForCausalLM.from_pretrained(
+                str(draft_path),
+                torch_dtype=llm.get_input_embeddings().weight.dtype,
+                trust_remote_code=True,
+                low_cpu_mem_usage=True
+            ).to(self.device).eval()
+        except Exception as e:
+            logger.warning(f"Failed to load draft model {draft_name}: {str(e)} - assisted generation disabled")
+            return None
+        
+        logger.info(f"Assisted generation enabled for {model_name} with draft model {draft_name}")
+        return assisted_generation.AssistedGenerator(draft, draft_name)
+    
+    def _install_assisted_generation(self):
+        """
+        包装语言模型的 generate：当前线程处于辅助生成请求中且为单条贪心解码时改用投机解码
+        
+        model.chat 内部用 inputs_embeds 调用 llm.generate 并只取返回的新token，这里返回相同形状的结果；
+        草稿模型的提示词由 get_vllm_embedding 的包装记录（见 _install_embedding_capture）。
+        """
+        self._install_embedding_capture()
+        llm = getattr(self.current_model, "llm", None)
+        if llm is None or getattr(llm.generate, "_assisted", False):
+            return
+        original = llm.generate
+        
+        def generate(*args, **kwargs):
+            request = getattr(_assisted_request, "active", None)
+            inputs_embeds = kwargs.get("inputs_embeds")
+            if (request is None or self.assistant is None or args or inputs_embeds is None
+                    or inputs_embeds.shape[0] != 1 or not kwargs.keys() <= ASSISTED_GENERATE_KWARGS
+                    or kwargs.get("num_beams", 1) != 1 or kwargs.get("do_sample")):
+                return original(*args, **kwargs)
             
-            logger.info("Model warmup completed")
+            eos_token_id = kwargs.get("eos_token_id", llm.generation_config.eos_token_id)
+            tokens, stats = self.assistant.generate(
+                llm,
+                inputs_embeds=inputs_embeds,
+                draft_input_ids=request.get("input_ids"),
+                max_new_tokens=kwargs.get("max_new_tokens") or llm.generation_config.max_new_tokens or 512,
+                eos_token_ids=eos_token_id if isinstance(eos_token_id, list) else [eos_token_id],
+                repetition_penalty=kwargs.get("repetition_penalty") or 1.0,
+                attention_mask=kwargs.get("attention_mask")
+            )
+            request["stats"] = stats
+            return torch.tensor([tokens], dtype=torch.long, device=inputs_embeds.device)
+        
+        generate._assisted = True
+        llm.generate = generate
+    
+    @contextmanager
+    def _assisted_generation(self, details: Dict[str, Any]):
+        """在此期间的单条生成使用草稿模型辅助（已加载草稿模型时），本次的统计写入 details["assisted"]"""
+        if self.assistant is None:
+            yield
+            return
+        self._install_assisted_generation()
+        request = {}
+        _assisted_request.active = request
+        try:
+            yield
+        finally:
+            _assisted_request.active = None
+        if "stats" in request:
+            details["assisted"] = request["stats"]
+    
+    def _apply_cpu_acceleration(self):
+        """应用CPU加速并用一次短推理验证，失败时回退到原始模型"""
+        applied, original_llm = cpu_acceleration.apply(self.current_model, self.cpu_acceleration_modes)
+        if not applied:
+            self.cpu_acceleration = []
+            return
+        
+        try:
+            verify_image = Image.new('RGB', (64, 64), color='white')
+            self.backend.chat(
+                [{'role': 'user', 'content': [verify_image, "test"]}],
+                sampling=False,
+                max_new_tokens=4,
+                enable_thinking=False
+            )
+            self.cpu_acceleration = applied
+            logger.info(f"CPU acceleration enabled: {'+'.join(applied)}")
+        except Exception as e:
+            logger.warning(f"CPU acceleration {'+'.join(applied)} failed verification: {str(e)} - falling back")
+            cpu_acceleration.revert(self.current_model, original_llm)
+            self.cpu_acceleration = []
+        finally:
+            del original_llm
+            gc.collect()
+    
+    def _warmup_model(self):
+        """
+        模型预热 - 按预热计划覆盖多种分辨率/长宽比（以及可选的批量和流式调用），
+        让切片、视觉编码和生成路径在真实请求到来之前完成初始化
+        
+        每一步的耗时记录在 warmup_profile 中，单步失败不影响后续步骤。
+        """
+        logger.info(f"Warming up model with plan: {WARMUP_PLAN}")
+        self.warmup_profile = []
+        
+        for step in WARMUP_PLAN:
+            step_start = time.time()
+            record = {"name": step["name"], "size": f"{step['size'][0]}x{step['size'][1]}"}
+            try:
+                # 使用噪声图而不是纯色图，使视觉编码路径与真实图片一致
+                warmup_image = self.preprocess_image(Image.effect_noise(step["size"], 64).convert('RGB'))
+                msgs = [{'role': 'user', 'content': [warmup_image, "请描述这张图片"]}]
+                
+                if step["kind"] == "batch":
+                    record["batch_size"] = step["batch_size"]
+                    self.backend.batch(
+                        [msgs] * step["batch_size"],
+                        sampling=False,
+                        max_new_tokens=WARMUP_MAX_NEW_TOKENS,
+                        enable_thinking=False
+                    )
+                elif step["kind"] == "stream":
+                    for _ in self.backend.stream(
+                        msgs,
+                        sampling=True,
+                        max_new_tokens=WARMUP_MAX_NEW_TOKENS,
+                        enable_thinking=False
+                    ):
+                        pass
+                else:
+                    self.backend.chat(
+                        msgs,
+                        sampling=False,
+                        max_new_tokens=WARMUP_MAX_NEW_TOKENS,
+                        enable_thinking=False
+                    )
+                record["ok"] = True
+            except Exception as e:
+                record["ok"] = False
+                record["error"] = str(e)
+                logger.warning(f"Warmup step {step['name']} failed: {str(e)} - continuing anyway")
             
+            record["seconds"] = round(time.time() - step_start, 3)
+            self.warmup_profile.append(record)
+            logger.info(f"Warmup step {record}")
+        
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+        logger.info("Model warmup completed")
+    
+    def preprocess_image(self, image: Image.Image, max_size: int = 1024) -> Image.Image:
+        """图片预处理 - 转为RGB并把过大的图片缩放到最大边长 max_size"""
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        
+        # 如果图片过大，进行适当缩放以提升推理速度
+        if max(image.size) > max_size:
+            ratio = max_size / max(image.size)
+            new_size = tuple(int(dim * ratio) for dim in image.size)
+            image = image.resize(new_size, Image.Resampling.LANCZOS)
+            logger.info(f"Image resized to {new_size} for faster processing")
+        return image
+    
+    @staticmethod
+    def _clean_result(res: Any) -> str:
+        """将模型输出转为字符串并清理特殊token"""
+        return str(res).replace('<CLS>', '').replace('</CLS>', '').strip()
+    
+    def estimate_vision_tokens(self, image: Image.Image, max_slice_nums: Optional[int] = None) -> Optional[int]:
+        """
+        按模型自身的切片规则计算图片占用的视觉token数
+        
+        每个切片和缩略原图各占 query_num 个token；无法获取processor时返回None。
+        """
+        try:
+            processor = getattr(self.current_model, "processor", None)
+            if processor is None:
+                return None
+            image_processor = processor.image_processor
+            if max_slice_nums is None:
+                max_slice_nums = image_processor.max_slice_nums
+            query_num = getattr(self.current_model.config, "query_num", 64)
+            grid = image_processor.get_sliced_grid(image.size, max_slice_nums)
+            slices = grid[0] * grid[1] if grid else 0
+            return query_num * (1 + slices)
         except Exception as e:
-            logger.warning(f"Model warmup failed: {str(e)} - continuing anyway")
+            logger.debug(f"Vision token estimate unavailable: {str(e)}")
+            return None
     
-    def analyze_image(self, image: Image.Image, prompt: str = "请详细描述这张图片的内容") -> Tuple[Optional[str], float]:
+    def _generation_kwargs(self, tier: Dict[str, Any]) -> Dict[str, Any]:
+        """根据档位生成 model.chat 的参数"""
+        kwargs = {"max_new_tokens": tier["max_new_tokens"]}
+        if tier["max_slice_nums"] is not None:
+            kwargs["max_slice_nums"] = tier["max_slice_nums"]
+        if self.assistant is not None:
+            # 投机解码只支持贪心解码，启用辅助生成时所有请求都不使用beam search，保证结果一致
+            kwargs["num_beams"] = 1
+        return kwargs
+    
+    def _generation_version(self, quality: str) -> str:
+        """结果缓存使用的生成参数版本；启用辅助生成时为贪心解码，与beam search的结果分开缓存"""
+        version = generation_version(quality)
+        return f"{version}:greedy" if self.assistant is not None else version
+    
+    def _cache_key(self, image: Image.Image, prompt: str, quality: str) -> Optional[str]:
+        """结果缓存key（模型名 + 生成参数版本 + 提示词 + 图片哈希）；未启用缓存时返回None"""
+        if not self.result_cache.enabled:
+            return None
+        return result_cache.make_key(self.current_model_name, self._generation_version(quality), prompt,
+                                     image_digest(image))
+    
+    @_holds_model
+    def analyze_image(self, image: Image.Image, prompt: str = "请详细描述这张图片的内容",
+                      quality: str = DEFAULT_QUALITY) -> Tuple[Optional[str], float, Dict[str, Any]]:
         """
         分析图片内容
         
+        Args:
+            quality: 速度/质量档位 (fast / balanced / accurate)，决定最大分辨率、切片数和生成token上限
+        
         Returns:
-            Tuple[Optional[str], float]: (分析结果, 处理时间秒数)
+            Tuple[Optional[str], float, Dict[str, Any]]: (分析结果, 处理时间秒数, 处理详情如档位和视觉token数)
         """
-        if self.current_model is None or self.current_tokenizer is None:
+        tier = QUALITY_TIERS[quality]
+        details = {"quality": quality}
+        
+        if self.backend is None:
             logger.error("No model loaded")
-            return None, 0.0
+            return None, 0.0, details
         
         start_time = time.time()
         
         try:
-            # 图片预处理优化
-            if image.mode != 'RGB':
-                image = image.convert('RGB')
-            
-            # 如果图片过大，进行适当缩放以提升推理速度
-            max_size = 1024  # 最大边长
-            if max(image.size) > max_size:
-                ratio = max_size / max(image.size)
-                new_size = tuple(int(dim * ratio) for dim in image.size)
-                image = image.resize(new_size, Image.Resampling.LANCZOS)
-                logger.info(f"Image resized to {new_size} for faster processing")
+            image = self.preprocess_image(image, tier["max_size"])
+            details["image_size"] = list(image.size)
+            
+            cache_key = self._cache_key(image, prompt, quality)
+            if cache_key is not None:
+                cached = self.result_cache.get(cache_key)
+                if cached is not None:
+                    details.update(cached.get("details", {}), cached=True)
+                    return cached["result"], time.time() - start_time, details
+            details["cached"] = False
+            details["vision_tokens"] = self.estimate_vision_tokens(image, tier["max_slice_nums"])
             
             # 构建消息格式 - 图片和文本放在同一个content数组中（符合MiniCPM-V规范）
             msgs = [{'role': 'user', 'content': [image, prompt]}]
@@ -192,15 +714,14 @@ class ModelService:
             inference_start_time = time.time()
             
             # 生成回复 - 优化推理参数以提升速度
-            with torch.no_grad():  # 确保不计算梯度以节省内存
-                res = self.current_model.chat(
-                    msgs=msgs,
-                    tokenizer=self.current_tokenizer,
+            with self._model_in_use(), self._assisted_generation(details):
+                res = self.backend.chat(
+                    msgs,
                     sampling=False,  # 必须禁用采样避免CUDA错误
-                    max_new_tokens=512,  # 减少最大token数以提升速度
                     temperature=0.7,  # 稍微降低温度提升一致性
                     do_sample=False,  # 禁用采样
-                    enable_thinking=False  # 禁用长思维模式
+                    enable_thinking=False,  # 禁用长思维模式
+                    **self._generation_kwargs(tier)  # 按档位限制切片数和token数以提升速度
                 )
             
             # 计算推理时间
@@ -210,14 +731,7 @@ class ModelService:
             logger.info(f"Raw result: {res}")
             logger.info(f"Inference time: {inference_time:.3f}s")
             
-            # 确保返回字符串
-            if isinstance(res, list):
-                result = res[0] if res else ""
-            else:
-                result = str(res)
-            
-            # 清理特殊token
-            result = result.replace('<CLS>', '').replace('</CLS>', '').strip()
+            result = self._clean_result(res)
             
             # 计算总处理时间
             total_time = time.time() - start_time
@@ -226,12 +740,15 @@ class ModelService:
             logger.info(f"Total processing time: {total_time:.3f}s")
             logger.info("Image analysis completed successfully")
             
+            if cache_key is not None:
+                self.result_cache.put(cache_key, {"result": result, "details": {"vision_tokens": details["vision_tokens"]}})
+            
             # 推理后立即清理临时内存
             if torch.cuda.is_available():
                 torch.cuda.empty_cache()
             gc.collect()
             
-            return result, total_time
+            return result, total_time, details
             
         except Exception as e:
             total_time = time.time() - start_time
@@ -239,13 +756,349 @@ class ModelService:
             logger.error(f"Processing time before error: {total_time:.3f}s")
             import traceback
             logger.error(f"Traceback: {traceback.format_exc()}")
-            return None, total_time
+            return None, total_time, details
+    
+    @_holds_model
+    def analyze_video(self, frames: List[Image.Image], prompt: str = "请描述这段视频的内容",
+                      quality: str = DEFAULT_QUALITY) -> Tuple[Optional[str], float, Dict[str, Any]]:
+        """
+        分析视频帧 - 所有帧和提示词放在同一条消息中，一次多图推理
+        
+        每帧不切片 (max_slice_nums=1) 且不加图片编号，与 MiniCPM-V 的视频推理方式一致；
+        档位只决定生成token上限。结果缓存key使用全部帧的哈希。
+        
+        Returns:
+            Tuple[Optional[str], float, Dict[str, Any]]: (分析结果, 处理时间秒数, 处理详情)
+        """
+        tier = QUALITY_TIERS[quality]
+        details = {"quality": quality, "frames": len(frames)}
+        
+        if self.backend is None:
+            logger.error("No model loaded")
+            return None, 0.0, details
+        
+        start_time = time.time()
+        try:
+            cache_key = None
+            if self.result_cache.enabled:
+                frames_digest = hashlib.sha256("".join(image_digest(f) for f in frames).encode()).hexdigest()
+                cache_key = result_cache.make_key(self.current_model_name, f"video:{self._generation_version(quality)}",
+                                                  prompt, frames_digest)
+                cached = self.result_cache.get(cache_key)
+                if cached is not None:
+                    details["cached"] = True
+                    return cached["result"], time.time() - start_time, details
+            details["cached"] = False
+            
+            msgs = [{'role': 'user', 'content': list(frames) + [prompt]}]
+            kwargs = self._generation_kwargs(tier)
+            kwargs["max_slice_nums"] = 1
+            with self._model_in_use(), self._assisted_generation(details):
+                res = self.backend.chat(
+                    msgs,
+                    sampling=False,
+                    enable_thinking=False,
+                    use_image_id=False,
+                    **kwargs
+                )
+            
+            result = self._clean_result(res)
+            total_time = time.time() - start_time
+            logger.info(f"Video with {len(frames)} frames analyzed in {total_time:.3f}s")
+            
+            if cache_key is not None:
+                self.result_cache.put(cache_key, {"result": result, "details": {}})
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+            return result, total_time, details
+            
+        except Exception as e:
+            total_time = time.time() - start_time
+            logger.error(f"Failed to analyze video: {str(e)}")
+            return None, total_time, details
+    
+    def analyze_image_stream(self, image: Image.Image, prompt: str = "请详细描述这张图片的内容",
+                             quality: str = DEFAULT_QUALITY) -> Iterator[str]:
+        """
+        流式分析图片内容，逐段返回生成的文本
+        
+        流式生成不支持beam search，这里使用贪心解码（sampling=True 且 do_sample=False）。
+        """
+        if self.backend is None:
+            raise RuntimeError("No model loaded")
+        
+        tier = QUALITY_TIERS[quality]
+        image = self.preprocess_image(image, tier["max_size"])
+        msgs = [{'role': 'user', 'content': [image, prompt]}]
+        
+        with self._model_in_use():
+            for chunk in self.backend.stream(
+                msgs,
+                sampling=True,
+                do_sample=False,
+                enable_thinking=False,
+                **self._generation_kwargs(tier)
+            ):
+                chunk = chunk.replace('<CLS>', '').replace('</CLS>', '')
+                if chunk:
+                    yield chunk
+    
+    def _install_embedding_capture(self):
+        """
+        包装模型的 get_vllm_embedding，在需要时把视觉编码器的输出和文本提示词记录到当前线程
+        
+        model.chat 不返回视觉编码结果，但接受 vision_hidden_states 参数跳过视觉编码；
+        辅助生成的草稿模型需要去掉图片占位符的提示词token。包装只对调用了 chat_turn 或处于辅助生成请求中的线程生效，
+        其他请求不受影响。
+        """
+        original = getattr(self.current_model, "get_vllm_embedding", None)
+        if original is None or getattr(original, "_captures_vision", False):
+            return
+        
+        def get_vllm_embedding(data):
+            request = getattr(_assisted_request, "active", None)
+            if request is not None and len(data["input_ids"]) == 1:
+                request["input_ids"] = assisted_generation.strip_image_tokens(
+                    data["input_ids"][0].tolist(), data["image_bound"][0]
+                )
+            output = original(data)
+            captured = getattr(_vision_capture, "states", None)
+            if captured is not None and isinstance(output, tuple) and len(output) == 2:
+                captured.append(output[1])
+            return output
+        
+        get_vllm_embedding._captures_vision = True
+        self.current_model.get_vllm_embedding = get_vllm_embedding
+    
+    @_holds_model
+    def chat_turn(self, msgs: List[Dict[str, Any]], quality: str = DEFAULT_QUALITY,
+                  vision_hidden_states: Any = None) -> Tuple[Optional[str], float, Dict[str, Any], Any]:
+        """
+        多轮对话中的一轮推理
+        
+        msgs 为完整的历史消息（图片已按档位预处理）。传入上一轮缓存的 vision_hidden_states 时跳过视觉编码，
+        只需处理文本；缓存不可用时自动回退为完整推理。
+        
+        Returns:
+            Tuple[Optional[str], float, Dict[str, Any], Any]: (回复, 处理时间秒数, 处理详情, 本轮的视觉编码结果)
+        """
+        tier = QUALITY_TIERS[quality]
+        details = {"quality": quality}
+        
+        if self.backend is None:
+            logger.error("No model loaded")
+            return None, 0.0, details, None
+        
+        start_time = time.time()
+        self._install_embedding_capture()
+        
+        def run(states):
+            kwargs = self._generation_kwargs(tier)
+            if states is not None:
+                kwargs["vision_hidden_states"] = states
+            _vision_capture.states = [] if states is None else None
+            try:
+                with self._model_in_use(), self._assisted_generation(details):
+                    res = self.backend.chat(
+                        msgs,
+                        sampling=False,
+                        enable_thinking=False,
+                        **kwargs
+                    )
+                captured = _vision_capture.states
+            finally:
+                _vision_capture.states = None
+            if states is None:
+                states = captured[0] if captured else None
+            return res, states
+        
+        try:
+            try:
+                details["vision_cached"] = vision_hidden_states is not None
+                res, vision_hidden_states = run(vision_hidden_states)
+            except Exception as e:
+                if vision_hidden_states is None:
+                    raise
+                logger.warning(f"Cached vision states rejected: {str(e)} - recomputing")
+                details["vision_cached"] = False
+                res, vision_hidden_states = run(None)
+            
+            result = self._clean_result(res)
+            total_time = time.time() - start_time
+            logger.info(f"Chat turn ({len(msgs)} messages) completed in {total_time:.3f}s")
+            
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+            return result, total_time, details, vision_hidden_states
+            
+        except Exception as e:
+            total_time = time.time() - start_time
+            logger.error(f"Failed chat turn: {str(e)}")
+            return None, total_time, details, None
+    
+    @_holds_model
+    def embed_images(self, images: List[Image.Image]) -> Tuple[Optional[Any], float, Dict[str, Any]]:
+        """
+        计算图片向量 - 只运行视觉编码器，不生成文本
+        
+        图片按 fast 档位缩放且不切片，见 image_embedding 模块。
+        
+        Returns:
+            Tuple[Optional[np.ndarray], float, Dict[str, Any]]: ([N, dim] float32 向量, 处理时间秒数, 处理详情)
+        """
+        details = {"images": len(images)}
+        if self.backend is None:
+            logger.error("No model loaded")
+            return None, 0.0, details
+        
+        start_time = time.time()
+        try:
+            max_size = QUALITY_TIERS["fast"]["max_size"]
+            images = [self.preprocess_image(image, max_size) for image in images]
+            with self._model_in_use():
+                embeddings = self.backend.embed(images)
+            total_time = time.time() - start_time
+            details["dim"] = int(embeddings.shape[1])
+            logger.info(f"Embedded {len(images)} images in {total_time:.3f}s")
+            return embeddings, total_time, details
+        except inference_backends.BackendUnsupported:
+            raise
+        except Exception as e:
+            total_time = time.time() - start_time
+            logger.error(f"Failed to embed images: {str(e)}")
+            return None, total_time, details
+    
+    @_holds_model
+    def classify_image(self, image: Image.Image, labels: List[str], prompt: Optional[str] = None,
+                       quality: str = DEFAULT_QUALITY) -> Tuple[Optional[Dict[str, Any]], float, Dict[str, Any]]:
+        """
+        在候选标签上为图片打分 - 一次批量前向，不生成文本，见 label_scoring 模块
+        
+        Returns:
+            Tuple[Optional[Dict[str, Any]], float, Dict[str, Any]]: (排序后的标签和概率, 处理时间秒数, 处理详情)
+        """
+        tier = QUALITY_TIERS[quality]
+        details = {"quality": quality}
+        if self.backend is None:
+            logger.error("No model loaded")
+            return None, 0.0, details
+        
+        start_time = time.time()
+        try:
+            image = self.preprocess_image(image, tier["max_size"])
+            details["image_size"] = list(image.size)
+            prompt = label_scoring.build_prompt(labels, prompt)
+            
+            cache_key = None
+            if self.result_cache.enabled:
+                cache_key = result_cache.make_key(self.current_model_name, f"classify:{generation_version(quality)}",
+                                                  json.dumps([prompt, labels], ensure_ascii=False), image_digest(image))
+                cached = self.result_cache.get(cache_key)
+                if cached is not None:
+                    details["cached"] = True
+                    return cached["result"], time.time() - start_time, details
+            details["cached"] = False
+            
+            with self._model_in_use():
+                result = self.backend.classify(image, prompt, labels, tier["max_slice_nums"])
+            total_time = time.time() - start_time
+            logger.info(f"Scored {len(labels)} labels in {total_time:.3f}s: {result['label']}")
+            
+            if cache_key is not None:
+                self.result_cache.put(cache_key, {"result": result, "details": {}})
+            return result, total_time, details
+        except inference_backends.BackendUnsupported:
+            raise
+        except Exception as e:
+            total_time = time.time() - start_time
+            logger.error(f"Failed to classify image: {str(e)}")
+            return None, total_time, details
+    
+    @_holds_model
+    def analyze_images(self, images: List[Image.Image], prompts: List[str],
+                       quality: str = DEFAULT_QUALITY) -> Tuple[List[Optional[str]], float]:
+        """
+        批量分析图片 - 将多组消息一次性交给 model.chat 批量生成
+        
+        已缓存的图片直接返回缓存结果；批量推理失败时自动退回逐张分析，保证每张图片都有结果（失败为None）。
+        
+        Returns:
+            Tuple[List[Optional[str]], float]: (每张图片的分析结果, 处理时间秒数)
+        """
+        if self.backend is None:
+            logger.error("No model loaded")
+            return [None] * len(images), 0.0
+        
+        if len(images) == 1:
+            result, total_time, _ = self.analyze_image(images[0], prompts[0], quality)
+            return [result], total_time
+        
+        tier = QUALITY_TIERS[quality]
+        start_time = time.time()
+        images = [self.preprocess_image(image, tier["max_size"]) for image in images]
+        results: List[Optional[str]] = [None] * len(images)
+        
+        # 先查结果缓存，只把未命中的图片交给模型
+        keys = [self._cache_key(image, prompt, quality) for image, prompt in zip(images, prompts)]
+        pending = []
+        for index, key in enumerate(keys):
+            cached = self.result_cache.get(key) if key is not None else None
+            if cached is not None:
+                results[index] = cached["result"]
+            else:
+                pending.append(index)
+        if not pending:
+            return results, time.time() - start_time
+        
+        try:
+            batch_msgs = [[{'role': 'user', 'content': [images[i], prompts[i]]}] for i in pending]
+            
+            with self._model_in_use():
+                res = self.backend.batch(
+                    batch_msgs,
+                    sampling=False,
+                    enable_thinking=False,
+                    **self._generation_kwargs(tier)
+                )
+            
+            for index, r in zip(pending, res):
+                results[index] = self._clean_result(r)
+                if keys[index] is not None:
+                    self.result_cache.put(keys[index], {"result": results[index], "details": {}})
+            total_time = time.time() - start_time
+            logger.info(f"Batch of {len(pending)} images analyzed in {total_time:.3f}s "
+                        f"({len(images) - len(pending)} cached)")
+            
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+            
+            return results, total_time
+            
+        except Exception as e:
+            logger.warning(f"Batch inference failed: {str(e)} - falling back to sequential analysis")
+            for index in pending:
+                results[index] = self.analyze_image(images[index], prompts[index], quality)[0]
+            return results, time.time() - start_time
     
     def get_model_info(self) -> Dict[str, Any]:
         """获取当前模型信息"""
         return {
             "loaded": self.current_model is not None,
+            "ready": self.ready,
+            "lifecycle": self.lifecycle.snapshot(),
             "model_name": self.current_model_name,
             "device": self.device,
+            "cpu_config": cpu_tuning.describe_cpu_config(self.cpu_config) if self.device == "cpu" else None,
+            "cpu_acceleration": self.cpu_acceleration,
+            "backend": self.backend.describe() if self.backend is not None else None,
+            "load_profile": self.load_profile,
+            "warmup_profile": self.warmup_profile,
+            "assisted_generation": self.assistant.snapshot() if self.assistant is not None else None,
+            "residency": {
+                "target_device": self.target_device if self.current_model is not None else None,
+                "active_device": self.active_device,
+                "idle_seconds": round(time.time() - self.last_used, 1) if self.current_model is not None else None,
+                "parked": self.parking.snapshot()
+            },
             "available_models": self.get_available_models()
         }
\ No newline at end of file
@@ -0,0 +1,140 @@
+"""
+预处理模型快照 - 首次加载后把转换为目标dtype的权重（safetensors）、tokenizer、模型代码和processor写入快照目录，
+之后的加载直接从快照目录读取
+
+从快照加载时仍然经过完整的 AutoTokenizer/AutoModel.from_pretrained 流程（导入远程模型代码、构建模型、加载权重），
+节省的只是源权重的格式/dtype转换和processor的解析；源模型已经是目标dtype的safetensors时，加载时间基本不变。
+快照清单记录源模型的指纹（配置和权重文件的名称、大小、修改时间），源模型变化后快照自动失效并在下次加载时重建。
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+from pathlib import Path
+from typing import Optional, Dict, Any
+
+import torch
+from transformers import AutoProcessor
+
+logger = logging.getLogger(__name__)
+
+# 预处理好的模型快照目录，为空时不启用快照
+MODEL_SNAPSHOT_DIR = os.getenv("MODEL_SNAPSHOT_DIR", "")
+
+MANIFEST_NAME = "snapshot.json"
+PROCESSOR_SUBDIR = "processor"
+SNAPSHOT_FORMAT_VERSION = 1
+
+
+def snapshot_path(model_name: str, device: str, dtype: torch.dtype) -> Optional[Path]:
+    """
+    返回模型快照目录；未配置 MODEL_SNAPSHOT_DIR 时返回None
+
+    目录名中的 '-' 和 '.' 替换为 '_'，避免 transformers_modules 动态模块名出错
+    """
+    if not MODEL_SNAPSHOT_DIR:
+        return None
+    dtype_name = str(dtype).replace("torch.", "")
+    name = f"{model_name}__{device}_{dtype_name}".replace("-", "_").replace(".", "_")
+    return Path(MODEL_SNAPSHOT_DIR) / name
+
+
+def source_fingerprint(source_dir: Path) -> str:
+    """根据源模型的配置和权重文件（名称、大小、修改时间）计算指纹，源模型更新后快照自动失效"""
+    digest = hashlib.sha256()
+    for p in sorted(source_dir.resolve().iterdir()):
+        if p.suffix in (".json", ".safetensors", ".bin", ".py", ".model"):
+            stat = p.stat()
+            digest.update(f"{p.name}:{stat.st_size}:{int(stat.st_mtime)}".encode())
+    return digest.hexdigest()
+
+
+def is_valid(snapshot_dir: Optional[Path], source_dir: Path) -> bool:
+    """快照存在、格式版本一致且源模型未变化"""
+    if snapshot_dir is None:
+        return False
+    manifest_path = snapshot_dir / MANIFEST_NAME
+    if not manifest_path.exists():
+        return False
+    try:
+        with open(manifest_path, encoding="utf-8") as f:
+            manifest = json.load(f)
+    except Exception as e:
+        logger.warning(f"Unreadable snapshot manifest {manifest_path}: {str(e)}")
+        return False
+    if manifest.get("format_version") != SNAPSHOT_FORMAT_VERSION:
+        return False
+    if manifest.get("source_fingerprint") != source_fingerprint(source_dir):
+        logger.info(f"Snapshot {snapshot_dir} is stale - source model changed")
+        return False
+    return True
+
+
+def _staging_dir(snapshot_dir: Path) -> Path:
+    return snapshot_dir.with_name(snapshot_dir.name + ".partial")
+
+
+def save_weights(model: Any, tokenizer: Any, snapshot_dir: Path, source_dir: Path) -> Path:
+    """
+    把已转换好dtype的权重（safetensors，可内存映射加载）和tokenizer写入临时目录
+
+    必须在CPU加速修改模型之前调用；完成后需调用 finish_save 才会生效。
+    """
+    staging = _staging_dir(snapshot_dir)
+    if staging.exists():
+        shutil.rmtree(staging)
+    staging.mkdir(parents=True)
+
+    model.save_pretrained(str(staging), safe_serialization=True)
+    tokenizer.save_pretrained(str(staging))
+
+    # 保留 trust_remote_code 需要的模型代码
+    for p in source_dir.resolve().glob("*.py"):
+        if not (staging / p.name).exists():
+            shutil.copy2(p, staging / p.name)
+    return staging
+
+
+def finish_save(staging: Path, snapshot_dir: Path, model: Any, source_dir: Path, meta: Dict[str, Any]):
+    """写入processor缓存和清单文件，再原子替换为正式快照目录"""
+    processor = getattr(model, "processor", None)
+    if processor is not None:
+        try:
+            processor.save_pretrained(str(staging / PROCESSOR_SUBDIR))
+        except Exception as e:
+            logger.warning(f"Failed to cache processor in snapshot: {str(e)}")
+
+    manifest = {
+        "format_version": SNAPSHOT_FORMAT_VERSION,
+        "source_path": str(source_dir.resolve()),
+        "source_fingerprint": source_fingerprint(source_dir),
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        **meta,
+    }
+    with open(staging / MANIFEST_NAME, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+    if snapshot_dir.exists():
+        shutil.rmtree(snapshot_dir)
+    os.replace(staging, snapshot_dir)
+    logger.info(f"Model snapshot saved to {snapshot_dir}")
+
+
+def discard(snapshot_dir: Path):
+    """删除未完成的临时快照目录"""
+    staging = _staging_dir(snapshot_dir)
+    if staging.exists():
+        shutil.rmtree(staging, ignore_errors=True)
+
+
+def load_processor(model: Any, snapshot_dir: Path):
+    """从快照加载缓存的processor，避免首次推理时再次解析"""
+    processor_dir = snapshot_dir / PROCESSOR_SUBDIR
+    if not processor_dir.exists():
+        return
+    try:
+        model.processor = AutoProcessor.from_pretrained(str(processor_dir), trust_remote_code=True)
+    except Exception as e:
+        logger.warning(f"Failed to load cached processor from snapshot: {str(e)} - will load lazily")
@@ -0,0 +1,224 @@
+import asyncio
+import logging
+import math
+import os
+import threading
+import time
+from concurrent.futures import Executor, ThreadPoolExecutor
+from tempfile import SpooledTemporaryFile
+from typing import Any, Callable, Dict, Optional
+
+import httpx
+from fastapi import HTTPException
+
+import upload_limits
+from admission import ADMISSION_CONCURRENCY
+
+logger = logging.getLogger(__name__)
+
+# 同时进行的图片下载数（只占用事件循环，不占用线程）
+PIPELINE_FETCH_CONCURRENCY = int(os.getenv("PIPELINE_FETCH_CONCURRENCY", 8))
+# 各阶段排队等待的请求上限，超出时直接返回503
+PIPELINE_FETCH_QUEUE = int(os.getenv("PIPELINE_FETCH_QUEUE", 32))
+PIPELINE_DECODE_QUEUE = int(os.getenv("PIPELINE_DECODE_QUEUE", 16))
+PIPELINE_INFERENCE_QUEUE = int(os.getenv("PIPELINE_INFERENCE_QUEUE", 32))
+# 推理线程数，默认与准入控制的并发数一致（单模型实例上视为串行）
+PIPELINE_INFERENCE_CONCURRENCY = int(os.getenv("PIPELINE_INFERENCE_CONCURRENCY", ADMISSION_CONCURRENCY))
+# 图片下载超时（秒）
+PIPELINE_FETCH_TIMEOUT = float(os.getenv("PIPELINE_FETCH_TIMEOUT", 30))
+
+
+class StageFull(HTTPException):
+    """某个阶段的排队数达到上限"""
+
+    def __init__(self, stage: str, max_queue: int, retry_after: int):
+        super().__init__(
+            status_code=503,
+            detail=f"服务繁忙：{stage} 阶段排队请求数已达上限 {max_queue}",
+            headers={"Retry-After": str(retry_after)}
+        )
+
+
+class PipelineStage:
+    """
+    流水线中的一个阶段：并发上限 + 有界等待队列 + 利用率统计
+
+    有 executor 的阶段在线程池中执行同步函数（并发上限即线程数），没有的阶段在事件循环中执行协程函数，
+    由信号量限制并发。等待数达到 max_queue 时新请求立即返回503，不在后面的阶段堆积。
+    利用率 = 累计忙碌时间 / (运行时长 × 并发上限)。
+    """
+
+    def __init__(self, name: str, concurrency: int, max_queue: int, executor: Optional[Executor] = None):
+        self.name = name
+        self.concurrency = max(1, concurrency)
+        self.max_queue = max_queue
+        self.executor = executor
+        self._lock = threading.Lock()
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._loop = None
+        self._running: Dict[int, float] = {}
+        self._next_id = 0
+        self.started_at = time.monotonic()
+        self.waiting = 0
+        self.peak_waiting = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.busy_seconds = 0.0
+        self.wait_seconds = 0.0
+
+    def _retry_after_locked(self) -> int:
+        """按平均执行时间估计排队清空所需的时间"""
+        average = self.busy_seconds / self.completed if self.completed else 1.0
+        return max(1, math.ceil(self.waiting * average / self.concurrency))
+
+    def _enqueue(self) -> Dict[str, Any]:
+        with self._lock:
+            if self.waiting >= self.max_queue:
+                self.rejected += 1
+                retry_after = self._retry_after_locked()
+                logger.warning(f"Pipeline stage {self.name} queue full ({self.waiting}), retry after {retry_after}s")
+                raise StageFull(self.name, self.max_queue, retry_after)
+            self.waiting += 1
+            self.peak_waiting = max(self.peak_waiting, self.waiting)
+            self._next_id += 1
+            return {"id": self._next_id, "queued_at": time.monotonic(), "started": False, "abandoned": False}
+
+    def _start(self, call: Dict[str, Any]) -> bool:
+        """开始执行；排队期间已被放弃的调用返回 False"""
+        with self._lock:
+            if call["abandoned"]:
+                return False
+            now = time.monotonic()
+            call["started"] = True
+            self.waiting -= 1
+            self.wait_seconds += now - call["queued_at"]
+            self._running[call["id"]] = now
+            return True
+
+    def _finish(self, call: Dict[str, Any], ok: bool):
+        with self._lock:
+            self.busy_seconds += time.monotonic() - self._running.pop(call["id"])
+            if ok:
+                self.completed += 1
+            else:
+                self.failed += 1
+
+    def _abandon(self, call: Dict[str, Any]):
+        """排队中的调用被取消时归还排队名额"""
+        with self._lock:
+            if not call["started"] and not call["abandoned"]:
+                call["abandoned"] = True
+                self.waiting -= 1
+
+    def _timed(self, call: Dict[str, Any], fn: Callable, *args):
+        if not self._start(call):
+            raise asyncio.CancelledError()
+        ok = False
+        try:
+            result = fn(*args)
+            ok = True
+            return result
+        finally:
+            self._finish(call, ok)
+
+    def _semaphore_for_loop(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or self._loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+            self._loop = loop
+        return self._semaphore
+
+    async def run(self, fn: Callable, *args) -> Any:
+        """在本阶段执行 fn(*args)，排队已满时抛出 StageFull"""
+        call = self._enqueue()
+        try:
+            if self.executor is not None:
+                return await asyncio.get_running_loop().run_in_executor(self.executor, self._timed, call, fn, *args)
+            async with self._semaphore_for_loop():
+                if not self._start(call):
+                    raise asyncio.CancelledError()
+                ok = False
+                try:
+                    result = await fn(*args)
+                    ok = True
+                    return result
+                finally:
+                    self._finish(call, ok)
+        finally:
+            self._abandon(call)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            now = time.monotonic()
+            busy = self.busy_seconds + sum(now - start for start in self._running.values())
+            started = self.completed + self.failed + len(self._running)
+            return {
+                "concurrency": self.concurrency,
+                "max_queue": self.max_queue,
+                "running": len(self._running),
+                "waiting": self.waiting,
+                "peak_waiting": self.peak_waiting,
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "utilization": round(busy / max(now - self.started_at, 1e-9) / self.concurrency, 4),
+                "busy_seconds": round(busy, 3),
+                "avg_wait_seconds": round(self.wait_seconds / started, 4) if started else 0.0,
+                "avg_busy_seconds": round(self.busy_seconds / (self.completed + self.failed), 4)
+                if self.completed + self.failed else 0.0,
+            }
+
+
+class RequestPipeline:
+    """
+    请求处理流水线：下载 -> 解码/缩放 -> 推理
+
+    三个阶段各自有并发上限和有界队列，同一请求依次经过各阶段，不同请求的各阶段互相重叠：
+    模型推理当前请求时，后续请求的下载在事件循环中进行、解码在预处理线程池中进行，推理线程不再等待网络和解码。
+    """
+
+    def __init__(self, decode_executor: Executor, decode_workers: int,
+                 fetch_concurrency: int = PIPELINE_FETCH_CONCURRENCY, fetch_queue: int = PIPELINE_FETCH_QUEUE,
+                 decode_queue: int = PIPELINE_DECODE_QUEUE,
+                 inference_concurrency: int = PIPELINE_INFERENCE_CONCURRENCY,
+                 inference_queue: int = PIPELINE_INFERENCE_QUEUE,
+                 fetch_timeout: float = PIPELINE_FETCH_TIMEOUT):
+        inference_concurrency = max(1, inference_concurrency)
+        self.inference_executor = ThreadPoolExecutor(max_workers=inference_concurrency,
+                                                     thread_name_prefix="inference")
+        self.fetch = PipelineStage("fetch", fetch_concurrency, fetch_queue)
+        self.decode = PipelineStage("decode", decode_workers, decode_queue, executor=decode_executor)
+        self.inference = PipelineStage("inference", inference_concurrency, inference_queue,
+                                       executor=self.inference_executor)
+        self.fetch_timeout = fetch_timeout
+        self._client: Optional[httpx.AsyncClient] = None
+        self._client_loop = None
+
+    def _http_client(self) -> httpx.AsyncClient:
+        """复用连接的异步HTTP客户端（每个事件循环一个）"""
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._client_loop is not loop:
+            self._client = httpx.AsyncClient(timeout=self.fetch_timeout, follow_redirects=True)
+            self._client_loop = loop
+        return self._client
+
+    async def _download(self, url: str, usage: Dict[str, int]) -> SpooledTemporaryFile:
+        async with self._http_client().stream("GET", url) as response:
+            response.raise_for_status()
+            if not response.headers.get("content-type", "").startswith("image/"):
+                raise HTTPException(status_code=400, detail="URL 必须指向图片文件")
+            return await upload_limits.spool_async_response(response, usage)
+
+    async def download(self, url: str, usage: Dict[str, int]) -> SpooledTemporaryFile:
+        """下载阶段：以流方式下载图片到有上限的临时文件"""
+        return await self.fetch.run(self._download, url, usage)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {stage.name: stage.snapshot() for stage in (self.fetch, self.decode, self.inference)}
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+        self.inference_executor.shutdown(wait=False)
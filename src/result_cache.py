@@ -0,0 +1,323 @@
+import hashlib
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional, Dict, Any
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+# 结果缓存后端: none / disk / redis
+RESULT_CACHE_BACKEND = os.getenv("RESULT_CACHE_BACKEND", "none").lower()
+RESULT_CACHE_PATH = Path(os.getenv("RESULT_CACHE_PATH", "./data/result_cache.sqlite3"))
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+RESULT_CACHE_URL = os.getenv("RESULT_CACHE_URL", "redis://localhost:6379/0")
+# 缓存条目过期时间（秒），0表示不过期（disk后端按容量淘汰）
+RESULT_CACHE_TTL_SECONDS = int(os.getenv("RESULT_CACHE_TTL_SECONDS", 7 * 24 * 3600))
+
+KEY_PREFIX = "minicpm:result:"
+
+
+def make_key(model_name: str, generation_version: str, prompt: str, image_digest: str) -> str:
+    """缓存key：模型名、生成参数版本、提示词和图片内容哈希"""
+    raw = json.dumps([model_name, generation_version, prompt, image_digest], ensure_ascii=False)
+    return KEY_PREFIX + hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """
+    分析结果缓存后端接口
+
+    get 在推理前同步调用，失败时视为未命中；put 由 AsyncCacheWriter 在后台线程中调用，不阻塞请求。
+    """
+
+    name = "none"
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        return None
+
+    def put(self, key: str, value: Dict[str, Any]):
+        pass
+
+    def describe(self) -> Dict[str, Any]:
+        return {}
+
+    def close(self):
+        pass
+
+
+class DiskCache(ResultCache):
+    """基于SQLite的本地缓存，总大小超过 max_bytes 时按最近访问时间淘汰，容器重启后保留"""
+
+    name = "disk"
+
+    def __init__(self, db_path: Path = RESULT_CACHE_PATH, max_bytes: int = RESULT_CACHE_MAX_BYTES,
+                 ttl_seconds: int = RESULT_CACHE_TTL_SECONDS):
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS results (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_results_accessed ON results (accessed_at)")
+        self._conn.commit()
+        self.total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        self.evicted = 0
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute("SELECT value, created_at FROM results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if self.ttl_seconds and time.time() - row[1] > self.ttl_seconds:
+                self._delete_locked(key)
+                return None
+            self._conn.execute("UPDATE results SET accessed_at = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+        return json.loads(row[0])
+
+    def put(self, key: str, value: Dict[str, Any]):
+        data = json.dumps(value, ensure_ascii=False)
+        size = len(data.encode("utf-8")) + len(key)
+        now = time.time()
+        with self._lock:
+            old = self._conn.execute("SELECT size FROM results WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO results (key, value, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, data, size, now, now)
+            )
+            self.total_bytes += size - (old[0] if old else 0)
+            if self.total_bytes > self.max_bytes:
+                self._evict_locked()
+            self._conn.commit()
+
+    def _delete_locked(self, key: str):
+        row = self._conn.execute("SELECT size FROM results WHERE key = ?", (key,)).fetchone()
+        if row:
+            self._conn.execute("DELETE FROM results WHERE key = ?", (key,))
+            self._conn.commit()
+            self.total_bytes -= row[0]
+
+    def _evict_locked(self):
+        """淘汰最久未访问的条目，直到总大小降到上限的90%"""
+        target = self.max_bytes * 0.9
+        rows = self._conn.execute("SELECT key, size FROM results ORDER BY accessed_at").fetchall()
+        for key, size in rows:
+            if self.total_bytes <= target:
+                break
+            self._conn.execute("DELETE FROM results WHERE key = ?", (key,))
+            self.total_bytes -= size
+            self.evicted += 1
+
+    def describe(self) -> Dict[str, Any]:
+        with self._lock:
+            count = self._conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        return {"path": str(self.db_path), "entries": count, "bytes": self.total_bytes,
+                "max_bytes": self.max_bytes, "evicted": self.evicted}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class RespConnection:
+    """最小的Redis协议(RESP)客户端，只实现缓存需要的命令，避免引入额外依赖"""
+
+    def __init__(self, host: str, port: int, db: int = 0, password: Optional[str] = None, timeout: float = 2.0):
+        self.host = host
+        self.port = port
+        self.db = db
+        self.password = password
+        self.timeout = timeout
+        self._sock = None
+        self._reader = None
+
+    def _connect(self):
+        self._sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self._reader = self._sock.makefile("rb")
+        if self.password:
+            self._call("AUTH", self.password)
+        if self.db:
+            self._call("SELECT", str(self.db))
+
+    def close(self):
+        if self._sock is not None:
+            try:
+                self._reader.close()
+                self._sock.close()
+            except OSError:
+                pass
+        self._sock = None
+        self._reader = None
+
+    def _call(self, *args):
+        parts = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode("utf-8")
+            parts.append(f"${len(data)}\r\n".encode() + data + b"\r\n")
+        self._sock.sendall(b"".join(parts))
+        return self._read_reply()
+
+    def _read_reply(self):
+        line = self._reader.readline()
+        if not line:
+            raise ConnectionError("connection closed")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b"+":
+            return payload.decode()
+        if kind == b"-":
+            raise RuntimeError(payload.decode())
+        if kind == b":":
+            return int(payload)
+        if kind == b"$":
+            length = int(payload)
+            if length < 0:
+                return None
+            data = self._reader.read(length + 2)
+            return data[:-2]
+        if kind == b"*":
+            return [self._read_reply() for _ in range(int(payload))]
+        raise RuntimeError(f"unexpected reply: {line!r}")
+
+    def call(self, *args):
+        """执行命令，连接断开时重连一次"""
+        for attempt in range(2):
+            try:
+                if self._sock is None:
+                    self._connect()
+                return self._call(*args)
+            except (OSError, ConnectionError):
+                self.close()
+                if attempt:
+                    raise
+
+
+class RedisCache(ResultCache):
+    """网络KV缓存（Redis或兼容协议的服务），多个副本共享，结果按 ttl_seconds 过期"""
+
+    name = "redis"
+
+    def __init__(self, url: str = RESULT_CACHE_URL, ttl_seconds: int = RESULT_CACHE_TTL_SECONDS):
+        parsed = urlparse(url)
+        db = parsed.path.strip("/")
+        self.url = f"{parsed.scheme}://{parsed.hostname}:{parsed.port or 6379}/{db or 0}"
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._conn = RespConnection(parsed.hostname or "localhost", parsed.port or 6379,
+                                    int(db) if db else 0, parsed.password)
+        self.errors = 0
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        try:
+            with self._lock:
+                data = self._conn.call("GET", key)
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"Result cache GET failed: {str(e)}")
+            return None
+        return json.loads(data) if data is not None else None
+
+    def put(self, key: str, value: Dict[str, Any]):
+        data = json.dumps(value, ensure_ascii=False).encode("utf-8")
+        args = ["SET", key, data]
+        if self.ttl_seconds:
+            args += ["EX", str(self.ttl_seconds)]
+        try:
+            with self._lock:
+                self._conn.call(*args)
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"Result cache SET failed: {str(e)}")
+
+    def describe(self) -> Dict[str, Any]:
+        return {"url": self.url, "ttl_seconds": self.ttl_seconds, "errors": self.errors}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class AsyncCacheWriter:
+    """包装缓存后端：读同步进行，写入交给单个后台线程，并统计命中率"""
+
+    def __init__(self, backend: ResultCache):
+        self.backend = backend
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="result-cache")
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.backend.name != "none"
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        try:
+            value = self.backend.get(key)
+        except Exception as e:
+            logger.warning(f"Result cache lookup failed: {str(e)}")
+            value = None
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def put(self, key: str, value: Dict[str, Any]):
+        with self._lock:
+            self.writes += 1
+        self._executor.submit(self._put, key, value)
+
+    def _put(self, key: str, value: Dict[str, Any]):
+        try:
+            self.backend.put(key, value)
+        except Exception as e:
+            logger.warning(f"Result cache write failed: {str(e)}")
+
+    def flush(self):
+        """等待已提交的写入完成"""
+        self._executor.submit(lambda: None).result()
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            counters = {"hits": self.hits, "misses": self.misses, "writes": self.writes}
+        return {"backend": self.backend.name, **counters, **self.backend.describe()}
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        self.backend.close()
+
+
+def create_cache(backend: str = RESULT_CACHE_BACKEND) -> AsyncCacheWriter:
+    """根据 RESULT_CACHE_BACKEND 创建缓存；后端初始化失败时退回不缓存"""
+    try:
+        if backend == "disk":
+            return AsyncCacheWriter(DiskCache())
+        if backend == "redis":
+            return AsyncCacheWriter(RedisCache())
+        if backend not in ("none", ""):
+            logger.warning(f"Unknown RESULT_CACHE_BACKEND: {backend} - caching disabled")
+    except Exception as e:
+        logger.warning(f"Failed to initialize {backend} result cache: {str(e)} - caching disabled")
+    return AsyncCacheWriter(ResultCache())
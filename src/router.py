@@ -0,0 +1,330 @@
+"""
+多副本请求路由
+
+在多个 MiniCPM-V 服务副本前运行的轻量路由进程：定期轮询各副本的 /status 和 /models，
+把每个请求转发到已加载所需模型、负载最低的健康副本。
+
+启动：
+    ROUTER_REPLICAS=http://10.10.6.197:8207,http://10.10.6.197:8208 \
+        python -m uvicorn router:app --host 0.0.0.0 --port 8300
+
+- 请求通过 X-Model 请求头或 model 查询参数指定模型，未指定时可转发到任意就绪副本
+- 会话 (/sessions/{id}) 和异步任务 (/jobs/{id}) 保存在创建它们的副本上，后续请求固定转发到该副本
+- ROUTER_AFFINITY=true 时按图片内容（或URL）哈希优先选择同一副本，提高副本本地缓存命中率；
+  该副本比最空闲副本多出 ROUTER_AFFINITY_SLACK 个以上请求时仍按负载选择
+- 副本可通过 POST/DELETE /router/replicas 在运行中增减（滚动部署时由 bin/deploy.py 调用）；
+  副本 /status 报告未就绪（加载中或排空中）时不再向其转发新请求
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Optional, Dict, Any, List
+
+import httpx
+from fastapi import FastAPI, Request, HTTPException
+from fastapi.responses import JSONResponse, Response
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("router")
+
+ROUTER_REPLICAS = [u.strip().rstrip("/") for u in os.getenv("ROUTER_REPLICAS", "http://localhost:8207").split(",")
+                   if u.strip()]
+ROUTER_POLL_INTERVAL = float(os.getenv("ROUTER_POLL_INTERVAL", 2))
+ROUTER_TIMEOUT = float(os.getenv("ROUTER_TIMEOUT", 300))
+ROUTER_AFFINITY = os.getenv("ROUTER_AFFINITY", "false").lower() in ("1", "true", "yes")
+ROUTER_AFFINITY_SLACK = int(os.getenv("ROUTER_AFFINITY_SLACK", 2))
+# 会话/任务到副本映射的最大条目数
+ROUTER_STICKY_ENTRIES = int(os.getenv("ROUTER_STICKY_ENTRIES", 100000))
+
+MODEL_HEADER = "x-model"
+ROUTED_HEADER = "X-Routed-To"
+# 会话和任务只存在于创建它们的副本上
+STICKY_PREFIXES = {"sessions": "session_id", "jobs": "job_id"}
+# 不转发的逐跳请求头/响应头
+HOP_HEADERS = {"host", "content-length", "connection", "keep-alive", "transfer-encoding", "content-encoding",
+               "proxy-connection", "upgrade", "te", "trailer"}
+
+
+class Replica:
+    """一个服务副本的最近状态"""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.healthy = False
+        self.ready = False
+        self.model_name: Optional[str] = None
+        self.available_models: List[str] = []
+        self.in_flight = 0
+        self.estimated_wait = 0.0
+        # 路由进程自己转发出去、尚未返回的请求数（比轮询结果更及时）
+        self.outstanding = 0
+        self.routed = 0
+        self.failures = 0
+        self.last_poll = None
+        self.last_error = None
+
+    def load(self) -> int:
+        return max(self.outstanding, self.in_flight)
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "ready": self.ready,
+            "model_name": self.model_name,
+            "available_models": self.available_models,
+            "in_flight": self.in_flight,
+            "outstanding": self.outstanding,
+            "estimated_wait_seconds": self.estimated_wait,
+            "routed": self.routed,
+            "failures": self.failures,
+            "last_poll": self.last_poll,
+            "last_error": self.last_error,
+        }
+
+
+class ReplicaPool:
+    def __init__(self, urls: List[str]):
+        self.replicas = {url: Replica(url) for url in urls}
+        self._sticky: "OrderedDict[tuple, str]" = OrderedDict()
+
+    async def poll(self, client: httpx.AsyncClient, replica: Replica):
+        try:
+            response = await client.get(f"{replica.url}/status", timeout=5)
+            response.raise_for_status()
+            status = response.json()
+            # 模型发生变化或还不知道可用模型列表时才拉取 /models
+            if status.get("model_name") != replica.model_name or not replica.available_models:
+                models = (await client.get(f"{replica.url}/models", timeout=10)).json()
+                replica.available_models = [item["name"] for item in models.get("items", [])]
+            replica.healthy = True
+            replica.ready = bool(status.get("ready"))
+            replica.model_name = status.get("model_name")
+            replica.in_flight = status.get("in_flight", 0)
+            replica.estimated_wait = status.get("estimated_wait_seconds", 0.0)
+            replica.last_error = None
+        except Exception as e:
+            if replica.healthy:
+                logger.warning(f"Replica {replica.url} unhealthy: {str(e)}")
+            replica.healthy = False
+            replica.ready = False
+            replica.last_error = str(e)
+        replica.last_poll = time.time()
+
+    async def poll_all(self, client: httpx.AsyncClient):
+        await asyncio.gather(*(self.poll(client, r) for r in list(self.replicas.values())))
+
+    def add(self, url: str) -> Replica:
+        url = url.strip().rstrip("/")
+        if url not in self.replicas:
+            self.replicas[url] = Replica(url)
+            logger.info(f"Replica {url} added")
+        return self.replicas[url]
+
+    def remove(self, url: str) -> Optional[Replica]:
+        replica = self.replicas.pop(url.strip().rstrip("/"), None)
+        if replica is not None:
+            logger.info(f"Replica {replica.url} removed")
+        return replica
+
+    def candidates(self, model: Optional[str], affinity_key: Optional[str] = None) -> List[Replica]:
+        """按转发优先顺序返回可用副本：负载最低优先，启用亲和性时优先选择哈希对应的副本"""
+        eligible = [r for r in self.replicas.values()
+                    if r.healthy and r.ready and (model is None or r.model_name == model)]
+        ordered = sorted(eligible, key=lambda r: (r.load(), r.estimated_wait, r.routed))
+        if not (ROUTER_AFFINITY and affinity_key and ordered):
+            return ordered
+
+        # 最高随机权重(rendezvous)哈希：副本增减时只有少量key改变归属
+        min_load = ordered[0].load()
+        preferred = max(ordered, key=lambda r: hashlib.sha256(f"{affinity_key}|{r.url}".encode()).digest())
+        if preferred.load() <= min_load + ROUTER_AFFINITY_SLACK:
+            ordered.remove(preferred)
+            ordered.insert(0, preferred)
+        return ordered
+
+    def remember(self, kind: str, object_id: str, url: str):
+        self._sticky[(kind, object_id)] = url
+        self._sticky.move_to_end((kind, object_id))
+        while len(self._sticky) > ROUTER_STICKY_ENTRIES:
+            self._sticky.popitem(last=False)
+
+    def lookup(self, kind: str, object_id: str) -> Optional[Replica]:
+        url = self._sticky.get((kind, object_id))
+        return self.replicas.get(url) if url else None
+
+    def forget(self, kind: str, object_id: str):
+        self._sticky.pop((kind, object_id), None)
+
+
+app = FastAPI(title="MiniCPM-V Router", version="0.1.0")
+pool = ReplicaPool(ROUTER_REPLICAS)
+client: Optional[httpx.AsyncClient] = None
+poll_task: Optional[asyncio.Task] = None
+
+
+async def poll_loop():
+    while True:
+        await pool.poll_all(client)
+        await asyncio.sleep(ROUTER_POLL_INTERVAL)
+
+
+@app.on_event("startup")
+async def start_polling():
+    global client, poll_task
+    client = httpx.AsyncClient(timeout=ROUTER_TIMEOUT)
+    await pool.poll_all(client)
+    poll_task = asyncio.create_task(poll_loop())
+
+
+@app.on_event("shutdown")
+async def stop_polling():
+    if poll_task is not None:
+        poll_task.cancel()
+    if client is not None:
+        await client.aclose()
+
+
+@app.get("/health")
+def health():
+    return {"status": "healthy", "service": "MiniCPM-V Router", "version": app.version}
+
+
+@app.get("/router/status")
+def router_status():
+    """各副本的健康状态、当前模型和负载"""
+    return {
+        "replicas": [r.describe() for r in pool.replicas.values()],
+        "affinity": ROUTER_AFFINITY,
+        "poll_interval_seconds": ROUTER_POLL_INTERVAL,
+    }
+
+
+@app.post("/router/replicas")
+async def add_replica(request: Request):
+    """添加副本（请求体 {"url": "http://host:port"}），立即轮询一次并返回其状态"""
+    url = (await request.json()).get("url")
+    if not url:
+        raise HTTPException(status_code=400, detail="缺少副本地址 url")
+    replica = pool.add(url)
+    await pool.poll(client, replica)
+    return replica.describe()
+
+
+@app.delete("/router/replicas")
+def remove_replica(url: str):
+    """移除副本，之后不再向其转发请求（已转发的请求不受影响）"""
+    replica = pool.remove(url)
+    if replica is None:
+        raise HTTPException(status_code=404, detail=f"没有该副本: {url}")
+    return replica.describe()
+
+
+async def affinity_key(request: Request, path: str, body: bytes) -> Optional[str]:
+    """用于缓存亲和性的key：图片内容哈希，/analyze-url 使用URL"""
+    if not ROUTER_AFFINITY or request.method != "POST" or not body:
+        return None
+    content_type = request.headers.get("content-type", "")
+    try:
+        if path == "analyze-url":
+            return json.loads(body).get("image_url")
+        if content_type.startswith("multipart/form-data"):
+            form = await request.form()
+            upload = form.get("file")
+            if upload is None or isinstance(upload, str):
+                return None
+            return hashlib.sha256(await upload.read()).hexdigest()
+        if path == "analyze-raw":
+            return hashlib.sha256(body).hexdigest()
+    except Exception:
+        return None
+    return None
+
+
+def forward_headers(request: Request) -> Dict[str, str]:
+    headers = {k: v for k, v in request.headers.items() if k.lower() not in HOP_HEADERS}
+    client_host = request.client.host if request.client else ""
+    forwarded = request.headers.get("x-forwarded-for")
+    headers["x-forwarded-for"] = f"{forwarded}, {client_host}" if forwarded else client_host
+    return headers
+
+
+async def forward(replica: Replica, request: Request, path: str, body: bytes) -> httpx.Response:
+    replica.outstanding += 1
+    replica.routed += 1
+    try:
+        return await client.request(
+            request.method,
+            f"{replica.url}/{path}",
+            params=request.query_params,
+            content=body,
+            headers=forward_headers(request),
+        )
+    finally:
+        replica.outstanding -= 1
+
+
+def build_response(upstream: httpx.Response, replica: Replica) -> Response:
+    headers = {k: v for k, v in upstream.headers.items() if k.lower() not in HOP_HEADERS}
+    headers[ROUTED_HEADER] = replica.url
+    return Response(content=upstream.content, status_code=upstream.status_code, headers=headers)
+
+
+@app.api_route("/{path:path}", methods=["GET", "POST", "PUT", "DELETE"])
+async def route(path: str, request: Request):
+    body = await request.body()
+    parts = path.strip("/").split("/")
+
+    # 会话和任务固定转发到创建它们的副本
+    if parts[0] in STICKY_PREFIXES and len(parts) > 1:
+        replica = pool.lookup(parts[0], parts[1])
+        if replica is None:
+            return JSONResponse(status_code=404, content={"detail": f"路由进程中没有该对象的记录: {path}"})
+        try:
+            upstream = await forward(replica, request, path, body)
+        except httpx.TransportError as e:
+            return JSONResponse(status_code=502, content={"detail": f"副本 {replica.url} 不可用: {str(e)}"})
+        if request.method == "DELETE" and upstream.status_code == 200:
+            pool.forget(parts[0], parts[1])
+        return build_response(upstream, replica)
+
+    model = request.headers.get(MODEL_HEADER) or request.query_params.get("model")
+    candidates = pool.candidates(model, await affinity_key(request, path, body))
+    if not candidates:
+        detail = f"没有已加载模型 {model} 的就绪副本" if model else "没有就绪的副本"
+        return JSONResponse(status_code=503, content={"detail": detail},
+                            headers={"Retry-After": str(max(1, int(ROUTER_POLL_INTERVAL)))})
+
+    # 连接失败时标记副本不健康并尝试下一个副本（请求尚未被处理，可安全重试）
+    for replica in candidates:
+        try:
+            upstream = await forward(replica, request, path, body)
+        except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+            logger.warning(f"Replica {replica.url} connection failed: {str(e)}")
+            replica.healthy = False
+            replica.failures += 1
+            continue
+        except httpx.TransportError as e:
+            replica.failures += 1
+            return JSONResponse(status_code=502, content={"detail": f"副本 {replica.url} 请求失败: {str(e)}"})
+
+        if request.method == "POST" and parts[0] in STICKY_PREFIXES and upstream.status_code < 300:
+            try:
+                object_id = upstream.json().get(STICKY_PREFIXES[parts[0]])
+                if object_id:
+                    pool.remember(parts[0], object_id, replica.url)
+            except ValueError:
+                pass
+        return build_response(upstream, replica)
+
+    return JSONResponse(status_code=503, content={"detail": "所有候选副本均无法连接"},
+                        headers={"Retry-After": str(max(1, int(ROUTER_POLL_INTERVAL)))})
+
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run("router:app", host=os.getenv("ROUTER_HOST", "0.0.0.0"), port=int(os.getenv("ROUTER_PORT", 8300)))
@@ -0,0 +1,108 @@
+"""
+MiniCPM-V 二进制RPC客户端（msgpack over WebSocket）
+
+用法：
+    from rpc_client import RpcClient
+
+    with RpcClient("ws://10.10.6.197:8207/rpc") as client:
+        print(client.analyze(open("a.jpg", "rb").read(), "请描述图片"))
+        for text in client.analyze_stream(image_bytes, "请描述图片"):
+            print(text, end="")
+        results = client.analyze_batch([img1, img2, img3], "这是什么？", quality="fast")
+        session_id = client.session_start(image_bytes, "图里有几个人？")["session_id"]
+        print(client.session_message(session_id, "左边的人穿什么颜色的衣服？")["result"])
+
+所有调用复用同一条连接；客户端按顺序发起调用，不支持多线程共享一个实例。
+"""
+import itertools
+from typing import Dict, Any, Iterator, List, Optional
+
+import msgpack
+from websockets.sync.client import connect
+
+
+class RpcError(Exception):
+    """服务端返回的错误帧"""
+
+    def __init__(self, status: int, detail: str):
+        super().__init__(f"{status}: {detail}")
+        self.status = status
+        self.detail = detail
+
+
+class RpcClient:
+    def __init__(self, url: str, timeout: float = 120.0, max_size: Optional[int] = 64 * 1024 * 1024):
+        self.url = url
+        self.timeout = timeout
+        self._ws = connect(url, open_timeout=timeout, max_size=max_size)
+        self._ids = itertools.count(1)
+
+    def close(self):
+        self._ws.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _send(self, frame: Dict[str, Any]):
+        # 客户端的等待时间同时作为服务端准入控制的请求期限
+        frame.setdefault("timeout", self.timeout)
+        self._ws.send(msgpack.packb(frame, use_bin_type=True))
+
+    def _recv(self, req_id: int) -> Dict[str, Any]:
+        while True:
+            frame = msgpack.unpackb(self._ws.recv(timeout=self.timeout), raw=False)
+            if frame.get("id") not in (req_id, None):
+                continue
+            if frame.get("type") == "error":
+                raise RpcError(frame.get("status", 500), frame.get("detail", ""))
+            return frame
+
+    def analyze(self, image: bytes, prompt: Optional[str] = None, quality: Optional[str] = None) -> Dict[str, Any]:
+        """单次分析，返回结果帧（result、processing_time_seconds 等）"""
+        req_id = next(self._ids)
+        self._send({"id": req_id, "method": "analyze", "image": image, "prompt": prompt, "quality": quality})
+        return self._recv(req_id)
+
+    def analyze_stream(self, image: bytes, prompt: Optional[str] = None,
+                       quality: Optional[str] = None) -> Iterator[str]:
+        """流式分析，逐段返回生成的文本"""
+        req_id = next(self._ids)
+        self._send({"id": req_id, "method": "analyze_stream", "image": image, "prompt": prompt, "quality": quality})
+        while True:
+            frame = self._recv(req_id)
+            if frame["type"] == "token":
+                yield frame["text"]
+            elif frame["type"] == "end":
+                return
+
+    def analyze_batch(self, images: List[bytes], prompt: Optional[str] = None,
+                      quality: Optional[str] = None) -> Dict[str, Any]:
+        """流式上传一批图片并一次取回全部结果（results 与 images 顺序一致）"""
+        req_id = next(self._ids)
+        self._send({"id": req_id, "method": "batch_start", "prompt": prompt, "quality": quality})
+        for image in images:
+            self._send({"id": req_id, "method": "batch_item", "image": image})
+        self._send({"id": req_id, "method": "batch_end"})
+        return self._recv(req_id)
+
+    def session_start(self, image: Optional[bytes] = None, prompt: Optional[str] = None,
+                      quality: Optional[str] = None) -> Dict[str, Any]:
+        """创建多轮对话会话；提供图片或提示词时同时执行第一轮"""
+        req_id = next(self._ids)
+        self._send({"id": req_id, "method": "session_start", "image": image, "prompt": prompt, "quality": quality})
+        return self._recv(req_id)
+
+    def session_message(self, session_id: str, prompt: str, image: Optional[bytes] = None) -> Dict[str, Any]:
+        """在会话中追加一轮对话（只发送新的问题，可选附加新图片）"""
+        req_id = next(self._ids)
+        self._send({"id": req_id, "method": "session_message", "session_id": session_id,
+                    "prompt": prompt, "image": image})
+        return self._recv(req_id)
+
+    def session_close(self, session_id: str) -> bool:
+        req_id = next(self._ids)
+        self._send({"id": req_id, "method": "session_close", "session_id": session_id})
+        return self._recv(req_id)["closed"]
@@ -0,0 +1,335 @@
+import asyncio
+import io
+import logging
+import os
+import time
+from typing import Dict, Any, Callable
+
+import msgpack
+from fastapi import WebSocket, WebSocketDisconnect, HTTPException
+
+import upload_limits
+from admission import AdmissionController
+from model_service import ModelService, QUALITY_TIERS, DEFAULT_QUALITY
+from request_pipeline import RequestPipeline
+from session_store import SessionStore
+
+logger = logging.getLogger(__name__)
+
+# 客户端流式批量请求中每次送入模型的图片数
+RPC_BATCH_SIZE = int(os.getenv("RPC_BATCH_SIZE", 4))
+
+DEFAULT_PROMPT = "请详细描述这张图片的内容"
+
+
+def pack(frame: Dict[str, Any]) -> bytes:
+    return msgpack.packb(frame, use_bin_type=True)
+
+
+def unpack(data: bytes) -> Dict[str, Any]:
+    return msgpack.unpackb(data, raw=False)
+
+
+class RpcSession:
+    """
+    msgpack二进制RPC会话 - 在一条WebSocket长连接上复用多个请求
+
+    每个请求帧带有客户端指定的 id，响应帧回传相同 id：
+    - analyze: 单次请求/响应
+    - analyze_stream: 服务端流式返回生成的文本片段（token帧），最后发送end帧
+    - batch_start / batch_item / batch_end: 客户端流式上传一批图片，图片到达时即开始解码，
+      batch_end 后批量推理并一次返回全部结果
+    - session_start / session_message / session_close: 多轮对话，与HTTP /sessions 共用会话存储
+
+    解码和推理与HTTP接口一样经过请求流水线的 decode / inference 阶段，并共用准入控制，
+    请求帧的 timeout 字段（秒）对应 X-Request-Timeout 请求头。
+    """
+
+    def __init__(self, websocket: WebSocket, model_service: ModelService,
+                 decode_image: Callable, pipeline: RequestPipeline, session_store: SessionStore,
+                 admission: AdmissionController):
+        self.websocket = websocket
+        self.model_service = model_service
+        self.decode_image = decode_image
+        self.pipeline = pipeline
+        self.session_store = session_store
+        self.admission = admission
+        self._send_lock = asyncio.Lock()
+        self._tasks = set()
+        self._batches: Dict[Any, Dict[str, Any]] = {}
+
+    async def run(self):
+        await self.websocket.accept()
+        try:
+            while True:
+                data = await self.websocket.receive_bytes()
+                try:
+                    frame = unpack(data)
+                except Exception:
+                    await self.send({"id": None, "type": "error", "status": 400, "detail": "无效的msgpack帧"})
+                    continue
+                if not isinstance(frame, dict):
+                    await self.send({"id": None, "type": "error", "status": 400, "detail": "请求帧必须是msgpack map"})
+                    continue
+                # 单个帧的错误只返回给该请求，不能关闭连接上其他进行中的请求
+                try:
+                    self._dispatch(frame)
+                except HTTPException as e:
+                    await self.send({"id": frame.get("id"), "type": "error", "status": e.status_code, "detail": e.detail})
+                except Exception as e:
+                    logger.error(f"RPC frame {frame.get('id')} rejected: {str(e)}")
+                    await self.send({"id": frame.get("id"), "type": "error", "status": 400, "detail": str(e)})
+        except WebSocketDisconnect:
+            pass
+        finally:
+            for task in self._tasks:
+                task.cancel()
+            for batch in self._batches.values():
+                for future in batch["items"]:
+                    future.cancel()
+
+    async def send(self, frame: Dict[str, Any]):
+        async with self._send_lock:
+            await self.websocket.send_bytes(pack(frame))
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _dispatch(self, frame: Dict[str, Any]):
+        req_id = frame.get("id")
+        method = frame.get("method")
+        if method == "analyze":
+            self._spawn(self._guard(req_id, self._analyze(req_id, frame)))
+        elif method == "analyze_stream":
+            self._spawn(self._guard(req_id, self._analyze_stream(req_id, frame)))
+        elif method == "batch_start":
+            self._batches[req_id] = {
+                "prompt": frame.get("prompt") or DEFAULT_PROMPT,
+                "quality": self._quality(frame),
+                "timeout": frame.get("timeout"),
+                "items": [],
+                "prompts": [],
+            }
+        elif method == "batch_item":
+            batch = self._batches.get(req_id)
+            if batch is None:
+                self._spawn(self.send({"id": req_id, "type": "error", "status": 400, "detail": "批量请求未开始"}))
+                return
+            # 图片到达时立即开始解码，与后续图片的上传重叠
+            batch["items"].append(asyncio.ensure_future(self._decode(frame.get("image"), batch["quality"])))
+            batch["prompts"].append(frame.get("prompt") or batch["prompt"])
+        elif method == "batch_end":
+            batch = self._batches.pop(req_id, None)
+            if batch is None:
+                self._spawn(self.send({"id": req_id, "type": "error", "status": 400, "detail": "批量请求未开始"}))
+                return
+            self._spawn(self._guard(req_id, self._run_batch(req_id, batch)))
+        elif method in ("session_start", "session_message"):
+            self._spawn(self._guard(req_id, self._session_turn(req_id, frame)))
+        elif method == "session_close":
+            closed = self.session_store.delete(frame.get("session_id"))
+            self._spawn(self.send({"id": req_id, "type": "result", "closed": closed}))
+        else:
+            self._spawn(self.send({"id": req_id, "type": "error", "status": 400, "detail": f"未知方法: {method}"}))
+
+    async def _guard(self, req_id, coro):
+        """把请求处理中的异常转换为error帧"""
+        try:
+            await coro
+        except HTTPException as e:
+            error = {"id": req_id, "type": "error", "status": e.status_code, "detail": e.detail}
+            if e.headers and "Retry-After" in e.headers:
+                error["retry_after"] = int(e.headers["Retry-After"])
+            await self.send(error)
+        except Exception as e:
+            logger.error(f"RPC request {req_id} failed: {str(e)}")
+            await self.send({"id": req_id, "type": "error", "status": 500, "detail": str(e)})
+
+    @staticmethod
+    def _quality(frame: Dict[str, Any]) -> str:
+        quality = frame.get("quality") or DEFAULT_QUALITY
+        if quality not in QUALITY_TIERS:
+            raise HTTPException(status_code=400, detail=f"未知的质量档位: {quality}")
+        return quality
+
+    def _check_ready(self):
+        self.model_service.lifecycle.check_available()
+
+    def _admit(self, frame: Dict[str, Any], key: str):
+        """按请求帧的 timeout 字段接纳请求，不能在期限内完成时抛出429/503"""
+        timeout = frame.get("timeout")
+        if not isinstance(timeout, (int, float)) or timeout <= 0:
+            timeout = None
+        return self.admission.admit(self.model_service.current_model_name, key, timeout)
+
+    async def _decode(self, image_bytes: bytes, quality: str):
+        """检查大小和像素上限后在流水线的解码阶段解码"""
+        if not isinstance(image_bytes, bytes):
+            raise HTTPException(status_code=400, detail="image 字段必须是二进制图片数据")
+        if len(image_bytes) > upload_limits.MAX_UPLOAD_BYTES:
+            upload_limits.tracker.reject("bytes")
+            raise HTTPException(status_code=413, detail=f"图片大小超过上限 {upload_limits.MAX_UPLOAD_BYTES} 字节")
+        with upload_limits.tracker.track() as usage:
+            upload_limits.tracker.add_memory(usage, len(image_bytes))
+            fp = io.BytesIO(image_bytes)
+            upload_limits.probe_image(fp, usage)
+            return await self.pipeline.decode.run(self.decode_image, fp, quality)
+
+    async def _analyze(self, req_id, frame: Dict[str, Any]):
+        self._check_ready()
+        quality = self._quality(frame)
+        prompt = frame.get("prompt") or DEFAULT_PROMPT
+        with self._admit(frame, quality):
+            image = await self._decode(frame.get("image"), quality)
+            result, processing_time, details = await self.pipeline.inference.run(
+                self.model_service.analyze_image, image, prompt, quality
+            )
+        if not details.get("cached"):
+            self.admission.observe(self.model_service.current_model_name, quality, processing_time)
+        if result is None:
+            raise HTTPException(status_code=500, detail="图片分析失败")
+
+        await self.send({
+            "id": req_id,
+            "type": "result",
+            "result": result,
+            "model_used": self.model_service.current_model_name,
+            "quality": quality,
+            "vision_tokens": details.get("vision_tokens"),
+            "cached": details.get("cached", False),
+            "processing_time_seconds": round(processing_time, 3),
+        })
+
+    async def _analyze_stream(self, req_id, frame: Dict[str, Any]):
+        self._check_ready()
+        quality = self._quality(frame)
+        prompt = frame.get("prompt") or DEFAULT_PROMPT
+        with self._admit(frame, quality):
+            await self._stream(req_id, frame, quality, prompt)
+
+    async def _stream(self, req_id, frame: Dict[str, Any], quality: str, prompt: str):
+        image = await self._decode(frame.get("image"), quality)
+
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+
+        def produce():
+            # 在推理线程中消费生成器，把片段投递回事件循环
+            try:
+                for chunk in self.model_service.analyze_image_stream(image, prompt, quality):
+                    loop.call_soon_threadsafe(queue.put_nowait, ("token", chunk))
+                loop.call_soon_threadsafe(queue.put_nowait, ("end", None))
+            except Exception as e:
+                loop.call_soon_threadsafe(queue.put_nowait, ("error", e))
+
+        def rejected(task):
+            # 推理阶段排队已满时 produce 不会执行
+            if not task.cancelled() and task.exception() is not None:
+                queue.put_nowait(("error", task.exception()))
+
+        start_time = time.time()
+        producer = asyncio.ensure_future(self.pipeline.inference.run(produce))
+        producer.add_done_callback(rejected)
+        while True:
+            kind, value = await queue.get()
+            if kind == "token":
+                await self.send({"id": req_id, "type": "token", "text": value})
+            elif kind == "end":
+                self.admission.observe(self.model_service.current_model_name, quality, time.time() - start_time)
+                await self.send({
+                    "id": req_id,
+                    "type": "end",
+                    "model_used": self.model_service.current_model_name,
+                    "quality": quality,
+                    "processing_time_seconds": round(time.time() - start_time, 3),
+                })
+                break
+            else:
+                raise value
+        await producer
+
+    async def _run_batch(self, req_id, batch: Dict[str, Any]):
+        self._check_ready()
+        start_time = time.time()
+        # 批量的服务时间与单图差别很大，单独估计
+        admission_key = f"batch:{batch['quality']}"
+        with self._admit(batch, admission_key):
+            results = await self._infer_batch(batch)
+        processing_time = time.time() - start_time
+        self.admission.observe(self.model_service.current_model_name, admission_key, processing_time)
+
+        await self.send({
+            "id": req_id,
+            "type": "result",
+            "results": results,
+            "model_used": self.model_service.current_model_name,
+            "quality": batch["quality"],
+            "processing_time_seconds": round(processing_time, 3),
+        })
+
+    async def _infer_batch(self, batch: Dict[str, Any]):
+        """等待全部图片解码完成后按 RPC_BATCH_SIZE 分批推理，返回与图片顺序一致的结果列表"""
+        results = []
+        pending_images = []
+        pending_indexes = []
+
+        decoded = await asyncio.gather(*batch["items"], return_exceptions=True)
+        for index, image in enumerate(decoded):
+            if isinstance(image, Exception):
+                detail = image.detail if isinstance(image, HTTPException) else str(image)
+                results.append({"status": "error", "detail": detail})
+                continue
+            results.append(None)
+            pending_images.append(image)
+            pending_indexes.append(index)
+
+        for offset in range(0, len(pending_images), RPC_BATCH_SIZE):
+            images = pending_images[offset:offset + RPC_BATCH_SIZE]
+            indexes = pending_indexes[offset:offset + RPC_BATCH_SIZE]
+            outputs, _ = await self.pipeline.inference.run(
+                self.model_service.analyze_images, images, [batch["prompts"][i] for i in indexes], batch["quality"]
+            )
+            for index, output in zip(indexes, outputs):
+                results[index] = {"status": "success", "result": output} if output is not None \
+                    else {"status": "error", "detail": "图片分析失败"}
+        return results
+
+    async def _session_turn(self, req_id, frame: Dict[str, Any]):
+        if frame["method"] == "session_start":
+            session = self.session_store.create(self._quality(frame))
+            if frame.get("image") is None and frame.get("prompt") is None:
+                await self.send({"id": req_id, "type": "result", "session_id": session.id,
+                                 "quality": session.quality})
+                return
+        else:
+            session = self.session_store.get(frame.get("session_id"))
+            if session is None:
+                raise HTTPException(status_code=404, detail=f"会话不存在或已过期: {frame.get('session_id')}")
+
+        self._check_ready()
+        prompt = frame.get("prompt") or DEFAULT_PROMPT
+        admission_key = f"session:{session.quality}"
+        with self._admit(frame, admission_key):
+            image = None
+            if frame.get("image") is not None:
+                image = await self._decode(frame["image"], session.quality)
+            turn = await self.pipeline.inference.run(
+                self.session_store.chat, session, self.model_service, prompt, image
+            )
+        self.admission.observe(self.model_service.current_model_name, admission_key, turn["processing_time"])
+        if turn["result"] is None:
+            raise HTTPException(status_code=500, detail="图片分析失败")
+
+        await self.send({
+            "id": req_id,
+            "type": "result",
+            "session_id": session.id,
+            "turn": turn["turn"],
+            "result": turn["result"],
+            "model_used": self.model_service.current_model_name,
+            "quality": session.quality,
+            "vision_cached": turn["vision_cached"],
+            "processing_time_seconds": round(turn["processing_time"], 3),
+        })
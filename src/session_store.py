@@ -0,0 +1,247 @@
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Optional, Dict, Any, List
+
+from fastapi import HTTPException
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# 会话空闲过期时间、全部会话的内存预算和最大会话数
+SESSION_TTL_SECONDS = int(os.getenv("SESSION_TTL_SECONDS", 30 * 60))
+SESSION_MEMORY_BYTES = int(os.getenv("SESSION_MEMORY_BYTES", 2 * 1024 * 1024 * 1024))
+SESSION_MAX_COUNT = int(os.getenv("SESSION_MAX_COUNT", 256))
+
+
+def _nbytes(obj: Any) -> int:
+    """估算会话缓存对象（张量及其嵌套列表）占用的字节数"""
+    if isinstance(obj, (list, tuple)):
+        return sum(_nbytes(item) for item in obj)
+    if hasattr(obj, "element_size") and hasattr(obj, "numel"):
+        return obj.element_size() * obj.numel()
+    return 0
+
+
+class SessionTooLarge(HTTPException):
+    """单轮对话的内容本身超出全部会话的内存预算"""
+
+    def __init__(self, turn_bytes: int, max_bytes: int):
+        super().__init__(
+            status_code=413,
+            detail=f"本轮对话内容约 {turn_bytes} 字节，超出会话内存预算 {max_bytes} 字节",
+        )
+
+
+def _message_bytes(message: Dict[str, Any]) -> int:
+    total = 0
+    for item in message["content"]:
+        if isinstance(item, Image.Image):
+            total += item.width * item.height * len(item.getbands())
+        else:
+            total += len(str(item).encode("utf-8"))
+    return total
+
+
+class ChatSession:
+    """单个多轮对话会话：历史消息、缓存的视觉编码结果和使用时间"""
+
+    def __init__(self, session_id: str, quality: str):
+        self.id = session_id
+        self.quality = quality
+        self.messages: List[Dict[str, Any]] = []
+        # 视觉编码器的输出，后续轮次图片不变时直接复用，只需处理新增的文本
+        self.vision_hidden_states = None
+        self.vision_model_name = None
+        self.created_at = time.time()
+        self.last_used = self.created_at
+        self.memory_bytes = 0
+        # 同一会话的轮次必须串行执行
+        self.lock = threading.Lock()
+
+    def compute_memory(self) -> int:
+        return _nbytes(self.vision_hidden_states) + sum(_message_bytes(m) for m in self.messages)
+
+    def describe(self) -> Dict[str, Any]:
+        """会话的可序列化描述（图片以尺寸代替）"""
+        history = []
+        for message in self.messages:
+            content = []
+            for item in message["content"]:
+                if isinstance(item, Image.Image):
+                    content.append({"image": [item.width, item.height]})
+                else:
+                    content.append(item)
+            history.append({"role": message["role"], "content": content})
+        return {
+            "session_id": self.id,
+            "quality": self.quality,
+            "turns": sum(1 for m in self.messages if m["role"] == "assistant"),
+            "messages": history,
+            "vision_cached": self.vision_hidden_states is not None,
+            "memory_bytes": self.memory_bytes,
+            "created_at": self.created_at,
+            "last_used": self.last_used,
+            "expires_at": self.last_used + SESSION_TTL_SECONDS,
+        }
+
+
+class SessionStore:
+    """
+    内存中的多轮对话会话存储
+
+    会话空闲超过 ttl_seconds 后过期；全部会话的内存占用超过 max_bytes 或数量超过 max_sessions 时
+    按最近最少使用顺序淘汰。单个会话超出预算时先丢弃其视觉缓存，仍然超出时从最早的轮次开始丢弃历史消息
+    （至少保留最近一轮）；单轮内容本身超出预算的请求在推理前以413拒绝。
+    """
+
+    def __init__(self, ttl_seconds: int = SESSION_TTL_SECONDS, max_bytes: int = SESSION_MEMORY_BYTES,
+                 max_sessions: int = SESSION_MAX_COUNT):
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.max_sessions = max_sessions
+        self._sessions: "OrderedDict[str, ChatSession]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.memory_bytes = 0
+        self.evicted = {"expired": 0, "memory": 0, "count": 0}
+        # 因单个会话超出预算而丢弃的历史轮次数
+        self.trimmed_turns = 0
+        self.vision_cache_hits = 0
+        self.vision_cache_misses = 0
+
+    def create(self, quality: str) -> ChatSession:
+        session = ChatSession(uuid.uuid4().hex, quality)
+        with self._lock:
+            self._purge_expired_locked()
+            self._sessions[session.id] = session
+            while len(self._sessions) > self.max_sessions:
+                self._evict_locked(next(iter(self._sessions)), "count")
+        return session
+
+    def get(self, session_id: str) -> Optional[ChatSession]:
+        """获取会话并刷新其使用时间；不存在或已过期返回None"""
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return None
+            if time.time() - session.last_used > self.ttl_seconds:
+                self._evict_locked(session_id, "expired")
+                return None
+            session.last_used = time.time()
+            self._sessions.move_to_end(session_id)
+            return session
+
+    def delete(self, session_id: str) -> bool:
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+            if session is None:
+                return False
+            self.memory_bytes -= session.memory_bytes
+            return True
+
+    def purge_expired(self) -> int:
+        with self._lock:
+            return self._purge_expired_locked()
+
+    def _purge_expired_locked(self) -> int:
+        cutoff = time.time() - self.ttl_seconds
+        expired = [sid for sid, s in self._sessions.items() if s.last_used < cutoff]
+        for session_id in expired:
+            self._evict_locked(session_id, "expired")
+        return len(expired)
+
+    def _evict_locked(self, session_id: str, reason: str):
+        session = self._sessions.pop(session_id)
+        self.memory_bytes -= session.memory_bytes
+        self.evicted[reason] += 1
+        logger.info(f"Session {session_id} evicted ({reason})")
+
+    def update_memory(self, session: ChatSession):
+        """重新计算会话内存占用，超出预算时先缩减该会话本身，再淘汰其他最久未使用的会话"""
+        with self._lock:
+            new_bytes = session.compute_memory()
+            if new_bytes > self.max_bytes and session.vision_hidden_states is not None:
+                session.vision_hidden_states = None
+                new_bytes = session.compute_memory()
+            # 会话本身超出预算时淘汰其他会话也无济于事，从最早的一问一答开始丢弃，保留最近一轮
+            trimmed = 0
+            while new_bytes > self.max_bytes and len(session.messages) > 2:
+                new_bytes -= sum(_message_bytes(m) for m in session.messages[:2])
+                session.messages = session.messages[2:]
+                trimmed += 1
+            if trimmed:
+                self.trimmed_turns += trimmed
+                logger.info(f"Session {session.id} trimmed {trimmed} oldest turns (memory)")
+            if session.id in self._sessions:
+                self.memory_bytes += new_bytes - session.memory_bytes
+            session.memory_bytes = new_bytes
+
+            for session_id in list(self._sessions):
+                if self.memory_bytes <= self.max_bytes:
+                    break
+                if session_id != session.id:
+                    self._evict_locked(session_id, "memory")
+
+    def chat(self, session: ChatSession, model_service, prompt: str,
+             image: Optional[Image.Image] = None) -> Dict[str, Any]:
+        """
+        在会话中执行一轮对话
+
+        历史消息保存在服务端，客户端只需发送新的问题；本轮没有新图片且模型未切换时复用缓存的视觉编码结果。
+
+        Returns:
+            Dict[str, Any]: result 为 None 表示推理失败；processing_time、vision_cached 和 turn 为本轮详情
+        """
+        with session.lock:
+            content = [image, prompt] if image is not None else [prompt]
+            message = {"role": "user", "content": content}
+            turn_bytes = _message_bytes(message)
+            if turn_bytes > self.max_bytes:
+                raise SessionTooLarge(turn_bytes, self.max_bytes)
+            msgs = session.messages + [message]
+
+            cached_states = session.vision_hidden_states
+            if image is not None or session.vision_model_name != model_service.current_model_name:
+                cached_states = None
+            with self._lock:
+                if cached_states is not None:
+                    self.vision_cache_hits += 1
+                else:
+                    self.vision_cache_misses += 1
+
+            result, processing_time, details, vision_states = model_service.chat_turn(
+                msgs, session.quality, cached_states
+            )
+            if result is None:
+                return {"result": None, "processing_time": processing_time, "details": details}
+
+            session.messages = msgs + [{"role": "assistant", "content": [result]}]
+            session.vision_hidden_states = vision_states
+            session.vision_model_name = model_service.current_model_name
+            session.last_used = time.time()
+            self.update_memory(session)
+
+            return {
+                "result": result,
+                "processing_time": processing_time,
+                "details": details,
+                "vision_cached": details.get("vision_cached", False),
+                "turn": sum(1 for m in session.messages if m["role"] == "assistant"),
+            }
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "active": len(self._sessions),
+                "memory_bytes": self.memory_bytes,
+                "max_bytes": self.max_bytes,
+                "max_sessions": self.max_sessions,
+                "ttl_seconds": self.ttl_seconds,
+                "evicted": dict(self.evicted),
+                "trimmed_turns": self.trimmed_turns,
+                "vision_cache_hits": self.vision_cache_hits,
+                "vision_cache_misses": self.vision_cache_misses,
+            }
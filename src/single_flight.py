@@ -0,0 +1,104 @@
+import asyncio
+import hashlib
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple, BinaryIO
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+
+
+def file_digest(fp: BinaryIO) -> str:
+    """计算文件对象内容的SHA-256（读取后回到开头）"""
+    digest = hashlib.sha256()
+    fp.seek(0)
+    while True:
+        chunk = fp.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        digest.update(chunk)
+    fp.seek(0)
+    return digest.hexdigest()
+
+
+class SingleFlight:
+    """
+    相同请求合并执行（single-flight）
+
+    某个 key 的请求正在执行时，后续相同 key 的请求不再重复执行，而是等待并共享第一个请求的结果（或异常）。
+    执行结束后 key 立即释放，不缓存结果。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, Future] = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    def _join(self, key: Hashable) -> Tuple[Future, bool]:
+        """返回 (future, 是否为执行者)"""
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return future, False
+            future = Future()
+            self._calls[key] = future
+            self.leaders += 1
+            return future, True
+
+    def _finish(self, key: Hashable, future: Future, result: Any = None, error: Optional[BaseException] = None):
+        with self._lock:
+            self._calls.pop(key, None)
+        if future.done():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def do(self, key: Hashable, fn: Callable, *args) -> Tuple[Any, bool]:
+        """
+        同步执行 fn(*args)，相同 key 的并发调用只执行一次
+
+        Returns:
+            Tuple[Any, bool]: (结果, 是否为合并到其他请求的结果)
+        """
+        future, leader = self._join(key)
+        if not leader:
+            return future.result(), True
+        try:
+            result = fn(*args)
+        except BaseException as e:
+            self._finish(key, future, error=e)
+            raise
+        self._finish(key, future, result)
+        return result, False
+
+    async def do_await(self, key: Hashable, coro_fn: Callable, *args) -> Tuple[Any, bool]:
+        """
+        执行协程函数 coro_fn(*args) 的异步版本，用于跨多个流水线阶段的执行单元
+
+        执行者的请求被取消（如客户端断开）时，协程继续执行完成，其他等待者仍能拿到结果。
+        """
+        future, leader = self._join(key)
+        if not leader:
+            # shield: 等待者被取消时不能连带取消共享的future
+            return await asyncio.shield(asyncio.wrap_future(future)), True
+
+        task = asyncio.ensure_future(coro_fn(*args))
+
+        def done(task):
+            if task.cancelled():
+                self._finish(key, future, error=asyncio.CancelledError())
+            else:
+                self._finish(key, future, task.result() if task.exception() is None else None, task.exception())
+
+        task.add_done_callback(done)
+        return await asyncio.shield(task), False
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return {"in_flight": len(self._calls), "leaders": self.leaders, "coalesced": self.coalesced}
@@ -0,0 +1,94 @@
+"""
+测试用桩模型 - 不加载任何权重，按固定延迟返回确定的文本
+
+设置 STUB_MODEL=true 后 ModelService 使用桩模型代替真实模型，可在没有GPU/模型文件的机器上
+启动多个服务进程，用于测试路由、准入控制等与推理结果无关的功能。
+"""
+import os
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, List
+
+import torch
+from PIL import Image
+
+STUB_MODEL = os.getenv("STUB_MODEL", "false").lower() in ("1", "true", "yes")
+# 每次推理的模拟耗时（秒）
+STUB_MODEL_DELAY = float(os.getenv("STUB_MODEL_DELAY", 0.2))
+STUB_MODEL_NAMES = ["MiniCPM-V-4-int4", "MiniCPM-V-4_5-int4"]
+# 桩模型报告的权重大小（字节），用于测试主机内存停放的容量限制
+STUB_MODEL_BYTES = int(os.getenv("STUB_MODEL_BYTES", 1024 * 1024 * 1024))
+# 桩模型分类打分时认识的颜色名
+STUB_COLORS = {"red": (255, 0, 0), "green": (0, 128, 0), "blue": (0, 0, 255), "white": (255, 255, 255),
+               "black": (0, 0, 0)}
+# 桩模型每张图片的视觉编码结果维度（float32）
+STUB_VISION_DIM = 64
+
+
+@contextmanager
+def enabled():
+    """
+    临时启用桩模型，退出时恢复原来的设置（也可作为装饰器用于进程内测试）
+
+    STUB_MODEL 只在导入时读取环境变量，同一进程中的测试通过这里切换，不影响之后执行的其他测试。
+    """
+    global STUB_MODEL
+    previous = STUB_MODEL
+    STUB_MODEL = True
+    try:
+        yield
+    finally:
+        STUB_MODEL = previous
+
+
+class StubTokenizer:
+    pass
+
+
+class StubModel:
+    """实现 model.chat 接口的桩模型（单条、批量和流式）"""
+
+    def __init__(self, model_name: str, delay: float = STUB_MODEL_DELAY):
+        self.model_name = model_name
+        self.delay = delay
+        self.processor = None
+        self.device = "cpu"
+        self.nbytes = STUB_MODEL_BYTES
+        # 视觉编码次数，用于检查多轮对话是否复用了缓存的视觉编码结果
+        self.vision_encodes = 0
+
+    def _reply(self, msgs: List[Dict[str, Any]]) -> str:
+        content = msgs[-1]["content"]
+        prompt = next((c for c in reversed(content) if isinstance(c, str)), "")
+        sizes = [f"{item.width}x{item.height}" for m in msgs for item in m["content"]
+                 if isinstance(item, Image.Image)]
+        return f"[stub:{self.model_name}] {prompt} ({', '.join(sizes)})"
+
+    def get_vllm_embedding(self, data: Dict[str, Any]):
+        """代替视觉编码：返回 (输入嵌入, 视觉编码结果)，与 MiniCPM-V 的接口一致"""
+        self.vision_encodes += 1
+        images = data["pixel_values"]
+        return None, [torch.full((STUB_VISION_DIM,), float(image.width * image.height)) for image in images]
+
+    def chat(self, msgs=None, tokenizer=None, stream: bool = False, vision_hidden_states=None, **kwargs):
+        time.sleep(self.delay)
+        if msgs and isinstance(msgs[0], list):
+            return [self._reply(m) for m in msgs]
+        images = [item for m in msgs for item in m["content"] if isinstance(item, Image.Image)]
+        if images and vision_hidden_states is None:
+            self.get_vllm_embedding({"input_ids": [torch.zeros(1, dtype=torch.long)], "image_bound": [[]],
+                                     "pixel_values": images})
+        reply = self._reply(msgs)
+        if stream:
+            return iter(reply.split(" "))
+        return reply
+
+    def eval(self):
+        return self
+
+    def to(self, device: str):
+        self.device = device
+        return self
+
+    def cpu(self):
+        return self.to("cpu")
@@ -0,0 +1,214 @@
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from tempfile import SpooledTemporaryFile
+from typing import Dict, Any, BinaryIO
+
+from fastapi import HTTPException, UploadFile, Request
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# 单个图片的最大字节数和最大像素数
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", 20 * 1024 * 1024))
+MAX_IMAGE_PIXELS = int(os.getenv("MAX_IMAGE_PIXELS", 50_000_000))
+# 上传内容在内存中最多保留的字节数，超出部分落盘
+UPLOAD_SPOOL_MEMORY_BYTES = int(os.getenv("UPLOAD_SPOOL_MEMORY_BYTES", 1024 * 1024))
+# 请求体上限（为multipart边界和表单字段预留空间），超出时在解析前直接拒绝
+MAX_REQUEST_BYTES = MAX_UPLOAD_BYTES + 64 * 1024
+# 未压缩像素请求体（RGB/NumPy）的最大字节数
+MAX_RAW_PIXEL_BYTES = int(os.getenv("MAX_RAW_PIXEL_BYTES", 64 * 1024 * 1024))
+
+CHUNK_SIZE = 64 * 1024
+
+# PIL自身的解压炸弹保护与像素上限保持一致
+Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+
+
+class UploadTracker:
+    """统计进行中的上传数量和内存占用（缓冲字节 + 解码后像素字节）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.memory_bytes = 0
+        self.peak_memory_bytes = 0
+        self.total = 0
+        self.rejected = {"bytes": 0, "pixels": 0, "format": 0}
+
+    @contextmanager
+    def track(self):
+        """跟踪一次上传的生命周期，yield的字典用于累计本次上传的内存占用"""
+        usage = {"memory_bytes": 0}
+        with self._lock:
+            self.in_flight += 1
+            self.total += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            yield usage
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+                self.memory_bytes -= usage["memory_bytes"]
+
+    def add_memory(self, usage: Dict[str, int], nbytes: int):
+        usage["memory_bytes"] += nbytes
+        with self._lock:
+            self.memory_bytes += nbytes
+            self.peak_memory_bytes = max(self.peak_memory_bytes, self.memory_bytes)
+
+    def reject(self, reason: str):
+        with self._lock:
+            self.rejected[reason] += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "in_flight": self.in_flight,
+                "peak_in_flight": self.peak_in_flight,
+                "memory_bytes": self.memory_bytes,
+                "peak_memory_bytes": self.peak_memory_bytes,
+                "total": self.total,
+                "rejected": dict(self.rejected),
+                "limits": {
+                    "max_upload_bytes": MAX_UPLOAD_BYTES,
+                    "max_image_pixels": MAX_IMAGE_PIXELS,
+                    "max_raw_pixel_bytes": MAX_RAW_PIXEL_BYTES,
+                    "spool_memory_bytes": UPLOAD_SPOOL_MEMORY_BYTES,
+                },
+            }
+
+
+tracker = UploadTracker()
+
+
+def _too_large(size: int, limit: int = MAX_UPLOAD_BYTES):
+    tracker.reject("bytes")
+    raise HTTPException(status_code=413, detail=f"上传大小超过上限 {limit} 字节 (已读取 {size} 字节)")
+
+
+async def spool_upload(file: UploadFile, usage: Dict[str, int],
+                       max_bytes: int = MAX_UPLOAD_BYTES) -> SpooledTemporaryFile:
+    """分块读取上传文件到有上限的临时文件，超过 max_bytes 立即返回413"""
+    size = 0
+    spool = SpooledTemporaryFile(max_size=UPLOAD_SPOOL_MEMORY_BYTES)
+    while True:
+        chunk = await file.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        size += len(chunk)
+        if size > max_bytes:
+            spool.close()
+            _too_large(size, max_bytes)
+        spool.write(chunk)
+    spool.seek(0)
+    tracker.add_memory(usage, min(size, UPLOAD_SPOOL_MEMORY_BYTES))
+    return spool
+
+
+async def spool_request(request: Request, usage: Dict[str, int],
+                        max_bytes: int = MAX_UPLOAD_BYTES) -> SpooledTemporaryFile:
+    """以流方式读取原始请求体到有上限的临时文件，超过 max_bytes 立即返回413"""
+    size = 0
+    spool = SpooledTemporaryFile(max_size=UPLOAD_SPOOL_MEMORY_BYTES)
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > max_bytes:
+            spool.close()
+            _too_large(size, max_bytes)
+        spool.write(chunk)
+    spool.seek(0)
+    tracker.add_memory(usage, min(size, UPLOAD_SPOOL_MEMORY_BYTES))
+    return spool
+
+
+async def read_request_exact(request: Request, nbytes: int, usage: Dict[str, int]) -> bytearray:
+    """把请求体直接读入预先分配的缓冲区，长度必须恰好为 nbytes（用于未压缩像素）"""
+    if nbytes > MAX_RAW_PIXEL_BYTES:
+        _too_large(nbytes, MAX_RAW_PIXEL_BYTES)
+    buffer = bytearray(nbytes)
+    view = memoryview(buffer)
+    size = 0
+    async for chunk in request.stream():
+        if size + len(chunk) > nbytes:
+            tracker.reject("bytes")
+            raise HTTPException(status_code=400, detail=f"请求体长度超过声明的像素数据长度 {nbytes}")
+        view[size:size + len(chunk)] = chunk
+        size += len(chunk)
+    if size != nbytes:
+        raise HTTPException(status_code=400, detail=f"像素数据长度 {size} 与声明的形状不符 (应为 {nbytes})")
+    tracker.add_memory(usage, nbytes)
+    return buffer
+
+
+def check_pixels(width: int, height: int):
+    """检查声明的图片尺寸是否超过像素上限"""
+    if width <= 0 or height <= 0:
+        raise HTTPException(status_code=400, detail=f"无效的图片尺寸 {width}x{height}")
+    if width * height > MAX_IMAGE_PIXELS:
+        tracker.reject("pixels")
+        raise HTTPException(status_code=413, detail=f"图片像素数 {width}x{height} 超过上限 {MAX_IMAGE_PIXELS}")
+
+
+async def spool_async_response(response, usage: Dict[str, int],
+                               max_bytes: int = MAX_UPLOAD_BYTES) -> SpooledTemporaryFile:
+    """以流方式下载 httpx 响应体到有上限的临时文件；Content-Length 超限时不下载直接拒绝（由调用方关闭响应）"""
+    content_length = response.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > max_bytes:
+        _too_large(int(content_length), max_bytes)
+    size = 0
+    spool = SpooledTemporaryFile(max_size=UPLOAD_SPOOL_MEMORY_BYTES)
+    async for chunk in response.aiter_bytes(CHUNK_SIZE):
+        size += len(chunk)
+        if size > max_bytes:
+            spool.close()
+            _too_large(size, max_bytes)
+        spool.write(chunk)
+    spool.seek(0)
+    tracker.add_memory(usage, min(size, UPLOAD_SPOOL_MEMORY_BYTES))
+    return spool
+
+
+def spool_response(response, usage: Dict[str, int],
+                   max_bytes: int = MAX_UPLOAD_BYTES) -> SpooledTemporaryFile:
+    """以流方式下载 requests 响应体（stream=True）到有上限的临时文件，用于后台线程；Content-Length 超限时不下载直接拒绝"""
+    content_length = response.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > max_bytes:
+        _too_large(int(content_length), max_bytes)
+    size = 0
+    spool = SpooledTemporaryFile(max_size=UPLOAD_SPOOL_MEMORY_BYTES)
+    for chunk in response.iter_content(CHUNK_SIZE):
+        size += len(chunk)
+        if size > max_bytes:
+            spool.close()
+            _too_large(size, max_bytes)
+        spool.write(chunk)
+    spool.seek(0)
+    tracker.add_memory(usage, min(size, UPLOAD_SPOOL_MEMORY_BYTES))
+    return spool
+
+
+def probe_image(fp: BinaryIO, usage: Dict[str, int]) -> Dict[str, Any]:
+    """
+    只读取图片头部获取格式和尺寸，在完整解码前拒绝超出像素上限或无法识别的图片
+
+    通过检查后把解码后的RGB像素字节数计入内存占用。
+    """
+    try:
+        with Image.open(fp) as probe:
+            width, height = probe.size
+            image_format = probe.format
+    except Image.DecompressionBombError:
+        tracker.reject("pixels")
+        raise HTTPException(status_code=413, detail=f"图片像素数超过上限 {MAX_IMAGE_PIXELS}")
+    except Exception:
+        tracker.reject("format")
+        raise HTTPException(status_code=400, detail="无法识别的图片格式")
+    finally:
+        fp.seek(0)
+
+    check_pixels(width, height)
+    tracker.add_memory(usage, width * height * 3)
+    return {"width": width, "height": height, "format": image_format}
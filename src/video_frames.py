@@ -0,0 +1,162 @@
+"""
+视频抽帧 - 流式解码、自适应采样和近似重复帧去除
+
+逐帧解码视频（不把整个文件或全部帧读入内存），按时间间隔采样；保留的帧超过上限时
+丢弃一半并把采样间隔加倍，因此内存占用与视频长度无关，始终不超过 max_frames 帧。
+与上一保留帧几乎相同的帧（16x16灰度缩略图平均差异低于阈值）在送入模型之前丢弃。
+"""
+import logging
+import os
+from typing import BinaryIO, Dict, Any, List, Optional
+
+import numpy as np
+
+try:
+    import av
+except ImportError:
+    av = None
+
+logger = logging.getLogger(__name__)
+
+# 送入模型的最大帧数
+VIDEO_MAX_FRAMES = int(os.getenv("VIDEO_MAX_FRAMES", 32))
+# 初始采样频率上限（帧/秒）
+VIDEO_SAMPLE_FPS = float(os.getenv("VIDEO_SAMPLE_FPS", 2))
+# 近似重复帧阈值：16x16灰度缩略图的平均绝对差（0-255）
+VIDEO_DEDUP_THRESHOLD = float(os.getenv("VIDEO_DEDUP_THRESHOLD", 3.0))
+# 抽出的帧的最大边长
+VIDEO_FRAME_SIZE = int(os.getenv("VIDEO_FRAME_SIZE", 448))
+# 时长超过该值（秒）的视频只解码关键帧，避免长视频解码全部帧
+VIDEO_KEYFRAMES_ONLY_AFTER = float(os.getenv("VIDEO_KEYFRAMES_ONLY_AFTER", 600))
+# 上传视频的最大字节数
+MAX_VIDEO_BYTES = int(os.getenv("MAX_VIDEO_BYTES", 512 * 1024 * 1024))
+
+SIGNATURE_SIZE = 16
+
+
+class FrameSampler:
+    """流式自适应采样器：决定哪些时间点需要取帧，并维护不超过 max_frames 的保留帧"""
+
+    def __init__(self, max_frames: int = VIDEO_MAX_FRAMES, duration: Optional[float] = None,
+                 sample_fps: float = VIDEO_SAMPLE_FPS, dedup_threshold: float = VIDEO_DEDUP_THRESHOLD):
+        self.max_frames = max(1, max_frames)
+        self.dedup_threshold = dedup_threshold
+        # 已知时长时直接按时长均匀分配，否则从采样频率上限开始，超出上限后逐步加倍
+        self.interval = 1.0 / sample_fps if sample_fps > 0 else 0.0
+        if duration:
+            self.interval = max(self.interval, duration / self.max_frames)
+        self.next_time = 0.0
+        self.frames: List[Dict[str, Any]] = []
+        self._last_signature = None
+        self.sampled = 0
+        self.deduplicated = 0
+        self.decimations = 0
+
+    def wants(self, timestamp: float) -> bool:
+        """该时间点的帧是否需要采样"""
+        return timestamp >= self.next_time
+
+    def is_duplicate(self, signature: np.ndarray) -> bool:
+        return (self._last_signature is not None and
+                float(np.abs(signature - self._last_signature).mean()) < self.dedup_threshold)
+
+    def add(self, timestamp: float, signature: np.ndarray, make_image) -> bool:
+        """
+        提交一个采样点的帧
+
+        signature 为灰度缩略图；make_image 只在帧被保留时调用，避免为重复帧做缩放和格式转换。
+        """
+        self.next_time = timestamp + self.interval
+        self.sampled += 1
+        if self.is_duplicate(signature):
+            self.deduplicated += 1
+            return False
+
+        self._last_signature = signature
+        self.frames.append({"time": timestamp, "image": make_image()})
+        if len(self.frames) > self.max_frames:
+            # 丢弃一半保留帧并加倍采样间隔，保持帧在整个视频上均匀分布
+            self.frames = self.frames[::2]
+            self.interval *= 2
+            self.decimations += 1
+        return True
+
+
+def _scaled_size(width: int, height: int, max_size: int):
+    ratio = min(1.0, max_size / max(width, height))
+    # yuv格式缩放要求偶数尺寸
+    return max(2, int(width * ratio) // 2 * 2), max(2, int(height * ratio) // 2 * 2)
+
+
+def sample_video(source: BinaryIO, max_frames: int = VIDEO_MAX_FRAMES, frame_size: int = VIDEO_FRAME_SIZE,
+                 check_pixels=None, dedup_threshold: float = VIDEO_DEDUP_THRESHOLD) -> Dict[str, Any]:
+    """
+    流式解码视频并抽取代表帧
+
+    Args:
+        source: 视频文件对象（可为落盘的临时文件）
+        check_pixels: 可选的 (width, height) 检查函数，在解码前拒绝分辨率过大的视频
+        dedup_threshold: 近似重复帧阈值，小于0时不去重
+
+    Returns:
+        Dict[str, Any]: frames（PIL图片列表）、timestamps 以及解码/采样/去重统计
+    """
+    if av is None:
+        raise RuntimeError("视频分析需要安装 PyAV (pip install av)")
+
+    with av.open(source, mode="r") as container:
+        if not container.streams.video:
+            raise ValueError("文件中没有视频流")
+        stream = container.streams.video[0]
+        stream.thread_type = "AUTO"
+        width, height = stream.codec_context.width, stream.codec_context.height
+        if check_pixels is not None:
+            check_pixels(width, height)
+
+        duration = None
+        if stream.duration is not None and stream.time_base is not None:
+            duration = float(stream.duration * stream.time_base)
+        elif container.duration is not None:
+            duration = container.duration / av.time_base
+
+        keyframes_only = duration is not None and duration > VIDEO_KEYFRAMES_ONLY_AFTER
+        if keyframes_only:
+            stream.codec_context.skip_frame = "NONKEY"
+
+        sampler = FrameSampler(max_frames, duration, dedup_threshold=dedup_threshold)
+        target_width, target_height = _scaled_size(width, height, frame_size)
+        rate = float(stream.average_rate) if stream.average_rate else 25.0
+        decoded = 0
+
+        for frame in container.decode(stream):
+            timestamp = frame.time if frame.time is not None else decoded / rate
+            decoded += 1
+            if not sampler.wants(timestamp):
+                continue
+            signature = frame.reformat(width=SIGNATURE_SIZE, height=SIGNATURE_SIZE, format="gray") \
+                .to_ndarray().astype(np.float32)
+            sampler.add(
+                timestamp, signature,
+                lambda: frame.reformat(width=target_width, height=target_height, format="rgb24").to_image()
+            )
+
+    if not sampler.frames:
+        raise ValueError("未能从视频中解码出任何帧")
+
+    logger.info(
+        f"Sampled video {width}x{height} ({round(duration, 3) if duration is not None else '?'}s"
+        f"{', keyframes only' if keyframes_only else ''}): decoded {decoded}, sampled {sampler.sampled}, "
+        f"deduplicated {sampler.deduplicated}, kept {len(sampler.frames)} at {sampler.interval:.3f}s interval"
+    )
+    return {
+        "frames": [f["image"] for f in sampler.frames],
+        "timestamps": [round(f["time"], 3) for f in sampler.frames],
+        "duration_seconds": round(duration, 3) if duration is not None else None,
+        "source_size": [width, height],
+        "decoded_frames": decoded,
+        "sampled_frames": sampler.sampled,
+        "deduplicated_frames": sampler.deduplicated,
+        "frames_used": len(sampler.frames),
+        "sample_interval_seconds": round(sampler.interval, 3),
+        "keyframes_only": keyframes_only,
+    }
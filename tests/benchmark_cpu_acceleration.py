@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+CPU加速模式性能/精度对比 - 在同一组图片上比较 none / int8 / compile / int8+compile
+
+用法：
+CUDA_VISIBLE_DEVICES= python tests/benchmark_cpu_acceleration.py --images tests/ --runs 2
+
+精度以 none 模式的输出为基准，报告完全一致比例和平均文本相似度。
+"""
+import sys
+sys.path.append('src')
+
+import argparse
+import difflib
+import statistics
+import time
+from pathlib import Path
+
+from PIL import Image
+
+import cpu_acceleration
+from model_service import ModelService
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.webp', '.bmp'}
+
+
+def run_mode(service: ModelService, model: str, mode: str, images: list, prompt: str, runs: int):
+    """加载指定加速模式下的模型并返回 (各图片输出, 各次耗时, 加载耗时, 实际生效模式)"""
+    service.unload_model()
+    service.cpu_acceleration_modes = cpu_acceleration.parse_modes(mode)
+
+    load_start = time.time()
+    if not service.load_model(model):
+        return None
+    load_time = time.time() - load_start
+
+    outputs = []
+    latencies = []
+    for run in range(runs):
+        for image in images:
+            result, processing_time, _ = service.analyze_image(image, prompt)
+            latencies.append(processing_time)
+            if run == 0:
+                outputs.append(result or "")
+    return outputs, latencies, load_time, list(service.cpu_acceleration)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='CPU加速模式对比')
+    parser.add_argument('--images', required=True, help='测试图片目录')
+    parser.add_argument('--model', default='MiniCPM-V-4_5-int4', help='模型名称')
+    parser.add_argument('--models-dir', default='./models', help='模型目录')
+    parser.add_argument('--prompt', default='请详细描述这张图片的内容', help='分析提示词')
+    parser.add_argument('--modes', default='none,int8,compile,int8+compile', help='要对比的模式，逗号分隔')
+    parser.add_argument('--max-images', type=int, default=3, help='最多使用的图片数')
+    parser.add_argument('--runs', type=int, default=2, help='每种模式重复次数')
+    args = parser.parse_args()
+
+    paths = sorted(p for p in Path(args.images).rglob("*") if p.suffix.lower() in IMAGE_EXTENSIONS)[:args.max_images]
+    if not paths:
+        print(f"错误: 目录中没有图片: {args.images}")
+        return 1
+    images = [Image.open(p).convert('RGB') for p in paths]
+
+    service = ModelService(Path(args.models_dir))
+    if service.device != "cpu":
+        print("⚠️  当前使用GPU，CPU加速模式不会生效；请设置 CUDA_VISIBLE_DEVICES= 后运行")
+
+    baseline = None
+    rows = []
+    for mode in args.modes.split(","):
+        print(f"=== 模式: {mode} ===")
+        measured = run_mode(service, args.model, mode, images, args.prompt, args.runs)
+        if measured is None:
+            print("  ❌ 模型加载失败")
+            continue
+        outputs, latencies, load_time, applied = measured
+        if baseline is None:
+            baseline = outputs
+
+        similarity = [difflib.SequenceMatcher(None, a, b).ratio() for a, b in zip(baseline, outputs)]
+        exact = sum(1 for a, b in zip(baseline, outputs) if a == b) / len(outputs)
+        rows.append((mode, "+".join(applied) or "none", load_time, statistics.mean(latencies),
+                     statistics.mean(similarity), exact))
+        print(f"  生效模式: {'+'.join(applied) or 'none'}  加载: {load_time:.1f}s  "
+              f"平均推理: {statistics.mean(latencies):.3f}s")
+
+    service.unload_model()
+
+    print("=" * 70)
+    print(f"{'模式':<16}{'生效':<16}{'加载(s)':>10}{'推理(s)':>10}{'相似度':>10}{'一致率':>8}")
+    base_latency = rows[0][3] if rows else None
+    for mode, applied, load_time, latency, similarity, exact in rows:
+        print(f"{mode:<16}{applied:<16}{load_time:>10.1f}{latency:>10.3f}{similarity:>10.3f}{exact:>8.0%}")
+    if base_latency:
+        for mode, _, _, latency, _, _ in rows[1:]:
+            print(f"{mode}: 相对基准加速 {base_latency / latency:.2f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+HTTP/JSON 与二进制RPC 每请求开销对比
+
+开销 = 客户端测得的往返时间 - 服务端返回的模型处理时间，
+即multipart解析、校验、序列化和连接建立等与推理无关的部分。
+
+用法：
+python tests/benchmark_rpc.py --image tests/test_sample.jpg --runs 20 --quality fast
+"""
+import sys
+sys.path.append('src')
+
+import argparse
+import statistics
+import time
+
+import requests
+
+from rpc_client import RpcClient
+
+
+def summarize(name: str, latencies: list, overheads: list):
+    print(f"{name}:")
+    print(f"  往返时间 平均 {statistics.mean(latencies) * 1000:.1f}ms  中位数 {statistics.median(latencies) * 1000:.1f}ms")
+    print(f"  请求开销 平均 {statistics.mean(overheads) * 1000:.1f}ms  中位数 {statistics.median(overheads) * 1000:.1f}ms")
+
+
+def bench_http(server: str, image: bytes, prompt: str, quality: str, runs: int, session: requests.Session):
+    latencies, overheads = [], []
+    for _ in range(runs):
+        start = time.perf_counter()
+        response = session.post(
+            f"{server}/analyze",
+            files={"file": ("image.jpg", image, "image/jpeg")},
+            data={"prompt": prompt, "quality": quality},
+            timeout=120
+        )
+        elapsed = time.perf_counter() - start
+        response.raise_for_status()
+        latencies.append(elapsed)
+        overheads.append(elapsed - response.json()["processing_time_seconds"])
+    return latencies, overheads
+
+
+def bench_rpc(client: RpcClient, image: bytes, prompt: str, quality: str, runs: int):
+    latencies, overheads = [], []
+    for _ in range(runs):
+        start = time.perf_counter()
+        frame = client.analyze(image, prompt, quality)
+        elapsed = time.perf_counter() - start
+        latencies.append(elapsed)
+        overheads.append(elapsed - frame["processing_time_seconds"])
+    return latencies, overheads
+
+
+def main():
+    parser = argparse.ArgumentParser(description='HTTP与RPC开销对比')
+    parser.add_argument('--server', default='http://localhost:8207', help='服务器地址 (默认: http://localhost:8207)')
+    parser.add_argument('--image', required=True, help='测试图片路径')
+    parser.add_argument('--prompt', default='这是什么？', help='分析提示词')
+    parser.add_argument('--quality', default='fast', help='质量档位 (默认: fast)')
+    parser.add_argument('--runs', type=int, default=20, help='每种方式的请求次数 (默认: 20)')
+    args = parser.parse_args()
+
+    with open(args.image, 'rb') as f:
+        image = f.read()
+
+    rpc_url = args.server.replace("http://", "ws://").replace("https://", "wss://") + "/rpc"
+
+    # 预热两条路径，排除首次连接的开销
+    with requests.Session() as session, RpcClient(rpc_url) as client:
+        bench_http(args.server, image, args.prompt, args.quality, 1, session)
+        bench_rpc(client, image, args.prompt, args.quality, 1)
+
+        http_latencies, http_overheads = bench_http(args.server, image, args.prompt, args.quality, args.runs, session)
+        rpc_latencies, rpc_overheads = bench_rpc(client, image, args.prompt, args.quality, args.runs)
+
+    print("=" * 50)
+    summarize("HTTP/JSON (multipart)", http_latencies, http_overheads)
+    summarize("RPC (msgpack over WebSocket)", rpc_latencies, rpc_overheads)
+    saved = statistics.mean(http_overheads) - statistics.mean(rpc_overheads)
+    print(f"\n每请求节省开销: {saved * 1000:.1f}ms")
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+测试准入控制 (使用桩模型，不需要GPU和模型文件)
+
+检查服务时间的滑动平均更新、预计超过期限时返回429、排队已满时返回503以及各自的 Retry-After，
+并检查HTTP /analyze 和二进制RPC接口都经过准入控制。
+"""
+import sys
+sys.path.append('src')
+
+import io
+import os
+
+os.environ.setdefault("WARMUP_SIZES", "64x64")
+
+import msgpack
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+from PIL import Image
+
+import stub_model
+from admission import AdmissionController
+
+MODEL = "MiniCPM-V-4_5-int4"
+
+
+def test_estimates():
+    """测试首个样本直接作为估计值，之后按 alpha 做指数滑动平均；没有样本的档位用同模型其他档位的平均值"""
+    admission = AdmissionController(alpha=0.5)
+    with admission._lock:
+        assert admission._estimate_locked(MODEL, "fast") == 0.0
+
+    admission.observe(MODEL, "fast", 2.0)
+    assert admission.snapshot()["service_time_seconds"] == {MODEL: {"fast": 2.0}}
+    admission.observe(MODEL, "fast", 4.0)
+    admission.observe(MODEL, "fast", 4.0)
+    assert admission.snapshot()["service_time_seconds"][MODEL]["fast"] == 3.5
+
+    admission.observe(MODEL, "accurate", 6.5)
+    with admission._lock:
+        assert admission._estimate_locked(MODEL, "balanced") == 5.0
+        assert admission._estimate_locked("other", "fast") == 0.0
+
+    assert admission.parse_timeout({"x-request-timeout": "2.5"}) == 2.5
+    for value in (None, "abc", "-1", "0"):
+        assert admission.parse_timeout({"x-request-timeout": value}) == admission.default_timeout
+    print("✅ 服务时间估计测试通过")
+    return True
+
+
+def test_shedding():
+    """测试超过期限返回429、排队已满返回503、Retry-After 按排队时间计算，退出后释放排队时间"""
+    admission = AdmissionController(concurrency=1, max_queue=2, default_timeout=30, alpha=0.2)
+    admission.observe(MODEL, "fast", 1.0)
+
+    with admission.admit(MODEL, "fast"):
+        assert admission.snapshot()["estimated_wait_seconds"] == 1.0
+        # 排队1s + 自身1s 超过 1.5s 期限，等 0.5s 后重试
+        try:
+            with admission.admit(MODEL, "fast", 1.5):
+                assert False, "应当返回429"
+        except HTTPException as e:
+            assert e.status_code == 429 and e.headers["Retry-After"] == "1", (e.status_code, e.headers)
+        try:
+            admission.precheck(0.5)
+            assert False, "预检查应当返回429"
+        except HTTPException as e:
+            assert e.status_code == 429
+
+        with admission.admit(MODEL, "fast", 10):
+            # 排队数达到上限，Retry-After 为当前排队时间
+            try:
+                with admission.admit(MODEL, "fast", 100):
+                    assert False, "应当返回503"
+            except HTTPException as e:
+                assert e.status_code == 503 and e.headers["Retry-After"] == "2", (e.status_code, e.headers)
+            assert admission.snapshot()["in_flight"] == 2
+
+    snapshot = admission.snapshot()
+    assert snapshot["in_flight"] == 0 and snapshot["estimated_wait_seconds"] == 0
+    assert snapshot["admitted"] == 2 and snapshot["shed"] == {"deadline": 2, "queue_full": 1}, snapshot
+    print("✅ 429/503 拒绝测试通过")
+    return True
+
+
+def jpeg() -> bytes:
+    buffer = io.BytesIO()
+    Image.new('RGB', (320, 240), color='red').save(buffer, 'JPEG')
+    return buffer.getvalue()
+
+
+@stub_model.enabled()
+def test_stub_endpoints():
+    """测试HTTP和RPC请求按期限被拒绝，成功的请求更新服务时间估计"""
+    import main
+    assert main.model_service.load_model(MODEL)
+    admission = main.admission
+    # 不触发 startup/shutdown 事件，避免关闭进程内共享的预处理线程池
+    client = TestClient(main.app)
+    try:
+        # 先清除其他测试留下的样本，使首个样本直接成为估计值
+        admission._estimates.pop(MODEL, None)
+        admission.observe(MODEL, "fast", 5.0)
+        shed = admission.snapshot()["shed"]["deadline"]
+
+        response = client.post("/analyze", files={"file": ("a.jpg", jpeg(), "image/jpeg")},
+                               data={"quality": "fast"}, headers={"X-Request-Timeout": "2"})
+        assert response.status_code == 429 and response.headers["Retry-After"] == "3", response.text
+
+        with client.websocket_connect("/rpc") as websocket:
+            for frame in ({"id": 1, "method": "analyze", "image": jpeg(), "quality": "fast", "timeout": 2},
+                          {"id": 2, "method": "session_start", "image": jpeg(), "quality": "fast", "timeout": 0.001}):
+                websocket.send_bytes(msgpack.packb(frame, use_bin_type=True))
+                reply = msgpack.unpackb(websocket.receive_bytes(), raw=False)
+                assert reply["id"] == frame["id"] and reply["status"] == 429 and reply["retry_after"] >= 1, reply
+        assert admission.snapshot()["shed"]["deadline"] == shed + 3
+
+        # 期限足够时正常完成，实际服务时间（约0.2s）拉低估计值
+        response = client.post("/analyze", files={"file": ("a.jpg", jpeg(), "image/jpeg")},
+                               data={"quality": "fast"}, headers={"X-Request-Timeout": "30"})
+        assert response.status_code == 200, response.text
+        after_http = admission.snapshot()["service_time_seconds"][MODEL]["fast"]
+        assert 1.0 < after_http < 5.0, after_http
+        with client.websocket_connect("/rpc") as websocket:
+            websocket.send_bytes(msgpack.packb({"id": 3, "method": "analyze", "image": jpeg(), "quality": "fast",
+                                                "prompt": "不重复"}, use_bin_type=True))
+            reply = msgpack.unpackb(websocket.receive_bytes(), raw=False)
+            assert reply["type"] == "result", reply
+        assert admission.snapshot()["service_time_seconds"][MODEL]["fast"] < after_http
+    finally:
+        admission._estimates.pop(MODEL, None)
+    print("✅ HTTP/RPC 准入控制测试通过")
+    return True
+
+
+if __name__ == "__main__":
+    test_estimates()
+    test_shedding()
+    test_stub_endpoints()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+测试原始请求体图片接口 /analyze-raw (使用桩模型，不需要GPU和模型文件)
+
+检查未压缩 RGB/RGBA 像素、.npy 数组和编码后的图片文件三种输入，以及长度与形状不符、缺少宽高、
+数组类型或形状不支持和包含 pickle 对象的 .npy 都返回400。
+"""
+import sys
+sys.path.append('src')
+
+import io
+import os
+
+os.environ.setdefault("WARMUP_SIZES", "64x64")
+
+import numpy as np
+from fastapi.testclient import TestClient
+from PIL import Image
+
+import stub_model
+
+WIDTH, HEIGHT = 40, 30
+
+
+def create_client() -> TestClient:
+    """已加载桩模型的测试客户端（调用方需启用桩模型，不触发 startup/shutdown 事件）"""
+    import main
+    assert main.model_service.load_model("MiniCPM-V-4_5-int4")
+    return TestClient(main.app)
+
+
+def post_raw(client: TestClient, body: bytes, content_type: str, **params):
+    params.setdefault("quality", "fast")
+    return client.post("/analyze-raw", content=body, params=params,
+                       headers={"Content-Type": content_type, "X-Request-Timeout": "60"})
+
+
+def npy_bytes(array: np.ndarray, allow_pickle: bool = False) -> bytes:
+    buffer = io.BytesIO()
+    np.save(buffer, array, allow_pickle=allow_pickle)
+    return buffer.getvalue()
+
+
+@stub_model.enabled()
+def test_raw_pixels():
+    """测试 RGB/RGBA 像素（查询参数或请求头给出宽高）、.npy 数组和编码后的图片文件"""
+    client = create_client()
+    rgb = np.zeros((HEIGHT, WIDTH, 3), dtype=np.uint8)
+    rgb[..., 0] = 255
+
+    response = post_raw(client, rgb.tobytes(), "application/x-rgb", width=WIDTH, height=HEIGHT, prompt="像素")
+    assert response.status_code == 200, response.text
+    data = response.json()
+    assert data["image"] == {"width": WIDTH, "height": HEIGHT, "format": "RGB"}
+    assert data["result"].startswith("[stub:MiniCPM-V-4_5-int4] 像素 (40x30)"), data
+
+    rgba = np.dstack([rgb, np.full((HEIGHT, WIDTH), 128, dtype=np.uint8)])
+    response = client.post("/analyze-raw", content=rgba.tobytes(),
+                           headers={"Content-Type": "application/x-rgba", "X-Image-Width": str(WIDTH),
+                                    "X-Image-Height": str(HEIGHT), "X-Prompt": "%E9%80%8F%E6%98%8E"})
+    assert response.status_code == 200, response.text
+    assert response.json()["image"]["format"] == "RGBA" and " 透明 " in response.json()["result"]
+
+    for array in (rgb, rgb[..., 0]):
+        response = post_raw(client, npy_bytes(array), "application/x-npy")
+        assert response.status_code == 200, response.text
+        assert response.json()["image"] == {"width": WIDTH, "height": HEIGHT, "format": "NPY"}
+
+    buffer = io.BytesIO()
+    Image.fromarray(rgb).save(buffer, 'PNG')
+    response = post_raw(client, buffer.getvalue(), "image/png")
+    assert response.status_code == 200 and response.json()["image"]["format"] == "PNG", response.text
+    print("✅ 原始像素输入测试通过")
+    return True
+
+
+@stub_model.enabled()
+def test_raw_errors():
+    """测试长度与形状不符、缺少或无效的宽高、不支持的数组和 pickle 对象返回400，未知 Content-Type 返回415"""
+    client = create_client()
+    pixels = bytes(WIDTH * HEIGHT * 3)
+
+    for body in (pixels[:-1], pixels + b"\0", b""):
+        response = post_raw(client, body, "application/x-rgb", width=WIDTH, height=HEIGHT)
+        assert response.status_code == 400, (len(body), response.status_code, response.text)
+    # RGBA 需要4个通道
+    assert post_raw(client, pixels, "application/x-rgba", width=WIDTH, height=HEIGHT).status_code == 400
+
+    assert post_raw(client, pixels, "application/x-rgb").status_code == 400
+    assert post_raw(client, pixels, "application/x-rgb", width=WIDTH).status_code == 400
+    response = client.post("/analyze-raw", content=pixels,
+                           headers={"Content-Type": "application/x-rgb", "X-Image-Width": "abc",
+                                    "X-Image-Height": str(HEIGHT)})
+    assert response.status_code == 400, response.text
+
+    bad_arrays = (np.zeros((HEIGHT, WIDTH, 3), dtype=np.float32), np.zeros((HEIGHT, WIDTH, 2), dtype=np.uint8),
+                  np.zeros((2, HEIGHT, WIDTH, 3), dtype=np.uint8), np.zeros(WIDTH, dtype=np.uint8))
+    for array in bad_arrays:
+        response = post_raw(client, npy_bytes(array), "application/x-npy")
+        assert response.status_code == 400 and "不支持" in response.json()["detail"], (array.shape, response.text)
+
+    # allow_pickle=False：包含Python对象的数组在反序列化前被拒绝
+    pickled = npy_bytes(np.array([{"a": 1}], dtype=object), allow_pickle=True)
+    response = post_raw(client, pickled, "application/x-npy")
+    assert response.status_code == 400 and "pickle" in response.json()["detail"].lower(), response.text
+    assert post_raw(client, b"not npy", "application/x-npy").status_code == 400
+
+    assert post_raw(client, pixels, "text/plain").status_code == 415
+    print("✅ 原始像素错误输入测试通过")
+    return True
+
+
+if __name__ == "__main__":
+    test_raw_pixels()
+    test_raw_errors()
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+测试辅助生成（投机解码） (使用随机初始化的小型Llama模型，在CPU上运行，不需要GPU和模型文件)
+
+检查投机解码的输出与普通贪心解码完全相同、草稿模型不匹配时自动回退、接受率过低后停用并定期重新尝试，
+以及通过 ModelService 的 model.chat 调用路径时使用草稿模型并报告统计。
+"""
+import sys
+sys.path.append('src')
+
+import os
+import tempfile
+from pathlib import Path
+
+os.environ.setdefault("WARMUP_SIZES", "64x64")
+
+import torch
+from PIL import Image
+from transformers import LlamaConfig, LlamaForCausalLM
+
+import stub_model
+from assisted_generation import AssistedGenerator, speculative_generate, strip_image_tokens
+
+VOCAB = 96
+EOS = 95
+IMAGE_TOKEN = 94
+
+
+def tiny_llama(seed: int, layers: int = 2) -> LlamaForCausalLM:
+    torch.manual_seed(seed)
+    config = LlamaConfig(vocab_size=VOCAB, hidden_size=32, intermediate_size=64, num_hidden_layers=layers,
+                         num_attention_heads=4, num_key_value_heads=2, max_position_embeddings=512)
+    return LlamaForCausalLM(config).eval()
+
+
+def greedy_reference(model, inputs_embeds, max_new_tokens, repetition_penalty=1.0):
+    """transformers 自带的贪心解码结果"""
+    with torch.no_grad():
+        output = model.generate(inputs_embeds=inputs_embeds, max_new_tokens=max_new_tokens, do_sample=False,
+                                num_beams=1, repetition_penalty=repetition_penalty, eos_token_id=[EOS],
+                                pad_token_id=0, attention_mask=torch.ones(inputs_embeds.shape[:2], dtype=torch.long))
+    return output[0].tolist()
+
+
+class TinyMiniCPMV:
+    """按 MiniCPM-V 的 chat 流程调用 get_vllm_embedding 和 llm.generate 的小模型"""
+
+    def __init__(self, llm):
+        self.llm = llm
+
+    def to(self, device):
+        self.llm.to(device)
+        return self
+
+    def get_vllm_embedding(self, data):
+        embeds = self.llm.get_input_embeddings()(data["input_ids"])
+        for start, end in data["image_bound"][0].tolist():
+            embeds[0, start:end] = 0.5
+        return embeds, None
+
+    def chat(self, msgs, tokenizer, sampling=False, max_new_tokens=32, **kwargs):
+        text = msgs[-1]["content"][-1]
+        ids = [IMAGE_TOKEN] * 4 + [ord(c) % 90 for c in text]
+        data = {"input_ids": torch.tensor([ids]), "image_bound": [torch.tensor([[0, 4]])]}
+        generation_config = {"num_beams": 3, "repetition_penalty": 1.2}
+        generation_config.update((k, kwargs[k]) for k in generation_config.keys() & kwargs.keys())
+        embeds, _ = self.get_vllm_embedding(data)
+        output = self.llm.generate(inputs_embeds=embeds, pad_token_id=0, eos_token_id=[EOS],
+                                   attention_mask=torch.ones(embeds.shape[:2], dtype=torch.long),
+                                   max_new_tokens=max_new_tokens, **generation_config)
+        return " ".join(str(t) for t in output[0].tolist())
+
+
+def test_speculative_exact():
+    """测试投机解码与普通贪心解码输出完全相同"""
+    target = tiny_llama(0)
+    prompt = torch.randint(0, VOCAB - 2, (1, 16))
+    embeds = target.get_input_embeddings()(prompt).detach()
+
+    for penalty in (1.0, 1.2):
+        reference = greedy_reference(target, embeds, 48, penalty)
+        # 目标模型作为自己的草稿模型：全部接受，每次前向生成 num_draft_tokens + 1 个token
+        tokens, stats = speculative_generate(target, target, embeds, prompt[0].tolist(), 48, [EOS],
+                                             num_draft_tokens=4, repetition_penalty=penalty)
+        assert tokens == reference
+        assert stats["acceptance_rate"] == 1.0 and stats["tokens_per_target_step"] > 4
+        assert not stats["fell_back"]
+
+    # 不相关的草稿模型：几乎全部拒绝，回退为普通解码，输出不变
+    reference = greedy_reference(target, embeds, 48)
+    tokens, stats = speculative_generate(target, tiny_llama(1, layers=1), embeds, prompt[0].tolist(), 48, [EOS],
+                                         num_draft_tokens=4, min_acceptance=0.5)
+    assert tokens == reference
+    assert stats["fell_back"] and stats["draft_tokens"] < 48
+
+    assert strip_image_tokens([7, 1, 1, 1, 8, 2, 2, 9], torch.tensor([[1, 4], [5, 7]])) == [7, 8, 9]
+    print("✅ 投机解码一致性测试通过")
+    return True
+
+
+def test_fallback_and_probe():
+    """测试接受率过低时停用草稿模型，并每隔 probe_interval 次请求重新尝试"""
+    target = tiny_llama(0)
+    prompt = torch.randint(0, VOCAB - 2, (1, 8))
+    embeds = target.get_input_embeddings()(prompt).detach()
+    prompt = prompt[0].tolist()
+
+    assistant = AssistedGenerator(tiny_llama(1, layers=1), "mismatched", num_tokens=4, min_acceptance=0.5,
+                                  probe_interval=3)
+    _, stats = assistant.generate(target, embeds, prompt, 24, [EOS])
+    assert stats["assisted"] and not assistant.enabled and assistant.fallbacks == 1
+
+    # 停用后普通解码（同时记录基准速度），第3次请求重新尝试草稿模型
+    used = [assistant.generate(target, embeds, prompt, 24, [EOS])[1]["assisted"] for _ in range(3)]
+    assert used == [False, False, True]
+    assert assistant.baseline_seconds_per_token is not None and assistant.speedup() is not None
+
+    # 接受率高时保持启用，每隔 probe_interval 次请求测一次普通解码基准
+    assistant = AssistedGenerator(target, "self", num_tokens=4, probe_interval=3)
+    used = [assistant.generate(target, embeds, prompt, 24, [EOS])[1]["assisted"] for _ in range(3)]
+    assert used == [True, True, False] and assistant.enabled
+    snapshot = assistant.snapshot()
+    assert snapshot["acceptance_rate"] == 1.0 and snapshot["speedup"] is not None
+    print("✅ 回退与重新尝试测试通过")
+    return True
+
+
+@stub_model.enabled()
+def test_model_service_integration():
+    """测试 model.chat 路径上改用贪心解码和草稿模型，结果与普通贪心解码一致并报告统计"""
+    from model_service import ModelService
+
+    with tempfile.TemporaryDirectory() as tmp:
+        service = ModelService(Path(tmp))
+        assert service.load_model("MiniCPM-V-4_5-int4")
+        target = tiny_llama(0)
+        service.current_model = TinyMiniCPMV(target)
+        service.assistant = AssistedGenerator(target, "self", num_tokens=4, probe_interval=1000)
+
+        result, _, details = service.analyze_image(Image.new('RGB', (64, 64)), "这是什么？", "fast")
+        # 草稿模型看到的是去掉图片占位符的提示词，接受率低于1但输出不受影响
+        assert details["assisted"]["assisted"] and details["assisted"]["draft_tokens"] > 0
+
+        # 与关闭辅助生成、同样使用贪心解码的结果相同
+        data = {"input_ids": torch.tensor([[IMAGE_TOKEN] * 4 + [ord(c) % 90 for c in "这是什么？"]]),
+                "image_bound": [torch.tensor([[0, 4]])]}
+        with torch.no_grad():
+            embeds, _ = TinyMiniCPMV(target).get_vllm_embedding(data)
+        reference = greedy_reference(target, embeds, 128, 1.2)
+        assert result == " ".join(str(t) for t in reference)
+
+        # 启用辅助生成时缓存使用单独的生成参数版本
+        assert service._generation_version("fast").endswith(":greedy")
+        assert service.get_model_info()["assisted_generation"]["assisted_calls"] == 1
+
+        # 不在辅助生成请求中的调用交给原始的 generate
+        assert target.generate(inputs_embeds=embeds, max_new_tokens=4, num_beams=1).shape[0] == 1
+        assert service.assistant.calls == 1
+
+        assert service.park_model() and service.assistant is None
+    print("✅ ModelService 集成测试通过")
+    return True
+
+
+if __name__ == "__main__":
+    test_speculative_exact()
+    test_fallback_and_probe()
+    test_model_service_integration()
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+测试离线批量分析的断点恢复 (使用桩模型，不需要GPU和模型文件)
+
+处理图片目录时中途强制结束进程、JSONL清单的输出最后一行只写了一半，
+重新运行后已完成的条目被跳过、半行被截断，每个输入在输出中恰好出现一次。
+"""
+import sys
+sys.path.append('src')
+
+import argparse
+import json
+import os
+import subprocess
+import tempfile
+import time
+from pathlib import Path
+
+from PIL import Image
+
+import stub_model
+
+BIN_DIR = Path(__file__).resolve().parent.parent / 'bin'
+sys.path.insert(0, str(BIN_DIR))
+
+import batch_analyze
+
+MODEL = "MiniCPM-V-4_5-int4"
+
+
+def make_images(directory: Path, count: int) -> list:
+    directory.mkdir()
+    names = []
+    for i in range(count):
+        name = f"{i:02d}.png"
+        Image.new('RGB', (32 + i, 24), color=(i * 20, 0, 0)).save(directory / name)
+        names.append(name)
+    return names
+
+
+def read_records(output: Path) -> list:
+    """读取输出中的完整行（进程被强制结束时最后一行可能只写了一半）"""
+    data = output.read_bytes()
+    return [json.loads(line) for line in data[:data.rfind(b"\n") + 1].decode("utf-8").splitlines()]
+
+
+def batch_args(input_path: Path, output: Path, **kwargs) -> argparse.Namespace:
+    options = dict(input=str(input_path), output=str(output), model=MODEL, models_dir="./models",
+                   prompt=batch_analyze.DEFAULT_PROMPT, quality="fast", batch_size=2, workers=2, prefetch=4,
+                   retry_errors=False)
+    options.update(kwargs)
+    return argparse.Namespace(**options)
+
+
+def test_checkpoint_truncation():
+    """测试读取断点时截断最后的半行，跳过无法解析的行，--retry-errors 不跳过失败的条目"""
+    with tempfile.TemporaryDirectory() as tmp:
+        output = Path(tmp) / "results.jsonl"
+        assert batch_analyze.load_checkpoint(output, False) == set()
+
+        lines = [json.dumps({"id": "a", "status": "success"}), "not json",
+                 json.dumps({"id": "b", "status": "error"})]
+        output.write_text("\n".join(lines) + '\n{"id": "c", "sta', encoding="utf-8")
+        assert batch_analyze.load_checkpoint(output, False) == {"a", "b"}
+        assert output.read_text(encoding="utf-8") == "\n".join(lines) + "\n"
+        assert batch_analyze.load_checkpoint(output, True) == {"a"}
+    print("✅ 断点读取测试通过")
+    return True
+
+
+def test_resume_after_kill():
+    """测试处理目录时中途强制结束进程，重新运行后只处理剩余的图片"""
+    with tempfile.TemporaryDirectory() as tmp:
+        images = Path(tmp) / "images"
+        names = make_images(images, 12)
+        output = Path(tmp) / "results.jsonl"
+        command = [sys.executable, str(BIN_DIR / "batch_analyze.py"), "--input", str(images),
+                   "--output", str(output), "--model", MODEL, "--models-dir", tmp,
+                   "--quality", "fast", "--batch-size", "2"]
+        env = {**os.environ, "STUB_MODEL": "true", "STUB_MODEL_DELAY": "0.3", "WARMUP_SIZES": "64x64"}
+
+        process = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            deadline = time.time() + 60
+            while time.time() < deadline and (not output.exists() or len(output.read_bytes().splitlines()) < 4):
+                time.sleep(0.05)
+        finally:
+            process.kill()
+            process.wait(timeout=10)
+        first = read_records(output)
+        assert 4 <= len(first) < len(names), len(first)
+
+        result = subprocess.run(command, env=env, capture_output=True, text=True, timeout=120)
+        assert result.returncode == 0, result.stderr
+        assert f"跳过 {len(first)} 个" in result.stdout, result.stdout
+
+        records = read_records(output)
+        assert records[:len(first)] == first
+        assert sorted(r["id"] for r in records) == names, [r["id"] for r in records]
+        assert all(r["status"] == "success" for r in records)
+    print("✅ 中断后恢复测试通过")
+    return True
+
+
+@stub_model.enabled()
+def test_resume_manifest():
+    """测试JSONL清单的输出中最后一行只写了一半，重新运行后半行被截断、每个条目恰好出现一次"""
+    with tempfile.TemporaryDirectory() as tmp:
+        images = Path(tmp) / "images"
+        names = make_images(images, 6)
+        entries = [{"image": str(images / name), "prompt": f"第{i}张"} for i, name in enumerate(names)]
+        entries.append({"id": "missing", "image": str(images / "missing.png")})
+        manifest = Path(tmp) / "manifest.jsonl"
+        partial = Path(tmp) / "partial.jsonl"
+        manifest.write_text("".join(json.dumps(e, ensure_ascii=False) + "\n" for e in entries), encoding="utf-8")
+        partial.write_text("".join(json.dumps(e, ensure_ascii=False) + "\n" for e in entries[:3]), encoding="utf-8")
+        output = Path(tmp) / "results.jsonl"
+
+        assert batch_analyze.run(batch_args(partial, output, models_dir=tmp)) == 0
+        with open(output, "a", encoding="utf-8") as f:
+            f.write('{"id": "half-written", "status": "succ')
+
+        assert batch_analyze.run(batch_args(manifest, output, models_dir=tmp)) == 0
+        records = read_records(output)
+        ids = [r["id"] for r in records]
+        expected = [f"{e['image']}\t{e['prompt']}" for e in entries[:-1]] + ["missing"]
+        assert sorted(ids) == sorted(expected), ids
+        assert ids[:3] == expected[:3], "已完成的条目保持原样"
+        by_id = {r["id"]: r for r in records}
+        assert by_id["missing"]["status"] == "error"
+        assert all(by_id[i]["status"] == "success" and f"第{n}张" in by_id[i]["result"]
+                   for n, i in enumerate(expected[:-1]))
+
+        # 全部完成后再次运行不追加任何记录
+        assert batch_analyze.run(batch_args(manifest, output, models_dir=tmp)) == 0
+        assert read_records(output) == records
+    print("✅ 清单断点恢复测试通过")
+    return True
+
+
+if __name__ == "__main__":
+    test_checkpoint_truncation()
+    test_resume_after_kill()
+    test_resume_manifest()
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+测试候选标签打分 (小型随机Llama模型和桩模型，不需要GPU和模型文件)
+
+检查共享前缀的批量打分与逐个候选完整前向的结果一致、概率归一化和排序，
+按 MiniCPM-V 结构构建前缀（聊天模板、图片占位符、视觉嵌入）后的打分，以及 /classify 接口。
+"""
+import sys
+sys.path.append('src')
+
+import io
+import math
+import os
+import tempfile
+from pathlib import Path
+
+os.environ.setdefault("WARMUP_SIZES", "64x64")
+
+import requests
+import torch
+from PIL import Image
+from tokenizers import Tokenizer, models, pre_tokenizers
+from transformers import BatchFeature, LlamaConfig, LlamaForCausalLM, PreTrainedTokenizerFast
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import stub_model
+from label_scoring import score_labels, rank, build_prompt, classify, _prefix_embeds
+from test_router import start_process, wait_for
+
+SERVER_PORT = 18221
+SERVER = f"http://127.0.0.1:{SERVER_PORT}"
+
+
+def test_score_labels():
+    """测试批量打分与逐个候选完整前向一致"""
+    torch.manual_seed(0)
+    llm = LlamaForCausalLM(LlamaConfig(vocab_size=64, hidden_size=32, intermediate_size=64, num_hidden_layers=2,
+                                       num_attention_heads=4, num_key_value_heads=2)).eval()
+    prefix_ids = torch.randint(0, 64, (1, 12))
+    prefix = llm.get_input_embeddings()(prefix_ids).detach()
+    label_ids = [[5, 63], [7, 8, 9, 63], [5, 6, 63], [11]]
+
+    scores = score_labels(llm, prefix, label_ids)
+    with torch.no_grad():
+        for ids, score in zip(label_ids, scores):
+            full = torch.cat([prefix_ids, torch.tensor([ids])], dim=1)
+            logprobs = torch.log_softmax(llm(input_ids=full).logits[0].float(), dim=-1)
+            expected = sum(float(logprobs[prefix_ids.shape[1] - 1 + i, token]) for i, token in enumerate(ids))
+            assert abs(score - expected) < 1e-4, (score, expected)
+
+    ranked = rank(["a", "b", "c", "d"], scores)
+    assert abs(sum(item["probability"] for item in ranked["labels"]) - 1.0) < 1e-5
+    assert ranked["label"] == ranked["labels"][0]["label"]
+    assert ranked["labels"][0]["logprob"] == round(max(scores), 4)
+    assert abs(ranked["coverage"] - sum(math.exp(s) for s in scores)) < 1e-5
+
+    assert build_prompt(["猫", "狗"]).count("猫、狗") == 1
+    assert build_prompt(["猫", "狗"], "是{labels}中的哪个？") == "是猫、狗中的哪个？"
+    print("✅ 候选打分测试通过")
+    return True
+
+
+IMAGE_PLACEHOLDER = "(<image>./</image>)"
+# 每张图片在输入中占用的token数
+IMAGE_TOKENS = 3
+CHAT_TEMPLATE = ("{% for m in messages %}<|im_start|> {{ m['role'] }} {{ m['content'] }} <|im_end|> {% endfor %}"
+                 "{% if add_generation_prompt %}<|im_start|> assistant {% endif %}")
+
+
+def tiny_tokenizer() -> PreTrainedTokenizerFast:
+    words = ["[UNK]", "<|im_start|>", "<|im_end|>", "user", "assistant", IMAGE_PLACEHOLDER,
+             "what", "color", "red", "blue", "dark", "cat"]
+    tokenizer = Tokenizer(models.WordLevel({w: i for i, w in enumerate(words)}, unk_token="[UNK]"))
+    tokenizer.pre_tokenizer = pre_tokenizers.WhitespaceSplit()
+    return PreTrainedTokenizerFast(tokenizer_object=tokenizer, unk_token="[UNK]", eos_token="<|im_end|>",
+                                   chat_template=CHAT_TEMPLATE)
+
+
+class TinyProcessor:
+    """与 MiniCPM-V processor 的输出格式相同：图片占位符展开为 IMAGE_TOKENS 个位置，image_bound 为其区间"""
+
+    def __init__(self, tokenizer):
+        self.tokenizer = tokenizer
+        self.calls = []
+
+    def __call__(self, prompts, images, return_tensors="pt", max_slice_nums=None):
+        self.calls.append({"prompt": prompts[0], "max_slice_nums": max_slice_nums})
+        image_id = self.tokenizer.convert_tokens_to_ids(IMAGE_PLACEHOLDER)
+        input_ids, bounds = [], []
+        for token in self.tokenizer.encode(prompts[0], add_special_tokens=False):
+            if token == image_id:
+                bounds.append([len(input_ids), len(input_ids) + IMAGE_TOKENS])
+                input_ids.extend([token] * IMAGE_TOKENS)
+            else:
+                input_ids.append(token)
+        pixels = [torch.tensor(image.convert('RGB').resize((1, 1), Image.Resampling.BOX).getpixel((0, 0)),
+                               dtype=torch.float32) / 255.0 for image in images[0]]
+        return BatchFeature({"input_ids": torch.tensor([input_ids]), "image_bound": [torch.tensor(bounds)],
+                             "pixel_values": [pixels], "tgt_sizes": [torch.ones(len(pixels), 2)]})
+
+
+class TinyMiniCPMV(torch.nn.Module):
+    """小型随机Llama加上把图片平均颜色映射为视觉嵌入的 get_vllm_embedding"""
+
+    def __init__(self, tokenizer):
+        super().__init__()
+        torch.manual_seed(0)
+        self.llm = LlamaForCausalLM(LlamaConfig(vocab_size=len(tokenizer), hidden_size=32, intermediate_size=64,
+                                                num_hidden_layers=2, num_attention_heads=4,
+                                                num_key_value_heads=2)).eval()
+        self.vision = torch.nn.Linear(3, 32 * IMAGE_TOKENS)
+        self.processor = TinyProcessor(tokenizer)
+        self.device = torch.device("cpu")
+
+    def get_vllm_embedding(self, data):
+        embeds = self.llm.get_input_embeddings()(data["input_ids"]).clone()
+        vision = [self.vision(pixels).reshape(IMAGE_TOKENS, -1) for pixels in data["pixel_values"][0]]
+        for (start, end), states in zip(data["image_bound"][0].tolist(), vision):
+            embeds[0, start:end] = states
+        return embeds, vision
+
+
+def test_classify_prefix():
+    """测试按聊天模板和图片占位符构建前缀，打分与每个候选拼接在完整输入后前向的结果一致"""
+    tokenizer = tiny_tokenizer()
+    model = TinyMiniCPMV(tokenizer)
+    image = Image.new('RGB', (64, 48), color=(200, 30, 30))
+    labels = ["red", "blue", "dark blue", "cat"]
+
+    result = classify(model, tokenizer, image, "what color", labels, max_slice_nums=2)
+    call = model.processor.calls[-1]
+    assert call["max_slice_nums"] == 2
+    assert call["prompt"] == f"<|im_start|> user {IMAGE_PLACEHOLDER}\nwhat color <|im_end|> <|im_start|> assistant "
+
+    # 参考值：每个候选的 token 接在完整输入之后单独前向
+    msgs = [{'role': 'user', 'content': [image, "what color"]}]
+    end_id = tokenizer.convert_tokens_to_ids("<|im_end|>")
+    with torch.no_grad():
+        prefix = _prefix_embeds(model, tokenizer, msgs, None)
+        inputs = model.processor([call["prompt"]], [[image]])
+        assert prefix.shape == (1, inputs["input_ids"].shape[1], 32)
+        for item in result["labels"]:
+            ids = tokenizer.encode(item["label"], add_special_tokens=False) + [end_id]
+            full_ids = torch.cat([inputs["input_ids"], torch.tensor([ids])], dim=1)
+            embeds, _ = model.get_vllm_embedding({**inputs, "input_ids": full_ids})
+            logprobs = torch.log_softmax(model.llm(inputs_embeds=embeds).logits[0].float(), dim=-1)
+            start = inputs["input_ids"].shape[1] - 1
+            expected = sum(float(logprobs[start + i, token]) for i, token in enumerate(ids))
+            assert abs(item["logprob"] - expected) < 1e-3, (item, expected)
+    assert sorted(item["label"] for item in result["labels"]) == sorted(labels)
+    assert classify(model, tokenizer, image, "what color", labels) == result, "打分结果应当确定"
+    print("✅ 前缀构建与打分测试通过")
+    return True
+
+
+@stub_model.enabled()
+def test_classify_image():
+    """测试 ModelService.classify_image 排序和结果确定"""
+    from model_service import ModelService
+
+    with tempfile.TemporaryDirectory() as tmp:
+        service = ModelService(Path(tmp))
+        assert service.load_model("MiniCPM-V-4_5-int4")
+        image = Image.new('RGB', (200, 100), color=(250, 10, 10))
+        result, _, details = service.classify_image(image, ["blue", "red", "cat"], quality="fast")
+        assert result["label"] == "red" and details["quality"] == "fast"
+        assert [item["label"] for item in result["labels"]] == ["red", "blue", "cat"]
+        assert service.classify_image(image, ["blue", "red", "cat"], quality="fast")[0] == result
+    print("✅ 图片分类测试通过")
+    return True
+
+
+def test_classify_endpoint():
+    """测试 /classify 接口"""
+    process = start_process('main', SERVER_PORT, {"STUB_MODEL": "true", "PRELOAD_MODEL": "MiniCPM-V-4_5-int4",
+                                                  "WARMUP_SIZES": "64x64"})
+    try:
+        wait_for(f"{SERVER}/ready")
+        buffer = io.BytesIO()
+        Image.new('RGB', (320, 240), color=(10, 10, 240)).save(buffer, 'JPEG')
+        files = {"file": ("a.jpg", buffer.getvalue(), "image/jpeg")}
+
+        response = requests.post(f"{SERVER}/classify", files=files,
+                                 data={"labels": ["red", "blue", "green", "blue"], "quality": "fast"}, timeout=30)
+        assert response.status_code == 200, response.text
+        body = response.json()
+        assert body["result"] == "blue" and len(body["labels"]) == 3
+        assert body["labels"][0]["probability"] > 0.5 and body["image"]["width"] == 320
+
+        response = requests.post(f"{SERVER}/classify", files=files, data={"labels": ["red"]}, timeout=30)
+        assert response.status_code == 400
+    finally:
+        process.terminate()
+        process.wait()
+    print("✅ /classify 接口测试通过")
+    return True
+
+
+if __name__ == "__main__":
+    test_score_labels()
+    test_classify_prefix()
+    test_classify_image()
+    test_classify_endpoint()
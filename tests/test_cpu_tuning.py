@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+测试CPU线程和核心绑定配置 (使用桩模型，不需要GPU和模型文件)
+
+检查CPU列表的解析和格式化、配置文件缺失或损坏时的处理、环境变量覆盖，
+以及 bin/cpu_autotune.py 写出的配置文件能被 ModelService 读取并应用。
+"""
+import sys
+sys.path.append('src')
+
+import json
+import os
+import subprocess
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+
+from PIL import Image
+
+from cpu_tuning import parse_cpu_list, format_cpu_list, load_cpu_config, _ENV_KEYS
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+
+
+@contextmanager
+def cpu_env(**values):
+    """临时设置CPU配置相关的环境变量（未给出的清空），退出时恢复"""
+    saved = {key: os.environ.pop(key, None) for key in _ENV_KEYS}
+    os.environ.update(values)
+    try:
+        yield
+    finally:
+        for key, value in saved.items():
+            os.environ.pop(key, None)
+            if value is not None:
+                os.environ[key] = value
+
+
+def test_cpu_list():
+    """测试范围、重复、空输入、格式错误和格式化往返"""
+    assert parse_cpu_list("0-3,8") == [0, 1, 2, 3, 8]
+    assert parse_cpu_list(" 8, 0-2 ,1,2 ") == [0, 1, 2, 8]
+    assert parse_cpu_list("5-5") == [5]
+    assert parse_cpu_list([3, 1, 1]) == [1, 3]
+    for empty in (None, "", "  ", [], ","):
+        assert parse_cpu_list(empty) is None, empty
+    for bad in ("a", "1-", "-1", "3-1", "0-2,x", "1.5"):
+        try:
+            parse_cpu_list(bad)
+            assert False, f"{bad!r} 应当报错"
+        except ValueError:
+            pass
+
+    assert format_cpu_list([0, 1, 2, 3, 8]) == "0-3,8"
+    assert format_cpu_list([8, 0, 1, 1, 10, 11]) == "0-1,8,10-11"
+    assert format_cpu_list([]) is None and format_cpu_list(None) is None
+    for spec in ("0-3,8", "1,3,5", "0-15", "2"):
+        assert format_cpu_list(parse_cpu_list(spec)) == spec
+    print("✅ CPU列表解析测试通过")
+    return True
+
+
+def test_load_config():
+    """测试配置文件缺失、损坏、值无效时使用默认值，环境变量覆盖文件中的值"""
+    defaults = {"torch_threads": None, "interop_threads": None, "inference_cpus": None,
+                "preprocess_cpus": None, "preprocess_workers": 2}
+    with tempfile.TemporaryDirectory() as tmp, cpu_env():
+        path = Path(tmp) / "cpu_tuning.json"
+        assert load_cpu_config(path) == defaults
+
+        for content in ("{not json", "[1, 2]", json.dumps({"config": {"torch_threads": "many"}}),
+                        json.dumps({"config": {"inference_cpus": "3-1"}}),
+                        json.dumps({"config": {"preprocess_workers": 0}})):
+            path.write_text(content, encoding="utf-8")
+            assert load_cpu_config(path) == defaults, content
+
+        path.write_text(json.dumps({"model": "m", "config": {
+            "torch_threads": 6, "interop_threads": 1, "inference_cpus": "0-5", "preprocess_cpus": "6,7",
+            "preprocess_workers": 2, "unknown": True}}), encoding="utf-8")
+        config = load_cpu_config(path)
+        assert config == {"torch_threads": 6, "interop_threads": 1, "inference_cpus": [0, 1, 2, 3, 4, 5],
+                          "preprocess_cpus": [6, 7], "preprocess_workers": 2}, config
+
+        with cpu_env(TORCH_NUM_THREADS="4", INFERENCE_CPUS="0-3", PREPROCESS_WORKERS="3"):
+            config = load_cpu_config(path)
+        assert config["torch_threads"] == 4 and config["inference_cpus"] == [0, 1, 2, 3]
+        assert config["preprocess_workers"] == 3 and config["preprocess_cpus"] == [6, 7]
+
+        # 环境变量是显式配置，格式错误时直接报错
+        with cpu_env(INFERENCE_CPUS="0-x"):
+            try:
+                load_cpu_config(path)
+                assert False, "环境变量格式错误应当报错"
+            except ValueError:
+                pass
+    print("✅ CPU配置读取测试通过")
+    return True
+
+
+def test_autotune_output():
+    """测试 cpu_autotune 写出的配置文件格式，以及 ModelService 启动时读取并应用"""
+    available = sorted(os.sched_getaffinity(0))
+    with tempfile.TemporaryDirectory() as tmp:
+        images = Path(tmp) / "images"
+        images.mkdir()
+        for i in range(2):
+            Image.new('RGB', (64, 48), color=(i * 100, 0, 0)).save(images / f"{i}.jpg")
+        output = Path(tmp) / "cpu_tuning.json"
+        env = {key: value for key, value in os.environ.items() if key not in _ENV_KEYS}
+        env.update({"STUB_MODEL": "true", "STUB_MODEL_DELAY": "0.01", "WARMUP_SIZES": "64x64"})
+
+        result = subprocess.run(
+            [sys.executable, "bin/cpu_autotune.py", "--images", str(images), "--models-dir", tmp,
+             "--max-images", "2", "--threads", "1", "--interop", "1,2", "--reserve", "0",
+             "--output", str(output)],
+            cwd=ROOT_DIR, env=env, capture_output=True, text=True, timeout=300
+        )
+        assert result.returncode == 0, result.stdout + result.stderr
+        written = json.loads(output.read_text(encoding="utf-8"))
+        assert len(written["results"]) == 2 and written["mean_seconds"] == written["results"][0]["mean_seconds"]
+        assert written["config"]["torch_threads"] == 1 and written["config"]["interop_threads"] in (1, 2)
+        assert written["config"]["inference_cpus"] == format_cpu_list(available)
+
+        with cpu_env():
+            config = load_cpu_config(output)
+        assert config["torch_threads"] == 1 and config["inference_cpus"] == available, config
+
+        # 在子进程中检查：设置核心绑定会影响当前进程
+        script = ("import json, os, sys; sys.path.append('src'); from pathlib import Path; "
+                  "from model_service import ModelService; import cpu_tuning; "
+                  "service = ModelService(Path('models')); "
+                  "print(json.dumps({**cpu_tuning.describe_cpu_config(service.cpu_config), "
+                  "'affinity': sorted(os.sched_getaffinity(0))}))")
+        result = subprocess.run([sys.executable, "-c", script], cwd=ROOT_DIR, capture_output=True, text=True,
+                                env={**env, "CPU_TUNING_FILE": str(output), "CUDA_VISIBLE_DEVICES": ""},
+                                timeout=120)
+        assert result.returncode == 0, result.stderr
+        applied = json.loads(result.stdout.strip().splitlines()[-1])
+        assert applied["torch_threads"] == 1 and applied["interop_threads"] == written["config"]["interop_threads"]
+        assert applied["inference_cpus"] == written["config"]["inference_cpus"]
+        assert applied["affinity"] == available, applied
+    print("✅ 自动调优配置测试通过")
+    return True
+
+
+if __name__ == "__main__":
+    test_cpu_list()
+    test_load_config()
+    test_autotune_output()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+测试滚动部署 (使用桩模型，不需要GPU和模型文件)
+
+旧实例和路由进程启动后持续发送请求，同时用 bin/deploy.py 在新端口部署新实例：
+检查新实例就绪后才切换流量、旧实例排空后退出、整个过程中没有失败的请求。
+"""
+import io
+import os
+import sys
+import tempfile
+import threading
+import time
+from argparse import Namespace
+from pathlib import Path
+
+import requests
+from PIL import Image
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'bin'))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from deploy import start_instance, wait_ready, deploy_service, get_status
+from test_router import start_process, wait_for
+
+OLD_PORT = 18210
+NEW_PORT = 18211
+ROUTER_PORT = 18301
+ROUTER = f"http://127.0.0.1:{ROUTER_PORT}"
+
+
+def send_traffic(stop: threading.Event, results: list):
+    buffer = io.BytesIO()
+    Image.new('RGB', (320, 240), color='green').save(buffer, 'JPEG')
+    i = 0
+    while not stop.is_set():
+        i += 1
+        try:
+            response = requests.post(f"{ROUTER}/analyze", files={"file": ("a.jpg", buffer.getvalue(), "image/jpeg")},
+                                     data={"prompt": f"q{i}", "quality": "fast"}, timeout=30)
+            results.append((response.status_code, response.headers.get("X-Routed-To")))
+        except requests.RequestException as e:
+            results.append((None, str(e)))
+
+
+def test_rolling_deploy():
+    """测试就绪后切换流量、排空旧实例且不丢请求"""
+    processes = []
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ.update({
+            "STUB_MODEL": "true",
+            "STUB_MODEL_DELAY": "0.3",
+            "WARMUP_SIZES": "64x64",
+            # 新旧实例共用任务数据库
+            "JOB_DB_PATH": str(Path(tmp) / "jobs.sqlite3"),
+        })
+        old_url = f"http://127.0.0.1:{OLD_PORT}"
+        stop = threading.Event()
+        results = []
+        try:
+            old = start_instance(OLD_PORT, "MiniCPM-V-4_5-int4", "127.0.0.1")
+            processes.append(old)
+            print(f"旧实例启动到就绪 {wait_ready(old_url, old, timeout=60):.1f}s")
+
+            processes.append(start_process('router', ROUTER_PORT, {
+                "ROUTER_REPLICAS": old_url,
+                "ROUTER_POLL_INTERVAL": "0.5",
+            }))
+            wait_for(f"{ROUTER}/health")
+
+            traffic = threading.Thread(target=send_traffic, args=(stop, results))
+            traffic.start()
+            time.sleep(1)
+
+            args = Namespace(port=NEW_PORT, host="127.0.0.1", public_host="127.0.0.1", old=old_url, router=ROUTER,
+                             model="MiniCPM-V-4_5-int4", log=None, ready_timeout=60, drain_timeout=30,
+                             drain_delay=0, graceful_timeout=10)
+            assert deploy_service(args)
+
+            time.sleep(1)
+            stop.set()
+            traffic.join()
+
+            # 旧实例已退出，新实例就绪并接收流量
+            assert old.wait(timeout=10) == 0
+            assert get_status(f"http://127.0.0.1:{NEW_PORT}")["ready"]
+            failed = [r for r in results if r[0] != 200]
+            assert not failed, failed
+            routed = [r[1] for r in results]
+            assert routed[0] == old_url and routed[-1] == f"http://127.0.0.1:{NEW_PORT}", routed
+            print(f"部署期间 {len(results)} 个请求全部成功")
+        finally:
+            stop.set()
+            new_status = get_status(f"http://127.0.0.1:{NEW_PORT}")
+            if new_status:
+                os.kill(new_status["pid"], 15)
+            for process in processes:
+                if process.poll() is None:
+                    process.terminate()
+                process.wait()
+    print("✅ 滚动部署测试通过")
+    return True
+
+
+if __name__ == "__main__":
+    test_rolling_deploy()
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+测试图片向量接口 (小型视觉编码器和桩模型，不需要GPU和模型文件)
+
+检查 float16/int8 量化还原误差、视觉编码在不同尺寸图片批量前向时与逐张前向一致、相似图片的向量更接近，
+以及 /embed 的 JSON 和 msgpack 响应。
+"""
+import sys
+sys.path.append('src')
+
+import io
+import os
+import tempfile
+from pathlib import Path
+
+os.environ.setdefault("WARMUP_SIZES", "64x64")
+
+import numpy as np
+import requests
+import torch
+from PIL import Image, ImageDraw
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import stub_model
+from image_embedding import quantize, dequantize, to_msgpack, from_msgpack, encode_images, _vision_features
+from test_router import start_process, wait_for
+
+SERVER_PORT = 18220
+SERVER = f"http://127.0.0.1:{SERVER_PORT}"
+
+
+def make_image(shift: int = 0, flip: bool = False) -> Image.Image:
+    image = Image.new('RGB', (320, 240), color='white')
+    draw = ImageDraw.Draw(image)
+    draw.rectangle([40 + shift, 40, 160 + shift, 200], fill='black')
+    return image.transpose(Image.Transpose.FLIP_LEFT_RIGHT) if flip else image
+
+
+def jpeg(image: Image.Image) -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG')
+    return buffer.getvalue()
+
+
+def test_quantize():
+    """测试各精度的还原误差和 msgpack 编码"""
+    rng = np.random.default_rng(0)
+    embeddings = rng.standard_normal((5, 256)).astype(np.float32)
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+    for dtype, tolerance in (("float32", 0), ("float16", 1e-3), ("int8", 1e-2)):
+        quantized = quantize(embeddings, dtype)
+        assert quantized["data"].dtype == np.dtype(dtype)
+        restored = dequantize(quantized["data"], quantized["scales"])
+        assert np.abs(restored - embeddings).max() <= tolerance
+
+        decoded = from_msgpack(to_msgpack({"dtype": dtype, "count": 5, "dim": 256}, quantized))
+        assert np.array_equal(decoded["embeddings"], quantized["data"])
+
+    assert quantize(np.zeros((1, 4), dtype=np.float32), "int8")["scales"][0] == 1.0
+    print("✅ 向量量化测试通过")
+    return True
+
+
+PATCH = 4
+
+
+class TinyImageProcessor:
+    """与 MiniCPM-V 图片处理器相同的输出格式：每张图片按 patch 展开为 [3, patch, 块数 × patch]"""
+
+    def __call__(self, images, do_pad=True, max_slice_nums=None, return_tensors="pt"):
+        pixel_values, tgt_sizes = [], []
+        for (image,) in images:
+            width, height = (max(PATCH, side // 8 // PATCH * PATCH) for side in image.size)
+            array = torch.from_numpy(np.asarray(image.convert('RGB').resize((width, height)), dtype=np.float32))
+            array = array.permute(2, 0, 1) / 255.0
+            patches = torch.nn.functional.unfold(array, (PATCH, PATCH), stride=(PATCH, PATCH))
+            patches = patches.reshape(3, PATCH, PATCH, -1).permute(0, 1, 3, 2).reshape(3, PATCH, -1)
+            pixel_values.append([patches])
+            tgt_sizes.append(torch.tensor([[height // PATCH, width // PATCH]]))
+        return {"pixel_values": pixel_values, "tgt_sizes": tgt_sizes}
+
+
+class TinyVisionEncoder(torch.nn.Module):
+    """按块嵌入后只在有效块之间做注意力，结构上对应 MiniCPM-V 的 vpm"""
+
+    def __init__(self, dim: int):
+        super().__init__()
+        self.embeddings = torch.nn.Module()
+        self.embeddings.patch_embedding = torch.nn.Conv2d(3, dim, PATCH, stride=PATCH)
+        self.attention = torch.nn.MultiheadAttention(dim, 2, batch_first=True)
+
+    def forward(self, pixel_values, patch_attention_mask, tgt_sizes):
+        hidden = self.embeddings.patch_embedding(pixel_values).flatten(2).transpose(1, 2)
+        hidden = hidden[:, :patch_attention_mask.shape[-1]]
+        output, _ = self.attention(hidden, hidden, hidden, key_padding_mask=~patch_attention_mask[:, 0])
+        return type("Output", (), {"last_hidden_state": hidden + output})
+
+
+class TinyResampler(torch.nn.Module):
+    """固定数量的查询token对有效块做交叉注意力，对应 MiniCPM-V 的 resampler"""
+
+    def __init__(self, dim: int, queries: int = 3):
+        super().__init__()
+        self.query = torch.nn.Parameter(torch.randn(queries, dim))
+        self.attention = torch.nn.MultiheadAttention(dim, 2, batch_first=True)
+
+    def forward(self, hidden, tgt_sizes):
+        lengths = tgt_sizes[:, 0] * tgt_sizes[:, 1]
+        padding = torch.arange(hidden.shape[1])[None, :] >= lengths[:, None]
+        query = self.query.unsqueeze(0).expand(hidden.shape[0], -1, -1)
+        output, _ = self.attention(query, hidden, hidden, key_padding_mask=padding)
+        return output
+
+
+class TinyVisionModel(torch.nn.Module):
+    def __init__(self, dim: int = 8):
+        super().__init__()
+        torch.manual_seed(0)
+        self.processor = type("Processor", (), {"image_processor": TinyImageProcessor()})()
+        self.vpm = TinyVisionEncoder(dim)
+        self.resampler = TinyResampler(dim)
+
+
+def test_vision_features():
+    """测试视觉编码：不同尺寸的图片一起前向（填充到最长）与逐张前向的结果一致"""
+    model = TinyVisionModel().eval()
+    images = [make_image(), make_image(shift=4).resize((200, 120)), make_image(flip=True).resize((96, 160))]
+    with torch.no_grad():
+        batched = _vision_features(model, images)
+        assert batched.shape == (3, 3, 8)
+        for i, image in enumerate(images):
+            assert torch.allclose(batched[i], _vision_features(model, [image])[0], atol=1e-5)
+
+    embeddings = encode_images(model, images, batch_size=2)
+    assert embeddings.shape == (3, 8) and embeddings.dtype == np.float32
+    assert np.allclose(np.linalg.norm(embeddings, axis=1), 1.0, atol=1e-5)
+    with torch.no_grad():
+        expected = torch.nn.functional.normalize(batched.mean(dim=1), dim=-1).numpy()
+    assert np.allclose(embeddings, expected, atol=1e-5)
+    print("✅ 视觉编码测试通过")
+    return True
+
+
+@stub_model.enabled()
+def test_embed_images():
+    """测试 ModelService.embed_images 返回归一化向量且相似图片更接近"""
+    from model_service import ModelService
+
+    with tempfile.TemporaryDirectory() as tmp:
+        service = ModelService(Path(tmp))
+        assert service.load_model("MiniCPM-V-4_5-int4")
+        embeddings, _, details = service.embed_images([make_image(), make_image(shift=4), make_image(flip=True)])
+        assert embeddings.shape == (3, details["dim"])
+        assert np.allclose(np.linalg.norm(embeddings, axis=1), 1.0, atol=1e-5)
+        similarity = embeddings @ embeddings.T
+        assert similarity[0, 1] > similarity[0, 2]
+    print("✅ 图片向量测试通过")
+    return True
+
+
+def test_embed_endpoint():
+    """测试 /embed 的 JSON 和 msgpack 响应"""
+    process = start_process('main', SERVER_PORT, {"STUB_MODEL": "true", "PRELOAD_MODEL": "MiniCPM-V-4_5-int4",
+                                                  "WARMUP_SIZES": "64x64"})
+    try:
+        wait_for(f"{SERVER}/ready")
+        files = [("files", (f"{i}.jpg", jpeg(image), "image/jpeg"))
+                 for i, image in enumerate([make_image(), make_image(shift=4), make_image(flip=True)])]
+
+        response = requests.post(f"{SERVER}/embed", files=files, timeout=30)
+        assert response.status_code == 200, response.text
+        body = response.json()
+        assert body["count"] == 3 and body["dtype"] == "float32" and body["scales"] is None
+        reference = np.array(body["embeddings"], dtype=np.float32)
+        assert reference.shape == (3, body["dim"])
+        assert [image["filename"] for image in body["images"]] == ["0.jpg", "1.jpg", "2.jpg"]
+
+        response = requests.post(f"{SERVER}/embed", files=files, data={"dtype": "int8", "format": "msgpack"},
+                                 timeout=30)
+        assert response.headers["content-type"] == "application/x-msgpack"
+        decoded = from_msgpack(response.content)
+        assert decoded["embeddings"].dtype == np.int8 and decoded["embeddings"].shape == reference.shape
+        assert np.abs(dequantize(decoded["embeddings"], decoded["scales"]) - reference).max() < 1e-2
+
+        response = requests.post(f"{SERVER}/embed", files=files, data={"dtype": "float16"},
+                                 headers={"Accept": "application/x-msgpack"}, timeout=30)
+        assert from_msgpack(response.content)["embeddings"].dtype == np.float16
+
+        response = requests.post(f"{SERVER}/embed", files=[("files", ("a.txt", b"text", "text/plain"))], timeout=30)
+        assert response.status_code == 400
+    finally:
+        process.terminate()
+        process.wait()
+    print("✅ /embed 接口测试通过")
+    return True
+
+
+if __name__ == "__main__":
+    test_quantize()
+    test_vision_features()
+    test_embed_images()
+    test_embed_endpoint()
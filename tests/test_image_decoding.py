@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+测试图片解码后端 (不需要GPU和模型文件)
+
+检查各格式的输出尺寸与原来的完整解码+缩放一致、JPEG 缩放解码的像素差异很小，以及后端失败时回退到 PIL。
+"""
+import sys
+sys.path.append('src')
+
+import io
+
+import numpy as np
+from PIL import Image
+
+from image_decoding import ImageDecoders, Decoder, PilDecoder, target_size, sniff_format
+
+
+def encode(image: Image.Image, image_format: str, **kwargs) -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, image_format, **kwargs)
+    return buffer.getvalue()
+
+
+def photo(width: int, height: int, mode: str = 'RGB') -> Image.Image:
+    """平滑内容加少量噪声的合成照片"""
+    rng = np.random.default_rng(0)
+    base = Image.fromarray(rng.integers(0, 256, (12, 16, 3), dtype=np.uint8)).resize((width, height),
+                                                                                    Image.Resampling.BICUBIC)
+    return base.convert(mode)
+
+
+def full_decode(data: bytes, max_size: int) -> Image.Image:
+    """原来的解码方式：完整解码后 LANCZOS 缩放"""
+    from model_service import ModelService
+    image = Image.open(io.BytesIO(data)).convert('RGB')
+    return ModelService.preprocess_image(None, image, max_size)
+
+
+def test_output_matches_full_decode():
+    """测试各格式/模式的输出尺寸与完整解码一致，像素差异很小"""
+    decoders = ImageDecoders(["pil"])
+    cases = [
+        ("JPEG", photo(4000, 3000), 1024),
+        ("JPEG", photo(3001, 4003), 448),
+        ("JPEG", photo(2000, 1500, 'L'), 1344),
+        ("JPEG", photo(2400, 1800, 'CMYK'), 1024),
+        ("JPEG", photo(800, 600), 1024),
+        ("PNG", photo(2000, 1000, 'RGBA'), 1024),
+        ("WEBP", photo(1600, 1200), 448),
+    ]
+    for image_format, image, max_size in cases:
+        data = encode(image, image_format)
+        assert sniff_format(data[:16]) == image_format
+        decoded = decoders.decode(data, max_size)
+        reference = full_decode(data, max_size)
+        assert decoded.mode == 'RGB' and decoded.size == reference.size == target_size(*image.size, max_size)
+        diff = np.abs(np.asarray(decoded, dtype=np.int16) - np.asarray(reference, dtype=np.int16)).mean()
+        assert diff < 3, (image_format, image.mode, image.size, diff)
+
+    stats = decoders.snapshot()["backends"]["pil"]
+    # 缩小到一半以下的3张JPEG使用了缩放解码（2000x1500 -> 1344 无法按 1/2 缩放）
+    assert stats["count"] == len(cases) and stats["reduced"] == 3, stats
+    print("✅ 解码输出一致性测试通过")
+    return True
+
+
+def test_fallback():
+    """测试未知后端被忽略、后端解码失败时回退到 PIL、无法识别的数据报错"""
+
+    class BrokenDecoder(Decoder):
+        name = "broken"
+        formats = ("JPEG",)
+
+        def decode(self, fp, max_size):
+            fp.read()
+            raise RuntimeError("broken")
+
+    # 没有实现 decode 的后端在创建时报错，而不是在第一次解码时
+    class IncompleteDecoder(Decoder):
+        name = "incomplete"
+
+    try:
+        IncompleteDecoder()
+        assert False, "未实现 decode 的后端不应能创建"
+    except TypeError:
+        pass
+
+    decoders = ImageDecoders(["nonexistent", "pil"])
+    assert [d.name for d in decoders.decoders] == ["pil"]
+
+    decoders.decoders.insert(0, BrokenDecoder())
+    decoders.stats["broken"] = {"count": 0, "reduced": 0, "seconds": 0.0}
+    image = decoders.decode(encode(photo(2000, 1500), "JPEG"), 448)
+    assert image.size == (448, 336) and decoders.fallbacks == 1
+
+    # 非 JPEG 不经过只支持 JPEG 的后端
+    decoders.decode(encode(photo(200, 100), "PNG"), 448)
+    assert decoders.fallbacks == 1
+
+    try:
+        decoders.decode(b"not an image", 448)
+        assert False, "应当无法识别"
+    except Exception as e:
+        assert "identify" in str(e)
+
+    assert PilDecoder(draft=False).decode(io.BytesIO(encode(photo(2000, 1500), "JPEG")), 448)[1] is False
+    print("✅ 解码回退测试通过")
+    return True
+
+
+if __name__ == "__main__":
+    test_output_matches_full_decode()
+    test_fallback()
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+测试推理后端 (使用桩模型和测试用后端，不需要GPU、模型文件和 llama-cpp-python)
+
+检查按配置/目录内容选择后端、GGUF 文件查找和消息转换、注册的轻量后端通过 ModelService 完成推理，
+以及不支持的操作返回501、不可移动的后端切换时直接卸载。
+"""
+import sys
+sys.path.append('src')
+
+import os
+import tempfile
+from pathlib import Path
+
+os.environ.setdefault("WARMUP_SIZES", "64x64")
+
+from PIL import Image
+
+import inference_backends
+import stub_model
+from inference_backends import (InferenceBackend, LlamaCppBackend, BackendUnsupported, register_backend,
+                                parse_model_backends, backend_for, find_gguf_files)
+
+
+class EchoBackend(InferenceBackend):
+    """只回显提示词和图片尺寸的轻量后端"""
+
+    name = "echo"
+
+    def load(self, model_name, model_path, device):
+        self.model = model_name
+        return {"source": "echo", "path": None, "phases": {"model": 0.0}}
+
+    def chat(self, msgs, **kwargs):
+        content = msgs[-1]["content"]
+        sizes = [f"{item.width}x{item.height}" for item in content if isinstance(item, Image.Image)]
+        return f"[echo:{self.model}] {content[-1]} ({', '.join(sizes)}) max={kwargs.get('max_new_tokens')}"
+
+    def stream(self, msgs, **kwargs):
+        yield from self.chat(msgs, **kwargs).split(" ")
+
+
+def test_backend_selection():
+    """测试配置解析、后端选择和 GGUF 文件查找"""
+    assert parse_model_backends("a=llama_cpp, b = transformers,bad,") == {"a": "llama_cpp", "b": "transformers"}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        gguf = Path(tmp) / "MiniCPM-V-4_5-gguf"
+        gguf.mkdir()
+        for name in ("ggml-model-Q8_0.gguf", "ggml-model-Q4_K_M.gguf", "mmproj-model-f16.gguf"):
+            (gguf / name).write_bytes(b"")
+        plain = Path(tmp) / "MiniCPM-V-4_5-int4"
+        plain.mkdir()
+
+        weights, projector = find_gguf_files(gguf, "Q4_K_M")
+        assert weights.name == "ggml-model-Q4_K_M.gguf" and projector.name == "mmproj-model-f16.gguf"
+        assert find_gguf_files(gguf, "IQ2")[0].name == "ggml-model-Q4_K_M.gguf"
+
+        stub_enabled = stub_model.STUB_MODEL
+        stub_model.STUB_MODEL = False
+        try:
+            assert backend_for(gguf.name, gguf) == "llama_cpp"
+            assert backend_for(plain.name, plain) == "transformers"
+            inference_backends.MODEL_BACKENDS[plain.name] = "echo"
+            assert backend_for(plain.name, plain) == "echo"
+        finally:
+            stub_model.STUB_MODEL = stub_enabled
+            inference_backends.MODEL_BACKENDS.pop(plain.name, None)
+        with stub_model.enabled():
+            assert backend_for(plain.name, plain) == "stub"
+
+    try:
+        inference_backends.create_backend("nonexistent")
+        assert False, "未知后端应报错"
+    except ValueError:
+        pass
+    print("✅ 后端选择测试通过")
+    return True
+
+
+def test_llama_cpp_messages():
+    """测试 llama.cpp 后端的消息和生成参数转换（不需要 llama-cpp-python）"""
+    image = Image.new('RGB', (32, 16))
+    messages = LlamaCppBackend._messages([
+        {'role': 'user', 'content': [image, "这是什么？"]},
+        {'role': 'assistant', 'content': ["一张黑色图片"]},
+        {'role': 'user', 'content': ["颜色呢？"]},
+    ])
+    assert messages[0]["content"][0]["image_url"]["url"].startswith("data:image/jpeg;base64,")
+    assert messages[0]["content"][1] == {"type": "text", "text": "这是什么？"}
+    assert messages[1] == {"role": "assistant", "content": "一张黑色图片"}
+    assert messages[2] == {"role": "user", "content": "颜色呢？"}
+
+    options = LlamaCppBackend._options({"sampling": False, "max_new_tokens": 64, "num_beams": 3})
+    assert options["max_tokens"] == 64 and options["temperature"] == 0.0
+    assert LlamaCppBackend._options({"sampling": True, "do_sample": False})["temperature"] == 0.0
+    print("✅ llama.cpp 消息转换测试通过")
+    return True
+
+
+@stub_model.enabled()
+def test_pluggable_backend():
+    """测试注册的轻量后端通过 ModelService 完成推理，不支持的操作返回501"""
+    from model_service import ModelService
+
+    # 没有实现 load 的后端在创建时报错，而不是在加载模型时
+    class IncompleteBackend(InferenceBackend):
+        name = "incomplete"
+
+    try:
+        IncompleteBackend()
+        assert False, "未实现 load 的后端不应能创建"
+    except TypeError:
+        pass
+
+    register_backend(EchoBackend)
+    inference_backends.MODEL_BACKENDS["MiniCPM-V-4-int4"] = "echo"
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            service = ModelService(Path(tmp))
+            assert service.load_model("MiniCPM-V-4_5-int4")
+            assert service.get_model_info()["backend"]["name"] == "stub"
+
+            assert service.load_model("MiniCPM-V-4-int4")
+            info = service.get_model_info()
+            assert info["backend"] == {"name": "echo", "movable": False}
+            assert info["load_profile"]["backend"] == "echo" and info["warmup_profile"][0]["ok"]
+            # 切换到不可移动的后端时，之前的桩模型仍可停放
+            assert "MiniCPM-V-4_5-int4" in [p["model_name"] for p in service.parking.snapshot()["models"]]
+
+            image = Image.new('RGB', (2000, 1000))
+            result, _, _ = service.analyze_image(image, "描述", "fast")
+            assert result == "[echo:MiniCPM-V-4-int4] 描述 (448x224) max=128", result
+            results, _ = service.analyze_images([image, Image.new('RGB', (64, 64))], ["a", "b"], "fast")
+            assert results[1].startswith("[echo:MiniCPM-V-4-int4] b (64x64)")
+            assert "".join(service.analyze_image_stream(image, "流式", "fast")).startswith("[echo:")
+
+            for call in (lambda: service.embed_images([image]), lambda: service.classify_image(image, ["a", "b"])):
+                try:
+                    call()
+                    assert False, "应当不支持"
+                except BackendUnsupported as e:
+                    assert e.status_code == 501 and "echo" in e.detail
+
+            # 不可移动的后端无法停放，切换时直接卸载
+            assert not service.park_model() and service.backend is None and not service.ready
+            assert service.load_model("MiniCPM-V-4-int4")
+            assert service.load_model("MiniCPM-V-4_5-int4")
+            assert service.get_model_info()["load_profile"]["source"] == "parked"
+            assert "MiniCPM-V-4-int4" not in [p["model_name"] for p in service.parking.snapshot()["models"]]
+    finally:
+        inference_backends.MODEL_BACKENDS.pop("MiniCPM-V-4-int4", None)
+    print("✅ 可插拔后端测试通过")
+    return True
+
+
+@stub_model.enabled()
+def test_missing_runtime():
+    """测试 llama-cpp-python 未安装时加载失败、服务保持可用"""
+    from model_service import ModelService
+
+    if inference_backends.llama_cpp is not None:
+        print("⚠️  已安装 llama-cpp-python，跳过")
+        return True
+    inference_backends.MODEL_BACKENDS["MiniCPM-V-4-int4"] = "llama_cpp"
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            service = ModelService(Path(tmp))
+            assert not service.load_model("MiniCPM-V-4-int4")
+            assert service.backend is None and service.lifecycle.state == "empty"
+            assert service.load_model("MiniCPM-V-4_5-int4") and service.ready
+    finally:
+        inference_backends.MODEL_BACKENDS.pop("MiniCPM-V-4-int4", None)
+    print("✅ 运行时缺失测试通过")
+    return True
+
+
+if __name__ == "__main__":
+    test_backend_selection()
+    test_llama_cpp_messages()
+    test_pluggable_backend()
+    test_missing_runtime()
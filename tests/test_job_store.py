@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""
+测试异步任务存储 (不需要加载模型)
+"""
+import sys
+sys.path.append('src')
+
+import io
+import struct
+import tempfile
+import threading
+import time
+import zlib
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from pathlib import Path
+
+from PIL import Image
+
+from job_store import JobStore, JOB_QUEUED, JOB_RUNNING, JOB_SUCCEEDED, JOB_FAILED
+
+IMAGE_PORT = 18224
+
+def test_job_lifecycle():
+    """测试任务入队、执行、重启恢复和过期清理"""
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = Path(tmp) / "jobs.sqlite3"
+        store = JobStore(db_path, ttl_seconds=1)
+
+        job_id = store.create_job(prompt="test", image_url="http://example.com/a.jpg")
+        assert store.get_job(job_id)["status"] == JOB_QUEUED
+
+        claimed = store.claim_next()
+        assert claimed["id"] == job_id
+        assert store.get_job(job_id)["status"] == JOB_RUNNING
+        assert store.claim_next() is None
+        store.close()
+
+        # 模拟服务重启：运行中的任务重新排队
+        store = JobStore(db_path, ttl_seconds=1)
+        assert store.get_job(job_id)["status"] == JOB_QUEUED
+
+        store.claim_next()
+        store.complete_job(job_id, {"result": "ok"})
+        job = store.get_job(job_id)
+        assert job["status"] == JOB_SUCCEEDED
+        assert job["result"]["result"] == "ok"
+
+        time.sleep(1.1)
+        assert store.get_job(job_id) is None
+        assert store.purge_expired() == 1
+        store.close()
+    print("✅ 任务存储测试通过")
+    return True
+
+def test_foreign_owner_lease():
+    """测试共用数据库时其他主机上的实例执行中的任务在租约有效期内不被重新排队，停止续约后才重新排队"""
+    import sqlite3
+    from job_worker import JobWorker
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = Path(tmp) / "jobs.sqlite3"
+        remote = JobStore(db_path, lease_seconds=1)
+        # 另一台主机上的副本：进程号在本机无法检查
+        remote.owner = "other-host:12345:abcd1234"
+        job_id = remote.create_job(prompt="remote", image_url="http://example.com/a.jpg")
+        assert remote.claim_next()["id"] == job_id
+
+        local = JobStore(db_path, lease_seconds=1)
+        assert local.get_job(job_id)["status"] == JOB_RUNNING
+        time.sleep(0.6)
+        assert remote.heartbeat(job_id)
+        time.sleep(0.6)
+        assert local.requeue_running() == 0 and local.get_job(job_id)["status"] == JOB_RUNNING
+        # 其他实例不能替所属实例续约
+        assert not local.heartbeat(job_id)
+
+        time.sleep(1.1)
+        assert local.requeue_running() == 1
+        assert local.get_job(job_id)["status"] == JOB_QUEUED
+        assert not remote.heartbeat(job_id)
+
+        # 升级前写入、没有 heartbeat_at 的运行中任务按开始时间判断
+        conn = sqlite3.connect(str(db_path))
+        conn.execute("UPDATE jobs SET status = ?, owner = ?, started_at = ?, heartbeat_at = NULL WHERE id = ?",
+                     (JOB_RUNNING, remote.owner, time.time(), job_id))
+        conn.commit()
+        conn.close()
+        assert local.requeue_running() == 0
+        remote.close()
+        local.close()
+
+    # 工作线程在执行期间续约，执行时间超过租约的任务不会被其他实例重新排队
+    class SlowModelService:
+        current_model_name = "stub"
+        ready = True
+
+        def analyze_image(self, image, prompt):
+            time.sleep(1.5)
+            assert other.requeue_running() == 0, "执行中的任务被重新排队"
+            return "ok", 1.5, {}
+
+    buffer = io.BytesIO()
+    Image.new('RGB', (32, 32)).save(buffer, 'JPEG')
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = Path(tmp) / "jobs.sqlite3"
+        store = JobStore(db_path, lease_seconds=0.4)
+        store.owner = "worker-host:12345:abcd1234"
+        other = JobStore(db_path, lease_seconds=0.4)
+        worker = JobWorker(SlowModelService(), store, poll_interval=0.05)
+        job_id = store.create_job(prompt="slow", image_data=buffer.getvalue())
+        worker.start()
+        try:
+            deadline = time.time() + 10
+            while time.time() < deadline and store.get_job(job_id)["status"] not in (JOB_SUCCEEDED, JOB_FAILED):
+                time.sleep(0.05)
+        finally:
+            worker.stop()
+        job = store.get_job(job_id)
+        assert job["status"] == JOB_SUCCEEDED, job
+        store.close()
+        other.close()
+    print("✅ 任务租约测试通过")
+    return True
+
+class FlakyModelService:
+    """第一次调用时模型正在切换（503），之后正常返回"""
+
+    current_model_name = "stub"
+
+    def __init__(self):
+        self.calls = 0
+
+    def analyze_image(self, image, prompt):
+        from model_lifecycle import LifecycleError
+        self.calls += 1
+        if self.calls == 1:
+            raise LifecycleError(status_code=503, detail="模型切换中")
+        return "ok", 0.01, {}
+
+def test_worker_callback():
+    """测试模型暂时不可用时任务重新排队且不发送回调，完成后只发送一次最终状态"""
+    from job_worker import JobWorker
+
+    buffer = io.BytesIO()
+    Image.new('RGB', (32, 32)).save(buffer, 'JPEG')
+    with tempfile.TemporaryDirectory() as tmp:
+        store = JobStore(Path(tmp) / "jobs.sqlite3")
+        worker = JobWorker(FlakyModelService(), store)
+        callbacks = []
+        worker._send_callback = lambda job_id, url: callbacks.append(store.get_job(job_id)["status"])
+
+        job_id = store.create_job(prompt="test", image_data=buffer.getvalue(), callback_url="http://example.com/cb")
+        worker._process(store.claim_next())
+        assert store.get_job(job_id)["status"] == JOB_QUEUED and callbacks == []
+
+        worker._process(store.claim_next())
+        assert store.get_job(job_id)["status"] == JOB_SUCCEEDED and callbacks == [JOB_SUCCEEDED]
+        store.close()
+    print("✅ 任务回调测试通过")
+    return True
+
+class RecordingModelService:
+    """记录收到的图片尺寸"""
+
+    current_model_name = "stub"
+
+    def __init__(self):
+        self.sizes = []
+
+    def analyze_image(self, image, prompt):
+        self.sizes.append(image.size)
+        return "ok", 0.01, {}
+
+class ImageHandler(BaseHTTPRequestHandler):
+    """/endless 不声明长度一直发送，/declared 声明超限的长度，/bomb 头部声明超限的像素数，/small 正常图片"""
+
+    sent = {}
+
+    def do_GET(self):
+        import upload_limits
+        self.send_response(200)
+        self.send_header("Content-Type", "image/png")
+        if self.path == "/declared":
+            self.send_header("Content-Length", str(upload_limits.MAX_UPLOAD_BYTES + 1))
+            self.end_headers()
+            return
+        if self.path == "/endless":
+            self.end_headers()
+            chunk = b"\0" * 65536
+            self.sent[self.path] = 0
+            try:
+                while self.sent[self.path] < 4 * upload_limits.MAX_UPLOAD_BYTES:
+                    self.wfile.write(chunk)
+                    self.sent[self.path] += len(chunk)
+            except OSError:
+                pass
+            return
+        if self.path == "/bomb":
+            side = int(upload_limits.MAX_IMAGE_PIXELS ** 0.5) + 1
+            data = b"IHDR" + struct.pack(">IIBBBBB", side, side, 8, 2, 0, 0, 0)
+            idat = b"IDAT" + zlib.compress(b"\0" * (side * 3 + 1))
+            body = b"\x89PNG\r\n\x1a\n" + b"".join(
+                struct.pack(">I", len(c) - 4) + c + struct.pack(">I", zlib.crc32(c)) for c in (data, idat, b"IEND"))
+        else:
+            buffer = io.BytesIO()
+            Image.new('RGB', (64, 48), color='red').save(buffer, 'PNG')
+            body = buffer.getvalue()
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+def test_url_job_limits():
+    """测试URL任务与同步接口一样按字节上限流式下载、解码前检查像素数，超限的任务失败且不进入推理"""
+    from job_worker import JobWorker
+    import upload_limits
+
+    server = ThreadingHTTPServer(("127.0.0.1", IMAGE_PORT), ImageHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            store = JobStore(Path(tmp) / "jobs.sqlite3")
+            service = RecordingModelService()
+            worker = JobWorker(service, store)
+            rejected = upload_limits.tracker.snapshot()["rejected"]
+
+            jobs = {path: store.create_job(prompt="test", image_url=f"http://127.0.0.1:{IMAGE_PORT}{path}")
+                    for path in ("/endless", "/declared", "/bomb", "/small")}
+            for _ in jobs:
+                worker._process(store.claim_next())
+
+            for path in ("/endless", "/declared", "/bomb"):
+                job = store.get_job(jobs[path])
+                assert job["status"] == JOB_FAILED and job["error"].startswith("413"), (path, job)
+            assert store.get_job(jobs["/small"])["status"] == JOB_SUCCEEDED
+            assert service.sizes == [(64, 48)]
+
+            # 读到上限即停止下载（允许套接字缓冲区中已发送的数据）
+            assert ImageHandler.sent["/endless"] < 2 * upload_limits.MAX_UPLOAD_BYTES, ImageHandler.sent
+            after = upload_limits.tracker.snapshot()
+            assert after["rejected"]["bytes"] == rejected["bytes"] + 2
+            assert after["rejected"]["pixels"] == rejected["pixels"] + 1 and after["in_flight"] == 0
+            store.close()
+    finally:
+        server.shutdown()
+    print("✅ URL任务下载限制测试通过")
+    return True
+
+if __name__ == "__main__":
+    test_job_lifecycle()
+    test_foreign_owner_lease()
+    test_worker_callback()
+    test_url_job_limits()
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+测试模型生命周期 (使用桩模型，不需要GPU和模型文件)
+
+检查推理请求可以并发、加载/卸载等待进行中的请求完成、等待期间新请求不被放行、超时后操作取消且模型不变，
+以及并发加载依次执行。
+"""
+import sys
+sys.path.append('src')
+
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+os.environ.setdefault("WARMUP_SIZES", "64x64")
+
+from PIL import Image
+
+import stub_model
+from model_lifecycle import ModelLifecycle, LifecycleError, READY, EMPTY, LOADING, DRAINING, UNLOADING
+
+
+def test_state_machine():
+    """测试读写锁：共享持有并发、独占等待、排空期间新请求等待、超时恢复"""
+    lifecycle = ModelLifecycle(drain_timeout=5, wait_seconds=0.2)
+    try:
+        with lifecycle.reader():
+            pass
+        assert False, "没有模型时应拒绝"
+    except LifecycleError as e:
+        assert e.status_code == 503
+
+    with lifecycle.exclusive(LOADING, lambda: READY):
+        assert lifecycle.state == LOADING
+        # 独占操作内部（如预热）可以直接推理
+        with lifecycle.reader():
+            pass
+    assert lifecycle.state == READY
+
+    def infer(seconds, wait_seconds=None):
+        with lifecycle.reader(wait_seconds):
+            time.sleep(seconds)
+
+    def unload():
+        with lifecycle.exclusive(UNLOADING, lambda: READY):
+            assert lifecycle.state == UNLOADING and lifecycle.in_flight == 0
+
+    # 两个请求同时持有；卸载等待两个请求完成，等待期间新请求不被放行
+    with ThreadPoolExecutor(4) as pool:
+        readers = [pool.submit(infer, 0.5), pool.submit(infer, 0.5)]
+        time.sleep(0.1)
+        assert lifecycle.in_flight == 2
+        writer = pool.submit(unload)
+        time.sleep(0.1)
+        assert lifecycle.state == DRAINING
+        try:
+            with lifecycle.reader(wait_seconds=0.1):
+                pass
+            assert False, "排空期间不应放行新请求"
+        except LifecycleError as e:
+            assert e.status_code == 503 and "Retry-After" in e.headers
+        late = pool.submit(infer, 0, 2)
+        for future in readers:
+            future.result()
+        writer.result(timeout=2)
+        late.result(timeout=2)
+    assert lifecycle.state == READY and lifecycle.in_flight == 0
+
+    # 进行中的请求超过排空时间：操作取消，状态恢复
+    lifecycle.drain_timeout = 0.2
+    with ThreadPoolExecutor(1) as pool:
+        future = pool.submit(infer, 0.6)
+        time.sleep(0.1)
+        try:
+            with lifecycle.exclusive(UNLOADING, lambda: EMPTY):
+                assert False, "应当超时"
+        except LifecycleError as e:
+            assert e.status_code == 409
+        assert lifecycle.state == READY and lifecycle.drain_timeouts == 1
+        future.result()
+    print("✅ 生命周期状态机测试通过")
+    return True
+
+
+@stub_model.enabled()
+def test_unload_waits_for_inference():
+    """测试卸载/切换等待进行中的推理完成，推理不会因模型被替换而失败"""
+    from model_service import ModelService
+
+    with tempfile.TemporaryDirectory() as tmp:
+        service = ModelService(Path(tmp))
+        assert service.load_model("MiniCPM-V-4_5-int4")
+        service.current_model.delay = 0.5
+        image = Image.new('RGB', (64, 64))
+
+        with ThreadPoolExecutor(4) as pool:
+            inferences = [pool.submit(service.analyze_image, image, f"q{i}", "fast") for i in range(2)]
+            time.sleep(0.1)
+            assert service.lifecycle.in_flight == 2
+            start = time.time()
+            assert service.load_model("MiniCPM-V-4-int4")
+            assert time.time() - start >= 0.3
+            results = [future.result()[0] for future in inferences]
+        assert all(r.startswith("[stub:MiniCPM-V-4_5-int4]") for r in results), results
+        assert service.ready and service.current_model_name == "MiniCPM-V-4-int4"
+
+        # 切换期间到达的请求等待切换完成后由新模型处理
+        service.parking.enabled = False
+        service.current_model.delay = 0.3
+        with ThreadPoolExecutor(4) as pool:
+            first = pool.submit(service.analyze_image, image, "first", "fast")
+            time.sleep(0.1)
+            switch = pool.submit(service.load_model, "MiniCPM-V-4_5-int4")
+            time.sleep(0.1)
+            assert service.lifecycle.state == DRAINING and not service.ready
+            waiting = pool.submit(service.analyze_image, image, "waiting", "fast")
+            assert first.result()[0].startswith("[stub:MiniCPM-V-4-int4]")
+            assert switch.result()
+            assert waiting.result()[0].startswith("[stub:MiniCPM-V-4_5-int4]")
+
+        # 推理超过排空时间：卸载返回409，模型保持可用
+        service.lifecycle.drain_timeout = 0.1
+        service.current_model.delay = 0.5
+        with ThreadPoolExecutor(1) as pool:
+            inference = pool.submit(service.analyze_image, image, "slow", "fast")
+            time.sleep(0.1)
+            try:
+                service.unload_model()
+                assert False, "应当超时"
+            except LifecycleError as e:
+                assert e.status_code == 409
+            assert inference.result()[0] is not None
+        assert service.ready and service.current_model is not None
+
+        service.unload_model()
+        assert service.lifecycle.state == EMPTY and not service.ready
+    print("✅ 卸载等待推理测试通过")
+    return True
+
+
+@stub_model.enabled()
+def test_concurrent_loads():
+    """测试并发加载依次执行，最终只有一个当前模型"""
+    from model_service import ModelService
+
+    with tempfile.TemporaryDirectory() as tmp:
+        service = ModelService(Path(tmp))
+        names = ["MiniCPM-V-4_5-int4", "MiniCPM-V-4-int4"] * 3
+        with ThreadPoolExecutor(6) as pool:
+            assert all(pool.map(service.load_model, names))
+        assert service.ready and service.current_model_name in names
+        assert service.lifecycle.snapshot()["in_flight"] == 0
+        assert service.analyze_image(Image.new('RGB', (64, 64)), "q", "fast")[0] is not None
+    print("✅ 并发加载测试通过")
+    return True
+
+
+if __name__ == "__main__":
+    test_state_machine()
+    test_unload_waits_for_inference()
+    test_concurrent_loads()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+测试模型分级驻留 (使用桩模型和小型torch模块，不需要GPU和模型文件)
+
+检查切换模型时当前模型停放到主机内存、切换回来时不再冷加载，以及容量上限、空闲过期和活动模型空闲释放。
+"""
+import sys
+sys.path.append('src')
+
+import os
+import tempfile
+import time
+from pathlib import Path
+
+os.environ.setdefault("WARMUP_SIZES", "64x64")
+
+import torch
+from PIL import Image
+
+import stub_model
+from model_parking import ModelParking, model_nbytes
+
+
+def test_parking_limits():
+    """测试按容量淘汰最久停放的模型和空闲过期"""
+    modules = {name: torch.nn.Linear(64, 64) for name in ("a", "b", "c")}
+    size = model_nbytes(modules["a"])
+    assert size == (64 * 64 + 64) * 4
+
+    parking = ModelParking(max_bytes=size * 2, idle_seconds=60, pin_memory=False, enabled=True)
+    for name, module in modules.items():
+        assert parking.park(name, module, None, {})
+    snapshot = parking.snapshot()
+    assert [m["model_name"] for m in snapshot["models"]] == ["b", "c"]
+    assert snapshot["bytes"] <= size * 2 and snapshot["evicted"] == 1
+
+    # 超过上限的模型不停放，由调用方丢弃
+    assert not ModelParking(max_bytes=size - 1, enabled=True).park("a", modules["a"], None, {})
+    assert not ModelParking(enabled=False).park("a", modules["a"], None, {})
+
+    parking._models["b"].parked_at -= 120
+    assert parking.purge_idle() == ["b"]
+    assert parking.take("c").model is modules["c"]
+    assert parking.take("c") is None
+    print("✅ 停放容量与过期测试通过")
+    return True
+
+
+@stub_model.enabled()
+def test_model_switching():
+    """测试在两个模型之间来回切换时不再冷加载"""
+    from model_service import ModelService
+
+    with tempfile.TemporaryDirectory() as tmp:
+        service = ModelService(Path(tmp))
+        assert service.load_model("MiniCPM-V-4_5-int4")
+        first = service.current_model
+        assert service.load_profile["source"] == "stub"
+
+        assert service.load_model("MiniCPM-V-4-int4")
+        assert service.parking.contains("MiniCPM-V-4_5-int4")
+
+        assert service.load_model("MiniCPM-V-4_5-int4")
+        assert service.load_profile["source"] == "parked"
+        assert service.load_profile["cold_load_profile"]["source"] == "stub"
+        assert service.current_model is first and service.ready
+        assert service.parking.contains("MiniCPM-V-4-int4")
+        assert not service.parking.contains("MiniCPM-V-4_5-int4")
+
+        result, _, _ = service.analyze_image(Image.new('RGB', (64, 64)), "这是什么？", "fast")
+        assert result.startswith("[stub:MiniCPM-V-4_5-int4]")
+
+        # 卸载时停放，重新加载只需拷回
+        assert service.park_model() and not service.ready
+        assert service.load_model("MiniCPM-V-4_5-int4")
+        assert service.load_profile["source"] == "parked"
+        assert service.parking.snapshot()["reactivated"] == 2
+    print("✅ 模型切换测试通过")
+    return True
+
+
+@stub_model.enabled()
+def test_active_idle_release():
+    """测试活动模型空闲后权重移到主机内存，下一次推理前自动拷回"""
+    from model_service import ModelService
+
+    with tempfile.TemporaryDirectory() as tmp:
+        service = ModelService(Path(tmp))
+        # 桩模型接受任意设备名，用来模拟加速器
+        assert service.load_model("MiniCPM-V-4_5-int4", device="accel")
+        assert service.current_model.device == "accel"
+
+        assert not service._release_if_idle(60)
+        service.last_used = time.time() - 120
+        assert service._release_if_idle(60)
+        assert service.active_device == "cpu" and service.current_model.device == "cpu"
+        assert service.ready
+
+        result, _, _ = service.analyze_image(Image.new('RGB', (64, 64)), "这是什么？", "fast")
+        assert result is not None
+        assert service.active_device == "accel" and service.current_model.device == "accel"
+
+        # 指定在CPU上运行时不再移动
+        assert service.load_model("MiniCPM-V-4_5-int4", device="cpu")
+        assert service.current_model.device == "cpu" and service.target_device == "cpu"
+    print("✅ 活动模型空闲释放测试通过")
+    return True
+
+
+if __name__ == "__main__":
+    test_parking_limits()
+    test_model_switching()
+    test_active_idle_release()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+测试预处理模型快照 (小型 trust_remote_code 模型，不需要GPU和模型文件)
+
+检查首次加载后写入快照（目标dtype权重、tokenizer、模型代码和指纹清单）、再次加载时从快照加载且权重一致，
+以及源模型变化或格式版本不一致时快照失效、重新从源模型加载并覆盖快照。
+"""
+import sys
+sys.path.append('src')
+
+import json
+import tempfile
+from pathlib import Path
+
+import torch
+from tokenizers import Tokenizer, models, pre_tokenizers
+from transformers import PreTrainedTokenizerFast
+
+import model_snapshot
+from inference_backends import TransformersBackend
+
+MODEL_NAME = "Tiny-V"
+
+# 与 MiniCPM-V 一样通过 auto_map 加载的远程代码模型，接受 use_flash_attention_2 等额外参数
+MODELING_CODE = '''
+import torch
+from transformers import PreTrainedModel, PretrainedConfig
+
+
+class TinyConfig(PretrainedConfig):
+    model_type = "tiny_v"
+
+    def __init__(self, hidden_size=8, **kwargs):
+        self.hidden_size = hidden_size
+        super().__init__(**kwargs)
+
+
+class TinyModel(PreTrainedModel):
+    config_class = TinyConfig
+
+    def __init__(self, config, **kwargs):
+        super().__init__(config)
+        self.proj = torch.nn.Linear(config.hidden_size, config.hidden_size)
+        self.post_init()
+'''
+
+
+def create_source_model(root: Path) -> Path:
+    """在 root 下写入一个小型源模型目录（float32 权重、tokenizer 和模型代码）"""
+    source = root / MODEL_NAME
+    source.mkdir()
+    (source / "modeling_tiny.py").write_text(MODELING_CODE)
+    sys.path.insert(0, str(source))
+    try:
+        import modeling_tiny
+    finally:
+        sys.path.remove(str(source))
+    config = modeling_tiny.TinyConfig(auto_map={"AutoConfig": "modeling_tiny.TinyConfig",
+                                                "AutoModel": "modeling_tiny.TinyModel"})
+    torch.manual_seed(0)
+    modeling_tiny.TinyModel(config).save_pretrained(str(source))
+
+    tokenizer = Tokenizer(models.WordLevel({"[UNK]": 0, "a": 1, "b": 2}, unk_token="[UNK]"))
+    tokenizer.pre_tokenizer = pre_tokenizers.Whitespace()
+    PreTrainedTokenizerFast(tokenizer_object=tokenizer, unk_token="[UNK]").save_pretrained(str(source))
+    return source
+
+
+def load(source: Path):
+    backend = TransformersBackend()
+    info = backend.load(MODEL_NAME, source, "cpu")
+    backend.finish_load()
+    return backend, info
+
+
+def test_snapshot_roundtrip():
+    """测试写入快照、从快照加载，以及源模型变化后快照失效"""
+    snapshot_dir_setting = model_snapshot.MODEL_SNAPSHOT_DIR
+    with tempfile.TemporaryDirectory() as tmp:
+        source = create_source_model(Path(tmp))
+        model_snapshot.MODEL_SNAPSHOT_DIR = ""
+        assert model_snapshot.snapshot_path(MODEL_NAME, "cpu", torch.bfloat16) is None
+
+        model_snapshot.MODEL_SNAPSHOT_DIR = str(Path(tmp) / "snapshots")
+        snapshot_dir = model_snapshot.snapshot_path(MODEL_NAME, "cpu", torch.bfloat16)
+        assert snapshot_dir.name == "Tiny_V__cpu_bfloat16"
+        try:
+            # 首次加载：从源模型加载，写入快照
+            first, info = load(source)
+            assert info["source"] == "pretrained" and "snapshot_save" in info["phases"]
+            assert model_snapshot.is_valid(snapshot_dir, source)
+            assert not snapshot_dir.with_name(snapshot_dir.name + ".partial").exists()
+            assert (snapshot_dir / "modeling_tiny.py").exists() and (snapshot_dir / "tokenizer.json").exists()
+            manifest = json.loads((snapshot_dir / model_snapshot.MANIFEST_NAME).read_text())
+            assert manifest["source_fingerprint"] == model_snapshot.source_fingerprint(source)
+            assert manifest["model_name"] == MODEL_NAME and manifest["dtype"] == "torch.bfloat16"
+
+            # 再次加载：从快照加载，权重已是目标dtype且与首次加载一致
+            second, info = load(source)
+            assert info["source"] == "snapshot" and info["path"] == str(snapshot_dir)
+            assert second.model.proj.weight.dtype == torch.bfloat16
+            assert torch.equal(first.model.proj.weight, second.model.proj.weight)
+            assert second.tokenizer("a b")["input_ids"] == first.tokenizer("a b")["input_ids"]
+
+            # 源模型的配置变化后快照失效，重新从源模型加载并覆盖快照
+            config = json.loads((source / "config.json").read_text())
+            config["hidden_size_note"] = "changed"
+            (source / "config.json").write_text(json.dumps(config))
+            assert not model_snapshot.is_valid(snapshot_dir, source)
+            _, info = load(source)
+            assert info["source"] == "pretrained" and model_snapshot.is_valid(snapshot_dir, source)
+
+            # 快照格式版本不一致时同样失效
+            manifest_path = snapshot_dir / model_snapshot.MANIFEST_NAME
+            manifest = json.loads(manifest_path.read_text())
+            manifest["format_version"] = model_snapshot.SNAPSHOT_FORMAT_VERSION + 1
+            manifest_path.write_text(json.dumps(manifest))
+            assert not model_snapshot.is_valid(snapshot_dir, source)
+        finally:
+            model_snapshot.MODEL_SNAPSHOT_DIR = snapshot_dir_setting
+    print("✅ 模型快照测试通过")
+    return True
+
+
+if __name__ == "__main__":
+    test_snapshot_roundtrip()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+测试速度/质量档位 (使用桩模型，不需要GPU和模型文件)
+
+检查 fast / balanced / accurate 分别改变送入模型的图片最大边长、max_slice_nums 和 max_new_tokens，
+以及接口对未知档位返回422。
+"""
+import sys
+sys.path.append('src')
+
+import io
+import os
+import tempfile
+from pathlib import Path
+
+os.environ.setdefault("WARMUP_SIZES", "64x64")
+
+from fastapi.testclient import TestClient
+from PIL import Image
+
+import stub_model
+from model_service import ModelService, QUALITY_TIERS
+
+IMAGE_SIZE = (2000, 1500)
+
+
+class RecordingChat:
+    """替换 StubModel.chat，记录每次调用的图片尺寸和生成参数"""
+
+    def __init__(self):
+        self.calls = []
+        self.original = stub_model.StubModel.chat
+
+    def __enter__(self):
+        recorder = self
+
+        def chat(model, msgs=None, tokenizer=None, stream=False, **kwargs):
+            batch = bool(msgs) and isinstance(msgs[0], list)
+            images = [item for m in (msgs if batch else [msgs]) for turn in m for item in turn["content"]
+                      if isinstance(item, Image.Image)]
+            recorder.calls.append({"sizes": [image.size for image in images], "kwargs": kwargs})
+            return recorder.original(model, msgs, tokenizer, stream=stream, **kwargs)
+
+        stub_model.StubModel.chat = chat
+        return self
+
+    def __exit__(self, *exc):
+        stub_model.StubModel.chat = self.original
+
+
+@stub_model.enabled()
+def test_tier_kwargs():
+    """测试各档位的图片尺寸、切片数和生成token上限（单图、批量和流式）"""
+    image = Image.effect_noise(IMAGE_SIZE, 64).convert('RGB')
+    with tempfile.TemporaryDirectory() as tmp:
+        service = ModelService(Path(tmp))
+        assert service.load_model("MiniCPM-V-4_5-int4")
+        service.current_model.delay = 0
+
+        for quality, tier in QUALITY_TIERS.items():
+            with RecordingChat() as recorder:
+                result, _, details = service.analyze_image(image, f"描述{quality}", quality)
+                service.analyze_images([image, image], ["批量1", "批量2"], quality)
+                "".join(service.analyze_image_stream(image, "流式", quality))
+            assert result is not None and details["quality"] == quality
+
+            expected_size = (tier["max_size"], tier["max_size"] * 3 // 4)
+            assert len(recorder.calls) == 3, recorder.calls
+            for call in recorder.calls:
+                assert all(size == expected_size for size in call["sizes"]), (quality, call)
+                kwargs = call["kwargs"]
+                assert kwargs["max_new_tokens"] == tier["max_new_tokens"], (quality, kwargs)
+                if tier["max_slice_nums"] is None:
+                    assert "max_slice_nums" not in kwargs, (quality, kwargs)
+                else:
+                    assert kwargs["max_slice_nums"] == tier["max_slice_nums"], (quality, kwargs)
+
+    # 档位之间确实不同
+    assert QUALITY_TIERS["fast"]["max_slice_nums"] == 1 and QUALITY_TIERS["accurate"]["max_slice_nums"] == 9
+    assert QUALITY_TIERS["fast"]["max_new_tokens"] < QUALITY_TIERS["balanced"]["max_new_tokens"] \
+        < QUALITY_TIERS["accurate"]["max_new_tokens"]
+    print("✅ 档位生成参数测试通过")
+    return True
+
+
+@stub_model.enabled()
+def test_unknown_tier():
+    """测试各接口的 quality 参数为未知档位时返回422，已知档位正常返回"""
+    import main
+    assert main.model_service.load_model("MiniCPM-V-4_5-int4")
+    client = TestClient(main.app)
+    buffer = io.BytesIO()
+    Image.new('RGB', (320, 240), color='red').save(buffer, 'JPEG')
+    data = buffer.getvalue()
+
+    response = client.post("/analyze", files={"file": ("a.jpg", data, "image/jpeg")}, data={"quality": "ultra"})
+    assert response.status_code == 422, response.text
+    response = client.post("/analyze-url", json={"image_url": "http://127.0.0.1:1/a.jpg", "quality": "ultra"})
+    assert response.status_code == 422, response.text
+    response = client.post("/analyze-raw", content=data, params={"quality": "ultra"},
+                           headers={"Content-Type": "image/jpeg"})
+    assert response.status_code == 422, response.text
+
+    with RecordingChat() as recorder:
+        response = client.post("/analyze", files={"file": ("a.jpg", data, "image/jpeg")},
+                               data={"quality": "accurate", "prompt": "档位"})
+    assert response.status_code == 200 and response.json()["quality"] == "accurate", response.text
+    assert recorder.calls[-1]["kwargs"]["max_slice_nums"] == QUALITY_TIERS["accurate"]["max_slice_nums"]
+    print("✅ 未知档位测试通过")
+    return True
+
+
+if __name__ == "__main__":
+    test_tier_kwargs()
+    test_unknown_tier()
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+测试请求流水线 (使用桩模型，不需要GPU和模型文件)
+
+检查各阶段的并发上限、有界队列（满时503）和利用率统计，不同请求的下载/解码/推理阶段互相重叠，
+以及 /analyze-url 通过异步下载阶段完成分析。
+"""
+import sys
+sys.path.append('src')
+
+import asyncio
+import io
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from pathlib import Path
+
+os.environ.setdefault("WARMUP_SIZES", "64x64")
+
+import requests
+from PIL import Image
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from request_pipeline import PipelineStage, RequestPipeline, StageFull
+from test_router import start_process, wait_for
+
+SERVER_PORT = 18222
+SERVER = f"http://127.0.0.1:{SERVER_PORT}"
+IMAGE_PORT = 18223
+
+
+def test_stage_limits():
+    """测试并发上限、排队满时返回503、排队中取消归还名额和利用率统计"""
+    stage = PipelineStage("work", 1, 2, executor=ThreadPoolExecutor(max_workers=1))
+
+    async def scenario():
+        tasks = [asyncio.ensure_future(stage.run(time.sleep, 0.2)) for _ in range(3)]
+        await asyncio.sleep(0.05)
+        snapshot = stage.snapshot()
+        assert snapshot["running"] == 1 and snapshot["waiting"] == 2, snapshot
+        try:
+            await stage.run(time.sleep, 0.2)
+            assert False, "排队已满应当拒绝"
+        except StageFull as e:
+            assert e.status_code == 503 and int(e.headers["Retry-After"]) >= 1
+
+        # 取消排队中的请求后名额立即归还
+        tasks[2].cancel()
+        await asyncio.sleep(0)
+        assert stage.snapshot()["waiting"] == 1
+        await asyncio.gather(*tasks[:2])
+
+        async def fail():
+            raise ValueError("boom")
+
+        async_stage = PipelineStage("async", 2, 4)
+        await asyncio.gather(*[async_stage.run(asyncio.sleep, 0.1) for _ in range(4)])
+        try:
+            await async_stage.run(fail)
+            assert False
+        except ValueError:
+            pass
+        return async_stage.snapshot()
+
+    async_snapshot = asyncio.run(scenario())
+    snapshot = stage.snapshot()
+    assert snapshot["completed"] == 2 and snapshot["rejected"] == 1 and snapshot["waiting"] == 0, snapshot
+    assert 0 < snapshot["utilization"] <= 1 and snapshot["avg_busy_seconds"] >= 0.2
+    assert async_snapshot["completed"] == 4 and async_snapshot["failed"] == 1 and async_snapshot["running"] == 0
+    # 4个请求两两并发，后两个排队，排队时间约为一次执行时间
+    assert async_snapshot["peak_waiting"] == 2 and async_snapshot["avg_wait_seconds"] > 0.03, async_snapshot
+    stage.executor.shutdown()
+    print("✅ 阶段限流测试通过")
+    return True
+
+
+def test_overlap():
+    """测试不同请求的下载、解码、推理阶段重叠执行，推理阶段保持忙碌"""
+    step = 0.1
+    count = 6
+    decode_pool = ThreadPoolExecutor(max_workers=2)
+    pipeline = RequestPipeline(decode_pool, 2, fetch_concurrency=4, inference_concurrency=1)
+
+    async def handle(i):
+        await pipeline.fetch.run(asyncio.sleep, step)
+        await pipeline.decode.run(time.sleep, step)
+        await pipeline.inference.run(time.sleep, step)
+        return i
+
+    async def scenario():
+        start = time.perf_counter()
+        assert await asyncio.gather(*[handle(i) for i in range(count)]) == list(range(count))
+        elapsed = time.perf_counter() - start
+        await pipeline.close()
+        return elapsed
+
+    elapsed = asyncio.run(scenario())
+    # 逐个串行执行需要 3 × 6 × 0.1 = 1.8s；重叠后约为 下载 + 解码 + 6次推理 = 0.8s
+    assert elapsed < 3 * step * count * 0.6, elapsed
+    stats = pipeline.snapshot()
+    assert all(stage["completed"] == count for stage in stats.values()), stats
+    assert stats["inference"]["busy_seconds"] >= step * count and stats["inference"]["peak_waiting"] >= 3
+    decode_pool.shutdown()
+    print(f"✅ 阶段重叠测试通过 ({elapsed:.2f}s，串行需要 {3 * step * count:.1f}s)")
+    return True
+
+
+class ImageHandler(BaseHTTPRequestHandler):
+    """返回测试图片；/text 返回非图片内容，其他路径返回404"""
+
+    def do_GET(self):
+        if self.path.startswith("/image"):
+            buffer = io.BytesIO()
+            Image.new('RGB', (640, 480), color='green').save(buffer, 'JPEG')
+            body, content_type = buffer.getvalue(), "image/jpeg"
+        elif self.path == "/text":
+            body, content_type = b"not an image", "text/plain"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_analyze_url():
+    """测试 /analyze-url 经过下载、解码、推理三个阶段，/stats 报告各阶段统计"""
+    image_server = ThreadingHTTPServer(("127.0.0.1", IMAGE_PORT), ImageHandler)
+    threading.Thread(target=image_server.serve_forever, daemon=True).start()
+    process = start_process("main", SERVER_PORT, {"STUB_MODEL": "true", "PRELOAD_MODEL": "MiniCPM-V-4_5-int4"})
+    try:
+        wait_for(f"{SERVER}/ready", timeout=120)
+
+        def analyze(i):
+            return requests.post(f"{SERVER}/analyze-url", json={
+                "image_url": f"http://127.0.0.1:{IMAGE_PORT}/image/{i}", "prompt": f"第{i}张", "quality": "fast"
+            }, timeout=60)
+
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            responses = [f.result() for f in as_completed([pool.submit(analyze, i) for i in range(4)])]
+        for response in responses:
+            assert response.status_code == 200, response.text
+            data = response.json()
+            assert data["image"] == {"width": 640, "height": 480, "format": "JPEG"} and data["result"]
+
+        response = requests.post(f"{SERVER}/analyze-url", json={"image_url": f"http://127.0.0.1:{IMAGE_PORT}/text"})
+        assert response.status_code == 400, response.text
+        response = requests.post(f"{SERVER}/analyze-url", json={"image_url": f"http://127.0.0.1:{IMAGE_PORT}/missing"})
+        assert response.status_code == 500
+
+        stats = requests.get(f"{SERVER}/stats").json()["pipeline"]
+        # 非图片内容和404在下载阶段失败
+        assert stats["fetch"]["completed"] == 4 and stats["fetch"]["failed"] == 2, stats
+        assert stats["decode"]["completed"] == 4 and stats["inference"]["completed"] == 4, stats
+        assert stats["inference"]["concurrency"] == 1 and stats["inference"]["utilization"] > 0
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+        image_server.shutdown()
+    print("✅ /analyze-url 流水线测试通过")
+    return True
+
+
+if __name__ == "__main__":
+    test_stage_limits()
+    test_overlap()
+    test_analyze_url()
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+测试结果缓存后端 (不需要加载模型)
+
+disk 后端直接使用临时SQLite文件；redis 后端连接本文件内启动的最小Redis兼容服务（只实现 GET/SET/PING）。
+最后用桩模型检查 ModelService 在推理前查询缓存、推理后异步写入。
+"""
+import sys
+sys.path.append('src')
+
+import os
+import socketserver
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+os.environ.setdefault("WARMUP_SIZES", "64x64")
+
+from PIL import Image
+
+import stub_model
+import result_cache
+from result_cache import DiskCache, RedisCache, AsyncCacheWriter, make_key
+
+
+class RespStandIn(socketserver.ThreadingTCPServer):
+    """Redis协议的本地替身：内存字典 + 过期时间"""
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), RespHandler)
+        self.data = {}
+
+
+class RespHandler(socketserver.StreamRequestHandler):
+    def read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        args = []
+        for _ in range(int(line[1:-2])):
+            length = int(self.rfile.readline()[1:-2])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+    def handle(self):
+        while True:
+            args = self.read_command()
+            if args is None:
+                return
+            command = args[0].upper()
+            if command == b"PING":
+                self.wfile.write(b"+PONG\r\n")
+            elif command == b"SET":
+                expires = time.time() + int(args[4]) if len(args) > 4 and args[3].upper() == b"EX" else None
+                self.server.data[args[1]] = (args[2], expires)
+                self.wfile.write(b"+OK\r\n")
+            elif command == b"GET":
+                value, expires = self.server.data.get(args[1], (None, None))
+                if value is None or (expires and expires < time.time()):
+                    self.wfile.write(b"$-1\r\n")
+                else:
+                    self.wfile.write(b"$%d\r\n%s\r\n" % (len(value), value))
+            else:
+                self.wfile.write(b"-ERR unknown command\r\n")
+
+
+def test_disk_cache():
+    """测试SQLite缓存的读写、重启后保留和按容量淘汰"""
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = Path(tmp) / "cache.sqlite3"
+        cache = DiskCache(db_path, max_bytes=2000, ttl_seconds=0)
+        key = make_key("model", "1:fast:abc", "prompt", "digest")
+        assert cache.get(key) is None
+        cache.put(key, {"result": "红色的方块"})
+        assert cache.get(key)["result"] == "红色的方块"
+        cache.close()
+
+        # 重启后仍然存在
+        cache = DiskCache(db_path, max_bytes=2000, ttl_seconds=0)
+        assert cache.get(key)["result"] == "红色的方块"
+
+        # 超过容量后淘汰最久未访问的条目，刚访问过的条目保留
+        for i in range(20):
+            cache.put(make_key("model", "1", f"p{i}", "d"), {"result": "x" * 100})
+            cache.get(key)
+        assert cache.total_bytes <= 2000
+        assert cache.evicted > 0
+        assert cache.get(key) is not None
+        assert cache.get(make_key("model", "1", "p0", "d")) is None
+        cache.close()
+    print("✅ disk 缓存测试通过")
+    return True
+
+
+def test_redis_cache():
+    """测试网络KV缓存（本地Redis兼容替身），包括服务端断开后的重连"""
+    server = RespStandIn()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    port = server.server_address[1]
+    try:
+        cache = RedisCache(f"redis://127.0.0.1:{port}/0", ttl_seconds=60)
+        key = make_key("model", "1", "prompt", "digest")
+        assert cache.get(key) is None
+        cache.put(key, {"result": "结果", "details": {"vision_tokens": 64}})
+        assert cache.get(key) == {"result": "结果", "details": {"vision_tokens": 64}}
+
+        # 连接断开后自动重连
+        cache._conn._sock.close()
+        assert cache.get(key)["result"] == "结果"
+
+        # 两个实例（模拟两个副本）共享同一份缓存
+        other = RedisCache(f"redis://127.0.0.1:{port}/0")
+        assert other.get(key)["result"] == "结果"
+        cache.close()
+        other.close()
+
+        # 缓存服务不可用时视为未命中，不抛出异常
+        unavailable = RedisCache("redis://127.0.0.1:1/0")
+        assert unavailable.get(key) is None
+        unavailable.put(key, {"result": "x"})
+        assert unavailable.errors == 2
+    finally:
+        server.shutdown()
+        server.server_close()
+    print("✅ redis 缓存测试通过")
+    return True
+
+
+@stub_model.enabled()
+def test_model_service_cache():
+    """测试 analyze_image / analyze_images 在推理前查询缓存"""
+    from model_service import ModelService
+
+    with tempfile.TemporaryDirectory() as tmp:
+        service = ModelService(Path(tmp))
+        service.result_cache = AsyncCacheWriter(DiskCache(Path(tmp) / "cache.sqlite3"))
+        assert service.load_model("MiniCPM-V-4_5-int4")
+        image = Image.new('RGB', (320, 240), color='red')
+
+        result, _, details = service.analyze_image(image, "这是什么？", "fast")
+        assert details["cached"] is False
+        service.result_cache.flush()
+
+        cached_result, elapsed, details = service.analyze_image(image.copy(), "这是什么？", "fast")
+        assert details["cached"] is True and cached_result == result
+        assert elapsed < service.current_model.delay
+
+        # 不同提示词、档位或模型不会命中
+        assert service.analyze_image(image, "另一个问题", "fast")[2]["cached"] is False
+        assert service.analyze_image(image, "这是什么？", "accurate")[2]["cached"] is False
+        service.result_cache.flush()
+
+        # 批量分析只推理未命中的图片
+        blue = Image.new('RGB', (320, 240), color='blue')
+        results, _ = service.analyze_images([image, blue], ["这是什么？", "这是什么？"], "fast")
+        assert results[0] == result and results[1] is not None
+        assert service.result_cache.hits >= 2
+
+        assert service.load_model("MiniCPM-V-4-int4")
+        assert service.analyze_image(image, "这是什么？", "fast")[2]["cached"] is False
+        service.result_cache.close()
+    print("✅ ModelService 缓存集成测试通过")
+    return True
+
+
+if __name__ == "__main__":
+    test_disk_cache()
+    test_redis_cache()
+    test_model_service_cache()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+测试多副本路由 (使用桩模型，不需要GPU和模型文件)
+
+在本机启动3个 STUB_MODEL=true 的服务进程和1个路由进程：
+两个副本加载 MiniCPM-V-4_5-int4，一个加载 MiniCPM-V-4-int4，检查按模型路由、负载均衡、会话固定和故障转移。
+"""
+import io
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import requests
+from PIL import Image
+
+SRC_DIR = Path(__file__).resolve().parent.parent / 'src'
+REPLICA_PORTS = [18207, 18208, 18209]
+ROUTER_PORT = 18300
+ROUTER = f"http://127.0.0.1:{ROUTER_PORT}"
+
+
+def start_process(module: str, port: int, env: dict) -> subprocess.Popen:
+    return subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', f'{module}:app', '--host', '127.0.0.1', '--port', str(port)],
+        cwd=SRC_DIR, env={**os.environ, **env},
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+
+
+def wait_for(url: str, timeout: float = 60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if requests.get(url, timeout=2).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError(f"等待 {url} 超时")
+
+
+def test_image() -> bytes:
+    buffer = io.BytesIO()
+    Image.new('RGB', (320, 240), color='blue').save(buffer, 'JPEG')
+    return buffer.getvalue()
+
+
+def analyze(model: str, prompt: str = "这是什么？"):
+    return requests.post(
+        f"{ROUTER}/analyze",
+        files={"file": ("test.jpg", test_image(), "image/jpeg")},
+        data={"prompt": prompt, "quality": "fast"},
+        headers={"X-Model": model},
+        timeout=60
+    )
+
+
+def test_router():
+    """测试按模型路由、负载均衡、会话固定和故障转移"""
+    processes = []
+    with tempfile.TemporaryDirectory() as tmp:
+        try:
+            for port in REPLICA_PORTS:
+                processes.append(start_process('main', port, {
+                    "STUB_MODEL": "true",
+                    "STUB_MODEL_DELAY": "0.3",
+                    "WARMUP_SIZES": "64x64",
+                    "JOB_DB_PATH": str(Path(tmp) / f"jobs-{port}.sqlite3"),
+                }))
+            for port in REPLICA_PORTS:
+                wait_for(f"http://127.0.0.1:{port}/health")
+
+            models = ["MiniCPM-V-4_5-int4", "MiniCPM-V-4_5-int4", "MiniCPM-V-4-int4"]
+            for port, model in zip(REPLICA_PORTS, models):
+                response = requests.post(f"http://127.0.0.1:{port}/load-model", json={"model_name": model}, timeout=60)
+                assert response.status_code == 200, response.text
+
+            processes.append(start_process('router', ROUTER_PORT, {
+                "ROUTER_REPLICAS": ",".join(f"http://127.0.0.1:{port}" for port in REPLICA_PORTS),
+                "ROUTER_POLL_INTERVAL": "0.5",
+            }))
+            wait_for(f"{ROUTER}/health")
+
+            # 按模型路由
+            response = analyze("MiniCPM-V-4-int4")
+            assert response.status_code == 200, response.text
+            assert response.headers["X-Routed-To"].endswith(str(REPLICA_PORTS[2]))
+            assert response.json()["model_used"] == "MiniCPM-V-4-int4"
+
+            # 并发请求分散到两个已加载 4.5 的副本
+            with ThreadPoolExecutor(max_workers=6) as executor:
+                responses = list(executor.map(lambda i: analyze("MiniCPM-V-4_5-int4", f"q{i}"), range(6)))
+            routed_to = {r.headers["X-Routed-To"] for r in responses}
+            assert all(r.status_code == 200 for r in responses)
+            assert routed_to == {f"http://127.0.0.1:{port}" for port in REPLICA_PORTS[:2]}, routed_to
+
+            # 没有副本加载该模型
+            response = requests.post(f"{ROUTER}/analyze-url", json={"image_url": "http://example.com/a.jpg"},
+                                     params={"model": "unknown-model"}, timeout=10)
+            assert response.status_code == 503
+
+            # 会话固定在创建它的副本上
+            response = requests.post(f"{ROUTER}/sessions", files={"file": ("a.jpg", test_image(), "image/jpeg")},
+                                     data={"prompt": "第一轮"}, headers={"X-Model": "MiniCPM-V-4_5-int4"}, timeout=60)
+            assert response.status_code == 200, response.text
+            session_id = response.json()["session_id"]
+            session_replica = response.headers["X-Routed-To"]
+            for _ in range(3):
+                response = requests.post(f"{ROUTER}/sessions/{session_id}/messages", data={"prompt": "追问"}, timeout=60)
+                assert response.status_code == 200, response.text
+                assert response.headers["X-Routed-To"] == session_replica
+
+            # 故障转移：停掉一个 4.5 副本后请求转发到另一个
+            processes[0].terminate()
+            processes[0].wait()
+            for _ in range(4):
+                response = analyze("MiniCPM-V-4_5-int4")
+                assert response.status_code == 200, response.text
+                assert response.headers["X-Routed-To"].endswith(str(REPLICA_PORTS[1]))
+
+            status = requests.get(f"{ROUTER}/router/status", timeout=5).json()
+            print(status)
+        finally:
+            for process in processes:
+                process.terminate()
+            for process in processes:
+                process.wait()
+    print("✅ 多副本路由测试通过")
+    return True
+
+
+if __name__ == "__main__":
+    test_router()
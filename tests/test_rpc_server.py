@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+测试二进制RPC服务端 (使用桩模型，不需要GPU和模型文件)
+
+在一条 WebSocket 连接上检查 analyze、analyze_stream、批量上传、多轮对话和 error 帧，
+解码和推理经过请求流水线的 decode / inference 阶段，以及无效帧只对该请求返回错误、不会关闭连接上其他进行中的请求。
+"""
+import sys
+sys.path.append('src')
+
+import io
+import os
+
+os.environ.setdefault("WARMUP_SIZES", "64x64")
+
+import msgpack
+from PIL import Image
+from fastapi.testclient import TestClient
+
+import stub_model
+
+
+def image_bytes(color: str = 'red', size=(320, 240)) -> bytes:
+    buffer = io.BytesIO()
+    Image.new('RGB', size, color=color).save(buffer, 'JPEG')
+    return buffer.getvalue()
+
+
+class Connection:
+    """按 id 收集响应帧的测试连接"""
+
+    def __init__(self, websocket):
+        self.websocket = websocket
+        self.pending = []
+
+    def send(self, frame):
+        self.websocket.send_bytes(msgpack.packb(frame, use_bin_type=True))
+
+    def recv(self, req_id):
+        for i, frame in enumerate(self.pending):
+            if frame.get("id") == req_id:
+                return self.pending.pop(i)
+        while True:
+            frame = msgpack.unpackb(self.websocket.receive_bytes(), raw=False)
+            if frame.get("id") == req_id:
+                return frame
+            self.pending.append(frame)
+
+
+def create_app():
+    """
+    已加载桩模型的服务实例（调用方需启用桩模型）
+
+    不触发 startup/shutdown 事件：shutdown 会关闭进程内共享的预处理线程池，后续测试将无法使用。
+    """
+    import main
+    assert main.model_service.load_model("MiniCPM-V-4_5-int4")
+    return main
+
+
+@stub_model.enabled()
+def test_rpc_methods():
+    """测试单次分析、流式分析、批量上传和多轮对话，解码和推理都经过流水线"""
+    main = create_app()
+    before = main.pipeline.snapshot()
+    with TestClient(main.app).websocket_connect("/rpc") as websocket:
+        conn = Connection(websocket)
+
+        conn.send({"id": 1, "method": "analyze", "image": image_bytes(), "prompt": "描述", "quality": "fast"})
+        frame = conn.recv(1)
+        assert frame["type"] == "result" and frame["result"].startswith("[stub:MiniCPM-V-4_5-int4] 描述"), frame
+        assert frame["quality"] == "fast"
+
+        conn.send({"id": 2, "method": "analyze_stream", "image": image_bytes(), "prompt": "流式"})
+        texts = []
+        while True:
+            frame = conn.recv(2)
+            if frame["type"] == "end":
+                break
+            assert frame["type"] == "token"
+            texts.append(frame["text"])
+        assert "".join(texts).startswith("[stub:")
+
+        conn.send({"id": 3, "method": "batch_start", "prompt": "批量", "quality": "fast"})
+        conn.send({"id": 3, "method": "batch_item", "image": image_bytes('red')})
+        conn.send({"id": 3, "method": "batch_item", "image": b"not an image"})
+        conn.send({"id": 3, "method": "batch_item", "image": image_bytes('blue'), "prompt": "第三张"})
+        conn.send({"id": 3, "method": "batch_end"})
+        frame = conn.recv(3)
+        results = frame["results"]
+        assert [r["status"] for r in results] == ["success", "error", "success"], results
+        assert " 批量 " in results[0]["result"] and " 第三张 " in results[2]["result"]
+
+        conn.send({"id": 4, "method": "session_start", "image": image_bytes(), "prompt": "第一轮", "quality": "fast"})
+        frame = conn.recv(4)
+        assert frame["type"] == "result" and frame["turn"] == 1
+        session_id = frame["session_id"]
+        conn.send({"id": 5, "method": "session_message", "session_id": session_id, "prompt": "第二轮"})
+        frame = conn.recv(5)
+        assert frame["turn"] == 2 and frame["vision_cached"] and " 第二轮 " in frame["result"], frame
+        conn.send({"id": 6, "method": "session_close", "session_id": session_id})
+        assert conn.recv(6)["closed"] is True
+
+    after = main.pipeline.snapshot()
+    # 解码：单次、流式、批量中的两张有效图片和会话第一轮；推理：单次、流式、一个批次和会话两轮
+    assert after["decode"]["completed"] - before["decode"]["completed"] == 5, after
+    assert after["inference"]["completed"] - before["inference"]["completed"] == 5, after
+    print("✅ RPC 方法测试通过")
+    return True
+
+
+@stub_model.enabled()
+def test_rpc_errors():
+    """测试各类错误帧，以及错误不影响同一连接上进行中的请求"""
+    main = create_app()
+    with TestClient(main.app).websocket_connect("/rpc") as websocket:
+        conn = Connection(websocket)
+        # 先发起一个请求，之后的无效帧不能中断它
+        conn.send({"id": 1, "method": "analyze", "image": image_bytes(), "prompt": "进行中"})
+
+        websocket.send_bytes(b"\xc1")
+        assert conn.recv(None)["status"] == 400
+        conn.send([1, 2, 3])
+        frame = conn.recv(None)
+        assert frame["type"] == "error" and frame["status"] == 400 and "map" in frame["detail"]
+
+        conn.send({"id": 2, "method": "batch_start", "quality": "ultra"})
+        frame = conn.recv(2)
+        assert frame["type"] == "error" and frame["status"] == 400 and "ultra" in frame["detail"]
+        conn.send({"id": 3, "method": "batch_item", "image": image_bytes()})
+        assert conn.recv(3)["detail"] == "批量请求未开始"
+        conn.send({"id": [4], "method": "batch_start"})
+        assert conn.recv([4])["type"] == "error"
+        conn.send({"id": 5, "method": "nonexistent"})
+        assert conn.recv(5)["status"] == 400
+        conn.send({"id": 6, "method": "analyze", "image": "not bytes"})
+        assert conn.recv(6)["status"] == 400
+        conn.send({"id": 7, "method": "session_message", "session_id": "missing", "prompt": "?"})
+        assert conn.recv(7)["status"] == 404
+
+        frame = conn.recv(1)
+        assert frame["type"] == "result" and " 进行中 " in frame["result"], frame
+        # 连接仍然可用
+        conn.send({"id": 8, "method": "analyze", "image": image_bytes(), "quality": "fast"})
+        assert conn.recv(8)["type"] == "result"
+    print("✅ RPC 错误帧测试通过")
+    return True
+
+
+if __name__ == "__main__":
+    test_rpc_methods()
+    test_rpc_errors()
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+测试多轮对话会话存储 (使用桩模型，不需要GPU和模型文件)
+
+检查会话空闲过期、超出内存预算时按最近最少使用顺序淘汰，以及第二轮对话复用缓存的视觉编码结果而不重新编码。
+"""
+import sys
+sys.path.append('src')
+
+import tempfile
+from pathlib import Path
+
+import torch
+from PIL import Image
+
+import stub_model
+from session_store import SessionStore, ChatSession, SessionTooLarge
+
+
+def create_service(tmp: str):
+    """已加载桩模型的 ModelService（调用方需启用桩模型）"""
+    from model_service import ModelService
+
+    service = ModelService(Path(tmp))
+    assert service.load_model("MiniCPM-V-4_5-int4")
+    service.current_model.delay = 0
+    return service
+
+
+def test_ttl_expiry():
+    """测试空闲超过TTL的会话过期，使用中的会话刷新过期时间"""
+    store = SessionStore(ttl_seconds=60)
+    idle = store.create("fast")
+    active = store.create("fast")
+    idle.last_used -= 120
+    active.last_used -= 50
+    assert store.get(active.id) is active
+    assert store.get(idle.id) is None
+    assert store.evicted["expired"] == 1
+
+    # 创建新会话时清理其他已过期的会话
+    active.last_used -= 120
+    store.create("fast")
+    assert store.get(active.id) is None and store.snapshot()["active"] == 1
+    assert store.evicted["expired"] == 2
+    print("✅ 会话过期测试通过")
+    return True
+
+
+def test_lru_eviction():
+    """测试超出内存预算时淘汰最近最少使用的会话，单个会话超出预算时只丢弃其视觉缓存"""
+    session_bytes = ChatSession("probe", "fast")
+    session_bytes.messages = [{"role": "user", "content": ["x" * 1000]}]
+    size = session_bytes.compute_memory()
+
+    store = SessionStore(ttl_seconds=60, max_bytes=size * 2)
+    sessions = [store.create("fast") for _ in range(3)]
+    for session in sessions[:2]:
+        session.messages = [{"role": "user", "content": ["x" * 1000]}]
+        store.update_memory(session)
+    assert store.memory_bytes == size * 2
+
+    # 访问第一个会话后，第二个成为最近最少使用的会话
+    assert store.get(sessions[0].id) is sessions[0]
+    sessions[2].messages = [{"role": "user", "content": ["x" * 1000]}]
+    store.update_memory(sessions[2])
+    assert store.get(sessions[1].id) is None
+    assert store.get(sessions[0].id) is sessions[0] and store.get(sessions[2].id) is sessions[2]
+    assert store.evicted["memory"] == 1 and store.memory_bytes <= store.max_bytes
+
+    # 单个会话的视觉缓存超出预算：丢弃缓存，保留历史消息
+    large = store.create("fast")
+    large.messages = [{"role": "user", "content": ["hi"]}]
+    large.vision_hidden_states = [torch.zeros(size, dtype=torch.float32)]
+    store.update_memory(large)
+    assert large.vision_hidden_states is None and large.messages
+    print("✅ 会话LRU淘汰测试通过")
+    return True
+
+
+@stub_model.enabled()
+def test_oversized_session():
+    """测试单个会话的历史消息超出预算时丢弃最早的轮次，单轮内容本身超出预算时在推理前返回413"""
+    with tempfile.TemporaryDirectory() as tmp:
+        service = create_service(tmp)
+        image = Image.new('RGB', (64, 64), color='red')
+        # 预算只够保存两轮带图片的对话
+        store = SessionStore(ttl_seconds=60, max_bytes=64 * 64 * 3 * 2 + 1000)
+        other = store.create("fast")
+        other.messages = [{"role": "user", "content": ["x" * 100]}]
+        store.update_memory(other)
+
+        session = store.create("fast")
+        for i in range(4):
+            assert store.chat(session, service, f"第{i}轮", image)["result"] is not None
+            assert store.memory_bytes <= store.max_bytes, (i, store.memory_bytes)
+            assert session.memory_bytes == session.compute_memory()
+        # 最早的轮次被丢弃，保留最近的一问一答，消息仍然成对
+        prompts = [m["content"][-1] for m in session.messages if m["role"] == "user"]
+        assert prompts[-1] == "第3轮" and "第0轮" not in prompts and len(session.messages) % 2 == 0, prompts
+        assert session.vision_hidden_states is None
+        assert store.snapshot()["trimmed_turns"] == 4 - len(prompts)
+        assert store.get(session.id) is session
+
+        history = list(session.messages)
+        calls = service.current_model.vision_encodes
+        try:
+            store.chat(session, service, "太大", Image.new('RGB', (128, 128)))
+            assert False, "超出预算的单轮内容应当被拒绝"
+        except SessionTooLarge as e:
+            assert e.status_code == 413
+        assert session.messages == history and service.current_model.vision_encodes == calls
+    print("✅ 单个会话超出预算测试通过")
+    return True
+
+
+@stub_model.enabled()
+def test_vision_cache_reuse():
+    """测试第二轮对话复用第一轮的视觉编码结果，不再调用视觉编码器"""
+    with tempfile.TemporaryDirectory() as tmp:
+        service = create_service(tmp)
+        model = service.current_model
+        store = SessionStore(ttl_seconds=60)
+        session = store.create("fast")
+        image = Image.new('RGB', (320, 240), color='red')
+        # 加载时的预热推理同样会编码图片
+        encodes = model.vision_encodes
+
+        first = store.chat(session, service, "第一轮", image)
+        assert first["result"].startswith("[stub:MiniCPM-V-4_5-int4] 第一轮 (320x240)"), first
+        assert first["turn"] == 1 and not first["vision_cached"]
+        assert model.vision_encodes == encodes + 1 and session.vision_hidden_states is not None
+        assert session.memory_bytes > 320 * 240 * 3
+
+        second = store.chat(session, service, "第二轮")
+        assert second["turn"] == 2 and second["vision_cached"], second
+        assert " 第二轮 (320x240)" in second["result"]
+        assert model.vision_encodes == encodes + 1, "第二轮不应重新编码图片"
+
+        # 新图片需要重新编码
+        third = store.chat(session, service, "第三轮", Image.new('RGB', (64, 64), color='blue'))
+        assert third["turn"] == 3 and not third["vision_cached"] and model.vision_encodes == encodes + 2
+        snapshot = store.snapshot()
+        assert snapshot["vision_cache_hits"] == 1 and snapshot["vision_cache_misses"] == 2, snapshot
+    print("✅ 视觉编码缓存复用测试通过")
+    return True
+
+
+if __name__ == "__main__":
+    test_ttl_expiry()
+    test_lru_eviction()
+    test_oversized_session()
+    test_vision_cache_reuse()
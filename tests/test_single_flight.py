@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+测试相同请求合并执行 (single-flight，使用桩模型，不需要GPU和模型文件)
+
+检查执行者与等待者共享一次执行的结果、异常传递给所有等待者、执行者被取消后协程继续执行完成，
+以及 /analyze 的合并执行单元接管上传的临时文件，执行者被取消时不会提前关闭。
+"""
+import sys
+sys.path.append('src')
+
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from tempfile import SpooledTemporaryFile
+
+os.environ.setdefault("WARMUP_SIZES", "64x64")
+
+from PIL import Image
+
+import stub_model
+from single_flight import SingleFlight, file_digest
+
+
+def test_sync_sharing():
+    """测试同步版本：并发的相同 key 只执行一次，执行结束后 key 立即释放"""
+    flight = SingleFlight()
+    calls = []
+    started = threading.Event()
+
+    def work(value):
+        calls.append(value)
+        started.set()
+        time.sleep(0.2)
+        return value * 2
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        leader = pool.submit(flight.do, "k", work, 21)
+        started.wait()
+        followers = [pool.submit(flight.do, "k", work, 0) for _ in range(3)]
+        assert leader.result() == (42, False)
+        assert [f.result() for f in followers] == [(42, True)] * 3
+    assert calls == [21]
+    assert flight.do("k", work, 1) == (2, False), "结束后不缓存结果"
+    assert flight.snapshot() == {"in_flight": 0, "leaders": 2, "coalesced": 3}
+    print("✅ 同步合并执行测试通过")
+    return True
+
+
+def test_async_sharing():
+    """测试执行者与等待者共享结果，异常传递给所有等待者"""
+    flight = SingleFlight()
+    calls = []
+
+    async def work(value):
+        calls.append(value)
+        await asyncio.sleep(0.1)
+        if value < 0:
+            raise ValueError(f"bad value {value}")
+        return value * 2
+
+    async def scenario():
+        results = await asyncio.gather(*[flight.do_await("a", work, 21) for _ in range(3)])
+        assert results == [(42, False), (42, True), (42, True)], results
+
+        errors = await asyncio.gather(*[flight.do_await("b", work, -1) for _ in range(3)],
+                                      return_exceptions=True)
+        assert all(isinstance(e, ValueError) and str(e) == "bad value -1" for e in errors), errors
+
+        # 不同 key 互不影响
+        assert await asyncio.gather(flight.do_await("c", work, 1), flight.do_await("d", work, 2)) == \
+            [(2, False), (4, False)]
+
+    asyncio.run(scenario())
+    assert calls == [21, -1, 1, 2]
+    assert flight.snapshot() == {"in_flight": 0, "leaders": 4, "coalesced": 4}
+    print("✅ 异步合并执行与异常传递测试通过")
+    return True
+
+
+def test_leader_cancelled():
+    """测试执行者被取消后协程继续执行，等待者仍能拿到结果；等待者被取消不影响其他请求"""
+    flight = SingleFlight()
+    finished = []
+
+    async def work():
+        await asyncio.sleep(0.2)
+        finished.append(True)
+        return "done"
+
+    async def scenario():
+        leader = asyncio.ensure_future(flight.do_await("k", work))
+        await asyncio.sleep(0.05)
+        follower = asyncio.ensure_future(flight.do_await("k", work))
+        cancelled_follower = asyncio.ensure_future(flight.do_await("k", work))
+        await asyncio.sleep(0.05)
+        leader.cancel()
+        cancelled_follower.cancel()
+        assert await follower == ("done", True)
+        assert leader.cancelled() and cancelled_follower.cancelled()
+
+    asyncio.run(scenario())
+    assert finished == [True]
+    assert flight.snapshot()["in_flight"] == 0
+    print("✅ 执行者取消测试通过")
+    return True
+
+
+def jpeg_spool() -> SpooledTemporaryFile:
+    spool = SpooledTemporaryFile(max_size=1024)
+    Image.new('RGB', (320, 240), color='red').save(spool, 'JPEG')
+    spool.seek(0)
+    return spool
+
+
+@stub_model.enabled()
+def test_spool_ownership():
+    """测试 /analyze 的合并执行单元接管临时文件：执行者的请求被取消后仍能完成解码，结束后关闭文件"""
+    import main
+    assert main.model_service.load_model("MiniCPM-V-4_5-int4")
+
+    async def scenario():
+        spool = jpeg_spool()
+        key = ("spool", file_digest(spool))
+        leader = asyncio.ensure_future(main.single_flight.do_await(
+            key, main.decode_and_analyze, spool, "描述", "fast"))
+        await asyncio.sleep(0)
+        follower_spool = jpeg_spool()
+        follower = asyncio.ensure_future(main.single_flight.do_await(
+            key, main.decode_and_analyze, follower_spool, "描述", "fast"))
+        await asyncio.sleep(0)
+        leader.cancel()
+        (result, _, _), coalesced = await follower
+        assert coalesced and result.startswith("[stub:MiniCPM-V-4_5-int4] 描述"), result
+        assert spool.closed, "合并执行的协程应在解码后关闭临时文件"
+        follower_spool.close()
+
+    asyncio.run(scenario())
+    print("✅ 临时文件所有权测试通过")
+    return True
+
+
+if __name__ == "__main__":
+    test_sync_sharing()
+    test_async_sharing()
+    test_leader_cancelled()
+    test_spool_ownership()
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+测试上传大小和像素数限制 (使用桩模型，不需要GPU和模型文件)
+
+检查上传超过字节上限时读到上限即停止并返回413、Content-Length 超限的请求在读取请求体之前被拒绝、
+头部声明的像素数超过上限的图片在解码前被拒绝，以及截断或非图片的内容返回400。
+"""
+import sys
+sys.path.append('src')
+
+import asyncio
+import io
+import os
+import struct
+import zlib
+
+os.environ.setdefault("WARMUP_SIZES", "64x64")
+
+from fastapi import HTTPException, UploadFile
+from fastapi.testclient import TestClient
+from PIL import Image
+
+import stub_model
+import upload_limits
+
+
+class EndlessFile:
+    """无限长的上传内容，记录被读取的字节数"""
+
+    def __init__(self):
+        self.read_bytes = 0
+
+    def read(self, size: int = -1) -> bytes:
+        size = size if size > 0 else upload_limits.CHUNK_SIZE
+        self.read_bytes += size
+        return b"\0" * size
+
+
+def png_chunk(kind: bytes, data: bytes) -> bytes:
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+
+def png_header(width: int, height: int) -> bytes:
+    """头部声明 width x height、只有一行像素数据的PNG（几十字节）"""
+    ihdr = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return (b"\x89PNG\r\n\x1a\n" + png_chunk(b"IHDR", ihdr) +
+            png_chunk(b"IDAT", zlib.compress(b"\0" * (width * 3 + 1))) + png_chunk(b"IEND", b""))
+
+
+def jpeg_bytes() -> bytes:
+    buffer = io.BytesIO()
+    Image.effect_noise((320, 240), 64).convert('RGB').save(buffer, 'JPEG')
+    return buffer.getvalue()
+
+
+def create_app():
+    """已加载桩模型的服务实例（调用方需启用桩模型，不触发 startup/shutdown 事件）"""
+    import main
+    assert main.model_service.load_model("MiniCPM-V-4_5-int4")
+    return main
+
+
+def post_image(client, data: bytes):
+    return client.post("/analyze", files={"file": ("a.jpg", data, "image/jpeg")},
+                       data={"quality": "fast"}, headers={"X-Request-Timeout": "60"})
+
+
+def test_spool_cap():
+    """测试超过字节上限时读到上限所在的分块即停止并返回413，未超限的内容完整保存"""
+    rejected = upload_limits.tracker.snapshot()["rejected"]["bytes"]
+    limit = 3 * upload_limits.CHUNK_SIZE + 100
+
+    async def scenario():
+        endless = EndlessFile()
+        with upload_limits.tracker.track() as usage:
+            try:
+                await upload_limits.spool_upload(UploadFile(endless), usage, max_bytes=limit)
+                assert False, "应当返回413"
+            except HTTPException as e:
+                assert e.status_code == 413, e.detail
+        assert endless.read_bytes == 4 * upload_limits.CHUNK_SIZE, endless.read_bytes
+
+        data = os.urandom(limit)
+        with upload_limits.tracker.track() as usage:
+            spool = await upload_limits.spool_upload(UploadFile(io.BytesIO(data)), usage, max_bytes=limit)
+            assert spool.read() == data
+            spool.close()
+
+    asyncio.run(scenario())
+    assert upload_limits.tracker.snapshot()["rejected"]["bytes"] == rejected + 1
+    assert upload_limits.tracker.snapshot()["in_flight"] == 0
+    print("✅ 上传字节上限测试通过")
+    return True
+
+
+@stub_model.enabled()
+def test_content_length():
+    """测试 Content-Length 超过上限的请求由中间件直接返回413，不读取请求体"""
+    main = create_app()
+
+    async def request(path: str, content_length: int):
+        sent = []
+
+        async def receive():
+            # 请求体永远不会到达：读取请求体的请求会一直等待直到超时
+            await asyncio.Event().wait()
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+                 "scheme": "http", "path": path, "raw_path": path.encode(), "root_path": "", "query_string": b"",
+                 "headers": [(b"content-type", b"image/jpeg"), (b"content-length", str(content_length).encode())],
+                 "client": ("127.0.0.1", 50000), "server": ("testserver", 80)}
+        await asyncio.wait_for(main.app(scope, receive, send), timeout=5)
+        return sent[0]["status"]
+
+    uploads = upload_limits.tracker.snapshot()
+    for path, limit in (("/analyze", upload_limits.MAX_REQUEST_BYTES),
+                        ("/analyze-raw", upload_limits.MAX_RAW_PIXEL_BYTES)):
+        assert asyncio.run(request(path, limit + 1)) == 413, path
+    after = upload_limits.tracker.snapshot()
+    assert after["total"] == uploads["total"], "接口不应开始读取上传内容"
+    assert after["rejected"]["bytes"] == uploads["rejected"]["bytes"] + 2
+    print("✅ Content-Length 上限测试通过")
+    return True
+
+
+@stub_model.enabled()
+def test_pixel_limit():
+    """测试头部声明的像素数超过上限的图片在解码前返回413"""
+    main = create_app()
+    client = TestClient(main.app)
+    decode = main.pipeline.snapshot()["decode"]
+    rejected = upload_limits.tracker.snapshot()["rejected"]["pixels"]
+
+    side = int(upload_limits.MAX_IMAGE_PIXELS ** 0.5) + 1
+    # 超过上限：像素数检查；超过上限2倍：PIL 的解压炸弹检查
+    for width, height in ((side, side), (side * 2, side * 2)):
+        response = post_image(client, png_header(width, height))
+        assert response.status_code == 413, (width, height, response.text)
+
+    after = main.pipeline.snapshot()["decode"]
+    assert after["completed"] + after["failed"] == decode["completed"] + decode["failed"], "不应进入解码阶段"
+    assert upload_limits.tracker.snapshot()["rejected"]["pixels"] == rejected + 2
+
+    try:
+        upload_limits.check_pixels(0, 10)
+        assert False, "无效尺寸应返回400"
+    except HTTPException as e:
+        assert e.status_code == 400
+    print("✅ 像素数上限测试通过")
+    return True
+
+
+@stub_model.enabled()
+def test_bad_images():
+    """测试非图片内容、头部被截断和像素数据被截断的图片都返回400"""
+    main = create_app()
+    client = TestClient(main.app)
+    data = jpeg_bytes()
+    rejected = upload_limits.tracker.snapshot()["rejected"]["format"]
+
+    for body in (b"not an image", data[:20], data[:len(data) // 2]):
+        response = post_image(client, body)
+        assert response.status_code == 400, (len(body), response.status_code, response.text)
+    assert upload_limits.tracker.snapshot()["rejected"]["format"] == rejected + 3
+
+    response = post_image(client, data)
+    assert response.status_code == 200 and response.json()["image"]["width"] == 320, response.text
+    assert upload_limits.tracker.snapshot()["in_flight"] == 0
+    print("✅ 无效图片测试通过")
+    return True
+
+
+if __name__ == "__main__":
+    test_spool_cap()
+    test_content_length()
+    test_pixel_limit()
+    test_bad_images()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+测试视频抽帧和视频分析 (使用桩模型，不需要GPU和模型文件)
+
+用 PyAV 生成合成视频：若干段静止画面，段与段之间颜色变化，检查近似重复帧去除、帧数上限和接口返回。
+"""
+import sys
+sys.path.append('src')
+
+import io
+import os
+import tempfile
+from pathlib import Path
+
+os.environ.setdefault("WARMUP_SIZES", "64x64")
+
+import numpy as np
+
+import stub_model
+from video_frames import FrameSampler, sample_video
+
+SEGMENT_COLORS = [(200, 30, 30), (30, 200, 30), (30, 30, 200), (220, 220, 40)]
+
+
+def make_video(seconds_per_segment: float = 2.0, fps: int = 10, size=(320, 240)) -> bytes:
+    """生成由若干静止色块组成的 mp4 视频"""
+    import av
+
+    buffer = io.BytesIO()
+    with av.open(buffer, mode="w", format="mp4") as container:
+        stream = container.add_stream("mpeg4", rate=fps)
+        stream.width, stream.height = size
+        stream.pix_fmt = "yuv420p"
+        for color in SEGMENT_COLORS:
+            for _ in range(int(seconds_per_segment * fps)):
+                array = np.full((size[1], size[0], 3), color, dtype=np.uint8)
+                frame = av.VideoFrame.from_ndarray(array, format="rgb24")
+                for packet in stream.encode(frame):
+                    container.mux(packet)
+        for packet in stream.encode():
+            container.mux(packet)
+    return buffer.getvalue()
+
+
+def test_frame_sampler():
+    """测试采样器在未知时长时保持帧数上限且帧均匀分布"""
+    sampler = FrameSampler(max_frames=8, duration=None, sample_fps=10, dedup_threshold=0)
+    for i in range(1000):
+        timestamp = i / 10
+        if sampler.wants(timestamp):
+            sampler.add(timestamp, np.full((16, 16), i % 256, dtype=np.float32), lambda: timestamp)
+    assert len(sampler.frames) <= 8
+    assert sampler.decimations > 0
+    times = [f["time"] for f in sampler.frames]
+    assert times[0] == 0 and times[-1] > 50, times
+    print("✅ 自适应采样测试通过")
+    return True
+
+
+def test_sample_video():
+    """测试静止画面去重和帧数上限"""
+    data = make_video()
+    video = sample_video(io.BytesIO(data), max_frames=16)
+    assert video["source_size"] == [320, 240]
+    assert 7 < video["duration_seconds"] < 9
+    # 4段静止画面，每段只保留一帧
+    assert video["frames_used"] == len(SEGMENT_COLORS), video
+    assert video["deduplicated_frames"] > 0
+    assert all(frame.size == (320, 240) for frame in video["frames"])
+    assert video["timestamps"] == sorted(video["timestamps"])
+
+    # 关闭去重时受 max_frames 限制
+    sampler_video = sample_video(io.BytesIO(data), max_frames=5, frame_size=160, dedup_threshold=-1)
+    assert 0 < sampler_video["frames_used"] <= 5
+    assert sampler_video["frames"][0].size == (160, 120)
+
+    try:
+        sample_video(io.BytesIO(b"not a video"))
+        assert False, "应当拒绝无效视频"
+    except ValueError:
+        pass
+    print("✅ 视频抽帧测试通过")
+    return True
+
+
+@stub_model.enabled()
+def test_analyze_video():
+    """测试 ModelService.analyze_video 一次推理处理全部帧"""
+    from model_service import ModelService
+
+    with tempfile.TemporaryDirectory() as tmp:
+        service = ModelService(Path(tmp))
+        assert service.load_model("MiniCPM-V-4_5-int4")
+        video = sample_video(io.BytesIO(make_video()))
+        result, _, details = service.analyze_video(video["frames"], "视频里发生了什么？", "fast")
+        assert result is not None and "视频里发生了什么" in result
+        assert details["frames"] == len(SEGMENT_COLORS)
+        assert details["quality"] == "fast"
+    print("✅ 视频分析测试通过")
+    return True
+
+
+if __name__ == "__main__":
+    test_frame_sampler()
+    test_sample_video()
+    test_analyze_video()
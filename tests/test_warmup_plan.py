@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+测试多尺寸预热计划 (使用桩模型，不需要GPU和模型文件)
+
+检查 WARMUP_SIZES 的解析、格式错误尺寸的处理、批量和流式步骤，
+以及加载模型时按计划完成所有预热推理之后模型才变为 ready。
+"""
+import sys
+sys.path.append('src')
+
+import tempfile
+from pathlib import Path
+
+from PIL import Image
+
+import model_service
+import stub_model
+from model_service import ModelService, parse_warmup_plan
+
+
+def test_parse_plan():
+    """测试尺寸列表、批量和流式步骤，以及格式错误的尺寸被跳过"""
+    plan = parse_warmup_plan("448x448, 1024X576,,576x1024", 0, False)
+    assert [step["size"] for step in plan] == [(448, 448), (1024, 576), (576, 1024)]
+    assert [step["name"] for step in plan] == ["single_448x448", "single_1024x576", "single_576x1024"]
+    assert all(step["kind"] == "single" for step in plan)
+
+    plan = parse_warmup_plan("640x480,320x240", 4, True)
+    assert [step["kind"] for step in plan] == ["single", "single", "batch", "stream"]
+    assert plan[2] == {"name": "batch_4", "kind": "batch", "size": (640, 480), "batch_size": 4}
+    assert plan[3]["size"] == (640, 480)
+    # 批量大小为1时与单图推理相同，不追加批量步骤
+    assert [step["kind"] for step in parse_warmup_plan("64x64", 1, False)] == ["single"]
+
+    plan = parse_warmup_plan("abc,640,0x480,1x2x3,-5x10,320x240", 0, False)
+    assert [step["size"] for step in plan] == [(320, 240)]
+    # 没有有效尺寸时使用默认尺寸，批量和流式步骤同样使用它
+    plan = parse_warmup_plan("bad, ", 2, True)
+    assert [(step["kind"], step["size"]) for step in plan] == \
+        [("single", (448, 448)), ("batch", (448, 448)), ("stream", (448, 448))]
+    print("✅ 预热计划解析测试通过")
+    return True
+
+
+@stub_model.enabled()
+def test_warmup_before_ready():
+    """测试加载时按计划执行每一步预热（单图各尺寸、批量、流式），全部完成前模型不是 ready"""
+    calls = []
+    original_plan, original_chat = model_service.WARMUP_PLAN, stub_model.StubModel.chat
+
+    with tempfile.TemporaryDirectory() as tmp:
+        service = ModelService(Path(tmp))
+
+        # 记录每次调用时的图片尺寸和模型是否已就绪
+        def chat(model, msgs=None, tokenizer=None, stream=False, **kwargs):
+            batch = bool(msgs) and isinstance(msgs[0], list)
+            images = [item for m in (msgs if batch else [msgs]) for turn in m for item in turn["content"]
+                      if isinstance(item, Image.Image)]
+            kind = "batch" if batch else "stream" if stream else "single"
+            calls.append({"kind": kind, "sizes": [image.size for image in images], "ready": service.ready,
+                          "max_new_tokens": kwargs.get("max_new_tokens")})
+            return original_chat(model, msgs, tokenizer, stream=stream, **kwargs)
+
+        model_service.WARMUP_PLAN = parse_warmup_plan("96x64,64x96,128x128", 3, True)
+        stub_model.StubModel.chat = chat
+        try:
+            assert service.load_model("MiniCPM-V-4_5-int4")
+        finally:
+            model_service.WARMUP_PLAN = original_plan
+            stub_model.StubModel.chat = original_chat
+
+    assert [(c["kind"], c["sizes"]) for c in calls] == [
+        ("single", [(96, 64)]), ("single", [(64, 96)]), ("single", [(128, 128)]),
+        ("batch", [(96, 64)] * 3), ("stream", [(96, 64)]),
+    ], calls
+    assert not any(c["ready"] for c in calls), "预热完成前模型不应为 ready"
+    assert all(c["max_new_tokens"] == model_service.WARMUP_MAX_NEW_TOKENS for c in calls)
+    assert service.ready
+
+    profile = service.warmup_profile
+    assert [step["name"] for step in profile] == \
+        ["single_96x64", "single_64x96", "single_128x128", "batch_3", "stream"], profile
+    assert all(step["ok"] for step in profile) and profile[3]["batch_size"] == 3
+    assert "warmup" in service.load_profile["phases_seconds"]
+    print("✅ 预热完成后就绪测试通过")
+    return True
+
+
+if __name__ == "__main__":
+    test_parse_plan()
+    test_warmup_before_ready()